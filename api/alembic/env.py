@@ -11,6 +11,20 @@ from app.modules.users.models import User  # noqa
 from app.modules.teams.models import Team, UserTeamLink  # noqa
 from app.modules.atlases.models import Atlas, AtlasTeamLink  # noqa
 from app.modules.auth.models import RefreshToken  # noqa
+from app.modules.tokens.models import ResourceToken, TokenRevocation  # noqa
+from app.modules.datasources.models import (  # noqa
+    Datasource,
+    DatasourceStats,
+    DatasourceUpload,
+)
+from app.modules.jobs.models import Job  # noqa
+from app.modules.proxy.models import (  # noqa
+    DatasourceExtent,
+    DatasourceOverview,
+    TileDirtyRegion,
+    TileEngineSource,
+    TileSeedJob,
+)
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -0,0 +1,42 @@
+"""add_tile_dirty_region_xid
+
+Revision ID: a2c6e9d4f731
+Revises: e7b3f1c8a294
+Create Date: 2026-10-21 10:41:05.518320
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "a2c6e9d4f731"
+down_revision: Union[str, Sequence[str], None] = "e7b3f1c8a294"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Existing regions get the id of this transaction, and are read again once.
+    op.add_column(
+        "tile_dirty_region",
+        sa.Column(
+            "xid",
+            sa.BigInteger(),
+            server_default=sa.text("(pg_current_xact_id()::text)::bigint"),
+            nullable=False,
+        ),
+    )
+    op.create_index(
+        op.f("ix_tile_dirty_region_xid"), "tile_dirty_region", ["xid"], unique=False
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f("ix_tile_dirty_region_xid"), table_name="tile_dirty_region")
+    op.drop_column("tile_dirty_region", "xid")
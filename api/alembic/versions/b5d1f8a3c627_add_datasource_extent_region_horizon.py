@@ -0,0 +1,41 @@
+"""add_datasource_extent_region_horizon
+
+Revision ID: b5d1f8a3c627
+Revises: a2c6e9d4f731
+Create Date: 2026-10-21 11:58:32.904417
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "b5d1f8a3c627"
+down_revision: Union[str, Sequence[str], None] = "a2c6e9d4f731"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Region ids do not tell which transactions an extent includes: the regions
+    # still logged are replayed once onto every extent.
+    op.add_column(
+        "datasource_extent",
+        sa.Column(
+            "region_horizon", sa.BigInteger(), server_default="0", nullable=False
+        ),
+    )
+    op.drop_column("datasource_extent", "region_id")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.add_column(
+        "datasource_extent",
+        sa.Column("region_id", sa.Integer(), server_default="0", nullable=False),
+    )
+    op.drop_column("datasource_extent", "region_horizon")
@@ -0,0 +1,42 @@
+"""add_token_revocation_xid
+
+Revision ID: e7b3f1c8a294
+Revises: d4a7c9e2b561
+Create Date: 2026-10-21 09:12:44.301857
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "e7b3f1c8a294"
+down_revision: Union[str, Sequence[str], None] = "d4a7c9e2b561"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Existing entries get the id of this transaction, and are read again once.
+    op.add_column(
+        "token_revocation",
+        sa.Column(
+            "xid",
+            sa.BigInteger(),
+            server_default=sa.text("(pg_current_xact_id()::text)::bigint"),
+            nullable=False,
+        ),
+    )
+    op.create_index(
+        op.f("ix_token_revocation_xid"), "token_revocation", ["xid"], unique=False
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f("ix_token_revocation_xid"), table_name="token_revocation")
+    op.drop_column("token_revocation", "xid")
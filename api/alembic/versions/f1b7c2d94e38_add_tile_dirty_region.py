@@ -0,0 +1,167 @@
+"""add_tile_dirty_region
+
+Revision ID: f1b7c2d94e38
+Revises: c3a9d5e07f12
+Create Date: 2026-10-19 16:27:40.902114
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = "f1b7c2d94e38"
+down_revision: Union[str, Sequence[str], None] = "c3a9d5e07f12"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# The trigger functions as of this revision (the app re-creates its current
+# version whenever it installs triggers). Edits are logged by statement-level
+# triggers; geometries without SRID, or a failure to compute their boxes, log
+# the whole datasource instead of aborting the edit.
+DIRTY_REGION_FUNCTIONS = (
+    """
+    CREATE OR REPLACE FUNCTION canopy_log_dirty_regions() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    DECLARE
+        v_geom_column text := TG_ARGV[0];
+        v_datasource text := TG_ARGV[1];
+        v_max_rows integer := TG_ARGV[2]::integer;
+        v_changed text;
+        v_count bigint;
+        v_unplaced bigint;
+    BEGIN
+        IF TG_OP = 'TRUNCATE' THEN
+            INSERT INTO tile_dirty_region (datasource) VALUES (v_datasource);
+            RETURN NULL;
+        ELSIF TG_OP = 'INSERT' THEN
+            v_changed := format('SELECT %I AS geom FROM new_rows', v_geom_column);
+        ELSIF TG_OP = 'DELETE' THEN
+            v_changed := format('SELECT %I AS geom FROM old_rows', v_geom_column);
+        ELSE
+            v_changed := format(
+                'SELECT %1$I AS geom FROM old_rows UNION ALL SELECT %1$I FROM new_rows',
+                v_geom_column
+            );
+        END IF;
+
+        BEGIN
+            EXECUTE format(
+                'SELECT count(*), count(*) FILTER (WHERE ST_SRID(geom) = 0) '
+                'FROM (%s) changed WHERE geom IS NOT NULL', v_changed
+            ) INTO v_count, v_unplaced;
+            IF v_count = 0 THEN
+                RETURN NULL;
+            END IF;
+            IF v_unplaced > 0 THEN
+                INSERT INTO tile_dirty_region (datasource) VALUES (v_datasource);
+                RETURN NULL;
+            END IF;
+
+            EXECUTE format(
+                'INSERT INTO tile_dirty_region (datasource, min_x, min_y, max_x, max_y) '
+                'SELECT $1, ST_XMin(box), ST_YMin(box), ST_XMax(box), ST_YMax(box) '
+                'FROM (SELECT %s AS box FROM (%s) changed WHERE geom IS NOT NULL) boxes',
+                CASE WHEN v_count > v_max_rows
+                    THEN 'ST_Extent(ST_Transform(geom, 4326))'
+                    ELSE 'Box2D(ST_Transform(geom, 4326))'
+                END,
+                v_changed
+            ) USING v_datasource;
+        EXCEPTION WHEN OTHERS THEN
+            RAISE WARNING 'canopy_log_dirty_regions on %: %', TG_TABLE_NAME, SQLERRM;
+            BEGIN
+                INSERT INTO tile_dirty_region (datasource) VALUES (v_datasource);
+            EXCEPTION WHEN OTHERS THEN
+                RAISE WARNING 'canopy_log_dirty_regions on %: %',
+                    TG_TABLE_NAME, SQLERRM;
+            END;
+        END;
+        RETURN NULL;
+    END;
+    $$
+    """,
+    """
+    CREATE OR REPLACE FUNCTION canopy_install_dirty_region_triggers(
+        target regclass, geom_column text, datasource text, max_rows integer
+    ) RETURNS void
+    LANGUAGE plpgsql AS $$
+    DECLARE
+        v_args text := format('%L, %L, %L', geom_column, datasource, max_rows);
+    BEGIN
+        EXECUTE format('DROP TRIGGER IF EXISTS canopy_dirty_insert ON %s', target);
+        EXECUTE format('DROP TRIGGER IF EXISTS canopy_dirty_update ON %s', target);
+        EXECUTE format('DROP TRIGGER IF EXISTS canopy_dirty_delete ON %s', target);
+        EXECUTE format('DROP TRIGGER IF EXISTS canopy_dirty_truncate ON %s', target);
+        EXECUTE format(
+            'CREATE TRIGGER canopy_dirty_insert AFTER INSERT ON %s '
+            'REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT '
+            'EXECUTE FUNCTION canopy_log_dirty_regions(%s)', target, v_args
+        );
+        EXECUTE format(
+            'CREATE TRIGGER canopy_dirty_update AFTER UPDATE ON %s '
+            'REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows '
+            'FOR EACH STATEMENT EXECUTE FUNCTION canopy_log_dirty_regions(%s)',
+            target, v_args
+        );
+        EXECUTE format(
+            'CREATE TRIGGER canopy_dirty_delete AFTER DELETE ON %s '
+            'REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT '
+            'EXECUTE FUNCTION canopy_log_dirty_regions(%s)', target, v_args
+        );
+        EXECUTE format(
+            'CREATE TRIGGER canopy_dirty_truncate AFTER TRUNCATE ON %s '
+            'FOR EACH STATEMENT EXECUTE FUNCTION canopy_log_dirty_regions(%s)',
+            target, v_args
+        );
+    END;
+    $$
+    """,
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.create_table(
+        "tile_dirty_region",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("datasource", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("min_x", sa.Float(), nullable=True),
+        sa.Column("min_y", sa.Float(), nullable=True),
+        sa.Column("max_x", sa.Float(), nullable=True),
+        sa.Column("max_y", sa.Float(), nullable=True),
+        sa.Column(
+            "created_at", sa.DateTime(), server_default=sa.text("now()"), nullable=False
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        op.f("ix_tile_dirty_region_created_at"),
+        "tile_dirty_region",
+        ["created_at"],
+        unique=False,
+    )
+    # ### end Alembic commands ###
+
+    for statement in DIRTY_REGION_FUNCTIONS:
+        op.execute(statement)
+    # No table is instrumented here: the app installs the triggers on the
+    # datasource tables it creates, and admins on the tables they choose.
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP FUNCTION IF EXISTS canopy_install_dirty_region_triggers")
+    # Drops the triggers installed on datasource tables as well.
+    op.execute("DROP FUNCTION IF EXISTS canopy_log_dirty_regions CASCADE")
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.drop_index(
+        op.f("ix_tile_dirty_region_created_at"), table_name="tile_dirty_region"
+    )
+    op.drop_table("tile_dirty_region")
+    # ### end Alembic commands ###
@@ -0,0 +1,54 @@
+import hashlib
+import math
+from typing import Iterable, Iterator
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over strings.
+
+    Membership answers "definitely absent" or "maybe present": callers confirm
+    positives against an exact structure.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.capacity = max(capacity, 1)
+        self.error_rate = error_rate
+        self.num_bits = math.ceil(
+            -self.capacity * math.log(error_rate) / (math.log(2) ** 2)
+        )
+        self.num_hashes = max(1, round(self.num_bits / self.capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.num_bits + 7) // 8)
+
+    @classmethod
+    def from_items(
+        cls, items: Iterable[str], capacity: int, error_rate: float = 0.001
+    ) -> "BloomFilter":
+        bloom = cls(capacity, error_rate)
+        for item in items:
+            bloom.add(item)
+        return bloom
+
+    def _positions(self, item: str) -> Iterator[int]:
+        # Double hashing: k positions derived from one 128-bit digest.
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(
+            self._bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(item)
+        )
+
+    @property
+    def is_full(self) -> bool:
+        return self.count >= self.capacity
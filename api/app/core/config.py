@@ -1,5 +1,5 @@
 from functools import lru_cache
-from typing import Any, List
+from typing import Any, Dict, List, Tuple
 
 from pydantic import ValidationInfo, field_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -57,6 +57,147 @@ class Settings(BaseSettings):
 
     # Martin tile server (internal network)
     martin_internal_url: str = "http://martin:3000"
+    martin_http2: bool = False
+    martin_max_connections: int = 200
+    martin_max_keepalive_connections: int = 50
+    martin_keepalive_expiry: float = 30.0
+    martin_connect_timeout: float = 2.0
+    martin_read_timeout: float = 10.0
+    martin_pool_timeout: float = 2.0
+
+    # Tile cache (memory LRU + shared SQLite store)
+    tile_cache_enabled: bool = True
+    tile_cache_memory_bytes: int = 256 * 1024 * 1024
+    tile_cache_disk_path: str | None = "cache/tiles.sqlite"
+    # Budget of the disk tier, kept by evicting the least recently read tiles
+    tile_cache_disk_max_bytes: int | None = 2 * 1024 * 1024 * 1024
+    tile_cache_disk_prune_seconds: float = 300.0
+    # TTL in seconds, applied from the given zoom up to the next configured one
+    tile_cache_zoom_ttls: Dict[int, int] = {0: 86400, 9: 3600, 13: 600}
+    tile_cache_version_refresh_seconds: float = 1.0
+
+    # Tile invalidation from the dirty-region log of datasource tables
+    tile_invalidation_enabled: bool = True
+    tile_invalidation_poll_seconds: float = 2.0
+    # Past this many tiles, a zoom level gets a new cache version instead
+    tile_invalidation_max_tiles_per_zoom: int = 1024
+    tile_invalidation_retention_seconds: int = 86400
+    # Statements changing more rows log their extent rather than each bbox
+    tile_invalidation_trigger_max_rows: int = 1000
+
+    # Tile cache pre-seeding jobs
+    tile_seed_enabled: bool = True
+    tile_seed_concurrency: int = 4
+    tile_seed_max_tiles: int = 1_000_000
+    tile_seed_poll_seconds: float = 5.0
+    # Seeding pauses while this many user tile fetches wait on Martin
+    tile_seed_yield_threshold: int = 8
+
+    # Datasource extent index: empty tiles outside the data skip Martin
+    tile_extent_enabled: bool = True
+    # Zoom of the occupancy grid (4^zoom bits per datasource), None for bbox only
+    tile_extent_occupancy_zoom: int | None = 8
+    tile_extent_refresh_seconds: float = 10.0
+
+    # Style-aware pruning of tile layers and properties (`?prune=true`)
+    tile_prune_enabled: bool = True
+    tile_prune_style_ttl_seconds: float = 30.0
+
+    # Composite tiles: several sources of one z/x/y merged into a single MVT
+    tile_composite_max_sources: int = 16
+
+    # In-API vector tiles (ST_AsMVT) for the datasources configured to skip Martin
+    tile_engine_enabled: bool = True
+    # Read-only pool, on DATABASE_URL unless set (e.g. a read replica)
+    tile_engine_database_url: str | None = None
+    tile_engine_pool_size: int = 10
+    tile_engine_statement_timeout_ms: int = 5000
+    # Prepared statements kept per connection (one per datasource and column set)
+    tile_engine_prepared_max: int = 256
+    tile_engine_source_ttl_seconds: float = 30.0
+
+    # Generalized overview tables rendering low zooms (by the in-API engine)
+    tile_overview_enabled: bool = True
+    # Default zoom bands (min, max) of a datasource's overviews
+    tile_overview_zoom_bands: List[Tuple[int, int]] = [(0, 5), (6, 8), (9, 11)]
+    # Simplification tolerance, in pixels at the band's highest zoom
+    tile_overview_tolerance_pixels: float = 1.0
+    # Edited datasources are rebuilt once their overviews are stale this long
+    tile_overview_rebuild_delay_seconds: float = 300.0
+    tile_overview_poll_seconds: float = 30.0
+
+    # PMTiles archives ({source}.pmtiles) served from disk without Martin
+    pmtiles_directory: str | None = "data/pmtiles"
+    pmtiles_check_seconds: float = 5.0
+    # Leaf directories kept parsed in memory, per archive
+    pmtiles_leaf_cache_entries: int = 64
+
+    # Datasource upload: streamed GeoJSON written with binary COPY
+    datasource_ingest_batch_size: int = 5000
+    # Largest single feature (or other top-level member) of an upload
+    datasource_ingest_max_feature_bytes: int = 64 * 1024 * 1024
+    # Shapefile/GeoPackage upload: feature ranges encoded in a process pool and
+    # copied in parallel, this many at a time
+    datasource_ingest_workers: int = 4
+    datasource_ingest_range_size: int = 50_000
+    # Post-ingest optimization: rows reordered along a Hilbert curve, GiST index
+    # (and BRIN, if enabled) and ANALYZE. The tile at this zoom holding a sample
+    # feature is timed before and after (None to skip the timings)
+    datasource_optimize_reorder: bool = True
+    datasource_optimize_brin: bool = False
+    datasource_optimize_sample_zoom: int | None = 14
+    # Uploaded files are spooled there (system temporary directory if unset)
+    datasource_upload_directory: str | None = None
+    # Resumable uploads: largest file, unfinished uploads per user, and how long
+    # an upload receiving no chunk is kept
+    datasource_upload_max_bytes: int = 10 * 1024 * 1024 * 1024
+    datasource_upload_max_active: int = 3
+    datasource_upload_expire_hours: float = 24.0
+    # Lease of the request receiving a chunk, renewed while the chunk streams
+    datasource_upload_lease_seconds: float = 60.0
+    # PMTiles archives built from datasources (into `pmtiles_directory`): tiles
+    # rendered this many at a time, simplified by at least this tolerance (tile
+    # units), and re-simplified up to `retries` times when over the byte budget
+    datasource_pmtiles_workers: int = 4
+    datasource_pmtiles_max_zoom: int = 14
+    datasource_pmtiles_max_tiles: int = 2_000_000
+    datasource_pmtiles_simplify: float = 1.0
+    datasource_pmtiles_max_tile_bytes: int = 500 * 1024
+    datasource_pmtiles_budget_retries: int = 3
+    # Attribute statistics: a TABLESAMPLE of about `sample_rows` features sketched
+    # per column after ingest, updates folded in until they changed
+    # `rebuild_ratio` of the features, then sampled again
+    datasource_stats_enabled: bool = True
+    datasource_stats_sample_rows: int = 50_000
+    datasource_stats_top_values: int = 20
+    datasource_stats_histogram_bins: int = 10
+    datasource_stats_rebuild_ratio: float = 0.2
+    # Datasource export: rows fetched from a server-side cursor this many at a
+    # time, encoded and sent (gzipped at this level, when asked) before the next
+    datasource_export_batch_size: int = 2000
+    datasource_export_gzip_level: int = 6
+    # Feature queries (bbox, point): at most `max_features` features each, and
+    # cancelled after `timeout_ms`
+    datasource_query_max_features: int = 1000
+    datasource_query_timeout_ms: int = 2000
+
+    # Background jobs (datasource ingests) claimed from the `job` table; disable
+    # them in the API when dedicated `python -m app.worker` processes run them
+    job_worker_enabled: bool = True
+    # Jobs run at once by each worker process, and per user across all workers
+    job_worker_concurrency: int = 2
+    job_max_running_per_user: int = 1
+    job_poll_seconds: float = 2.0
+    # A failed job is retried after this delay, doubled on each attempt
+    job_max_attempts: int = 3
+    job_retry_delay_seconds: float = 30.0
+
+    # Resource tokens (tile access for Maputnik and third-party apps)
+    resource_token_secret: str | None = None
+    session_token_expire_minutes: int = 240
+    resource_token_revocation_refresh_seconds: float = 10.0
+    # Full reload of the revocation index, dropping expired tokens
+    resource_token_revocation_rebuild_seconds: float = 600.0
 
     # Google SSO
     activate_google_auth: bool = False
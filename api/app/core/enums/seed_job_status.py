@@ -0,0 +1,9 @@
+from enum import Enum
+
+
+class SeedJobStatus(str, Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
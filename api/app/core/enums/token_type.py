@@ -0,0 +1,6 @@
+from enum import Enum
+
+
+class TokenType(str, Enum):
+    SESSION = "session"
+    STYLE = "style"
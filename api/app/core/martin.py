@@ -0,0 +1,64 @@
+from typing import Annotated, Optional
+
+import httpx
+from fastapi import Depends
+
+from app.core.config import Settings
+
+
+def martin_timeout(settings: Settings) -> httpx.Timeout:
+    """Timeout applied to every request sent to Martin."""
+    return httpx.Timeout(
+        settings.martin_read_timeout,
+        connect=settings.martin_connect_timeout,
+        pool=settings.martin_pool_timeout,
+    )
+
+
+class MartinClientManager:
+    """
+    Holds the single app-scoped HTTP client used to reach Martin.
+    Sharing one client keeps upstream connections pooled and alive across requests.
+    """
+
+    def __init__(self):
+        self.client: httpx.AsyncClient | None = None
+
+    def init(
+        self,
+        settings: Settings,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        limits = httpx.Limits(
+            max_connections=settings.martin_max_connections,
+            max_keepalive_connections=settings.martin_max_keepalive_connections,
+            keepalive_expiry=settings.martin_keepalive_expiry,
+        )
+        self.client = httpx.AsyncClient(
+            base_url=settings.martin_internal_url,
+            limits=limits,
+            timeout=martin_timeout(settings),
+            http2=settings.martin_http2,
+            transport=transport,
+        )
+
+    def get_client(self) -> httpx.AsyncClient:
+        if self.client is None:
+            raise Exception("MartinClientManager is not initialized")
+        return self.client
+
+    async def close(self):
+        if self.client is None:
+            raise Exception("MartinClientManager is not initialized")
+        await self.client.aclose()
+        self.client = None
+
+
+martin_client = MartinClientManager()
+
+
+def get_martin_client() -> httpx.AsyncClient:
+    return martin_client.get_client()
+
+
+MartinClientDep = Annotated[httpx.AsyncClient, Depends(get_martin_client)]
@@ -0,0 +1,48 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Generic, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+@dataclass
+class SingleFlightStats:
+    upstream_calls: int = 0
+    coalesced: int = 0
+    failures: int = 0
+
+
+class SingleFlight(Generic[T]):
+    """
+    Coalesces concurrent calls sharing a key into one execution.
+
+    The call runs in its own task: a caller being cancelled (e.g. client
+    disconnect) never cancels the work other callers are waiting for, and
+    results or exceptions (timeouts included) reach every caller.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, "asyncio.Task[T]"] = {}
+        self.stats = SingleFlightStats()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            self.stats.upstream_calls += 1
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.stats.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: "asyncio.Task[T]") -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Mark the exception as retrieved even if every caller went away.
+        if not task.cancelled() and task.exception() is not None:
+            self.stats.failures += 1
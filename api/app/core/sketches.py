@@ -0,0 +1,145 @@
+import base64
+import hashlib
+import math
+import random
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+
+def _hash64(item: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(item.encode(), digest_size=8).digest(), "little"
+    )
+
+
+class HyperLogLog:
+    """
+    Cardinality estimate of a stream of strings in 2**precision one-byte
+    registers (4 KiB and ~1.6% standard error at the default precision).
+
+    Sketches of the same precision merge into the sketch of the union.
+    """
+
+    def __init__(self, precision: int = 12, registers: Optional[bytes] = None):
+        if not 4 <= precision <= 16:
+            raise ValueError("precision must be between 4 and 16")
+        self.precision = precision
+        self.size = 1 << precision
+        self._registers = bytearray(registers or self.size)
+
+    def add(self, item: str) -> None:
+        h = _hash64(item)
+        bits = 64 - self.precision
+        index = h >> bits
+        # Position of the first set bit of the remaining bits.
+        rank = bits - (h & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self._registers[index]:
+            self._registers[index] = rank
+
+    def merge(self, other: "HyperLogLog") -> None:
+        if other.precision != self.precision:
+            raise ValueError("sketches of different precisions")
+        self._registers = bytearray(map(max, self._registers, other._registers))
+
+    def count(self) -> int:
+        alpha = 0.7213 / (1 + 1.079 / self.size)
+        estimate = alpha * self.size**2 / sum(2.0**-r for r in self._registers)
+        zeros = self._registers.count(0)
+        if estimate <= 2.5 * self.size and zeros:
+            # Linear counting is more accurate for small cardinalities.
+            estimate = self.size * math.log(self.size / zeros)
+        return round(estimate)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "precision": self.precision,
+            "registers": base64.b64encode(bytes(self._registers)).decode(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "HyperLogLog":
+        return cls(data["precision"], base64.b64decode(data["registers"]))
+
+
+class TopK:
+    """
+    Most frequent items of a stream in `capacity` counters (Space-Saving): an
+    untracked item replaces the least counted one and inherits its count as
+    `error`, so counts are overestimated by at most `error`.
+    """
+
+    def __init__(self, capacity: int = 64):
+        self.capacity = max(capacity, 1)
+        # item -> [count, error]
+        self._counters: Dict[Hashable, List[int]] = {}
+
+    def add(self, item: Hashable, weight: int = 1) -> None:
+        counter = self._counters.get(item)
+        if counter is not None:
+            counter[0] += weight
+        elif len(self._counters) < self.capacity:
+            self._counters[item] = [weight, 0]
+        else:
+            evicted = min(self._counters, key=lambda k: self._counters[k][0])
+            floor = self._counters.pop(evicted)[0]
+            self._counters[item] = [floor + weight, floor]
+
+    def top(self, k: int) -> List[Tuple[Hashable, int, int]]:
+        """The k most counted (item, count, error), most counted first."""
+        ranked = sorted(self._counters.items(), key=lambda kv: -kv[1][0])
+        return [(item, count, error) for item, (count, error) in ranked[:k]]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "capacity": self.capacity,
+            "counters": [[item, *counter] for item, counter in self._counters.items()],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "TopK":
+        top = cls(data["capacity"])
+        top._counters = {
+            item: [count, error] for item, count, error in data["counters"]
+        }
+        return top
+
+
+class Reservoir:
+    """
+    Uniform sample of `size` items of a stream of unknown length (algorithm R),
+    answering approximate quantiles.
+    """
+
+    def __init__(self, size: int = 1024, seed: Optional[int] = None):
+        self.size = max(size, 1)
+        self.seen = 0
+        self.items: List[float] = []
+        self._random = random.Random(seed)
+
+    def add(self, item: float) -> None:
+        self.seen += 1
+        if len(self.items) < self.size:
+            self.items.append(item)
+            return
+        index = self._random.randrange(self.seen)
+        if index < self.size:
+            self.items[index] = item
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Value below which a fraction q of the items fall (interpolated)."""
+        if not self.items:
+            return None
+        items = sorted(self.items)
+        position = min(max(q, 0.0), 1.0) * (len(items) - 1)
+        lower = math.floor(position)
+        upper = min(lower + 1, len(items) - 1)
+        return items[lower] + (items[upper] - items[lower]) * (position - lower)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"size": self.size, "seen": self.seen, "items": self.items}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Reservoir":
+        reservoir = cls(data["size"])
+        reservoir.seen = data["seen"]
+        reservoir.items = list(data["items"])
+        return reservoir
@@ -0,0 +1,618 @@
+"""
+FlatGeobuf reading, features of a file as EWKB and values, and streamed writing.
+
+A FlatGeobuf file is a magic number, a FlatBuffers header, an optional packed
+Hilbert R-tree and the features, each a size-prefixed FlatBuffers table. Tables
+are read in place from the buffers (no generated code), and the flat X/Y arrays
+of a geometry are little-endian doubles like WKB coordinates, so 2D points are
+copied as is.
+
+The R-tree gives the byte offset of every feature: ranges of an indexed file are
+read without scanning it, and a bbox keeps only the features whose own bbox
+intersects it, reading the index nodes it crosses and those features only.
+
+Written files have no index and an unknown feature count: the header is written
+first, then every feature as it comes (see `FlatGeobufWriter`).
+"""
+
+import struct
+import sys
+from array import array
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from app.core.utils.geojson import EWKB_SRID, EWKB_Z
+
+MAGIC = b"fgb\x03fgb"
+PREAMBLE_SIZE = 12
+NODE = struct.Struct("<4dQ")
+DEFAULT_NODE_SIZE = 16
+
+# Geometry types, numbered as in WKB.
+UNKNOWN, POINT, LINESTRING, POLYGON = 0, 1, 2, 3
+MULTIPOINT, MULTILINESTRING, MULTIPOLYGON, GEOMETRYCOLLECTION = 4, 5, 6, 7
+
+# Column types.
+BYTE, UBYTE, BOOL, SHORT, USHORT, INT, UINT, LONG, ULONG = range(9)
+FLOAT, DOUBLE, STRING, JSON, DATETIME, BINARY = range(9, 15)
+SCALAR_FORMATS = {
+    BYTE: struct.Struct("<b"),
+    UBYTE: struct.Struct("<B"),
+    BOOL: struct.Struct("<?"),
+    SHORT: struct.Struct("<h"),
+    USHORT: struct.Struct("<H"),
+    INT: struct.Struct("<i"),
+    UINT: struct.Struct("<I"),
+    LONG: struct.Struct("<q"),
+    ULONG: struct.Struct("<Q"),
+    FLOAT: struct.Struct("<f"),
+    DOUBLE: struct.Struct("<d"),
+}
+
+Bbox = Tuple[float, float, float, float]
+
+
+class FlatGeobufError(ValueError):
+    """Malformed or unsupported FlatGeobuf."""
+
+
+class _Table:
+    """A FlatBuffers table at `position` of `buffer`."""
+
+    __slots__ = ("buffer", "position", "vtable", "vtable_size")
+
+    def __init__(self, buffer: memoryview, position: int):
+        self.buffer = buffer
+        self.position = position
+        self.vtable = position - struct.unpack_from("<i", buffer, position)[0]
+        self.vtable_size = struct.unpack_from("<H", buffer, self.vtable)[0]
+
+    @classmethod
+    def root(cls, buffer: memoryview) -> "_Table":
+        return cls(buffer, struct.unpack_from("<I", buffer)[0])
+
+    def _field(self, field: int) -> int:
+        entry = 4 + 2 * field
+        if entry >= self.vtable_size:
+            return 0
+        return struct.unpack_from("<H", self.buffer, self.vtable + entry)[0]
+
+    def scalar(self, field: int, format: str, default: Any) -> Any:
+        offset = self._field(field)
+        if not offset:
+            return default
+        return struct.unpack_from(format, self.buffer, self.position + offset)[0]
+
+    def _target(self, field: int) -> Optional[int]:
+        offset = self._field(field)
+        if not offset:
+            return None
+        position = self.position + offset
+        return position + struct.unpack_from("<I", self.buffer, position)[0]
+
+    def vector(self, field: int, size: int) -> Optional[memoryview]:
+        """Bytes of a vector of `size`-byte scalars."""
+        position = self._target(field)
+        if position is None:
+            return None
+        length = struct.unpack_from("<I", self.buffer, position)[0]
+        return self.buffer[position + 4 : position + 4 + size * length]
+
+    def string(self, field: int) -> Optional[str]:
+        raw = self.vector(field, 1)
+        return None if raw is None else bytes(raw).decode("utf-8", "replace")
+
+    def table(self, field: int) -> Optional["_Table"]:
+        position = self._target(field)
+        return None if position is None else _Table(self.buffer, position)
+
+    def tables(self, field: int) -> List["_Table"]:
+        position = self._target(field)
+        if position is None:
+            return []
+        length = struct.unpack_from("<I", self.buffer, position)[0]
+        tables = []
+        for element in range(position + 4, position + 4 + 4 * length, 4):
+            tables.append(
+                _Table(
+                    self.buffer,
+                    element + struct.unpack_from("<I", self.buffer, element)[0],
+                )
+            )
+        return tables
+
+
+def level_bounds(count: int, node_size: int) -> List[Tuple[int, int]]:
+    """
+    Node positions [start, end) of each level of a packed R-tree of `count`
+    features, leaves first; the root level is stored first.
+    """
+    sizes = [count]
+    n = count
+    while True:
+        n = -(-n // node_size)
+        sizes.append(n)
+        if n == 1:
+            break
+    bounds, end = [], sum(sizes)
+    for size in sizes:
+        bounds.append((end - size, end))
+        end -= size
+    return bounds
+
+
+def _header(kind: int, has_z: bool, srid: Optional[int] = None) -> bytes:
+    code = kind | (EWKB_Z if has_z else 0)
+    if srid is None:
+        return struct.pack("<BI", 1, code)
+    return struct.pack("<BII", 1, code | EWKB_SRID, srid)
+
+
+def _coordinates(geometry: _Table, has_z: bool) -> Tuple[bytes, int]:
+    """WKB points (X, Y[, Z]) of a geometry, and their count."""
+    xy = geometry.vector(1, 8)
+    if xy is None:
+        return b"", 0
+    count = len(xy) // 16
+    z = geometry.vector(2, 8) if has_z else None
+    if z is None:
+        return bytes(xy), count
+    xy_values, z_values = array("d"), array("d")
+    xy_values.frombytes(xy)
+    z_values.frombytes(z[: 8 * count])
+    if sys.byteorder == "big":
+        xy_values.byteswap()
+        z_values.byteswap()
+    xyz = array("d", bytes(24 * count))
+    xyz[0::3] = xy_values[0::2]
+    xyz[1::3] = xy_values[1::2]
+    xyz[2::3] = z_values
+    if sys.byteorder == "big":
+        xyz.byteswap()
+    return xyz.tobytes(), count
+
+
+def _ends(geometry: _Table, count: int) -> List[int]:
+    ends = geometry.vector(0, 4)
+    if not ends:
+        return [count]
+    return list(struct.unpack(f"<{len(ends) // 4}I", ends))
+
+
+def geometry_to_ewkb(
+    geometry: _Table, kind: int, has_z: bool, srid: Optional[int]
+) -> bytes:
+    """EWKB (little-endian, with SRID unless None) of a FlatGeobuf geometry."""
+    if kind == UNKNOWN:
+        kind = geometry.scalar(6, "<B", UNKNOWN)
+    header = _header(kind, has_z, srid)
+
+    if kind in (MULTIPOLYGON, GEOMETRYCOLLECTION):
+        parts = geometry.tables(7)
+        return (
+            header
+            + struct.pack("<I", len(parts))
+            + b"".join(
+                geometry_to_ewkb(
+                    part, POLYGON if kind == MULTIPOLYGON else UNKNOWN, has_z, None
+                )
+                for part in parts
+            )
+        )
+
+    points, count = _coordinates(geometry, has_z)
+    size = 24 if has_z else 16
+    if kind == POINT:
+        if not count:
+            return header + struct.pack(f"<{size // 8}d", *[float("nan")] * (size // 8))
+        return header + points[:size]
+    if kind == LINESTRING:
+        return header + struct.pack("<I", count) + points
+    if kind == MULTIPOINT:
+        return (
+            header
+            + struct.pack("<I", count)
+            + b"".join(
+                _header(POINT, has_z) + points[i * size : (i + 1) * size]
+                for i in range(count)
+            )
+        )
+    if kind not in (POLYGON, MULTILINESTRING):
+        raise FlatGeobufError(f"Unsupported geometry type {kind}")
+    ends = _ends(geometry, count)
+    parts = [points[start * size : end * size] for start, end in zip([0] + ends, ends)]
+    counted = [struct.pack("<I", len(part) // size) + part for part in parts]
+    if kind == MULTILINESTRING:
+        counted = [_header(LINESTRING, has_z) + part for part in counted]
+    return header + struct.pack("<I", len(parts)) + b"".join(counted)
+
+
+def _properties(data: memoryview, types: List[int]) -> List[Any]:
+    values: List[Any] = [None] * len(types)
+    position = 0
+    while position < len(data):
+        (column,) = struct.unpack_from("<H", data, position)
+        position += 2
+        if column >= len(types):
+            raise FlatGeobufError(f"Invalid property column {column}")
+        column_type = types[column]
+        scalar = SCALAR_FORMATS.get(column_type)
+        if scalar is not None:
+            (values[column],) = scalar.unpack_from(data, position)
+            position += scalar.size
+            continue
+        (length,) = struct.unpack_from("<I", data, position)
+        raw = bytes(data[position + 4 : position + 4 + length])
+        position += 4 + length
+        if column_type == BINARY:
+            values[column] = raw
+        else:
+            values[column] = raw.decode("utf-8", "replace")
+    return values
+
+
+class FlatGeobuf:
+    """A FlatGeobuf file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        try:
+            with open(path, "rb") as file:
+                preamble = file.read(PREAMBLE_SIZE)
+                if len(preamble) < PREAMBLE_SIZE or preamble[:7] != MAGIC:
+                    raise FlatGeobufError("Not a FlatGeobuf file")
+                (header_size,) = struct.unpack_from("<I", preamble, 8)
+                header = _Table.root(memoryview(file.read(header_size)))
+                self._describe(header)
+        except (OSError, struct.error) as e:
+            raise FlatGeobufError(f"Unreadable FlatGeobuf: {e}") from e
+        self._index_offset = PREAMBLE_SIZE + header_size
+        self.indexed = self.node_size > 0 and self.count > 0
+        self._bounds: List[Tuple[int, int]] = []
+        if self.indexed:
+            self._bounds = level_bounds(self.count, self.node_size)
+        self._features_offset = self._index_offset + (
+            self._bounds[0][1] * NODE.size if self.indexed else 0
+        )
+
+    def _describe(self, header: _Table) -> None:
+        self.name = header.string(0)
+        self.geometry_type = header.scalar(2, "<B", UNKNOWN)
+        self.has_z = header.scalar(3, "<?", False)
+        # (name, column type) of the properties.
+        self.fields: List[Tuple[str, int]] = [
+            (column.string(0) or "", column.scalar(1, "<B", BYTE))
+            for column in header.tables(7)
+        ]
+        # 0 when unknown (written as a stream), then the file has no index.
+        self.count = header.scalar(8, "<Q", 0)
+        node_size = header.scalar(9, "<H", DEFAULT_NODE_SIZE)
+        self.node_size = min(max(node_size, 2), 65535) if node_size else 0
+        self.srid: Optional[int] = None
+        crs = header.table(10)
+        if crs is not None:
+            organization, code = crs.string(0), crs.scalar(1, "<i", 0)
+            if code > 0 and (organization or "EPSG").upper() == "EPSG":
+                self.srid = code
+
+    def search(
+        self, bbox: Bbox, start: int = 0, stop: Optional[int] = None
+    ) -> List[Tuple[int, int]]:
+        """
+        (index, offset) of the features, with start <= index < stop, whose bbox
+        intersects `bbox`. Index nodes covering features out of [start, stop)
+        are not read.
+        """
+        if not self.indexed:
+            raise FlatGeobufError("The FlatGeobuf file has no spatial index")
+        stop = self.count if stop is None else stop
+        min_x, min_y, max_x, max_y = bbox
+        found = []
+        # (node position, level): the root first.
+        pending = [(0, len(self._bounds) - 1)]
+        with open(self.path, "rb") as file:
+            while pending:
+                node, level = pending.pop()
+                level_start, level_end = self._bounds[level]
+                end = min(node + self.node_size, level_end)
+                file.seek(self._index_offset + node * NODE.size)
+                nodes = file.read((end - node) * NODE.size)
+                # Features covered by a node of this level.
+                span = self.node_size**level
+                for i, (x0, y0, x1, y1, offset) in enumerate(NODE.iter_unpack(nodes)):
+                    if x1 < min_x or y1 < min_y or x0 > max_x or y0 > max_y:
+                        continue
+                    first = (node + i - level_start) * span
+                    if first >= stop or first + span <= start:
+                        continue
+                    if level == 0:
+                        found.append((first, offset))
+                    else:
+                        pending.append((offset, level - 1))
+        found.sort()
+        return found
+
+    def _leaves(self, start: int, stop: int) -> List[Tuple[int, int]]:
+        """(index, offset) of the features [start, stop), from the index leaves."""
+        with open(self.path, "rb") as file:
+            file.seek(self._index_offset + (self._bounds[0][0] + start) * NODE.size)
+            nodes = file.read((stop - start) * NODE.size)
+        return [(start + i, node[4]) for i, node in enumerate(NODE.iter_unpack(nodes))]
+
+    def scan(self, size: int) -> Tuple[List[Tuple[int, int]], List[int]]:
+        """
+        Ranges [start, stop) of `size` features of a file read from start to end,
+        and the offset of their first feature (when the index is missing).
+        """
+        ranges, offsets = [], []
+        offset = count = 0
+        with open(self.path, "rb") as file:
+            file.seek(self._features_offset)
+            while True:
+                prefix = file.read(4)
+                if len(prefix) < 4:
+                    break
+                if count % size == 0:
+                    ranges.append((count, count + size))
+                    offsets.append(offset)
+                (length,) = struct.unpack("<I", prefix)
+                file.seek(length, 1)
+                offset += 4 + length
+                count += 1
+        if ranges:
+            ranges[-1] = (ranges[-1][0], count)
+        self.count = count
+        return ranges, offsets
+
+    def records(
+        self,
+        start: int,
+        stop: int,
+        srid: int,
+        bbox: Optional[Bbox] = None,
+        offset: Optional[int] = None,
+    ) -> Iterator[Tuple[int, Optional[bytes], List[Any]]]:
+        """
+        (fid, EWKB, values) of the features [start, stop) (intersecting `bbox`),
+        fid being the index + 1. Without index, `offset` is that of feature
+        `start`.
+        """
+        if bbox is not None:
+            features = self.search(bbox, start, stop)
+        elif self.indexed:
+            features = self._leaves(start, min(stop, self.count))
+        else:
+            features = None
+        types = [column_type for _, column_type in self.fields]
+        with open(self.path, "rb") as file:
+            if features is None:
+                # Read in sequence from feature `start`.
+                file.seek(self._features_offset + (offset or 0))
+                features = [(index, None) for index in range(start, stop)]
+            for index, feature_offset in features:
+                if feature_offset is not None:
+                    file.seek(self._features_offset + feature_offset)
+                prefix = file.read(4)
+                if len(prefix) < 4:
+                    return
+                (length,) = struct.unpack("<I", prefix)
+                data = memoryview(file.read(length))
+                try:
+                    feature = _Table.root(data)
+                    geometry = feature.table(0)
+                    ewkb = None
+                    if geometry is not None:
+                        ewkb = geometry_to_ewkb(
+                            geometry, self.geometry_type, self.has_z, srid
+                        )
+                    properties = feature.vector(1, 1)
+                    values = (
+                        _properties(properties, types)
+                        if properties is not None
+                        else [None] * len(types)
+                    )
+                except struct.error as e:
+                    raise FlatGeobufError(f"Invalid feature {index}") from e
+                yield index + 1, ewkb, values
+
+
+# Inline sizes of the scalar field formats written.
+SCALAR_SIZES = {kind: struct.calcsize(f"<{kind}") for kind in "B?HiIQd"}
+WKB_POINT = struct.Struct("<2d")
+
+
+def _align(position: int, alignment: int) -> int:
+    return -(-position // alignment) * alignment
+
+
+class _Builder:
+    """
+    FlatBuffers buffer written front to back: a table is followed by what it
+    points to, so offsets are all forward. Everything is aligned on its size, as
+    verifying readers (GDAL) require.
+
+    Fields are {field id: (kind, value)}: a scalar struct format ("B", "?", "H",
+    "i", "I", "Q", "d"), "str", "table", "tables", or a vector of scalars ("B*",
+    "I*", "d*") given as a list or as its little-endian bytes.
+    """
+
+    def __init__(self):
+        self.out = bytearray(4)
+
+    def _pad(self, alignment: int, extra: int = 0) -> None:
+        """Pad so that `extra` bytes later the position is aligned."""
+        self.out += bytes(-(len(self.out) + extra) % alignment)
+
+    def finish(self, fields: Dict[int, Tuple[str, Any]]) -> bytes:
+        struct.pack_into("<I", self.out, 0, self.table(fields))
+        return bytes(self.out)
+
+    def table(self, fields: Dict[int, Tuple[str, Any]]) -> int:
+        count = max(fields) + 1 if fields else 0
+        offsets, size = {}, 4
+        # Largest fields first, each aligned on its size from an 8-aligned table.
+        for field, (kind, _) in sorted(
+            fields.items(), key=lambda item: -SCALAR_SIZES.get(item[1][0], 4)
+        ):
+            field_size = SCALAR_SIZES.get(kind, 4)
+            offsets[field] = size = _align(size, field_size)
+            size += field_size
+        self._pad(2)
+        vtable = len(self.out)
+        self.out += struct.pack(
+            f"<HH{count}H",
+            4 + 2 * count,
+            size,
+            *(offsets.get(i, 0) for i in range(count)),
+        )
+        self._pad(8)
+        table = len(self.out)
+        self.out += struct.pack("<i", table - vtable) + bytes(size - 4)
+        for field, (kind, value) in fields.items():
+            at = table + offsets[field]
+            if kind in SCALAR_SIZES:
+                struct.pack_into(f"<{kind}", self.out, at, value)
+            else:
+                struct.pack_into("<I", self.out, at, self._write(kind, value) - at)
+        return table
+
+    def _write(self, kind: str, value: Any) -> int:
+        """Write a string, table or vector; its position."""
+        if kind == "table":
+            return self.table(value)
+        if kind == "tables":
+            self._pad(4)
+            position = len(self.out)
+            self.out += struct.pack("<I", len(value)) + bytes(4 * len(value))
+            for i, child in enumerate(value):
+                slot = position + 4 + 4 * i
+                struct.pack_into("<I", self.out, slot, self.table(child) - slot)
+            return position
+        if kind == "str":
+            data = value.encode()
+            self._pad(4)
+            position = len(self.out)
+            # Null-terminated.
+            self.out += struct.pack("<I", len(data)) + data + b"\x00"
+            return position
+        item = kind[0]
+        size = SCALAR_SIZES[item]
+        self._pad(max(size, 4), 4)
+        position = len(self.out)
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            self.out += struct.pack("<I", len(value) // size) + value
+        else:
+            self.out += struct.pack(f"<I{len(value)}{item}", len(value), *value)
+        return position
+
+
+def _wkb_geometry(wkb: memoryview, position: int = 0) -> Tuple[dict, int]:
+    """
+    FlatGeobuf geometry fields of the 2D little-endian WKB geometry at
+    `position`, and the position after it.
+    """
+    byte_order, kind = struct.unpack_from("<BI", wkb, position)
+    if byte_order != 1 or kind > GEOMETRYCOLLECTION:
+        raise FlatGeobufError(f"Unsupported WKB geometry {byte_order}/{kind}")
+    position += 5
+    fields: dict = {6: ("B", kind)}
+    if kind == POINT:
+        x, y = WKB_POINT.unpack_from(wkb, position)
+        if x == x or y == y:
+            # Not empty (NaN coordinates).
+            fields[1] = ("d*", wkb[position : position + 16])
+        return fields, position + 16
+    (count,) = struct.unpack_from("<I", wkb, position)
+    position += 4
+    if kind == LINESTRING:
+        fields[1] = ("d*", wkb[position : position + 16 * count])
+        return fields, position + 16 * count
+    if kind == POLYGON:
+        xy, ends = bytearray(), []
+        for _ in range(count):
+            (points,) = struct.unpack_from("<I", wkb, position)
+            xy += wkb[position + 4 : position + 4 + 16 * points]
+            ends.append(len(xy) // 16)
+            position += 4 + 16 * points
+    elif kind in (MULTIPOINT, MULTILINESTRING):
+        xy, ends = bytearray(), []
+        for _ in range(count):
+            part, position = _wkb_geometry(wkb, position)
+            if 1 in part:
+                xy += part[1][1]
+            ends.append(len(xy) // 16)
+        if kind == MULTIPOINT:
+            ends = []
+    else:
+        parts = []
+        for _ in range(count):
+            part, position = _wkb_geometry(wkb, position)
+            parts.append(part)
+        fields[7] = ("tables", parts)
+        return fields, position
+    if xy:
+        fields[1] = ("d*", bytes(xy))
+    if len(ends) > 1:
+        fields[0] = ("I*", ends)
+    return fields, position
+
+
+def wkb_to_geometry(wkb: bytes) -> dict:
+    """FlatGeobuf geometry fields of a 2D little-endian WKB geometry."""
+    try:
+        return _wkb_geometry(memoryview(wkb))[0]
+    except struct.error as e:
+        raise FlatGeobufError("Invalid WKB geometry") from e
+
+
+class FlatGeobufWriter:
+    """
+    Streamed FlatGeobuf of 2D geometries of any type: `header()`, then
+    `feature()` for each feature, without index nor feature count.
+    `columns` are (name, column type) of the properties.
+    """
+
+    def __init__(self, name: str, columns: List[Tuple[str, int]], srid: int):
+        self.name = name
+        self.columns = columns
+        self.srid = srid
+
+    def header(self) -> bytes:
+        header = _Builder().finish(
+            {
+                0: ("str", self.name),
+                2: ("B", UNKNOWN),
+                7: (
+                    "tables",
+                    [
+                        {0: ("str", name), 1: ("B", column_type)}
+                        for name, column_type in self.columns
+                    ],
+                ),
+                8: ("Q", 0),
+                9: ("H", 0),
+                10: ("table", {0: ("str", "EPSG"), 1: ("i", self.srid)}),
+            }
+        )
+        return MAGIC + b"\x00" + struct.pack("<I", len(header)) + header
+
+    def _properties(self, values: List[Any]) -> bytes:
+        data = bytearray()
+        for column, ((_, column_type), value) in enumerate(zip(self.columns, values)):
+            if value is None:
+                continue
+            data += struct.pack("<H", column)
+            scalar = SCALAR_FORMATS.get(column_type)
+            if scalar is not None:
+                data += scalar.pack(value)
+                continue
+            raw = value if isinstance(value, bytes) else str(value).encode()
+            data += struct.pack("<I", len(raw)) + raw
+        return bytes(data)
+
+    def feature(self, wkb: Optional[bytes], values: List[Any]) -> bytes:
+        """Size-prefixed feature of a WKB geometry (or None) and its values."""
+        fields: Dict[int, Tuple[str, Any]] = {1: ("B*", self._properties(values))}
+        if wkb is not None:
+            fields[0] = ("table", wkb_to_geometry(wkb))
+        feature = _Builder().finish(fields)
+        return struct.pack("<I", len(feature)) + feature
@@ -0,0 +1,282 @@
+"""
+Streaming GeoJSON: incremental FeatureCollection parsing and EWKB encoding.
+
+`FeatureParser` is fed the bytes of a document as they arrive and returns the
+features completed by each chunk, so memory is bounded by the largest feature,
+not by the collection. Members other than `features` are kept in `members`
+(`type`, a legacy `crs`, ...).
+"""
+
+import codecs
+import json
+import re
+import struct
+from typing import Any, Dict, List, Optional
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+CRS_PATTERN = re.compile(r"EPSG:+(?:[\d.]*:)?(\d+)$")
+DEFAULT_SRID = 4326
+
+WKB_TYPES = {
+    "Point": 1,
+    "LineString": 2,
+    "Polygon": 3,
+    "MultiPoint": 4,
+    "MultiLineString": 5,
+    "MultiPolygon": 6,
+    "GeometryCollection": 7,
+}
+MULTI_PARTS = {
+    "MultiPoint": "Point",
+    "MultiLineString": "LineString",
+    "MultiPolygon": "Polygon",
+}
+EWKB_Z = 0x80000000
+EWKB_SRID = 0x20000000
+
+# Parser states
+START, KEY, COLON, VALUE, FEATURES_START, FEATURES, DONE = range(7)
+INCOMPLETE = object()
+
+
+class GeoJSONError(ValueError):
+    """Malformed or unsupported GeoJSON."""
+
+
+class FeatureParser:
+    """Push parser of a FeatureCollection (or a single Feature)."""
+
+    def __init__(self, max_feature_size: int = 64 * 1024 * 1024):
+        self.max_feature_size = max_feature_size
+        self.members: Dict[str, Any] = {}
+        self.has_features = False
+        self._decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        self._json = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._state = START
+        self._key: Optional[str] = None
+        # A value that did not parse is retried once the buffer doubled, so a
+        # large feature arriving in many chunks is not re-parsed for each one.
+        self._wait_for = 0
+
+    @property
+    def srid(self) -> int:
+        """SRID of a legacy `crs` member read so far, WGS84 otherwise."""
+        try:
+            name = self.members["crs"]["properties"]["name"]
+        except (KeyError, TypeError):
+            return DEFAULT_SRID
+        match = CRS_PATTERN.search(str(name))
+        return int(match.group(1)) if match else DEFAULT_SRID
+
+    def feed(self, data: bytes) -> List[dict]:
+        """Features completed by a chunk of the document."""
+        try:
+            text = self._decoder.decode(data)
+        except UnicodeDecodeError as e:
+            raise GeoJSONError("Invalid UTF-8") from e
+        self._buffer = self._buffer[self._pos :] + text
+        self._pos = 0
+        if len(self._buffer) < self._wait_for:
+            return []
+        return self._parse(final=False)
+
+    def close(self) -> List[dict]:
+        """Features left at the end of the document."""
+        try:
+            text = self._decoder.decode(b"", final=True)
+        except UnicodeDecodeError as e:
+            raise GeoJSONError("Invalid UTF-8") from e
+        self._buffer = self._buffer[self._pos :] + text
+        self._pos = 0
+        features = self._parse(final=True)
+        if self._state != DONE:
+            raise GeoJSONError("Unexpected end of document")
+        document_type = self.members.get("type")
+        if not self.has_features:
+            if document_type != "Feature":
+                raise GeoJSONError("Expected a FeatureCollection or a Feature")
+            features.append(self.members)
+        elif document_type not in (None, "FeatureCollection"):
+            raise GeoJSONError("Expected a FeatureCollection or a Feature")
+        return features
+
+    def _decode(self, final: bool) -> Any:
+        try:
+            value, end = self._json.raw_decode(self._buffer, self._pos)
+        except json.JSONDecodeError as e:
+            if final:
+                raise GeoJSONError(f"Invalid JSON: {e.msg}") from e
+            remaining = len(self._buffer) - self._pos
+            if remaining > self.max_feature_size:
+                raise GeoJSONError(
+                    f"Value larger than {self.max_feature_size} characters"
+                ) from e
+            self._wait_for = 2 * remaining
+            return INCOMPLETE
+        if (
+            not final
+            and end == len(self._buffer)
+            and isinstance(value, (int, float))
+            and not isinstance(value, bool)
+        ):
+            # More digits may follow in the next chunk.
+            return INCOMPLETE
+        self._pos = end
+        self._wait_for = 0
+        return value
+
+    def _parse(self, final: bool) -> List[dict]:
+        features: List[dict] = []
+        while True:
+            self._pos = WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos >= len(self._buffer):
+                return features
+            char = self._buffer[self._pos]
+            if self._state == START:
+                if char != "{":
+                    raise GeoJSONError("Expected a GeoJSON object")
+                self._pos += 1
+                self._state = KEY
+            elif self._state == KEY:
+                if char == "}":
+                    self._pos += 1
+                    self._state = DONE
+                elif char == ",":
+                    self._pos += 1
+                elif char == '"':
+                    key = self._decode(final)
+                    if key is INCOMPLETE:
+                        return features
+                    self._key = key
+                    self._state = COLON
+                else:
+                    raise GeoJSONError("Expected a member name")
+            elif self._state == COLON:
+                if char != ":":
+                    raise GeoJSONError("Expected ':'")
+                self._pos += 1
+                self._state = FEATURES_START if self._key == "features" else VALUE
+            elif self._state == VALUE:
+                value = self._decode(final)
+                if value is INCOMPLETE:
+                    return features
+                self.members[self._key] = value
+                self._state = KEY
+            elif self._state == FEATURES_START:
+                if char != "[":
+                    raise GeoJSONError("features must be an array")
+                self._pos += 1
+                self.has_features = True
+                self._state = FEATURES
+            elif self._state == FEATURES:
+                if char == "]":
+                    self._pos += 1
+                    self._state = KEY
+                elif char == ",":
+                    self._pos += 1
+                else:
+                    feature = self._decode(final)
+                    if feature is INCOMPLETE:
+                        return features
+                    if not isinstance(feature, dict):
+                        raise GeoJSONError("Features must be objects")
+                    features.append(feature)
+            else:
+                raise GeoJSONError("Unexpected data after the document")
+
+
+def _has_z(coordinates: Any) -> bool:
+    """Whether the first position of a coordinates array has a Z value."""
+    while isinstance(coordinates, list) and coordinates:
+        if not isinstance(coordinates[0], list):
+            return len(coordinates) >= 3
+        coordinates = coordinates[0]
+    return False
+
+
+def _first_coordinates(geometry: dict) -> Any:
+    if geometry.get("type") == "GeometryCollection":
+        for part in geometry.get("geometries") or []:
+            coordinates = _first_coordinates(part)
+            if coordinates:
+                return coordinates
+        return None
+    return geometry.get("coordinates")
+
+
+def _positions(out: bytearray, positions: list, dims: int) -> None:
+    values: List[float] = []
+    for position in positions:
+        values += position[:dims]
+        if len(position) < dims:
+            values.append(0.0)
+    out += struct.pack(f"<I{len(values)}d", len(positions), *values)
+
+
+def _write(out: bytearray, geometry: dict, dims: int, srid: Optional[int]) -> None:
+    kind = geometry.get("type")
+    code = WKB_TYPES.get(kind)
+    if code is None:
+        raise GeoJSONError(f"Unsupported geometry type {kind!r}")
+    if dims == 3:
+        code |= EWKB_Z
+    if srid is not None:
+        out += struct.pack("<BII", 1, code | EWKB_SRID, srid)
+    else:
+        out += struct.pack("<BI", 1, code)
+
+    if kind == "GeometryCollection":
+        parts = geometry.get("geometries") or []
+        out += struct.pack("<I", len(parts))
+        for part in parts:
+            _write(out, part, dims, None)
+        return
+    coordinates = geometry.get("coordinates")
+    if kind == "Point":
+        if coordinates:
+            values = list(coordinates[:dims]) + [0.0] * (dims - len(coordinates))
+        else:
+            values = [float("nan")] * dims
+        out += struct.pack(f"<{dims}d", *values)
+    elif kind == "LineString":
+        _positions(out, coordinates, dims)
+    elif kind == "Polygon":
+        out += struct.pack("<I", len(coordinates))
+        for ring in coordinates:
+            _positions(out, ring, dims)
+    else:
+        part_type = MULTI_PARTS[kind]
+        out += struct.pack("<I", len(coordinates))
+        for part in coordinates:
+            _write(out, {"type": part_type, "coordinates": part}, dims, None)
+
+
+def geometry_to_ewkb(geometry: Optional[dict], srid: int) -> Optional[bytes]:
+    """
+    EWKB (little-endian, with SRID) of a GeoJSON geometry, None for a null one.
+    Z is kept when the first position has one; M values are dropped.
+    """
+    if geometry is None:
+        return None
+    if not isinstance(geometry, dict):
+        raise GeoJSONError("Geometries must be objects")
+    out = bytearray()
+    try:
+        dims = 3 if _has_z(_first_coordinates(geometry)) else 2
+        _write(out, geometry, dims, srid)
+    except (AttributeError, TypeError, struct.error) as e:
+        raise GeoJSONError(f"Invalid {geometry.get('type')} coordinates") from e
+    return bytes(out)
+
+
+def wkb_to_ewkb(wkb: bytes, srid: int) -> bytes:
+    """
+    EWKB, with SRID, of a WKB geometry: its outer type code is rewritten, its
+    coordinates are copied as is. PostGIS reads ISO type codes (1001, ...)
+    flagged with an EWKB SRID.
+    """
+    order = "<" if wkb[0] == 1 else ">"
+    code = struct.unpack_from(f"{order}I", wkb, 1)[0]
+    return bytes(wkb[:1]) + struct.pack(f"{order}II", code | EWKB_SRID, srid) + wkb[5:]
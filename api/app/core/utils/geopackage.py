@@ -0,0 +1,145 @@
+"""
+GeoPackage reading: features of a layer as EWKB and values.
+
+A GeoPackage is a SQLite database; features are read by FID range on their own
+read-only connection, so ranges of a layer are read independently (by other
+processes). Geometries are standard WKB behind a small header, turned into
+EWKB by rewriting the outer type code, without decoding coordinates.
+"""
+
+import sqlite3
+from typing import Any, Iterator, List, Optional, Tuple
+
+from app.core.utils.geojson import wkb_to_ewkb
+
+MAGIC = b"GP"
+# Envelope sizes by the envelope indicator of the header flags.
+ENVELOPE_SIZES = {0: 0, 1: 32, 2: 48, 3: 48, 4: 64}
+FLAG_EXTENDED = 0x20
+
+
+class GeoPackageError(ValueError):
+    """Malformed or unsupported GeoPackage."""
+
+
+def quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def gpkg_to_ewkb(blob: Optional[bytes], srid: int) -> Optional[bytes]:
+    """EWKB, with SRID, of a GeoPackage geometry blob; None for a null one."""
+    if blob is None:
+        return None
+    if blob[:2] != MAGIC or len(blob) < 8:
+        raise GeoPackageError("Invalid GeoPackage geometry")
+    flags = blob[3]
+    if flags & FLAG_EXTENDED:
+        raise GeoPackageError("Extended GeoPackage geometries are not supported")
+    envelope = ENVELOPE_SIZES.get((flags >> 1) & 0x07)
+    if envelope is None:
+        raise GeoPackageError("Invalid GeoPackage geometry envelope")
+    wkb = blob[8 + envelope :]
+    if len(wkb) < 5:
+        raise GeoPackageError("Invalid GeoPackage geometry")
+    return wkb_to_ewkb(wkb, srid)
+
+
+class GeoPackageLayer:
+    """A feature table of a GeoPackage (the first one when not named)."""
+
+    def __init__(self, path: str, table: Optional[str] = None):
+        self.path = path
+        try:
+            connection = self._connect()
+            try:
+                self._describe(connection, table)
+            finally:
+                connection.close()
+        except sqlite3.Error as e:
+            raise GeoPackageError(f"Unreadable GeoPackage: {e}") from e
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+
+    def _describe(self, connection: sqlite3.Connection, table: Optional[str]) -> None:
+        tables = [
+            row[0]
+            for row in connection.execute(
+                "SELECT table_name FROM gpkg_contents "
+                "WHERE data_type = 'features' ORDER BY table_name"
+            )
+        ]
+        if not tables or (table is not None and table not in tables):
+            raise GeoPackageError(f"No feature table {table or ''}".rstrip())
+        self.table = table or tables[0]
+
+        row = connection.execute(
+            "SELECT g.column_name, g.srs_id, s.organization, "
+            "s.organization_coordsys_id FROM gpkg_geometry_columns g "
+            "LEFT JOIN gpkg_spatial_ref_sys s ON s.srs_id = g.srs_id "
+            "WHERE g.table_name = ?",
+            (self.table,),
+        ).fetchone()
+        if row is None:
+            raise GeoPackageError(f"No geometry column in {self.table}")
+        self.geometry_column, srs_id, organization, code = row
+        # -1 and 0 are the undefined cartesian and geographic systems.
+        if (organization or "").upper() == "EPSG" and code:
+            self.srid: Optional[int] = code
+        else:
+            self.srid = srs_id if srs_id and srs_id > 0 else None
+
+        self.fid_column: Optional[str] = None
+        # (name, declared type) of the attribute columns.
+        self.fields: List[Tuple[str, str]] = []
+        for _, name, declared, _, _, pk in connection.execute(
+            f"PRAGMA table_info({quote(self.table)})"
+        ):
+            if pk and (declared or "").upper() == "INTEGER":
+                self.fid_column = name
+            elif name != self.geometry_column:
+                self.fields.append((name, (declared or "").upper()))
+        if self.fid_column is None:
+            raise GeoPackageError(f"No integer primary key in {self.table}")
+
+        self.min_fid, self.max_fid, self.count = connection.execute(
+            f"SELECT min({quote(self.fid_column)}), max({quote(self.fid_column)}), "
+            f"count(*) FROM {quote(self.table)}"
+        ).fetchone()
+
+    def ranges(self, size: int) -> List[Tuple[int, int]]:
+        """FID ranges [start, stop) of about `size` features each."""
+        if not self.count:
+            return []
+        span = self.max_fid - self.min_fid + 1
+        # FIDs may have gaps: split the FID span evenly, by the average density.
+        step = max(1, span * size // self.count)
+        return [
+            (start, min(start + step, self.max_fid + 1))
+            for start in range(self.min_fid, self.max_fid + 1, step)
+        ]
+
+    def records(
+        self, start: int, stop: int, srid: int
+    ) -> Iterator[Tuple[int, Optional[bytes], List[Any]]]:
+        """(fid, EWKB, values) of the features with start <= fid < stop."""
+        columns = ", ".join(
+            quote(name)
+            for name in [self.fid_column, self.geometry_column]
+            + [name for name, _ in self.fields]
+        )
+        fid = quote(self.fid_column)
+        try:
+            connection = self._connect()
+            try:
+                rows = connection.execute(
+                    f"SELECT {columns} FROM {quote(self.table)} "
+                    f"WHERE {fid} >= ? AND {fid} < ? ORDER BY {fid}",
+                    (start, stop),
+                )
+                for row in rows:
+                    yield row[0], gpkg_to_ewkb(row[1], srid), list(row[2:])
+            finally:
+                connection.close()
+        except sqlite3.Error as e:
+            raise GeoPackageError(f"Unreadable GeoPackage: {e}") from e
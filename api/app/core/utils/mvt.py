@@ -0,0 +1,199 @@
+"""
+Mapbox Vector Tile pruning at the protobuf wire level.
+
+Only the parts of a tile that pruning rewrites are decoded (layer names, keys,
+values and feature tags); geometries and every other field are copied as raw
+bytes, so no protobuf runtime is needed.
+
+    Tile:    3 = layers (repeated Layer)
+    Layer:   1 = name, 2 = features, 3 = keys, 4 = values, 5 = extent, 15 = version
+    Feature: 1 = id, 2 = tags (packed key/value index pairs), 3 = type, 4 = geometry
+"""
+
+import gzip
+from typing import Dict, FrozenSet, Iterator, List, Mapping, Optional, Tuple
+
+VARINT = 0
+FIXED64 = 1
+LENGTH_DELIMITED = 2
+FIXED32 = 5
+
+TILE_LAYERS = 3
+LAYER_NAME = 1
+LAYER_FEATURES = 2
+LAYER_KEYS = 3
+LAYER_VALUES = 4
+FEATURE_TAGS = 2
+
+# source-layer -> properties to keep, None keeping all of them
+LayerProperties = Mapping[str, Optional[FrozenSet[str]]]
+
+
+def read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    """Decode a varint at `pos`, return it with the position after it."""
+    result = shift = 0
+    while True:
+        if pos >= len(data):
+            raise ValueError("Truncated varint")
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def write_varint(value: int) -> bytes:
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def iter_fields(data: bytes) -> Iterator[Tuple[int, int, object, bytes]]:
+    """
+    Yield (field number, wire type, value, raw bytes) for each field of a message.
+    Length-delimited values are bytes, other values ints.
+    """
+    pos = 0
+    while pos < len(data):
+        start = pos
+        tag, pos = read_varint(data, pos)
+        field, wire_type = tag >> 3, tag & 0x07
+        if wire_type == VARINT:
+            value, pos = read_varint(data, pos)
+        elif wire_type == LENGTH_DELIMITED:
+            length, pos = read_varint(data, pos)
+            value = data[pos : pos + length]
+            if len(value) != length:
+                raise ValueError("Truncated field")
+            pos += length
+        elif wire_type == FIXED64:
+            value, pos = int.from_bytes(data[pos : pos + 8], "little"), pos + 8
+        elif wire_type == FIXED32:
+            value, pos = int.from_bytes(data[pos : pos + 4], "little"), pos + 4
+        else:
+            raise ValueError(f"Unsupported wire type {wire_type}")
+        if pos > len(data):
+            raise ValueError("Truncated field")
+        yield field, wire_type, value, data[start:pos]
+
+
+def length_delimited(field: int, value: bytes) -> bytes:
+    return (
+        write_varint(field << 3 | LENGTH_DELIMITED) + write_varint(len(value)) + value
+    )
+
+
+def _feature_tags(value: object, wire_type: int) -> List[int]:
+    if wire_type == VARINT:
+        return [value]
+    tags, pos = [], 0
+    while pos < len(value):
+        tag, pos = read_varint(value, pos)
+        tags.append(tag)
+    return tags
+
+
+def layer_name(layer: bytes) -> Optional[str]:
+    for field, wire_type, value, _ in iter_fields(layer):
+        if field == LAYER_NAME and wire_type == LENGTH_DELIMITED:
+            return value.decode("utf-8")
+    return None
+
+
+def rename_layer(layer: bytes, name: str) -> bytes:
+    """A layer with its name replaced, every other field copied as is."""
+    out = bytearray(length_delimited(LAYER_NAME, name.encode("utf-8")))
+    for field, _, _, raw in iter_fields(layer):
+        if field != LAYER_NAME:
+            out += raw
+    return bytes(out)
+
+
+def tile_layers(data: bytes) -> List[bytes]:
+    """The layers of a tile, as encoded."""
+    return [
+        value
+        for field, wire_type, value, _ in iter_fields(data)
+        if field == TILE_LAYERS and wire_type == LENGTH_DELIMITED
+    ]
+
+
+def prune_layer(layer: bytes, properties: FrozenSet[str]) -> bytes:
+    """Drop the keys of a layer not in `properties`, and the values they used."""
+    fields: List[bytes] = []
+    features: List[bytes] = []
+    keys: List[str] = []
+    values: List[bytes] = []
+    for field, wire_type, value, raw in iter_fields(layer):
+        if field == LAYER_FEATURES and wire_type == LENGTH_DELIMITED:
+            features.append(value)
+        elif field == LAYER_KEYS and wire_type == LENGTH_DELIMITED:
+            keys.append(value.decode("utf-8"))
+        elif field == LAYER_VALUES and wire_type == LENGTH_DELIMITED:
+            values.append(value)
+        else:
+            fields.append(raw)
+
+    kept_keys = [i for i, key in enumerate(keys) if key in properties]
+    key_index = {old: new for new, old in enumerate(kept_keys)}
+    value_index: Dict[int, int] = {}
+
+    out = bytearray().join(fields)
+    for feature in features:
+        pruned = bytearray()
+        tags: List[int] = []
+        for field, wire_type, value, raw in iter_fields(feature):
+            if field != FEATURE_TAGS:
+                pruned += raw
+                continue
+            pairs = _feature_tags(value, wire_type)
+            for key, val in zip(pairs[::2], pairs[1::2]):
+                if key in key_index:
+                    tags += [
+                        key_index[key],
+                        value_index.setdefault(val, len(value_index)),
+                    ]
+        if tags:
+            pruned += length_delimited(
+                FEATURE_TAGS, b"".join(write_varint(tag) for tag in tags)
+            )
+        out += length_delimited(LAYER_FEATURES, bytes(pruned))
+    for old in kept_keys:
+        out += length_delimited(LAYER_KEYS, keys[old].encode("utf-8"))
+    for old in sorted(value_index, key=value_index.get):
+        out += length_delimited(LAYER_VALUES, values[old])
+    return bytes(out)
+
+
+def prune_tile(data: bytes, layers: LayerProperties) -> bytes:
+    """
+    Keep the layers listed in `layers`, each with the given properties only.
+    Feature ids and geometries are left untouched.
+    """
+    out = bytearray()
+    for field, wire_type, value, raw in iter_fields(data):
+        if field != TILE_LAYERS or wire_type != LENGTH_DELIMITED:
+            out += raw
+            continue
+        name = layer_name(value)
+        if name not in layers:
+            continue
+        properties = layers[name]
+        if properties is None:
+            out += raw
+        else:
+            out += length_delimited(TILE_LAYERS, prune_layer(value, properties))
+    return bytes(out)
+
+
+def prune_encoded_tile(
+    data: bytes, content_encoding: Optional[str], layers: LayerProperties
+) -> bytes:
+    """`prune_tile` on a tile body that may be gzipped, keeping its encoding."""
+    if content_encoding == "gzip":
+        return gzip.compress(prune_tile(gzip.decompress(data), layers), mtime=0)
+    return prune_tile(data, layers)
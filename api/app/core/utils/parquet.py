@@ -0,0 +1,226 @@
+"""
+GeoParquet reading: row groups of a file as EWKB and values.
+
+Files are read with pyarrow, one row group at a time, in record batches: every
+codec and encoding of the format is supported (SNAPPY, GZIP, ZSTD, dictionary
+pages, v2 pages...). Nested columns (lists, structs, maps) and binary columns
+other than the geometry are not read. WKB geometries are sliced from the data
+buffer of their batch (no copy) and go to EWKB by rewriting their type code
+only.
+
+The `geo` metadata of the file names its geometry columns, their encoding (WKB
+only, not the native GeoArrow encodings) and their CRS, as PROJJSON.
+"""
+
+import json
+import re
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from app.core.utils.geojson import DEFAULT_SRID, wkb_to_ewkb
+
+# Column kinds, by Arrow type.
+KIND_BOOLEAN, KIND_INTEGER, KIND_FLOAT = "boolean", "integer", "float"
+KIND_STRING, KIND_DATE, KIND_TIMESTAMP = "string", "date", "timestamp"
+KIND_BINARY = "binary"
+
+EPOCH = datetime(1970, 1, 1)
+# Nanoseconds per timestamp unit.
+TIMESTAMP_UNITS = {"s": 1_000_000_000, "ms": 1_000_000, "us": 1_000, "ns": 1}
+CRS_CODE = re.compile(r"EPSG:+(\d+)$", re.IGNORECASE)
+# Rows per record batch of a row group.
+BATCH_SIZE = 65536
+
+
+class ParquetError(ValueError):
+    """Malformed or unsupported (Geo)Parquet file."""
+
+
+def _kind(data_type: pa.DataType) -> str:
+    """Kind of a column, "" when it is not read."""
+    if pa.types.is_dictionary(data_type):
+        data_type = data_type.value_type
+    if pa.types.is_boolean(data_type):
+        return KIND_BOOLEAN
+    if pa.types.is_integer(data_type):
+        return KIND_INTEGER
+    if pa.types.is_floating(data_type) or pa.types.is_decimal(data_type):
+        return KIND_FLOAT
+    if pa.types.is_string(data_type) or pa.types.is_large_string(data_type):
+        return KIND_STRING
+    if pa.types.is_date(data_type):
+        return KIND_DATE
+    if pa.types.is_timestamp(data_type):
+        return KIND_TIMESTAMP
+    if (
+        pa.types.is_binary(data_type)
+        or pa.types.is_large_binary(data_type)
+        or pa.types.is_fixed_size_binary(data_type)
+    ):
+        return KIND_BINARY
+    return ""
+
+
+def _timestamp(value: int, unit: int) -> Optional[str]:
+    try:
+        return (EPOCH + timedelta(microseconds=value * unit // 1000)).isoformat()
+    except OverflowError:
+        return None
+
+
+def _values(array: pa.Array) -> List[Any]:
+    """Python values of an attribute column, dates and timestamps as ISO text."""
+    data_type = array.type
+    if pa.types.is_dictionary(data_type):
+        array = array.dictionary_decode()
+        data_type = array.type
+    if pa.types.is_timestamp(data_type):
+        # As integers, so that out-of-range timestamps become nulls.
+        unit = TIMESTAMP_UNITS[data_type.unit]
+        return [
+            None if value is None else _timestamp(value, unit)
+            for value in array.cast(pa.int64()).to_pylist()
+        ]
+    values = array.to_pylist()
+    if pa.types.is_date(data_type):
+        return [None if value is None else value.isoformat() for value in values]
+    return values
+
+
+def _geometries(array: pa.Array, srid: int) -> List[Optional[bytes]]:
+    """EWKB of a WKB column, read from the buffers of the array."""
+    if pa.types.is_large_binary(array.type):
+        offset_format = "q"
+    elif pa.types.is_binary(array.type):
+        offset_format = "i"
+    else:
+        raise ParquetError(f"Unsupported geometry type {array.type}")
+    _, offsets_buffer, data_buffer = array.buffers()
+    offsets = memoryview(offsets_buffer).cast(offset_format)
+    data = memoryview(data_buffer) if data_buffer is not None else memoryview(b"")
+    valid = array.is_valid().to_pylist() if array.null_count else [True] * len(array)
+    first = array.offset
+    return [
+        wkb_to_ewkb(data[offsets[first + i] : offsets[first + i + 1]], srid)
+        if valid[i]
+        else None
+        for i in range(len(array))
+    ]
+
+
+def crs_srid(crs: Any) -> Optional[int]:
+    """EPSG code of a PROJJSON (or "EPSG:code") CRS, None when not one."""
+    if isinstance(crs, str):
+        match = CRS_CODE.match(crs.strip())
+        return int(match.group(1)) if match else None
+    if not isinstance(crs, dict):
+        return None
+    identifier = crs.get("id") or {}
+    authority = str(identifier.get("authority", "")).upper()
+    code = str(identifier.get("code", ""))
+    if authority == "OGC" and code == "CRS84":
+        return DEFAULT_SRID
+    if authority == "EPSG" and code.isdigit():
+        return int(code)
+    return None
+
+
+def _read(read: Callable[[], Any]) -> Any:
+    """Run a pyarrow read, its failures raised as `ParquetError`."""
+    try:
+        return read()
+    except (pa.ArrowException, OSError) as e:
+        raise ParquetError(f"Unreadable Parquet file: {e}") from e
+
+
+class GeoParquetLayer:
+    """
+    A geometry column of a GeoParquet file (the primary one when not named),
+    with the other flat columns as attributes.
+    """
+
+    def __init__(self, path: str, geometry: Optional[str] = None):
+        self.file = _read(lambda: pq.ParquetFile(path))
+        schema = self.file.schema_arrow
+        try:
+            geo = json.loads((schema.metadata or {})[b"geo"])
+            columns = geo["columns"]
+            self.geometry_column = geometry or geo["primary_column"]
+        except (KeyError, TypeError, ValueError) as e:
+            raise ParquetError("No GeoParquet metadata") from e
+        metadata = columns.get(self.geometry_column)
+        if not isinstance(metadata, dict):
+            raise ParquetError(f"No geometry column {self.geometry_column}")
+        # Native (GeoArrow) encodings are nested columns, not read.
+        encoding = str(metadata.get("encoding", "WKB"))
+        kinds: Dict[str, str] = {field.name: _kind(field.type) for field in schema}
+        if encoding.upper() != "WKB" or kinds.get(self.geometry_column) != KIND_BINARY:
+            raise ParquetError(f"Unsupported geometry encoding {encoding}")
+        # An absent CRS is OGC:CRS84; a null one is unknown.
+        self.srid = crs_srid(metadata["crs"]) if "crs" in metadata else DEFAULT_SRID
+        # (name, kind) of the attribute columns.
+        self.fields: List[Tuple[str, str]] = [
+            (name, kind)
+            for name, kind in kinds.items()
+            if kind and name != self.geometry_column
+        ]
+        self.count = self.file.metadata.num_rows
+        # (first row, row count) of each row group.
+        self.row_groups: List[Tuple[int, int]] = []
+        first = 0
+        for index in range(self.file.metadata.num_row_groups):
+            rows = self.file.metadata.row_group(index).num_rows
+            self.row_groups.append((first, rows))
+            first += rows
+
+    def ranges(self, size: int) -> List[Tuple[int, int]]:
+        """
+        Row ranges [start, stop) of whole row groups, consecutive small row
+        groups merged up to about `size` rows.
+        """
+        ranges: List[Tuple[int, int]] = []
+        for first, rows in self.row_groups:
+            if not rows:
+                continue
+            if ranges and ranges[-1][1] - ranges[-1][0] < size:
+                ranges[-1] = (ranges[-1][0], first + rows)
+            else:
+                ranges.append((first, first + rows))
+        return ranges
+
+    def records(
+        self, start: int, stop: int, srid: int
+    ) -> Iterator[Tuple[int, Optional[bytes], List[Any]]]:
+        """
+        (fid, EWKB, values) of the rows of the row groups starting in
+        [start, stop), fid being the row number + 1.
+        """
+        groups = [
+            index
+            for index, (first, rows) in enumerate(self.row_groups)
+            if start <= first < stop and rows
+        ]
+        if not groups:
+            return
+        names = [name for name, _ in self.fields]
+        batches = _read(
+            lambda: self.file.iter_batches(
+                batch_size=BATCH_SIZE,
+                row_groups=groups,
+                columns=[self.geometry_column, *names],
+                use_threads=False,
+            )
+        )
+        fid = self.row_groups[groups[0]][0] + 1
+        while True:
+            batch = _read(lambda: next(batches, None))
+            if batch is None:
+                return
+            geometries = _geometries(batch.column(0), srid)
+            values = [_values(batch.column(i + 1)) for i in range(len(names))]
+            for i, geometry in enumerate(geometries):
+                yield fid, geometry, [column[i] for column in values]
+                fid += 1
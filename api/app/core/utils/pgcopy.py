@@ -0,0 +1,53 @@
+"""
+PostgreSQL binary COPY streams.
+
+`CopyEncoder` builds the bytes of a `COPY ... FROM STDIN (FORMAT binary)` stream
+without a connection, so rows can be encoded in another process and only the
+bytes are written on the connection. Column types use the names of psycopg's
+binary dumpers (`int8`, `float8`, ...).
+"""
+
+import json
+import struct
+from typing import Any, Sequence
+
+HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+TRAILER = struct.pack(">h", -1)
+NULL = struct.pack(">i", -1)
+JSONB_VERSION = b"\x01"
+
+ENCODERS = {
+    "bytea": bytes,
+    "bool": lambda value: b"\x01" if value else b"\x00",
+    "int8": struct.Struct(">q").pack,
+    "float8": struct.Struct(">d").pack,
+    "text": str.encode,
+    "jsonb": lambda value: JSONB_VERSION + json.dumps(value).encode(),
+}
+
+
+class CopyEncoder:
+    """Rows of a binary COPY stream, encoded in memory."""
+
+    def __init__(self, types: Sequence[str]):
+        self._encoders = [ENCODERS[column_type] for column_type in types]
+        self._field_count = struct.pack(">h", len(types))
+        self._buffer = bytearray(HEADER)
+        self.rows = 0
+
+    def write_row(self, values: Sequence[Any]) -> None:
+        out = self._buffer
+        out += self._field_count
+        for encode, value in zip(self._encoders, values):
+            if value is None:
+                out += NULL
+                continue
+            data = encode(value)
+            out += struct.pack(">i", len(data))
+            out += data
+        self.rows += 1
+
+    def finish(self) -> bytes:
+        """The complete stream, trailer included."""
+        self._buffer += TRAILER
+        return bytes(self._buffer)
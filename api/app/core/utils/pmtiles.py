@@ -0,0 +1,362 @@
+"""
+PMTiles v3 archive format: header, directories and Hilbert tile ids.
+
+    Header (127 bytes) | root directory | metadata | leaf directories | tile data
+
+A directory is a sorted list of entries (tile id, offset, length, run length).
+An entry with a run length points to tile data, shared by `run_length`
+consecutive tile ids; an entry with a run length of 0 points to a leaf directory.
+
+`ArchiveWriter` writes clustered archives: tiles added in tile id order, each
+distinct content stored once.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import struct
+import tempfile
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from app.core.utils.mvt import read_varint, write_varint
+
+MAGIC = b"PMTiles"
+VERSION = 3
+HEADER_SIZE = 127
+# Root -> leaf directories, as written by the reference implementation.
+MAX_DIRECTORY_DEPTH = 4
+# Clients read the header and root directory with the first 16 KiB request.
+MAX_ROOT_DIRECTORY_BYTES = 16384 - HEADER_SIZE
+LEAF_DIRECTORY_ENTRIES = 4096
+
+COMPRESSION_UNKNOWN = 0
+COMPRESSION_NONE = 1
+COMPRESSION_GZIP = 2
+COMPRESSION_BROTLI = 3
+COMPRESSION_ZSTD = 4
+
+CONTENT_ENCODINGS = {
+    COMPRESSION_GZIP: "gzip",
+    COMPRESSION_BROTLI: "br",
+    COMPRESSION_ZSTD: "zstd",
+}
+TILE_TYPE_MVT = 1
+CONTENT_TYPES = {
+    TILE_TYPE_MVT: "application/x-protobuf",
+    2: "image/png",
+    3: "image/jpeg",
+    4: "image/webp",
+    5: "image/avif",
+}
+
+# 8 u64 offsets/lengths, 3 u64 counts, 6 u8 flags/zooms, 4 i32 bounds,
+# u8 center zoom, 2 i32 center coordinates.
+HEADER_FORMAT = struct.Struct("<7sB11Q6B4iB2i")
+
+
+class PMTilesError(ValueError):
+    """Malformed or unsupported archive."""
+
+
+@dataclass(frozen=True)
+class Header:
+    root_dir_offset: int
+    root_dir_length: int
+    metadata_offset: int
+    metadata_length: int
+    leaf_dirs_offset: int
+    leaf_dirs_length: int
+    tile_data_offset: int
+    tile_data_length: int
+    addressed_tiles_count: int
+    tile_entries_count: int
+    tile_contents_count: int
+    clustered: bool
+    internal_compression: int
+    tile_compression: int
+    tile_type: int
+    min_zoom: int
+    max_zoom: int
+    min_lon_e7: int
+    min_lat_e7: int
+    max_lon_e7: int
+    max_lat_e7: int
+    center_zoom: int
+    center_lon_e7: int
+    center_lat_e7: int
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "Header":
+        if len(data) < HEADER_SIZE:
+            raise PMTilesError("Truncated header")
+        magic, version, *values = HEADER_FORMAT.unpack_from(data)
+        if magic != MAGIC:
+            raise PMTilesError("Not a PMTiles archive")
+        if version != VERSION:
+            raise PMTilesError(f"Unsupported PMTiles version {version}")
+        values[11] = bool(values[11])
+        return cls(*values)
+
+    def to_bytes(self) -> bytes:
+        values = list(vars(self).values())
+        values[11] = int(values[11])
+        return HEADER_FORMAT.pack(MAGIC, VERSION, *values)
+
+    @property
+    def content_type(self) -> str:
+        return CONTENT_TYPES.get(self.tile_type, "application/octet-stream")
+
+    @property
+    def content_encoding(self) -> Optional[str]:
+        return CONTENT_ENCODINGS.get(self.tile_compression)
+
+
+@dataclass(frozen=True)
+class Entry:
+    tile_id: int
+    offset: int
+    length: int
+    run_length: int
+
+
+def zxy_to_tile_id(z: int, x: int, y: int) -> int:
+    """Position of a tile on the Hilbert curves of every zoom up to z."""
+    n = 1 << z
+    if not 0 <= x < n or not 0 <= y < n:
+        raise ValueError(f"Tile {z}/{x}/{y} is outside the tile grid")
+    tile_id = ((1 << (2 * z)) - 1) // 3
+    s = n >> 1
+    while s > 0:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        tile_id += s * s * ((3 * rx) ^ ry)
+        if ry == 0:
+            if rx == 1:
+                x, y = n - 1 - x, n - 1 - y
+            x, y = y, x
+        s >>= 1
+    return tile_id
+
+
+def decompress(data: bytes, compression: int) -> bytes:
+    if compression == COMPRESSION_NONE:
+        return data
+    if compression == COMPRESSION_GZIP:
+        return gzip.decompress(data)
+    raise PMTilesError(f"Unsupported internal compression {compression}")
+
+
+def compress(data: bytes, compression: int) -> bytes:
+    if compression == COMPRESSION_NONE:
+        return data
+    if compression == COMPRESSION_GZIP:
+        return gzip.compress(data, mtime=0)
+    raise PMTilesError(f"Unsupported internal compression {compression}")
+
+
+def decode_directory(data: bytes) -> List[Entry]:
+    """Entries of a decompressed directory, columns stored one after the other."""
+    try:
+        count, pos = read_varint(data, 0)
+        columns = []
+        for _ in range(4):
+            column = []
+            for _ in range(count):
+                value, pos = read_varint(data, pos)
+                column.append(value)
+            columns.append(column)
+    except ValueError as e:
+        raise PMTilesError(str(e)) from e
+
+    deltas, run_lengths, lengths, offsets = columns
+    entries: List[Entry] = []
+    tile_id = 0
+    for i in range(count):
+        tile_id += deltas[i]
+        if offsets[i] == 0 and i > 0:
+            # Tile data right after the previous entry's.
+            offset = entries[-1].offset + entries[-1].length
+        else:
+            offset = offsets[i] - 1
+        entries.append(Entry(tile_id, offset, lengths[i], run_lengths[i]))
+    return entries
+
+
+def encode_directory(entries: List[Entry]) -> bytes:
+    out = bytearray(write_varint(len(entries)))
+    last_id = 0
+    for entry in entries:
+        out += write_varint(entry.tile_id - last_id)
+        last_id = entry.tile_id
+    for entry in entries:
+        out += write_varint(entry.run_length)
+    for entry in entries:
+        out += write_varint(entry.length)
+    for i, entry in enumerate(entries):
+        previous = entries[i - 1] if i > 0 else None
+        if previous is not None and entry.offset == previous.offset + previous.length:
+            out += write_varint(0)
+        else:
+            out += write_varint(entry.offset + 1)
+    return bytes(out)
+
+
+def find_entry(entries: List[Entry], tile_id: int) -> Optional[Entry]:
+    """Entry holding a tile id (or the leaf directory that may), None if absent."""
+    low, high = 0, len(entries) - 1
+    while low <= high:
+        middle = (low + high) >> 1
+        if entries[middle].tile_id < tile_id:
+            low = middle + 1
+        elif entries[middle].tile_id > tile_id:
+            high = middle - 1
+        else:
+            return entries[middle]
+    # `high` is now the last entry starting before the tile id.
+    if high >= 0:
+        entry = entries[high]
+        if entry.run_length == 0 or tile_id - entry.tile_id < entry.run_length:
+            return entry
+    return None
+
+
+def build_directories(entries: List[Entry], compression: int) -> Tuple[bytes, bytes]:
+    """
+    Compressed root and leaf directories of sorted entries: the root alone when
+    it fits the first request, else leaves of `LEAF_DIRECTORY_ENTRIES` entries or
+    more, until their root fits.
+    """
+    root = compress(encode_directory(entries), compression)
+    leaf_size = LEAF_DIRECTORY_ENTRIES
+    leaves = bytearray()
+    while len(root) > MAX_ROOT_DIRECTORY_BYTES:
+        root_entries, leaves = [], bytearray()
+        for start in range(0, len(entries), leaf_size):
+            leaf = compress(
+                encode_directory(entries[start : start + leaf_size]), compression
+            )
+            root_entries.append(
+                Entry(entries[start].tile_id, len(leaves), len(leaf), 0)
+            )
+            leaves += leaf
+        root = compress(encode_directory(root_entries), compression)
+        leaf_size *= 2
+    return root, bytes(leaves)
+
+
+class ArchiveWriter:
+    """
+    Clustered archive written tile by tile, in tile id order. Identical tiles
+    (same hash) are stored once, and consecutive ones share a run-length entry.
+    Tile data is spooled next to `path` until `finish` assembles the archive and
+    moves it into place, so a reader never sees a partial archive.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        tile_compression: int = COMPRESSION_GZIP,
+        tile_type: int = TILE_TYPE_MVT,
+        internal_compression: int = COMPRESSION_GZIP,
+    ):
+        self.path = path
+        self.tile_compression = tile_compression
+        self.tile_type = tile_type
+        self.internal_compression = internal_compression
+        self.entries: List[Entry] = []
+        self.addressed = 0
+        self._offsets: dict = {}
+        self._data_length = 0
+        self._data = tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(path) or ".", prefix=".pmtiles-", delete=False
+        )
+
+    def add(self, tile_id: int, data: bytes, digest: Optional[bytes] = None) -> None:
+        """Add the (compressed) bytes of a tile, after every lower tile id."""
+        if self.entries and tile_id <= self.entries[-1].tile_id:
+            raise PMTilesError("Tiles must be added in tile id order")
+        if digest is None:
+            digest = hashlib.sha256(data).digest()
+        offset = self._offsets.get(digest)
+        if offset is None:
+            offset = self._data_length
+            self._offsets[digest] = offset
+            self._data.write(data)
+            self._data_length += len(data)
+        self.addressed += 1
+
+        last = self.entries[-1] if self.entries else None
+        if (
+            last is not None
+            and last.offset == offset
+            and last.tile_id + last.run_length == tile_id
+        ):
+            self.entries[-1] = Entry(
+                last.tile_id, offset, last.length, last.run_length + 1
+            )
+        else:
+            self.entries.append(Entry(tile_id, offset, len(data), 1))
+
+    def finish(
+        self,
+        min_zoom: int,
+        max_zoom: int,
+        bounds: Tuple[float, float, float, float],
+        metadata: dict,
+    ) -> Header:
+        """Write the archive: header, directories, metadata, then tile data."""
+        self._data.flush()
+        root, leaves = build_directories(self.entries, self.internal_compression)
+        encoded = compress(json.dumps(metadata).encode(), self.internal_compression)
+        metadata_offset = HEADER_SIZE + len(root)
+        leaf_offset = metadata_offset + len(encoded)
+        min_lon, min_lat, max_lon, max_lat = bounds
+        header = Header(
+            root_dir_offset=HEADER_SIZE,
+            root_dir_length=len(root),
+            metadata_offset=metadata_offset,
+            metadata_length=len(encoded),
+            leaf_dirs_offset=leaf_offset,
+            leaf_dirs_length=len(leaves),
+            tile_data_offset=leaf_offset + len(leaves),
+            tile_data_length=self._data_length,
+            addressed_tiles_count=self.addressed,
+            tile_entries_count=len(self.entries),
+            tile_contents_count=len(self._offsets),
+            clustered=True,
+            internal_compression=self.internal_compression,
+            tile_compression=self.tile_compression,
+            tile_type=self.tile_type,
+            min_zoom=min_zoom,
+            max_zoom=max_zoom,
+            min_lon_e7=round(min_lon * 1e7),
+            min_lat_e7=round(min_lat * 1e7),
+            max_lon_e7=round(max_lon * 1e7),
+            max_lat_e7=round(max_lat * 1e7),
+            center_zoom=min_zoom,
+            center_lon_e7=round((min_lon + max_lon) / 2 * 1e7),
+            center_lat_e7=round((min_lat + max_lat) / 2 * 1e7),
+        )
+        partial = f"{self.path}.partial"
+        try:
+            with open(partial, "wb") as out:
+                out.write(header.to_bytes() + root + encoded + leaves)
+                self._data.seek(0)
+                shutil.copyfileobj(self._data, out, 1024 * 1024)
+                out.flush()
+                os.fsync(out.fileno())
+            os.replace(partial, self.path)
+        finally:
+            self.close()
+            if os.path.exists(partial):
+                os.remove(partial)
+        return header
+
+    def close(self) -> None:
+        """Drop the spooled tile data (the archive, once finished, stays)."""
+        self._data.close()
+        if os.path.exists(self._data.name):
+            os.remove(self._data.name)
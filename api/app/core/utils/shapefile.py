@@ -0,0 +1,306 @@
+"""
+Shapefile reading: records of a .shp/.shx/.dbf triplet as EWKB and values.
+
+Records are addressed by index through the .shx offsets, so any range of a
+layer is read on its own (by another process) with one read per file. Point
+arrays are moved as whole arrays: 2D points are stored as interleaved
+little-endian doubles in both the .shp and WKB, so their bytes are copied as is,
+and Z values are interleaved with array slices, not per coordinate.
+"""
+
+import codecs
+import struct
+import sys
+from array import array
+from dataclasses import dataclass
+from datetime import date
+from operator import mul
+from typing import Any, Iterator, List, Optional, Tuple
+
+from app.core.utils.geojson import EWKB_SRID, EWKB_Z, WKB_TYPES
+
+HEADER_SIZE = 100
+INDEX_RECORD_SIZE = 8
+RECORD_HEADER_SIZE = 8
+DBF_FIELD_SIZE = 32
+DBF_HEADER_END = 0x0D
+DBF_DELETED = ord("*")
+
+# Shape type % 10 (Z types are 11-18, M types 21-28).
+POINT, POLYLINE, POLYGON, MULTIPOINT = 1, 3, 5, 8
+
+
+@dataclass(frozen=True)
+class DbfField:
+    name: str
+    type: str
+    length: int
+    decimals: int
+
+
+class ShapefileError(ValueError):
+    """Malformed or unsupported Shapefile."""
+
+
+def _little_endian(values: array) -> bytes:
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tobytes()
+
+
+def _points(content: memoryview, offset: int, count: int, has_z: bool) -> bytes:
+    """WKB points (X, Y[, Z]) of the X/Y array of a record at `offset`."""
+    xy = content[offset : offset + 16 * count]
+    if not has_z:
+        return bytes(xy)
+    # The Z range (2 doubles), then the Z values, follow the X/Y array.
+    z_offset = offset + 16 * count + 16
+    xy_values, z_values = array("d"), array("d")
+    xy_values.frombytes(xy)
+    z_values.frombytes(content[z_offset : z_offset + 8 * count])
+    if sys.byteorder == "big":
+        xy_values.byteswap()
+        z_values.byteswap()
+    xyz = array("d", bytes(24 * count))
+    xyz[0::3] = xy_values[0::2]
+    xyz[1::3] = xy_values[1::2]
+    xyz[2::3] = z_values
+    return _little_endian(xyz)
+
+
+def _header(kind: str, has_z: bool, srid: Optional[int] = None) -> bytes:
+    code = WKB_TYPES[kind] | (EWKB_Z if has_z else 0)
+    if srid is None:
+        return struct.pack("<BI", 1, code)
+    return struct.pack("<BII", 1, code | EWKB_SRID, srid)
+
+
+def _ring_area(ring: bytes, dims: int) -> float:
+    """Twice the signed area of a ring (negative when clockwise)."""
+    values = array("d")
+    values.frombytes(ring)
+    if sys.byteorder == "big":
+        values.byteswap()
+    xs, ys = values[0::dims], values[1::dims]
+    return sum(map(mul, xs, ys[1:])) - sum(map(mul, xs[1:], ys))
+
+
+def _contains(ring: bytes, dims: int, x: float, y: float) -> bool:
+    """Ray casting test of a point against a ring."""
+    values = struct.unpack(f"<{len(ring) // 8}d", ring)
+    xs, ys = values[0::dims], values[1::dims]
+    inside = False
+    for i in range(len(xs) - 1):
+        if (ys[i] > y) != (ys[i + 1] > y):
+            crossing = xs[i] + (y - ys[i]) * (xs[i + 1] - xs[i]) / (ys[i + 1] - ys[i])
+            if x < crossing:
+                inside = not inside
+    return inside
+
+
+def _polygons(rings: List[bytes], dims: int) -> List[List[bytes]]:
+    """
+    Rings grouped into polygons: outer rings are clockwise, holes belong to the
+    outer ring containing them (the previous one when none does).
+    """
+    polygons: List[List[bytes]] = []
+    holes: List[bytes] = []
+    for ring in rings:
+        if _ring_area(ring, dims) < 0 or not polygons:
+            polygons.append([ring])
+        else:
+            holes.append(ring)
+    for hole in holes:
+        target = polygons[-1]
+        if len(polygons) > 1:
+            x, y = struct.unpack_from("<2d", hole)
+            target = next(
+                (p for p in polygons if _contains(p[0], dims, x, y)), polygons[-1]
+            )
+        target.append(hole)
+    return polygons
+
+
+def shape_to_ewkb(content: memoryview, srid: int) -> Optional[bytes]:
+    """EWKB (little-endian, with SRID) of a .shp record, None for a null shape."""
+    shape_type = struct.unpack_from("<i", content)[0]
+    if shape_type == 0:
+        return None
+    kind = shape_type % 10
+    has_z = 10 < shape_type < 20
+    dims = 3 if has_z else 2
+
+    if kind == POINT:
+        # PointZ stores X, Y, Z, M and PointM X, Y, M.
+        values = struct.unpack_from(f"<{dims}d", content, 4)
+        return _header("Point", has_z, srid) + struct.pack(f"<{dims}d", *values)
+
+    if kind == MULTIPOINT:
+        count = struct.unpack_from("<i", content, 36)[0]
+        points = _points(content, 40, count, has_z)
+        size = 8 * dims
+        parts = b"".join(
+            _header("Point", has_z) + points[i * size : (i + 1) * size]
+            for i in range(count)
+        )
+        return _header("MultiPoint", has_z, srid) + struct.pack("<I", count) + parts
+
+    if kind not in (POLYLINE, POLYGON):
+        raise ShapefileError(f"Unsupported shape type {shape_type}")
+    part_count, count = struct.unpack_from("<2i", content, 36)
+    starts = list(struct.unpack_from(f"<{part_count}i", content, 44))
+    points = _points(content, 44 + 4 * part_count, count, has_z)
+    size = 8 * dims
+    parts = [
+        points[start * size : end * size]
+        for start, end in zip(starts, starts[1:] + [count])
+    ]
+
+    if kind == POLYLINE:
+        if len(parts) == 1:
+            return _header("LineString", has_z, srid) + _counted(parts[0], size)
+        lines = b"".join(
+            _header("LineString", has_z) + _counted(part, size) for part in parts
+        )
+        return (
+            _header("MultiLineString", has_z, srid)
+            + struct.pack("<I", len(parts))
+            + lines
+        )
+
+    polygons = _polygons(parts, dims)
+    if len(polygons) == 1:
+        return _header("Polygon", has_z, srid) + _rings(polygons[0], size)
+    body = b"".join(_header("Polygon", has_z) + _rings(p, size) for p in polygons)
+    return (
+        _header("MultiPolygon", has_z, srid) + struct.pack("<I", len(polygons)) + body
+    )
+
+
+def _counted(points: bytes, size: int) -> bytes:
+    return struct.pack("<I", len(points) // size) + points
+
+
+def _rings(rings: List[bytes], size: int) -> bytes:
+    return struct.pack("<I", len(rings)) + b"".join(_counted(r, size) for r in rings)
+
+
+def _decoder(cpg: Optional[str]):
+    """Text decoder of the .cpg code page; UTF-8, then CP1252, without one."""
+    if cpg:
+        name = cpg.strip()
+        for candidate in (name, f"cp{name}", name.replace("8859", "iso8859-")):
+            try:
+                codec = codecs.lookup(candidate)
+            except LookupError:
+                continue
+            return lambda raw: codec.decode(raw, "replace")[0]
+
+    def decode(raw: bytes) -> str:
+        try:
+            return raw.decode("utf-8")
+        except UnicodeDecodeError:
+            return raw.decode("cp1252", "replace")
+
+    return decode
+
+
+def _dbf_value(raw: bytes, field: DbfField, decode) -> Any:
+    if field.type in "NF":
+        text = raw.strip(b" \x00*")
+        if not text:
+            return None
+        try:
+            if field.decimals == 0 and b"." not in text:
+                return int(text)
+            return float(text)
+        except ValueError:
+            return None
+    if field.type == "L":
+        flag = raw[:1].upper()
+        if flag in (b"T", b"Y"):
+            return True
+        if flag in (b"F", b"N"):
+            return False
+        return None
+    if field.type == "D":
+        try:
+            return date(int(raw[:4]), int(raw[4:6]), int(raw[6:8])).isoformat()
+        except ValueError:
+            return None
+    text = decode(raw.rstrip(b" \x00"))
+    return text or None
+
+
+class Shapefile:
+    """A .shp/.shx/.dbf triplet, given its path without extension."""
+
+    def __init__(self, base: str, cpg: Optional[str] = None):
+        self.base = base
+        self._decode = _decoder(cpg)
+        try:
+            with open(f"{base}.shx", "rb") as index:
+                index.seek(0, 2)
+                self.count = (index.tell() - HEADER_SIZE) // INDEX_RECORD_SIZE
+            with open(f"{base}.dbf", "rb") as table:
+                header = table.read(32)
+                self._dbf_count, self._dbf_header, self._dbf_record = (
+                    struct.unpack_from("<IHH", header, 4)
+                )
+                descriptors = table.read(self._dbf_header - 32)
+        except (OSError, struct.error) as e:
+            raise ShapefileError(f"Unreadable shapefile {base}: {e}") from e
+
+        self.fields: List[DbfField] = []
+        # Offsets of the fields in a record, after the deletion flag.
+        self._offsets: List[int] = []
+        offset = 1
+        for start in range(0, len(descriptors) - DBF_FIELD_SIZE + 1, DBF_FIELD_SIZE):
+            descriptor = descriptors[start : start + DBF_FIELD_SIZE]
+            if descriptor[0] == DBF_HEADER_END:
+                break
+            name = descriptor[:11].split(b"\x00")[0].decode("ascii", "replace")
+            field = DbfField(name, chr(descriptor[11]), descriptor[16], descriptor[17])
+            self.fields.append(field)
+            self._offsets.append(offset)
+            offset += field.length
+
+    def records(
+        self, start: int, stop: int, srid: int
+    ) -> Iterator[Tuple[int, Optional[bytes], List[Any]]]:
+        """(fid, EWKB, values) of records [start, stop), fid being the index + 1."""
+        stop = min(stop, self.count)
+        if start >= stop:
+            return
+        with open(f"{self.base}.shx", "rb") as index:
+            index.seek(HEADER_SIZE + INDEX_RECORD_SIZE * start)
+            entries = struct.unpack(
+                f">{2 * (stop - start)}i",
+                index.read(INDEX_RECORD_SIZE * (stop - start)),
+            )
+        # Offsets and lengths are in 16-bit words.
+        first = entries[0] * 2
+        last = entries[-2] * 2 + RECORD_HEADER_SIZE + entries[-1] * 2
+        with open(f"{self.base}.shp", "rb") as shapes:
+            shapes.seek(first)
+            data = memoryview(shapes.read(last - first))
+        with open(f"{self.base}.dbf", "rb") as table:
+            table.seek(self._dbf_header + self._dbf_record * start)
+            rows = table.read(self._dbf_record * (stop - start))
+
+        fields = list(zip(self.fields, self._offsets))
+        for i in range(stop - start):
+            row = rows[i * self._dbf_record : (i + 1) * self._dbf_record]
+            if row[:1] == bytes([DBF_DELETED]):
+                continue
+            offset = entries[2 * i] * 2 - first + RECORD_HEADER_SIZE
+            length = entries[2 * i + 1] * 2
+            try:
+                geometry = shape_to_ewkb(data[offset : offset + length], srid)
+            except struct.error as e:
+                raise ShapefileError(f"Invalid shape of record {start + i}") from e
+            values = [
+                _dbf_value(row[o : o + field.length], field, self._decode)
+                for field, o in fields
+            ]
+            yield start + i + 1, geometry, values
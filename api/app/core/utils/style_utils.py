@@ -0,0 +1,219 @@
+"""
+Helpers to inspect Mapbox/MapLibre style documents stored on Maps.
+"""
+
+import json
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, FrozenSet, List, Optional, Set
+from urllib.parse import urlsplit
+
+TILE_PLACEHOLDER = "{z}"
+# Expressions and legacy filters whose second item names a feature property.
+PROPERTY_OPERATORS = {
+    "get",
+    "has",
+    "!has",
+    "==",
+    "!=",
+    "<",
+    "<=",
+    ">",
+    ">=",
+    "in",
+    "!in",
+}
+# Operators reading an object argument rather than the feature when given one.
+OBJECT_OPERATORS = {"get", "has", "!has"}
+# Legacy `{property}` tokens of these layout values.
+TOKEN_LAYOUT_PROPERTIES = ("text-field", "icon-image")
+TOKEN_PATTERN = re.compile(r"\{([^{}]+)\}")
+
+
+@dataclass(frozen=True)
+class DatasourceRef:
+    """A datasource referenced by a style source, optionally via one source-layer."""
+
+    source_id: str
+    datasource: str
+    source_url: Optional[str] = None
+    source_layer: Optional[str] = None
+
+
+def parse_style(style: Any) -> Dict[str, Any]:
+    """
+    Return the style as a dict.
+    Styles which are not JSON documents (e.g. legacy names like "dark") yield {}.
+    """
+    if isinstance(style, dict):
+        return style
+    if not isinstance(style, str) or not style.strip().startswith("{"):
+        return {}
+    try:
+        parsed = json.loads(style)
+    except ValueError:
+        return {}
+    return parsed if isinstance(parsed, dict) else {}
+
+
+def datasource_from_url(url: str) -> Optional[str]:
+    """
+    Resolve the datasource name from a source URL.
+
+    Tile templates (`.../tiles/{source}/{z}/{x}/{y}.pbf`) use the path segment before
+    `{z}`, TileJSON URLs (`http://martin:3000/{source}`) and archives
+    (`pmtiles://.../{source}.pmtiles`) use the last path segment.
+    """
+    path = urlsplit(url).path if "://" in url else url.split("?")[0]
+    segments = [s for s in path.split("/") if s]
+    if TILE_PLACEHOLDER in segments:
+        index = segments.index(TILE_PLACEHOLDER)
+        return segments[index - 1] if index > 0 else None
+    if not segments:
+        return None
+    name = segments[-1]
+    if name.endswith((".json", ".pmtiles")):
+        name = name.rsplit(".", 1)[0]
+    return name or None
+
+
+def _source_url(source: Dict[str, Any]) -> Optional[str]:
+    if isinstance(source.get("url"), str):
+        return source["url"]
+    tiles = source.get("tiles")
+    if isinstance(tiles, list) and tiles and isinstance(tiles[0], str):
+        return tiles[0]
+    return None
+
+
+def extract_datasource_refs(style: Any) -> List[DatasourceRef]:
+    """
+    Extract every datasource referenced by a style together with the source-layers
+    its layers read. Sources without any layer still produce one ref without
+    source-layer. Inline sources (GeoJSON data, images...) are ignored.
+    """
+    document = parse_style(style)
+    sources = document.get("sources")
+    if not isinstance(sources, dict):
+        return []
+
+    layers_by_source: Dict[str, List[str]] = {}
+    for layer in document.get("layers") or []:
+        if not isinstance(layer, dict) or not isinstance(layer.get("source"), str):
+            continue
+        source_layers = layers_by_source.setdefault(layer["source"], [])
+        source_layer = layer.get("source-layer")
+        if isinstance(source_layer, str) and source_layer not in source_layers:
+            source_layers.append(source_layer)
+
+    refs: List[DatasourceRef] = []
+    for source_id, source in sources.items():
+        if not isinstance(source, dict):
+            continue
+        url = _source_url(source)
+        datasource = datasource_from_url(url) if url else None
+        if not datasource:
+            continue
+
+        source_layers = layers_by_source.get(source_id) or [None]
+        refs.extend(
+            DatasourceRef(
+                source_id=source_id,
+                datasource=datasource,
+                source_url=url,
+                source_layer=source_layer,
+            )
+            for source_layer in source_layers
+        )
+    return refs
+
+
+def _collect_properties(value: Any, found: Set[str]) -> bool:
+    """
+    Add the feature properties read by a style value (expression, legacy filter or
+    function) to `found`. False when it reads every property (`["properties"]`).
+    """
+    if isinstance(value, list):
+        if value and isinstance(value[0], str):
+            operator = value[0]
+            if operator == "properties":
+                return False
+            if (
+                operator in PROPERTY_OPERATORS
+                and len(value) >= 2
+                and isinstance(value[1], str)
+                and not value[1].startswith("$")
+                and not (operator in OBJECT_OPERATORS and len(value) > 2)
+            ):
+                found.add(value[1])
+        return all(_collect_properties(item, found) for item in value)
+    if isinstance(value, dict):
+        if isinstance(value.get("property"), str):
+            found.add(value["property"])
+        return all(_collect_properties(item, found) for item in value.values())
+    return True
+
+
+def _layer_properties(layer: Dict[str, Any]) -> Optional[Set[str]]:
+    """Properties read by a style layer, None when it may read any of them."""
+    found: Set[str] = set()
+    if not all(
+        _collect_properties(layer.get(key), found)
+        for key in ("filter", "layout", "paint")
+    ):
+        return None
+    layout = layer.get("layout")
+    if isinstance(layout, dict):
+        for key in TOKEN_LAYOUT_PROPERTIES:
+            if isinstance(layout.get(key), str):
+                found.update(TOKEN_PATTERN.findall(layout[key]))
+    return found
+
+
+def _promoted_properties(source: Dict[str, Any], source_layer: str) -> Set[str]:
+    """Feature id property of a source (`promoteId`), read by feature-state."""
+    promote_id = source.get("promoteId")
+    if isinstance(promote_id, str):
+        return {promote_id}
+    if isinstance(promote_id, dict) and isinstance(promote_id.get(source_layer), str):
+        return {promote_id[source_layer]}
+    return set()
+
+
+def extract_style_usage(style: Any) -> Dict[str, Dict[str, Optional[FrozenSet[str]]]]:
+    """
+    Source-layers of each datasource read by a style, with the feature properties
+    its layers use: in filters, expressions, legacy functions and `{token}`
+    strings. None stands for every property (e.g. `["properties"]`).
+    """
+    document = parse_style(style)
+    sources = document.get("sources")
+    if not isinstance(sources, dict):
+        return {}
+
+    usage: Dict[str, Dict[str, Optional[FrozenSet[str]]]] = {}
+    for layer in document.get("layers") or []:
+        if not isinstance(layer, dict) or not isinstance(
+            layer.get("source-layer"), str
+        ):
+            continue
+        source = sources.get(layer.get("source"))
+        url = _source_url(source) if isinstance(source, dict) else None
+        datasource = datasource_from_url(url) if url else None
+        if not datasource:
+            continue
+
+        source_layer = layer["source-layer"]
+        layers = usage.setdefault(datasource, {})
+        properties = _layer_properties(layer)
+        if properties is None or (
+            source_layer in layers and layers[source_layer] is None
+        ):
+            layers[source_layer] = None
+        else:
+            layers[source_layer] = frozenset(
+                properties
+                | _promoted_properties(source, source_layer)
+                | layers.get(source_layer, frozenset())
+            )
+    return usage
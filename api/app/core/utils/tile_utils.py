@@ -0,0 +1,80 @@
+"""
+Web Mercator (XYZ) tile arithmetic.
+"""
+
+import math
+import re
+from typing import Iterator, List, NamedTuple, Tuple
+
+# Martin source ids (datasource table names).
+SOURCE_PATTERN = re.compile(r"^[A-Za-z0-9_\-][A-Za-z0-9_.\-]*$")
+MAX_ZOOM = 30
+MAX_LATITUDE = 85.0511287798066
+# Martin renders features up to 64 units (of a 4096 extent) past the tile edges.
+DEFAULT_TILE_BUFFER = 64 / 4096
+
+
+def split_sources(sources: str) -> List[str]:
+    """Comma-separated source ids, without blanks or duplicates, in order."""
+    return list(dict.fromkeys(s.strip() for s in sources.split(",") if s.strip()))
+
+
+class TileRange(NamedTuple):
+    """Inclusive range of tiles at one zoom level."""
+
+    z: int
+    min_x: int
+    min_y: int
+    max_x: int
+    max_y: int
+
+    @property
+    def count(self) -> int:
+        return (self.max_x - self.min_x + 1) * (self.max_y - self.min_y + 1)
+
+    def tiles(self) -> Iterator[Tuple[int, int, int]]:
+        for x in range(self.min_x, self.max_x + 1):
+            for y in range(self.min_y, self.max_y + 1):
+                yield self.z, x, y
+
+
+def lonlat_to_tile_fraction(lon: float, lat: float, z: int) -> Tuple[float, float]:
+    """Fractional tile coordinates of a WGS84 point at zoom z."""
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    n = 2**z
+    x = (lon + 180.0) / 360.0 * n
+    lat_rad = math.radians(lat)
+    y = (1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n
+    return x, y
+
+
+def tile_bounds(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """WGS84 bounds (min_lon, min_lat, max_lon, max_lat) of a tile."""
+    n = 2**z
+
+    def lat(tile_y: float) -> float:
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / n))))
+
+    return x / n * 360.0 - 180.0, lat(y + 1), (x + 1) / n * 360.0 - 180.0, lat(y)
+
+
+def tile_range(
+    bbox: Tuple[float, float, float, float],
+    z: int,
+    buffer: float = DEFAULT_TILE_BUFFER,
+) -> TileRange:
+    """
+    Tiles at zoom z whose content can be affected by a WGS84 bbox, the tile
+    buffer (as a fraction of a tile) included.
+    """
+    min_lon, min_lat, max_lon, max_lat = bbox
+    n = 2**z
+    left, top = lonlat_to_tile_fraction(min_lon, max_lat, z)
+    right, bottom = lonlat_to_tile_fraction(max_lon, min_lat, z)
+    return TileRange(
+        z=z,
+        min_x=max(0, math.floor(left - buffer)),
+        min_y=max(0, math.floor(top - buffer)),
+        max_x=min(n - 1, math.floor(right + buffer)),
+        max_y=min(n - 1, math.floor(bottom + buffer)),
+    )
@@ -0,0 +1,28 @@
+"""
+Transaction ids, to follow append-only logs without missing late commits.
+
+Serial ids are allocated before commit, so a row can become visible after rows
+with higher ids were read. Log rows are therefore tagged with the id of the
+transaction writing them (`CURRENT_XACT_ID`), and readers keep a horizon: the
+oldest transaction still running when they last read (`xact_horizon`). Every
+transaction below it had ended, its rows already visible; the next read takes
+the rows of transactions from the horizon on, late commits included.
+
+Transaction ids are 64-bit (`xid8`): they never wrap around.
+"""
+
+from sqlalchemy import text
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+# Server default of the `xid` column of log tables.
+CURRENT_XACT_ID = "(pg_current_xact_id()::text)::bigint"
+XACT_HORIZON = "SELECT (pg_snapshot_xmin(pg_current_snapshot())::text)::bigint"
+
+
+async def xact_horizon(session: AsyncSession) -> int:
+    """
+    Oldest transaction id still running: taken before a read, every transaction
+    below it is visible to that read.
+    """
+    result = await session.execute(text(XACT_HORIZON))
+    return result.scalar_one()
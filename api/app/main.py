@@ -11,20 +11,63 @@ from starlette.middleware.trustedhost import TrustedHostMiddleware
 from app.core.config import get_settings
 from app.core.database import sessionmanager
 from app.core.exceptions.handlers import add_all_exception_handlers
+from app.core.martin import martin_client
 from app.core.messages import MessageService
 from app.core.rate_limit import limiter
 from app.modules.atlases.endpoints import atlasesRouter
 from app.modules.auth.endpoints import authRouter
+from app.modules.datasources.endpoints import datasourcesRouter
+from app.modules.datasources.parallel import ingest_pool
+from app.modules.jobs.endpoints import jobsRouter
+from app.modules.jobs.worker import job_worker
 from app.modules.maps.endpoints import mapsRouter
+from app.modules.proxy.cache import tile_cache
+from app.modules.proxy.endpoints import proxyRouter
+from app.modules.proxy.engine import tile_engine
+from app.modules.proxy.extent import extent_index
+from app.modules.proxy.invalidation import tile_invalidator
+from app.modules.proxy.overviews import overview_builder
+from app.modules.proxy.pmtiles import pmtiles_archives
+from app.modules.proxy.pruning import style_usages
+from app.modules.proxy.seeding import tile_seeder
 from app.modules.teams.endpoints import teamsRouter
+from app.modules.tokens.endpoints import tokensRouter
+from app.modules.tokens.revocation import revocation_index
 from app.modules.users.endpoints import userRouter
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     sessionmanager.init(str(get_settings().database_url))
+    martin_client.init(get_settings())
+    tile_cache.init(get_settings())
+    tile_cache.start(get_settings())
     MessageService.load_messages()
+    style_usages.configure(get_settings())
+    pmtiles_archives.configure(get_settings())
+    tile_engine.init(get_settings(), pmtiles_archives)
+    await revocation_index.start(
+        get_settings().resource_token_revocation_refresh_seconds,
+        get_settings().resource_token_revocation_rebuild_seconds,
+    )
+    extent_index.start(get_settings())
+    tile_invalidator.start(tile_cache.get_cache(), get_settings())
+    tile_seeder.start(tile_cache.get_cache(), get_settings())
+    overview_builder.start(tile_cache.get_cache(), get_settings())
+    if get_settings().job_worker_enabled:
+        job_worker.start(get_settings())
     yield
+    await job_worker.stop()
+    await overview_builder.stop()
+    ingest_pool.close()
+    await tile_seeder.stop()
+    await tile_invalidator.stop()
+    await extent_index.stop()
+    await revocation_index.stop()
+    await tile_cache.stop()
+    tile_cache.close()
+    await martin_client.close()
+    await tile_engine.close()
     await sessionmanager.close()
 
 
@@ -78,3 +121,7 @@ app.include_router(userRouter)
 app.include_router(teamsRouter)
 app.include_router(atlasesRouter)
 app.include_router(mapsRouter)
+app.include_router(tokensRouter)
+app.include_router(proxyRouter)
+app.include_router(datasourcesRouter)
+app.include_router(jobsRouter)
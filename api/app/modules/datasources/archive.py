@@ -0,0 +1,392 @@
+"""
+PMTiles archives built offline from datasource tables.
+
+For datasources that rarely change, every tile of a zoom range is rendered once
+with the in-API engine query: ST_AsMVTGeom clips geometries to the tile and its
+buffer, and they are simplified by at least `datasource_pmtiles_simplify` tile
+units. Tiles are rendered on `datasource_pmtiles_workers` connections at once,
+then gzipped and hashed in the ingest process pool, and written to a clustered
+archive where identical tiles (the inside of a large polygon, a dense grid) are
+stored once. The datasource then switches to the archive
+(`TileEngineSource.archive`): its tiles are read from disk without a query.
+
+The pyramid is walked zoom by zoom from the tiles covering the datasource extent,
+descending only into tiles holding features, in tile id order so that tiles are
+appended to the archive as they are rendered. A tile over the byte budget is
+rendered again with twice the simplification, up to
+`datasource_pmtiles_budget_retries` times.
+
+Edits of the table do not reach the archive: rebuild it, or switch the
+datasource back to its table.
+"""
+
+import asyncio
+import gzip
+import hashlib
+import os
+import time
+from concurrent.futures import Executor
+from datetime import datetime
+from typing import Annotated, Callable, List, Optional, Tuple
+
+from fastapi import Depends
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from app.core.config import Settings, get_settings
+from app.core.database import SessionDep, get_engine
+from app.core.exceptions import DomainException
+from app.core.logging_config import logger
+from app.core.utils.pmtiles import ArchiveWriter, zxy_to_tile_id
+from app.core.utils.tile_utils import tile_range
+from app.modules.datasources.ingest import GEOMETRY_COLUMN, ID_COLUMN, quote
+from app.modules.datasources.models import Datasource
+from app.modules.datasources.parallel import ingest_pool
+from app.modules.datasources.repository import DatasourceRepository
+from app.modules.datasources.schemas import DatasourceArchiveCreate, DatasourceRead
+from app.modules.datasources.service import DatasourceService, DatasourceServiceDep
+from app.modules.jobs.schemas import JobRead
+from app.modules.jobs.service import JobService, JobServiceDep
+from app.modules.proxy.engine import (
+    TileEngine,
+    tile_engine,
+    tile_envelope,
+    tile_params,
+    tile_query,
+)
+from app.modules.proxy.models import DatasourceExtent, TileEngineSource
+from app.modules.proxy.repository import (
+    DatasourceExtentRepository,
+    TileEngineSourceRepository,
+    quote_table,
+)
+from app.modules.users.schemas import UserDetail
+
+BUILD_PMTILES = "datasource.build_pmtiles"
+# Tiles rendered, then encoded in the process pool, per round trip.
+BATCH_SIZE = 256
+
+OCCUPIED_QUERY = "SELECT EXISTS (SELECT 1 FROM {table} WHERE {column} && {envelope})"
+
+
+def encode_tiles(
+    tiles: List[Tuple[int, bytes]],
+) -> List[Tuple[int, bytes, bytes]]:
+    """(tile id, gzipped MVT, SHA-256 of it) of (tile id, MVT) tiles."""
+    encoded = []
+    for tile_id, data in tiles:
+        data = gzip.compress(data, 9, mtime=0)
+        encoded.append((tile_id, data, hashlib.sha256(data).digest()))
+    return encoded
+
+
+class PyramidBuilder:
+    """Renders the tiles of one datasource into a PMTiles archive."""
+
+    def __init__(
+        self,
+        engine: AsyncEngine,
+        executor: Executor,
+        source: TileEngineSource,
+        settings: Settings,
+    ):
+        self.engine = engine
+        self.executor = executor
+        self.settings = settings
+        self.source = TileEngineSource(
+            **{
+                **source.model_dump(),
+                "simplify": max(source.simplify, settings.datasource_pmtiles_simplify),
+            }
+        )
+        self.occupied_query = text(
+            OCCUPIED_QUERY.format(
+                table=quote_table(self.source.table_name),
+                column=quote(self.source.geometry_column),
+                envelope=tile_envelope(self.source),
+            )
+        )
+        self.semaphore = asyncio.Semaphore(settings.datasource_pmtiles_workers)
+        self.rendered = 0
+        self.oversized = 0
+
+    async def _query(
+        self, connection: AsyncConnection, z: int, x: int, y: int
+    ) -> bytes:
+        """MVT of a tile, simplified further while over the byte budget."""
+        source = self.source
+        budget = self.settings.datasource_pmtiles_max_tile_bytes
+        retries = self.settings.datasource_pmtiles_budget_retries
+        for attempt in range(retries + 1):
+            result = await connection.execute(
+                text(tile_query(source, source.columns)), tile_params(source, z, x, y)
+            )
+            data = bytes(result.scalar() or b"")
+            if len(data) <= budget:
+                return data
+            if attempt < retries:
+                source = TileEngineSource(
+                    **{**source.model_dump(), "simplify": max(source.simplify * 2, 1.0)}
+                )
+        self.oversized += 1
+        return data
+
+    async def _render(self, z: int, x: int, y: int) -> Tuple[bytes, bool]:
+        """
+        MVT of a tile, and whether features touch it: features too small to
+        show at this zoom still do, and show in its children.
+        """
+        async with self.semaphore:
+            async with self.engine.connect() as connection:
+                data = await self._query(connection, z, x, y)
+                if data:
+                    return data, True
+                result = await connection.execute(
+                    self.occupied_query,
+                    {
+                        "z": z,
+                        "x": x,
+                        "y": y,
+                        "margin": self.source.buffer / self.source.extent,
+                    },
+                )
+                return data, bool(result.scalar())
+
+    async def build(
+        self,
+        path: str,
+        bounds: Tuple[float, float, float, float],
+        min_zoom: int,
+        max_zoom: int,
+        progress: Optional[Callable[[int], None]] = None,
+    ) -> dict:
+        """Write the archive of tiles `min_zoom`..`max_zoom` over `bounds`."""
+        loop = asyncio.get_running_loop()
+        buffer = self.source.buffer / self.source.extent
+        max_tiles = self.settings.datasource_pmtiles_max_tiles
+        tiles = list(tile_range(bounds, min_zoom, buffer).tiles())
+        writer = ArchiveWriter(path)
+        try:
+            for z in range(min_zoom, max_zoom + 1):
+                if self.rendered + len(tiles) > max_tiles:
+                    raise DomainException(
+                        key="datasource.pmtiles_too_many_tiles",
+                        params={"max": max_tiles},
+                    )
+                ordered = sorted((zxy_to_tile_id(z, x, y), x, y) for _, x, y in tiles)
+                tiles = []
+                for start in range(0, len(ordered), BATCH_SIZE):
+                    batch = ordered[start : start + BATCH_SIZE]
+                    try:
+                        async with asyncio.TaskGroup() as group:
+                            tasks = [
+                                group.create_task(self._render(z, x, y))
+                                for _, x, y in batch
+                            ]
+                    except ExceptionGroup as errors:
+                        raise errors.exceptions[0]
+                    filled = []
+                    for (tile_id, x, y), task in zip(batch, tasks):
+                        data, occupied = task.result()
+                        if data:
+                            filled.append((tile_id, data))
+                        if occupied and z < max_zoom:
+                            tiles += [
+                                (z + 1, 2 * x + dx, 2 * y + dy)
+                                for dy in (0, 1)
+                                for dx in (0, 1)
+                            ]
+                    encoded = await loop.run_in_executor(
+                        self.executor, encode_tiles, filled
+                    )
+                    for tile_id, data, digest in encoded:
+                        writer.add(tile_id, data, digest)
+                    self.rendered += len(batch)
+                    if progress is not None:
+                        progress(len(batch))
+
+            metadata = {
+                "name": self.source.datasource,
+                "format": "pbf",
+                "vector_layers": [
+                    {
+                        "id": self.source.datasource,
+                        "fields": {name: "" for name in self.source.columns},
+                        "minzoom": min_zoom,
+                        "maxzoom": max_zoom,
+                    }
+                ],
+            }
+            header = await asyncio.to_thread(
+                writer.finish, min_zoom, max_zoom, bounds, metadata
+            )
+        except BaseException:
+            writer.close()
+            raise
+        return {
+            "tiles_rendered": self.rendered,
+            "tiles": header.addressed_tiles_count,
+            "tile_contents": header.tile_contents_count,
+            "tiles_oversized": self.oversized,
+            "bytes": header.tile_data_offset + header.tile_data_length,
+        }
+
+
+class DatasourceArchiveService:
+    """Builds datasource archives (as jobs) and switches datasources to them."""
+
+    def __init__(
+        self,
+        repository: DatasourceRepository,
+        datasources: DatasourceService,
+        jobs: JobService,
+        settings: Settings,
+        engine: TileEngine | None = None,
+    ):
+        self.repository = repository
+        self.datasources = datasources
+        self.jobs = jobs
+        self.settings = settings
+        self.engine = engine or tile_engine
+
+    def _path(self, name: str) -> str:
+        if self.settings.pmtiles_directory is None:
+            raise DomainException(key="proxy.pmtiles_disabled")
+        return os.path.join(self.settings.pmtiles_directory, f"{name}.pmtiles")
+
+    def _zooms(self, data: DatasourceArchiveCreate) -> Tuple[int, int]:
+        max_allowed = self.settings.datasource_pmtiles_max_zoom
+        max_zoom = max_allowed if data.max_zoom is None else data.max_zoom
+        if not data.min_zoom <= max_zoom <= max_allowed:
+            raise DomainException(
+                key="datasource.pmtiles_invalid_zooms", params={"max": max_allowed}
+            )
+        return data.min_zoom, max_zoom
+
+    async def _source(self, datasource: DatasourceRead) -> TileEngineSource:
+        """Engine configuration of a datasource, the default one if it has none."""
+        source = await TileEngineSourceRepository(
+            self.repository.session, TileEngineSource
+        ).get_by_datasource(datasource.name)
+        if source is not None:
+            return source
+        return TileEngineSource(
+            datasource=datasource.name,
+            table_name=datasource.name,
+            geometry_column=GEOMETRY_COLUMN,
+            srid=datasource.srid,
+            id_column=ID_COLUMN,
+            columns=datasource.columns,
+        )
+
+    async def _switch(
+        self, datasource: DatasourceRead, archive: bool, current_user: UserDetail
+    ) -> None:
+        now = datetime.utcnow()
+        if self.settings.tile_engine_enabled:
+            source = await self._source(datasource)
+            await TileEngineSourceRepository(
+                self.repository.session, TileEngineSource
+            ).upsert({**source.model_dump(exclude={"updated_at"}), "archive": archive})
+        await self.repository.update(
+            datasource.id,
+            {
+                "archive_built_at": now if archive else None,
+                "updated_at": now,
+                "updated_by_id": current_user.id,
+            },
+        )
+        await self.repository.session.commit()
+        if self.settings.tile_engine_enabled:
+            self.engine.expire()
+
+    async def queue_build(
+        self,
+        datasource_id: int,
+        data: DatasourceArchiveCreate,
+        current_user: UserDetail,
+    ) -> JobRead:
+        """Queue the build of the archive of a datasource."""
+        datasource = await self.datasources.get_datasource(datasource_id, current_user)
+        self._path(datasource.name)
+        min_zoom, max_zoom = self._zooms(data)
+        job = await self.jobs.enqueue(
+            BUILD_PMTILES,
+            {
+                "datasource_id": datasource.id,
+                "min_zoom": min_zoom,
+                "max_zoom": max_zoom,
+            },
+            current_user,
+        )
+        await self.repository.session.commit()
+        return JobRead.model_validate(job)
+
+    async def build(
+        self,
+        datasource_id: int,
+        min_zoom: int,
+        max_zoom: int,
+        current_user: UserDetail,
+        progress: Optional[Callable[[int], None]] = None,
+    ) -> dict:
+        """Build the archive of a datasource, then serve its tiles from it (job)."""
+        datasource = await self.datasources.get_datasource(datasource_id, current_user)
+        path = self._path(datasource.name)
+        source = await self._source(datasource)
+        bounds, _, _ = await DatasourceExtentRepository(
+            self.repository.session, DatasourceExtent
+        ).compute(source.table_name, source.geometry_column, None)
+        # No transaction is kept open while the tiles are rendered.
+        await self.repository.session.rollback()
+        if bounds is None:
+            raise DomainException(
+                key="datasource.pmtiles_empty", params={"name": datasource.name}
+            )
+
+        started_at = time.monotonic()
+        await asyncio.to_thread(os.makedirs, os.path.dirname(path), exist_ok=True)
+        builder = PyramidBuilder(
+            get_engine(),
+            ingest_pool.get(self.settings.datasource_ingest_workers),
+            source,
+            self.settings,
+        )
+        stats = await builder.build(path, bounds, min_zoom, max_zoom, progress)
+        await self._switch(datasource, True, current_user)
+        stats["build_seconds"] = time.monotonic() - started_at
+        logger.info(f"PMTiles archive of {datasource.name} built: {stats}")
+        return stats
+
+    async def delete_archive(
+        self, datasource_id: int, current_user: UserDetail
+    ) -> None:
+        """Serve a datasource from its table again and remove its archive."""
+        datasource = await self.datasources.get_datasource(datasource_id, current_user)
+        if datasource.archive_built_at is None:
+            raise DomainException(key="datasource.pmtiles_not_built")
+        await self._switch(datasource, False, current_user)
+        try:
+            await asyncio.to_thread(os.remove, self._path(datasource.name))
+        except FileNotFoundError:
+            pass
+
+
+# Dependencies
+SettingsDep = Annotated[Settings, Depends(get_settings)]
+
+
+def get_datasource_archive_service(
+    session: SessionDep,
+    settings: SettingsDep,
+    datasources: DatasourceServiceDep,
+    jobs: JobServiceDep,
+) -> DatasourceArchiveService:
+    return DatasourceArchiveService(
+        DatasourceRepository(session, Datasource), datasources, jobs, settings
+    )
+
+
+DatasourceArchiveServiceDep = Annotated[
+    DatasourceArchiveService, Depends(get_datasource_archive_service)
+]
@@ -0,0 +1,304 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, Query, Request, Response
+
+from app.core.messages import MessageService
+from app.core.security import get_current_user
+from app.modules.datasources.archive import DatasourceArchiveServiceDep
+from app.modules.datasources.export import DatasourceExportServiceDep, ExportFormat
+from app.modules.datasources.query import DatasourceQueryServiceDep
+from app.modules.datasources.schemas import (
+    DatasourceArchiveCreate,
+    DatasourceRead,
+    DatasourceStatsRead,
+    DatasourceUploadCreate,
+    DatasourceUploadRead,
+)
+from app.modules.datasources.service import DatasourceServiceDep, parse_bbox
+from app.modules.datasources.uploads import DatasourceUploadServiceDep
+from app.modules.jobs.schemas import JobRead
+from app.modules.users.schemas import UserDetail
+
+datasourcesRouter = APIRouter(prefix="/datasources", tags=["Datasources"])
+
+
+@datasourcesRouter.post("/upload", response_model=JobRead, status_code=202)
+async def upload_datasource(
+    request: Request,
+    service: DatasourceUploadServiceDep,
+    name: str = Query(...),
+    current_user: UserDetail = Depends(get_current_user),
+):
+    """
+    Queue the load of the GeoJSON FeatureCollection sent as request body into a
+    new datasource table (ADMIN or LOAD_DATA); the job is followed at
+    `/jobs/{job_id}`.
+    """
+    return await service.upload(name, "geojson", request.stream(), current_user)
+
+
+@datasourcesRouter.post("/upload/file", response_model=JobRead, status_code=202)
+async def upload_datasource_file(
+    request: Request,
+    service: DatasourceUploadServiceDep,
+    name: str = Query(...),
+    layer: Optional[str] = Query(None),
+    srid: Optional[int] = Query(None, gt=0),
+    bbox: Optional[str] = Query(None),
+    current_user: UserDetail = Depends(get_current_user),
+):
+    """
+    Queue the load of a layer of the zipped Shapefile, GeoPackage, FlatGeobuf or
+    GeoParquet file sent as request body into a new datasource table (ADMIN or
+    LOAD_DATA). `layer` names the shapefile, feature table or GeoParquet geometry
+    column (the first or primary one by default), `srid` overrides its SRID.
+    `bbox` ("min_x,min_y,max_x,max_y", in the coordinates of the file) loads the
+    features of an indexed FlatGeobuf it intersects.
+    """
+    return await service.upload(
+        name,
+        "file",
+        request.stream(),
+        current_user,
+        layer=layer,
+        srid=srid,
+        bbox=parse_bbox(bbox),
+    )
+
+
+@datasourcesRouter.post("/update", response_model=JobRead, status_code=202)
+async def update_datasource(
+    request: Request,
+    service: DatasourceUploadServiceDep,
+    name: str = Query(...),
+    key: str = Query(...),
+    current_user: UserDetail = Depends(get_current_user),
+):
+    """
+    Queue the update of the datasource `name` to the GeoJSON FeatureCollection
+    sent as request body, its features matched on the `key` column: only the
+    features that changed are written (owner or admin, with ADMIN or LOAD_DATA).
+    """
+    return await service.upload(
+        name, "geojson", request.stream(), current_user, update_key=key
+    )
+
+
+@datasourcesRouter.post("/update/file", response_model=JobRead, status_code=202)
+async def update_datasource_file(
+    request: Request,
+    service: DatasourceUploadServiceDep,
+    name: str = Query(...),
+    key: str = Query(...),
+    layer: Optional[str] = Query(None),
+    srid: Optional[int] = Query(None, gt=0),
+    bbox: Optional[str] = Query(None),
+    current_user: UserDetail = Depends(get_current_user),
+):
+    """
+    Queue the update of the datasource `name` to a layer of the file sent as
+    request body (read like with `/upload/file`), like `/update`.
+    """
+    return await service.upload(
+        name,
+        "file",
+        request.stream(),
+        current_user,
+        update_key=key,
+        layer=layer,
+        srid=srid,
+        bbox=parse_bbox(bbox),
+    )
+
+
+@datasourcesRouter.post("/uploads", response_model=DatasourceUploadRead)
+async def create_upload(
+    data: DatasourceUploadCreate,
+    service: DatasourceUploadServiceDep,
+    current_user: UserDetail = Depends(get_current_user),
+):
+    """Start a resumable upload of `length` bytes (ADMIN or LOAD_DATA)."""
+    return await service.create_upload(data, current_user)
+
+
+@datasourcesRouter.head("/uploads/{upload_id}")
+async def get_upload_offset(
+    upload_id: int,
+    service: DatasourceUploadServiceDep,
+    current_user: UserDetail = Depends(get_current_user),
+):
+    """Bytes received so far, to resume an interrupted upload."""
+    upload = await service.get_upload(upload_id, current_user)
+    return Response(
+        headers={
+            "Upload-Offset": str(upload.offset),
+            "Upload-Length": str(upload.length),
+            "Cache-Control": "no-store",
+        }
+    )
+
+
+@datasourcesRouter.get("/uploads/{upload_id}", response_model=DatasourceUploadRead)
+async def get_upload(
+    upload_id: int,
+    service: DatasourceUploadServiceDep,
+    current_user: UserDetail = Depends(get_current_user),
+):
+    return await service.get_upload(upload_id, current_user)
+
+
+@datasourcesRouter.patch("/uploads/{upload_id}", response_model=DatasourceUploadRead)
+async def append_upload(
+    upload_id: int,
+    request: Request,
+    response: Response,
+    service: DatasourceUploadServiceDep,
+    upload_offset: int = Header(..., alias="Upload-Offset", ge=0),
+    upload_checksum: Optional[str] = Header(None, alias="Upload-Checksum"),
+    current_user: UserDetail = Depends(get_current_user),
+):
+    """
+    Append the request body at `Upload-Offset`, checked against
+    `Upload-Checksum` ("sha256 <base64 digest>") when given.
+    """
+    upload = await service.append(
+        upload_id, upload_offset, upload_checksum, request.stream(), current_user
+    )
+    response.headers["Upload-Offset"] = str(upload.offset)
+    return upload
+
+
+@datasourcesRouter.post(
+    "/uploads/{upload_id}/finalize", response_model=JobRead, status_code=202
+)
+async def finalize_upload(
+    upload_id: int,
+    service: DatasourceUploadServiceDep,
+    current_user: UserDetail = Depends(get_current_user),
+):
+    """
+    Queue the load of a complete upload into its datasource; the job is followed
+    at `/jobs/{job_id}`.
+    """
+    return await service.finalize(upload_id, current_user)
+
+
+@datasourcesRouter.delete("/uploads/{upload_id}")
+async def delete_upload(
+    upload_id: int,
+    service: DatasourceUploadServiceDep,
+    current_user: UserDetail = Depends(get_current_user),
+):
+    """Abort an upload."""
+    await service.delete_upload(upload_id, current_user)
+    return {"message": MessageService.get_message("datasource.upload_deleted")}
+
+
+@datasourcesRouter.get("/{datasource_id}", response_model=DatasourceRead)
+async def get_datasource(
+    datasource_id: int,
+    service: DatasourceServiceDep,
+    current_user: UserDetail = Depends(get_current_user),
+):
+    return await service.get_datasource(datasource_id, current_user)
+
+
+@datasourcesRouter.get("/{datasource_id}/stats", response_model=DatasourceStatsRead)
+async def get_datasource_stats(
+    datasource_id: int,
+    service: DatasourceServiceDep,
+    current_user: UserDetail = Depends(get_current_user),
+):
+    """
+    Estimated attribute statistics of a datasource (counts, distinct and most
+    frequent values, numeric ranges, quantiles and histograms), computed from a
+    sample after each load and kept up to date by updates.
+    """
+    return await service.get_stats(datasource_id, current_user)
+
+
+@datasourcesRouter.get("/{datasource_id}/export")
+async def export_datasource(
+    datasource_id: int,
+    service: DatasourceExportServiceDep,
+    format: ExportFormat = Query("geojson"),
+    bbox: Optional[str] = Query(None),
+    gzip: bool = Query(False),
+    current_user: UserDetail = Depends(get_current_user),
+):
+    """
+    Download the features of a datasource, or those intersecting a WGS84 `bbox`
+    ("min_x,min_y,max_x,max_y"), as GeoJSON, FlatGeobuf or CSV, streamed as they
+    are read; gzipped with `gzip=true`.
+    """
+    return await service.export(
+        datasource_id, format, parse_bbox(bbox), gzip, current_user
+    )
+
+
+@datasourcesRouter.get("/{datasource_id}/features")
+async def query_datasource_features(
+    datasource_id: int,
+    service: DatasourceQueryServiceDep,
+    bbox: str = Query(...),
+    properties: Optional[str] = Query(None),
+    limit: int = Query(100, ge=1),
+    current_user: UserDetail = Depends(get_current_user),
+):
+    """
+    GeoJSON features of a datasource intersecting a WGS84 `bbox`
+    ("min_x,min_y,max_x,max_y"), with the comma-separated `properties` columns
+    (all by default). At most `limit` features, capped by the server; the
+    `X-Limit-Reached` header tells whether there were more.
+    """
+    return await service.features_in_bbox(
+        datasource_id, parse_bbox(bbox), properties, limit, current_user
+    )
+
+
+@datasourcesRouter.get("/{datasource_id}/features/at")
+async def query_datasource_features_at(
+    datasource_id: int,
+    service: DatasourceQueryServiceDep,
+    lon: float = Query(...),
+    lat: float = Query(...),
+    tolerance: float = Query(0.0),
+    properties: Optional[str] = Query(None),
+    limit: int = Query(100, ge=1),
+    current_user: UserDetail = Depends(get_current_user),
+):
+    """
+    GeoJSON features of a datasource within `tolerance` meters (Web Mercator)
+    of a WGS84 point, closest first, for identify tools. `properties` and
+    `limit` as for the bbox query.
+    """
+    return await service.features_at_point(
+        datasource_id, lon, lat, tolerance, properties, limit, current_user
+    )
+
+
+@datasourcesRouter.post(
+    "/{datasource_id}/pmtiles", response_model=JobRead, status_code=202
+)
+async def build_datasource_archive(
+    datasource_id: int,
+    service: DatasourceArchiveServiceDep,
+    data: DatasourceArchiveCreate = DatasourceArchiveCreate(),
+    current_user: UserDetail = Depends(get_current_user),
+):
+    """
+    Queue the build of a PMTiles archive of the datasource, which then serves its
+    tiles instead of the table; the job is followed at `/jobs/{job_id}`.
+    """
+    return await service.queue_build(datasource_id, data, current_user)
+
+
+@datasourcesRouter.delete("/{datasource_id}/pmtiles")
+async def delete_datasource_archive(
+    datasource_id: int,
+    service: DatasourceArchiveServiceDep,
+    current_user: UserDetail = Depends(get_current_user),
+):
+    """Serve the datasource from its table again and remove its archive."""
+    await service.delete_archive(datasource_id, current_user)
+    return {"message": MessageService.get_message("datasource.pmtiles_deleted")}
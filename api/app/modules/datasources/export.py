@@ -0,0 +1,333 @@
+"""
+Datasource export as GeoJSON, FlatGeobuf or CSV, streamed.
+
+The features (all of them, or those intersecting a WGS84 bbox) are read on a
+connection of their own through a server-side cursor, in table order and
+`datasource_export_batch_size` rows at a time. Each batch is encoded (and
+gzipped, if asked, each batch flushed) in a thread and sent before the next one
+is fetched: the response starts with the first batch, memory holds one batch
+whatever the size of the datasource, and a slow client slows the cursor down
+instead of filling buffers.
+
+GeoJSON is written in WGS84 (RFC 7946), FlatGeobuf and CSV (WKT geometries) in
+the datasource SRID; FlatGeobuf files are written as a stream, without spatial
+index, and with 2D geometries.
+"""
+
+import asyncio
+import csv
+import io
+import json
+import zlib
+from abc import ABC, abstractmethod
+from typing import (
+    Annotated,
+    Any,
+    AsyncIterator,
+    Dict,
+    List,
+    Literal,
+    Optional,
+    Sequence,
+)
+
+from fastapi import Depends
+from fastapi.responses import StreamingResponse
+from sqlalchemy import text
+
+from app.core.config import Settings, get_settings
+from app.core.database import SessionDep, get_engine
+from app.core.exceptions import DomainException
+from app.core.utils import flatgeobuf
+from app.modules.datasources.ingest import (
+    BIGINT,
+    BOOLEAN,
+    DOUBLE,
+    GEOMETRY_COLUMN,
+    ID_COLUMN,
+    JSONB,
+    quote,
+)
+from app.modules.datasources.models import Datasource
+from app.modules.datasources.repository import DatasourceRepository
+from app.modules.datasources.schemas import DatasourceRead
+from app.modules.datasources.service import (
+    Bbox,
+    DatasourceService,
+    DatasourceServiceDep,
+)
+from app.modules.users.schemas import UserDetail
+
+EXPORT_QUERY = "SELECT {id}, {geometry}{columns} FROM {table}{where}"
+BBOX_FILTER = """
+    WHERE ST_Intersects(
+        {geom},
+        ST_Transform(ST_MakeEnvelope(:min_x, :min_y, :max_x, :max_y, 4326), {srid})
+    )
+"""
+
+FGB_TYPES = {
+    BOOLEAN: flatgeobuf.BOOL,
+    BIGINT: flatgeobuf.LONG,
+    DOUBLE: flatgeobuf.DOUBLE,
+    JSONB: flatgeobuf.JSON,
+}
+
+GEOJSON_GEOMETRY = f"ST_AsGeoJSON(ST_Transform({GEOMETRY_COLUMN}, 4326))"
+COLLECTION_HEADER = b'{"type":"FeatureCollection","features":[\n'
+COLLECTION_FOOTER = b"\n]}\n"
+
+
+def geojson_features(rows: Sequence[Sequence[Any]], names: List[str]) -> str:
+    """
+    GeoJSON features, one per line and comma-separated, of (fid, GeoJSON
+    geometry, *values) rows with the attribute columns `names`.
+    """
+    return ",\n".join(
+        '{"type":"Feature","id":%d,"geometry":%s,"properties":%s}'
+        % (
+            fid,
+            geometry or "null",
+            json.dumps(dict(zip(names, values)), ensure_ascii=False, default=str),
+        )
+        for fid, geometry, *values in rows
+    )
+
+
+def _json(value: Any) -> Any:
+    """Values of JSON columns as their text."""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+class ExportEncoder(ABC):
+    """Encodes batches of (fid, geometry, *values) rows into a file format."""
+
+    extension = ""
+    media_type = "application/octet-stream"
+
+    def __init__(self, datasource: DatasourceRead, types: Dict[str, str]):
+        self.datasource = datasource
+        # Type of each attribute column, in datasource order.
+        self.types = types
+
+    @abstractmethod
+    def geometry(self) -> str:
+        """SQL expression of the geometry, as the encoder takes it."""
+
+    def header(self) -> bytes:
+        return b""
+
+    @abstractmethod
+    def encode(self, rows: Sequence[Sequence[Any]]) -> bytes:
+        """Bytes of a batch of rows."""
+
+    def footer(self) -> bytes:
+        return b""
+
+
+class GeoJSONEncoder(ExportEncoder):
+    extension = "geojson"
+    media_type = "application/geo+json"
+
+    def __init__(self, datasource: DatasourceRead, types: Dict[str, str]):
+        super().__init__(datasource, types)
+        self.first = True
+
+    def geometry(self) -> str:
+        return GEOJSON_GEOMETRY
+
+    def header(self) -> bytes:
+        return COLLECTION_HEADER
+
+    def encode(self, rows: Sequence[Sequence[Any]]) -> bytes:
+        if not rows:
+            return b""
+        data = geojson_features(rows, list(self.types))
+        if not self.first:
+            data = ",\n" + data
+        self.first = False
+        return data.encode()
+
+    def footer(self) -> bytes:
+        return COLLECTION_FOOTER
+
+
+class CSVEncoder(ExportEncoder):
+    extension = "csv"
+    media_type = "text/csv; charset=utf-8"
+
+    def geometry(self) -> str:
+        return f"ST_AsText({GEOMETRY_COLUMN})"
+
+    def _write(self, rows: Sequence[Sequence[Any]]) -> bytes:
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\n").writerows(rows)
+        return buffer.getvalue().encode()
+
+    def header(self) -> bytes:
+        return self._write([[ID_COLUMN, GEOMETRY_COLUMN, *self.types]])
+
+    def encode(self, rows: Sequence[Sequence[Any]]) -> bytes:
+        return self._write(
+            [
+                [
+                    str(value).lower() if isinstance(value, bool) else _json(value)
+                    for value in row
+                ]
+                for row in rows
+            ]
+        )
+
+
+class FlatGeobufEncoder(ExportEncoder):
+    extension = "fgb"
+    media_type = "application/flatgeobuf"
+
+    def __init__(self, datasource: DatasourceRead, types: Dict[str, str]):
+        super().__init__(datasource, types)
+        self.writer = flatgeobuf.FlatGeobufWriter(
+            datasource.name,
+            [
+                (name, FGB_TYPES.get(column_type, flatgeobuf.STRING))
+                for name, column_type in types.items()
+            ],
+            datasource.srid,
+        )
+
+    def geometry(self) -> str:
+        return f"ST_AsBinary(ST_Force2D({GEOMETRY_COLUMN}), 'NDR')"
+
+    def header(self) -> bytes:
+        return self.writer.header()
+
+    def encode(self, rows: Sequence[Sequence[Any]]) -> bytes:
+        return b"".join(
+            self.writer.feature(
+                bytes(geometry) if geometry is not None else None,
+                [_json(value) for value in values],
+            )
+            for _, geometry, *values in rows
+        )
+
+
+ExportFormat = Literal["geojson", "fgb", "csv"]
+ENCODERS = {
+    "geojson": GeoJSONEncoder,
+    "fgb": FlatGeobufEncoder,
+    "csv": CSVEncoder,
+}
+
+
+class Gzip:
+    """Incremental gzip member, flushed at each chunk so bytes keep flowing."""
+
+    def __init__(self, level: int):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self.compressor.flush()
+
+
+class DatasourceExportService:
+    def __init__(
+        self,
+        repository: DatasourceRepository,
+        datasources: DatasourceService,
+        settings: Settings,
+    ):
+        self.repository = repository
+        self.datasources = datasources
+        self.settings = settings
+
+    def _query(self, encoder: ExportEncoder, bbox: Optional[Bbox]) -> str:
+        where = ""
+        if bbox is not None:
+            where = BBOX_FILTER.format(
+                geom=GEOMETRY_COLUMN, srid=int(encoder.datasource.srid)
+            )
+        return EXPORT_QUERY.format(
+            id=ID_COLUMN,
+            geometry=encoder.geometry(),
+            columns="".join(f", {quote(name)}" for name in encoder.types),
+            table=quote(encoder.datasource.name),
+            where=where,
+        )
+
+    async def _chunks(
+        self, encoder: ExportEncoder, query: str, params: Dict[str, float]
+    ) -> AsyncIterator[bytes]:
+        yield encoder.header()
+        statement = text(query).execution_options(
+            yield_per=self.settings.datasource_export_batch_size
+        )
+        async with get_engine().connect() as connection:
+            result = await connection.stream(statement, params)
+            async for rows in result.partitions():
+                yield await asyncio.to_thread(encoder.encode, rows)
+        yield encoder.footer()
+
+    async def _gzip(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        gzip = Gzip(self.settings.datasource_export_gzip_level)
+        async for chunk in chunks:
+            yield await asyncio.to_thread(gzip.compress, chunk)
+        yield gzip.finish()
+
+    async def export(
+        self,
+        datasource_id: int,
+        format: ExportFormat,
+        bbox: Optional[Bbox],
+        compress: bool,
+        current_user: UserDetail,
+    ) -> StreamingResponse:
+        """
+        The features of a datasource (owner or admin), or those intersecting a
+        WGS84 bbox, streamed as a `format` file.
+        """
+        datasource = await self.datasources.get_datasource(datasource_id, current_user)
+        if bbox is not None and (bbox[0] > bbox[2] or bbox[1] > bbox[3]):
+            raise DomainException(key="datasource.invalid_bbox")
+        types = await self.repository.column_types(datasource.name)
+        # The export reads on a connection of its own: release the session's.
+        await self.repository.session.close()
+
+        encoder = ENCODERS[format](
+            datasource, {name: types[name] for name in datasource.columns}
+        )
+        params: Dict[str, float] = {}
+        if bbox is not None:
+            params = dict(zip(("min_x", "min_y", "max_x", "max_y"), bbox))
+        chunks = self._chunks(encoder, self._query(encoder, bbox), params)
+        filename = f"{datasource.name}.{encoder.extension}"
+        media_type = encoder.media_type
+        if compress:
+            chunks = self._gzip(chunks)
+            filename += ".gz"
+            media_type = "application/gzip"
+        return StreamingResponse(
+            chunks,
+            media_type=media_type,
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        )
+
+
+# Dependencies
+SettingsDep = Annotated[Settings, Depends(get_settings)]
+
+
+def get_datasource_export_service(
+    session: SessionDep, settings: SettingsDep, datasources: DatasourceServiceDep
+) -> DatasourceExportService:
+    return DatasourceExportService(
+        DatasourceRepository(session, Datasource), datasources, settings
+    )
+
+
+DatasourceExportServiceDep = Annotated[
+    DatasourceExportService, Depends(get_datasource_export_service)
+]
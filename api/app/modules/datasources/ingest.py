@@ -0,0 +1,209 @@
+"""
+Feature tables written with binary COPY.
+
+Features are written in batches, one `COPY ... FROM STDIN (FORMAT binary)` per
+batch, on the psycopg connection of the request's transaction: nothing is
+visible until the ingest commits. Geometries are sent as EWKB, which is the
+binary input format of PostGIS geometries. Property columns are created from the
+first batch and widened when later features bring new keys or other types.
+
+Feature tables are UNLOGGED staging tables, without primary key: they are
+published (see `DatasourceRepository.swap_staging`) or diffed into a datasource,
+then dropped.
+"""
+
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from psycopg import AsyncConnection
+from sqlalchemy.dialects import postgresql
+
+from app.core.utils.geojson import GeoJSONError, geometry_to_ewkb
+
+ID_COLUMN = "fid"
+GEOMETRY_COLUMN = "geom"
+MAX_IDENTIFIER_BYTES = 63
+
+BOOLEAN = "boolean"
+BIGINT = "bigint"
+DOUBLE = "double precision"
+TEXT = "text"
+JSONB = "jsonb"
+# Type names of the binary dumpers used by COPY, per column type.
+COPY_TYPES = {
+    BOOLEAN: "bool",
+    BIGINT: "int8",
+    DOUBLE: "float8",
+    TEXT: "text",
+    JSONB: "jsonb",
+}
+INT64_RANGE = range(-(2**63), 2**63)
+
+
+def quote(name: str) -> str:
+    return postgresql.dialect().identifier_preparer.quote(name)
+
+
+def value_type(value: Any) -> Optional[str]:
+    """Column type holding a JSON value, None for null."""
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return BOOLEAN
+    if isinstance(value, int):
+        return BIGINT if value in INT64_RANGE else DOUBLE
+    if isinstance(value, float):
+        return DOUBLE
+    if isinstance(value, str):
+        return TEXT
+    return JSONB
+
+
+def merge_types(current: Optional[str], other: Optional[str]) -> Optional[str]:
+    """Narrowest column type holding the values of both types."""
+    if current is None or current == other:
+        return other or current
+    if other is None:
+        return current
+    if {current, other} == {BIGINT, DOUBLE}:
+        return DOUBLE
+    if JSONB in (current, other) and TEXT not in (current, other):
+        return JSONB
+    return TEXT
+
+
+def encode_value(value: Any, column_type: str) -> Any:
+    if value is None:
+        return None
+    if column_type == DOUBLE:
+        return float(value)
+    if column_type == TEXT and not isinstance(value, str):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+def column_name(key: str, taken: set) -> str:
+    """Column of a property: at most 63 bytes, unique, not a reserved column."""
+    base = key.encode()[:MAX_IDENTIFIER_BYTES].decode(errors="ignore") or "property"
+    name, suffix = base, 1
+    while name in taken:
+        suffix += 1
+        tail = f"_{suffix}"
+        room = MAX_IDENTIFIER_BYTES - len(tail)
+        name = base.encode()[:room].decode(errors="ignore") + tail
+    return name
+
+
+class FeatureTable:
+    """Columns of a feature table, following the properties of its features."""
+
+    def __init__(self):
+        # Property key -> [column name, column type (None while only nulls)].
+        self.columns: Dict[str, List[Optional[str]]] = {}
+        self._taken = {ID_COLUMN, GEOMETRY_COLUMN}
+
+    def update(
+        self, features: List[dict]
+    ) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str]]]:
+        """
+        Track the properties of a batch: (added, widened) columns, as
+        (name, type) pairs, which the table needs before the batch is written.
+        """
+        before = {key: column[1] for key, column in self.columns.items()}
+        for feature in features:
+            properties = feature.get("properties") or {}
+            if not isinstance(properties, dict):
+                raise GeoJSONError("Feature properties must be an object")
+            for key, value in properties.items():
+                column = self.columns.get(key)
+                if column is None:
+                    name = column_name(key, self._taken)
+                    self._taken.add(name)
+                    column = self.columns[key] = [name, None]
+                column[1] = merge_types(column[1], value_type(value))
+
+        added, widened = [], []
+        for key, (name, column_type) in self.columns.items():
+            column_type = column_type or TEXT
+            if key not in before:
+                added.append((name, column_type))
+            elif (before[key] or TEXT) != column_type:
+                widened.append((name, column_type))
+        return added, widened
+
+    @property
+    def names(self) -> List[str]:
+        return [name for name, _ in self.columns.values()]
+
+    def types(self) -> List[str]:
+        return [column_type or TEXT for _, column_type in self.columns.values()]
+
+    def row(self, feature: dict, srid: int) -> tuple:
+        properties = feature.get("properties") or {}
+        values = [geometry_to_ewkb(feature.get("geometry"), srid)]
+        for key, (_, column_type) in self.columns.items():
+            values.append(encode_value(properties.get(key), column_type or TEXT))
+        return tuple(values)
+
+
+class FeatureWriter:
+    """Creates a feature table on the first batch and COPYs every batch into it."""
+
+    def __init__(self, connection: AsyncConnection, table: str):
+        self.connection = connection
+        self.table = table
+        self.schema = FeatureTable()
+        self.srid: Optional[int] = None
+        self.count = 0
+
+    async def _execute(self, statement: str) -> None:
+        async with self.connection.cursor() as cursor:
+            await cursor.execute(statement)
+
+    async def _create(self, srid: int, columns: List[Tuple[str, str]]) -> None:
+        definitions = [
+            f"{ID_COLUMN} bigint GENERATED ALWAYS AS IDENTITY",
+            f"{GEOMETRY_COLUMN} geometry(Geometry, {int(srid)})",
+            *(f"{quote(name)} {column_type}" for name, column_type in columns),
+        ]
+        await self._execute(
+            f"CREATE UNLOGGED TABLE {quote(self.table)} ({', '.join(definitions)})"
+        )
+        self.srid = srid
+
+    async def write(self, features: List[dict], srid: int) -> None:
+        added, widened = self.schema.update(features)
+        if self.srid is None:
+            await self._create(srid, added)
+        else:
+            for name, column_type in added:
+                await self._execute(
+                    f"ALTER TABLE {quote(self.table)} "
+                    f"ADD COLUMN {quote(name)} {column_type}"
+                )
+            for name, column_type in widened:
+                # Scalars have no cast to jsonb.
+                using = (
+                    f"to_jsonb({quote(name)})"
+                    if column_type == JSONB
+                    else f"{quote(name)}::{column_type}"
+                )
+                await self._execute(
+                    f"ALTER TABLE {quote(self.table)} ALTER COLUMN {quote(name)} "
+                    f"TYPE {column_type} USING {using}"
+                )
+        if not features:
+            return
+
+        columns = ", ".join(
+            quote(name) for name in [GEOMETRY_COLUMN, *self.schema.names]
+        )
+        async with self.connection.cursor() as cursor:
+            async with cursor.copy(
+                f"COPY {quote(self.table)} ({columns}) FROM STDIN (FORMAT binary)"
+            ) as copy:
+                # EWKB goes through the bytea dumper: same bytes on the wire.
+                copy.set_types(["bytea", *(COPY_TYPES[t] for t in self.schema.types())])
+                for feature in features:
+                    await copy.write_row(self.schema.row(feature, self.srid))
+        self.count += len(features)
@@ -0,0 +1,79 @@
+"""
+Datasource ingests and archive builds run as background jobs (see
+`app.modules.jobs.worker`).
+"""
+
+from typing import Callable
+
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.config import Settings
+from app.modules.datasources.archive import get_datasource_archive_service
+from app.modules.datasources.schemas import DatasourceUpdateRead
+from app.modules.datasources.service import get_datasource_service
+from app.modules.datasources.stats import get_datasource_stats_service
+from app.modules.datasources.uploads import get_datasource_upload_service
+from app.modules.jobs.models import Job
+from app.modules.jobs.service import get_job_service
+from app.modules.proxy.extent import get_tile_extent_service
+from app.modules.users.schemas import UserDetail
+from app.modules.users.service import get_user_service
+
+
+async def job_user(session: AsyncSession, settings: Settings, job: Job) -> UserDetail:
+    users = get_user_service(session, settings)
+    return UserDetail.model_validate(await users.get_user_internal(job.created_by_id))
+
+
+async def ingest_upload(
+    session: AsyncSession,
+    settings: Settings,
+    job: Job,
+    progress: Callable[[int], None],
+) -> dict:
+    """Load a finalized upload, on behalf of the user who queued the job."""
+    current_user = await job_user(session, settings, job)
+    datasources = get_datasource_service(
+        session,
+        settings,
+        get_tile_extent_service(session, settings),
+        get_datasource_stats_service(session, settings),
+    )
+    uploads = get_datasource_upload_service(
+        session, settings, datasources, get_job_service(session, settings)
+    )
+    datasource = await uploads.load(job.payload["upload_id"], current_user, progress)
+    result = {"datasource_id": datasource.id, "name": datasource.name}
+    if isinstance(datasource, DatasourceUpdateRead):
+        result.update(
+            inserted=datasource.inserted,
+            updated=datasource.updated,
+            deleted=datasource.deleted,
+        )
+    return result
+
+
+async def build_pmtiles(
+    session: AsyncSession,
+    settings: Settings,
+    job: Job,
+    progress: Callable[[int], None],
+) -> dict:
+    """Build the PMTiles archive of a datasource; `progress` counts tiles."""
+    current_user = await job_user(session, settings, job)
+    datasources = get_datasource_service(
+        session,
+        settings,
+        get_tile_extent_service(session, settings),
+        get_datasource_stats_service(session, settings),
+    )
+    archives = get_datasource_archive_service(
+        session, settings, datasources, get_job_service(session, settings)
+    )
+    return await archives.build(
+        job.payload["datasource_id"],
+        job.payload["min_zoom"],
+        job.payload["max_zoom"],
+        current_user,
+        progress,
+    )
@@ -0,0 +1,409 @@
+"""
+Shapefile, GeoPackage, FlatGeobuf and GeoParquet layers, read in feature ranges.
+
+`open_layer` recognizes an uploaded file (a zipped Shapefile, a GeoPackage, a
+FlatGeobuf or a GeoParquet file) and describes its layer: columns, SRID and the
+feature ranges it is split into. `encode_range` reads one range into a binary
+COPY stream, geometries left in the SRID of the layer (see `parallel` for
+reprojection); it only takes picklable arguments and runs in the ingest process
+pool.
+
+GeoParquet ranges are whole row groups. A FlatGeobuf layer can be filtered by a
+bbox (in the coordinates of the file) through its spatial index: only the
+features whose bbox intersects it are read.
+"""
+
+import os
+import re
+import shutil
+import struct
+import zipfile
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.utils import flatgeobuf
+from app.core.utils.flatgeobuf import Bbox, FlatGeobuf, FlatGeobufError
+from app.core.utils.geopackage import GeoPackageError, GeoPackageLayer
+from app.core.utils.parquet import GeoParquetLayer, ParquetError
+from app.core.utils.pgcopy import CopyEncoder
+from app.core.utils.shapefile import DbfField, Shapefile, ShapefileError
+from app.modules.datasources.ingest import (
+    BIGINT,
+    BOOLEAN,
+    COPY_TYPES,
+    DOUBLE,
+    GEOMETRY_COLUMN,
+    ID_COLUMN,
+    INT64_RANGE,
+    TEXT,
+    column_name,
+)
+
+SHAPEFILE = "shapefile"
+GEOPACKAGE = "geopackage"
+FLATGEOBUF = "flatgeobuf"
+GEOPARQUET = "geoparquet"
+ZIP_MAGIC = b"PK\x03\x04"
+SQLITE_MAGIC = b"SQLite format 3\x00"
+PARQUET_MAGIC = b"PAR1"
+SHAPEFILE_PARTS = (".shp", ".shx", ".dbf", ".prj", ".cpg")
+# Wider DBF integers do not fit a bigint.
+MAX_BIGINT_DIGITS = 18
+
+GPKG_TYPES = {
+    "INTEGER": BIGINT,
+    "INT": BIGINT,
+    "MEDIUMINT": BIGINT,
+    "SMALLINT": BIGINT,
+    "TINYINT": BIGINT,
+    "BOOLEAN": BOOLEAN,
+    "DOUBLE": DOUBLE,
+    "FLOAT": DOUBLE,
+    "REAL": DOUBLE,
+}
+FGB_TYPES = {
+    flatgeobuf.BYTE: BIGINT,
+    flatgeobuf.UBYTE: BIGINT,
+    flatgeobuf.BOOL: BOOLEAN,
+    flatgeobuf.SHORT: BIGINT,
+    flatgeobuf.USHORT: BIGINT,
+    flatgeobuf.INT: BIGINT,
+    flatgeobuf.UINT: BIGINT,
+    flatgeobuf.LONG: BIGINT,
+    flatgeobuf.ULONG: BIGINT,
+    flatgeobuf.FLOAT: DOUBLE,
+    flatgeobuf.DOUBLE: DOUBLE,
+    flatgeobuf.STRING: TEXT,
+    flatgeobuf.JSON: TEXT,
+    flatgeobuf.DATETIME: TEXT,
+}
+# Parquet column kinds; binary columns are not loaded.
+PARQUET_TYPES = {
+    "boolean": BOOLEAN,
+    "integer": BIGINT,
+    "float": DOUBLE,
+    "string": TEXT,
+    "date": TEXT,
+    "timestamp": TEXT,
+}
+# Outermost EPSG authority of a WKT1 definition.
+PRJ_AUTHORITY = re.compile(r'AUTHORITY\[\s*"EPSG"\s*,\s*"?(\d+)"?\s*\]\s*\]\s*$')
+PRJ_NAME = re.compile(r'^\s*(?:PROJCS|GEOGCS)\[\s*"([^"]+)"')
+PRJ_UTM = re.compile(r"^WGS_1984_UTM_Zone_(\d+)([NS])$")
+# ESRI .prj files carry no authority: common systems by name.
+ESRI_NAMES = {
+    "GCS_WGS_1984": 4326,
+    "WGS_1984_Web_Mercator_Auxiliary_Sphere": 3857,
+    "WGS_84_Pseudo_Mercator": 3857,
+    "GCS_ETRS_1989": 4258,
+    "ETRS_1989_LAEA": 3035,
+    "GCS_RGF_1993": 4171,
+    "RGF_1993_Lambert_93": 2154,
+    "RGF93_Lambert_93": 2154,
+}
+
+
+class LayerError(ValueError):
+    """Unreadable or unsupported uploaded layer."""
+
+
+@dataclass
+class Layer:
+    format: str
+    # Shapefile path without extension, or the uploaded file.
+    path: str
+    name: str
+    srid: Optional[int]
+    # (column name, column type) of the attributes, and their source positions.
+    columns: List[Tuple[str, str]]
+    sources: List[int]
+    ranges: List[Tuple[int, int]]
+    count: int
+    cpg: Optional[str] = None
+    # FlatGeobuf: features kept by their bbox, and the byte offset of the first
+    # feature of each range (start) when the file has no spatial index.
+    bbox: Optional[Bbox] = None
+    offsets: Optional[Dict[int, int]] = None
+
+
+def prj_srid(wkt: str) -> Optional[int]:
+    """EPSG code of a .prj definition, None when not recognized."""
+    match = PRJ_AUTHORITY.search(wkt)
+    if match:
+        return int(match.group(1))
+    match = PRJ_NAME.match(wkt)
+    if match is None:
+        return None
+    name = match.group(1)
+    utm = PRJ_UTM.match(name)
+    if utm:
+        return (32600 if utm.group(2) == "N" else 32700) + int(utm.group(1))
+    return ESRI_NAMES.get(name)
+
+
+def dbf_type(field: DbfField) -> str:
+    if field.type in "NF":
+        if field.decimals == 0 and field.length <= MAX_BIGINT_DIGITS:
+            return BIGINT
+        return DOUBLE
+    if field.type == "L":
+        return BOOLEAN
+    return TEXT
+
+
+def gpkg_type(declared: str) -> Optional[str]:
+    """Column type of a declared SQLite type, None for BLOB (not loaded)."""
+    base = declared.split("(")[0].strip()
+    if base == "BLOB":
+        return None
+    return GPKG_TYPES.get(base, TEXT)
+
+
+def coerce(value: Any, column_type: str) -> Any:
+    """A source value as its column type (SQLite columns are loosely typed)."""
+    if value is None:
+        return None
+    try:
+        if column_type == BIGINT:
+            value = int(value)
+            return value if value in INT64_RANGE else None
+        if column_type == DOUBLE:
+            return float(value)
+        if column_type == BOOLEAN:
+            return bool(int(value)) if not isinstance(value, bool) else value
+    except (TypeError, ValueError, OverflowError):
+        return None
+    if isinstance(value, bytes):
+        return value.decode("utf-8", "replace")
+    return str(value)
+
+
+def _columns(fields: List[Tuple[str, Optional[str]]]) -> Tuple[list, list]:
+    taken = {ID_COLUMN, GEOMETRY_COLUMN}
+    columns, sources = [], []
+    for position, (key, column_type) in enumerate(fields):
+        if column_type is None:
+            continue
+        name = column_name(key, taken)
+        taken.add(name)
+        columns.append((name, column_type))
+        sources.append(position)
+    return columns, sources
+
+
+def _open_shapefile(
+    path: str, directory: str, layer: Optional[str], range_size: int
+) -> Layer:
+    with zipfile.ZipFile(path) as archive:
+        stems = {
+            os.path.basename(stem): stem
+            for stem, extension in map(os.path.splitext, archive.namelist())
+            if extension.lower() == ".shp" and not stem.startswith("__MACOSX")
+        }
+        if not stems or (layer is not None and layer not in stems):
+            raise LayerError(f"No shapefile {layer or ''}".rstrip())
+        name = layer or sorted(stems)[0]
+        stem = stems[name]
+        # Extracted under fixed names: member paths are not trusted.
+        base = os.path.join(directory, "layer")
+        found = set()
+        for member in archive.namelist():
+            member_stem, extension = os.path.splitext(member)
+            if member_stem == stem and extension.lower() in SHAPEFILE_PARTS:
+                with (
+                    archive.open(member) as source,
+                    open(base + extension.lower(), "wb") as target,
+                ):
+                    shutil.copyfileobj(source, target)
+                found.add(extension.lower())
+    if not {".shx", ".dbf"} <= found:
+        raise LayerError(f"Shapefile {name} needs its .shx and .dbf files")
+
+    def read_text(extension: str) -> Optional[str]:
+        if extension not in found:
+            return None
+        with open(base + extension, encoding="utf-8", errors="replace") as file:
+            return file.read()
+
+    prj, cpg = read_text(".prj"), read_text(".cpg")
+    shapefile = Shapefile(base, cpg)
+    columns, sources = _columns(
+        [(field.name.lower(), dbf_type(field)) for field in shapefile.fields]
+    )
+    return Layer(
+        format=SHAPEFILE,
+        path=base,
+        name=name,
+        # Shapefiles without a .prj are taken as WGS84.
+        srid=prj_srid(prj) if prj is not None else 4326,
+        columns=columns,
+        sources=sources,
+        ranges=[
+            (start, min(start + range_size, shapefile.count))
+            for start in range(0, shapefile.count, range_size)
+        ],
+        count=shapefile.count,
+        cpg=cpg,
+    )
+
+
+def _open_geopackage(path: str, layer: Optional[str], range_size: int) -> Layer:
+    geopackage = GeoPackageLayer(path, layer)
+    columns, sources = _columns(
+        [(name, gpkg_type(declared)) for name, declared in geopackage.fields]
+    )
+    return Layer(
+        format=GEOPACKAGE,
+        path=path,
+        name=geopackage.table,
+        srid=geopackage.srid,
+        columns=columns,
+        sources=sources,
+        ranges=geopackage.ranges(range_size),
+        count=geopackage.count,
+    )
+
+
+def _open_flatgeobuf(
+    path: str, layer: Optional[str], range_size: int, bbox: Optional[Bbox]
+) -> Layer:
+    fgb = FlatGeobuf(path)
+    name = fgb.name or "features"
+    if layer is not None and layer != name:
+        raise LayerError(f"No layer {layer}")
+    columns, sources = _columns(
+        [(key, FGB_TYPES.get(column_type)) for key, column_type in fgb.fields]
+    )
+    offsets = None
+    if bbox is not None:
+        # Ranges of `range_size` matching features, by feature index.
+        found = [index for index, _ in fgb.search(bbox)]
+        count = len(found)
+        ranges = [
+            (found[i], found[min(i + range_size, count) - 1] + 1)
+            for i in range(0, count, range_size)
+        ]
+    elif fgb.indexed:
+        count = fgb.count
+        ranges = [
+            (start, min(start + range_size, count))
+            for start in range(0, count, range_size)
+        ]
+    else:
+        scanned, starts = fgb.scan(range_size)
+        count, ranges = fgb.count, scanned
+        offsets = {start: offset for (start, _), offset in zip(scanned, starts)}
+    return Layer(
+        format=FLATGEOBUF,
+        path=path,
+        name=name,
+        srid=fgb.srid,
+        columns=columns,
+        sources=sources,
+        ranges=ranges,
+        count=count,
+        bbox=bbox,
+        offsets=offsets,
+    )
+
+
+def _open_geoparquet(path: str, layer: Optional[str], range_size: int) -> Layer:
+    geoparquet = GeoParquetLayer(path, layer)
+    columns, sources = _columns(
+        [(name, PARQUET_TYPES.get(kind)) for name, kind in geoparquet.fields]
+    )
+    return Layer(
+        format=GEOPARQUET,
+        path=path,
+        name=geoparquet.geometry_column,
+        srid=geoparquet.srid,
+        columns=columns,
+        sources=sources,
+        ranges=geoparquet.ranges(range_size),
+        count=geoparquet.count,
+    )
+
+
+def open_layer(
+    path: str,
+    directory: str,
+    layer: Optional[str],
+    range_size: int,
+    bbox: Optional[Bbox] = None,
+) -> Layer:
+    """
+    Describe the layer of an uploaded file; a zipped Shapefile is extracted to
+    `directory`. `layer` names the shapefile, feature table, FlatGeobuf layer
+    or GeoParquet geometry column; `bbox` filters a FlatGeobuf layer.
+    """
+    try:
+        with open(path, "rb") as file:
+            magic = file.read(len(SQLITE_MAGIC))
+        if magic.startswith(flatgeobuf.MAGIC):
+            return _open_flatgeobuf(path, layer, range_size, bbox)
+        if bbox is not None:
+            raise LayerError("Only FlatGeobuf files can be filtered by bbox")
+        if magic.startswith(ZIP_MAGIC):
+            return _open_shapefile(path, directory, layer, range_size)
+        if magic == SQLITE_MAGIC:
+            return _open_geopackage(path, layer, range_size)
+        if magic.startswith(PARQUET_MAGIC):
+            return _open_geoparquet(path, layer, range_size)
+    except (
+        ShapefileError,
+        GeoPackageError,
+        FlatGeobufError,
+        ParquetError,
+        zipfile.BadZipFile,
+    ) as e:
+        raise LayerError(str(e)) from e
+    raise LayerError(
+        "Expected a zipped Shapefile, a GeoPackage, a FlatGeobuf or a GeoParquet file"
+    )
+
+
+def copy_types(layer: Layer) -> List[str]:
+    """Binary COPY types of the fid, geometry and attribute columns."""
+    return ["int8", "bytea", *(COPY_TYPES[t] for _, t in layer.columns)]
+
+
+def encode_range(layer: Layer, start: int, stop: int) -> Tuple[bytes, int]:
+    """Binary COPY stream of a range of features, and its row count."""
+    encoder = CopyEncoder(copy_types(layer))
+    targets = list(zip(layer.sources, (t for _, t in layer.columns)))
+    try:
+        if layer.format == SHAPEFILE:
+            records = Shapefile(layer.path, layer.cpg).records(start, stop, layer.srid)
+        elif layer.format == GEOPACKAGE:
+            records = GeoPackageLayer(layer.path, layer.name).records(
+                start, stop, layer.srid
+            )
+        elif layer.format == FLATGEOBUF:
+            records = FlatGeobuf(layer.path).records(
+                start,
+                stop,
+                layer.srid,
+                layer.bbox,
+                (layer.offsets or {}).get(start),
+            )
+        else:
+            records = GeoParquetLayer(layer.path, layer.name).records(
+                start, stop, layer.srid
+            )
+        for fid, geometry, values in records:
+            encoder.write_row(
+                [
+                    fid,
+                    geometry,
+                    *(coerce(values[i], column_type) for i, column_type in targets),
+                ]
+            )
+    except (
+        ShapefileError,
+        GeoPackageError,
+        FlatGeobufError,
+        ParquetError,
+        struct.error,
+    ) as e:
+        raise LayerError(str(e)) from e
+    return encoder.finish(), encoder.rows
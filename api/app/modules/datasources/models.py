@@ -0,0 +1,90 @@
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import BigInteger, Float, ForeignKey, String
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlmodel import ARRAY, Column, Field, SQLModel
+
+from app.core.mixins.audit_mixin import AuditMixin
+
+
+class Datasource(AuditMixin, SQLModel, table=True):
+    """
+    Datasource table loaded through the API. `name` is both the table and the
+    tile source id; the table has a `fid` identity key and a `geom` column.
+    """
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    name: str = Field(unique=True, index=True)
+    geometry_column: str = Field(default="geom")
+    srid: int
+    feature_count: int = Field(default=0)
+    columns: List[str] = Field(default=[], sa_column=Column(ARRAY(String)))
+    ingest_seconds: Optional[float] = Field(default=None)
+    # Post-ingest optimization, and a tile ("z/x/y") timed before and after it
+    optimize_seconds: Optional[float] = Field(default=None)
+    sample_tile: Optional[str] = Field(default=None)
+    tile_ms_before: Optional[float] = Field(default=None)
+    tile_ms_after: Optional[float] = Field(default=None)
+    # Last build of its PMTiles archive, None while tiles come from the table
+    archive_built_at: Optional[datetime] = Field(default=None)
+
+
+class DatasourceUpload(AuditMixin, SQLModel, table=True):
+    """
+    Resumable upload of a datasource file, spooled under the upload directory.
+    `offset` bytes of `length` are received; the file is loaded into the
+    datasource `name` (or updates it, with `update_key`) once complete and
+    finalized.
+    """
+
+    __tablename__ = "datasource_upload"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    name: str
+    # "geojson" or "file" (zipped Shapefile, GeoPackage, FlatGeobuf or GeoParquet)
+    format: str
+    layer: Optional[str] = Field(default=None)
+    srid: Optional[int] = Field(default=None)
+    # Column matching the features of an update of the existing datasource `name`
+    update_key: Optional[str] = Field(default=None)
+    # (min_x, min_y, max_x, max_y) of the features loaded from a FlatGeobuf
+    bbox: Optional[List[float]] = Field(default=None, sa_column=Column(ARRAY(Float)))
+    length: int = Field(sa_column=Column(BigInteger, nullable=False))
+    offset: int = Field(default=0, sa_column=Column(BigInteger, nullable=False))
+    # "<algorithm> <base64 digest>" of the whole file, checked when finalized
+    checksum: Optional[str] = Field(default=None)
+    datasource_id: Optional[int] = Field(
+        default=None,
+        sa_column=Column(ForeignKey("datasource.id", ondelete="SET NULL")),
+    )
+    expires_at: datetime = Field(index=True)
+    finalized_at: Optional[datetime] = Field(default=None)
+    # Lease of the request receiving a chunk, see `DatasourceUploadService.append`
+    lock_token: Optional[str] = Field(default=None)
+    locked_until: Optional[datetime] = Field(default=None)
+
+
+class DatasourceStats(SQLModel, table=True):
+    """
+    Attribute statistics of a datasource, estimated from a sample of
+    `sampled_rows` of its features (see `app.modules.datasources.stats`):
+    `columns` is the summary served to clients, `sketches` the per-column state
+    that updates are folded into. `changed_rows` features were changed by updates
+    since `computed_at`.
+    """
+
+    __tablename__ = "datasource_stats"
+
+    datasource_id: int = Field(
+        sa_column=Column(
+            ForeignKey("datasource.id", ondelete="CASCADE"), primary_key=True
+        )
+    )
+    feature_count: int = Field(default=0)
+    sampled_rows: int = Field(default=0)
+    changed_rows: int = Field(default=0)
+    columns: list = Field(default=[], sa_column=Column(JSONB, nullable=False))
+    sketches: dict = Field(default={}, sa_column=Column(JSONB, nullable=False))
+    computed_at: datetime = Field(default_factory=datetime.utcnow)
+    refreshed_at: datetime = Field(default_factory=datetime.utcnow)
@@ -0,0 +1,94 @@
+"""
+Parallel ingest of Shapefile and GeoPackage layers.
+
+A layer is split into feature ranges. Each range is read, turned into EWKB and
+encoded as a binary COPY stream by a process of the ingest pool, then written
+on its own database connection into an UNLOGGED staging table. Up to
+`datasource_ingest_workers` ranges are in flight at once, which also bounds the
+encoded streams held in memory; the event loop only moves bytes.
+
+Geometries are not reprojected at ingest: they are stored in the SRID of the
+layer, recorded on the datasource, and reprojection is deferred to query time
+(`ST_Transform` in the tile engine, exports, feature queries and extents). The
+API has no coordinate transformation library, and the source coordinates are
+kept exactly as uploaded.
+"""
+
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Optional
+
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.modules.datasources.ingest import GEOMETRY_COLUMN, ID_COLUMN, quote
+from app.modules.datasources.layers import Layer, encode_range
+
+
+class IngestPool:
+    """Process pool of a worker, created on the first file upload."""
+
+    def __init__(self):
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def get(self, workers: int) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # Forking a process running an event loop and threads is unsafe.
+            self._executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+
+ingest_pool = IngestPool()
+
+
+async def copy_ranges(
+    engine: AsyncEngine,
+    executor: ProcessPoolExecutor,
+    layer: Layer,
+    table: str,
+    workers: int,
+    progress: Optional[Callable[[int], None]] = None,
+) -> int:
+    """
+    COPY every range of a layer into `table`, committed; the rows copied.
+    `progress` is called with the rows of each range once committed.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(workers)
+    columns = ", ".join(
+        quote(name)
+        for name in [ID_COLUMN, GEOMETRY_COLUMN, *(n for n, _ in layer.columns)]
+    )
+    statement = f"COPY {quote(table)} ({columns}) FROM STDIN (FORMAT binary)"
+
+    async def copy_range(start: int, stop: int) -> int:
+        async with semaphore:
+            data, count = await loop.run_in_executor(
+                executor, encode_range, layer, start, stop
+            )
+            if not count:
+                return 0
+            async with engine.connect() as connection:
+                raw = await connection.get_raw_connection()
+                async with raw.driver_connection.cursor() as cursor:
+                    async with cursor.copy(statement) as copy:
+                        await copy.write(data)
+                await connection.commit()
+            if progress is not None:
+                progress(count)
+            return count
+
+    try:
+        async with asyncio.TaskGroup() as group:
+            tasks = [group.create_task(copy_range(*r)) for r in layer.ranges]
+    except ExceptionGroup as errors:
+        # The other ranges are cancelled; report the first failure.
+        raise errors.exceptions[0]
+    return sum(task.result() for task in tasks)
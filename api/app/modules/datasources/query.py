@@ -0,0 +1,240 @@
+"""
+Feature queries of datasources, for identify and inspect tools: the features in
+a WGS84 bbox, or those at a point within a tolerance.
+
+Both filter on the GiST index of the geometry column (`&&` on the query box,
+then an exact `ST_Intersects`), select only the requested attribute columns and
+stop at a server-side LIMIT. They run on the tile engine's read-only pool (the
+main pool when the engine is disabled), whose connections prepare each query
+server-side on first use (`prepare_threshold=0`): the query text is fixed per
+datasource, query kind and column set, so later requests only bind and execute
+it. Each request sets its own `statement_timeout` in its transaction, so a
+query over a huge table is cancelled instead of holding a connection.
+
+The rows, at most `datasource_query_max_features`, are read before the response
+starts (a failed or cancelled query gets its own status), then encoded as a
+GeoJSON FeatureCollection and streamed in batches.
+"""
+
+import asyncio
+from typing import Annotated, Any, AsyncIterator, Dict, List, Optional, Sequence
+
+import psycopg
+from fastapi import Depends
+from fastapi.responses import StreamingResponse
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from app.core.config import Settings, get_settings
+from app.core.database import get_engine
+from app.core.exceptions import DomainException, ExternalServiceException
+from app.core.logging_config import logger
+from app.modules.datasources.export import (
+    COLLECTION_FOOTER,
+    COLLECTION_HEADER,
+    GEOJSON_GEOMETRY,
+    geojson_features,
+)
+from app.modules.datasources.ingest import GEOMETRY_COLUMN, ID_COLUMN, quote
+from app.modules.datasources.schemas import DatasourceRead
+from app.modules.datasources.service import (
+    Bbox,
+    DatasourceService,
+    DatasourceServiceDep,
+)
+from app.modules.maps.service import MapService, MapServiceDep
+from app.modules.proxy.engine import WEB_MERCATOR_SRID, TileEngine, tile_engine
+from app.modules.users.schemas import UserDetail
+
+# Latitude limit of Web Mercator, where point tolerances are measured.
+MAX_LATITUDE = 85.05112878
+
+TIMEOUT_QUERY = "SELECT set_config('statement_timeout', :timeout, true)"
+FEATURES_QUERY = """
+    SELECT {id}, {geometry}{columns}
+    FROM {table}
+    WHERE {geom} && {box} AND ST_Intersects({geom}, {box}){order}
+    LIMIT :limit
+"""
+BBOX = "ST_MakeEnvelope(:min_x, :min_y, :max_x, :max_y, 4326)"
+POINT = "ST_SetSRID(ST_MakePoint(:lon, :lat), 4326)"
+# The point, expanded by the tolerance in Web Mercator meters.
+POINT_BOX = f"ST_Expand(ST_Transform({POINT}, {WEB_MERCATOR_SRID}), :tolerance)"
+
+
+def transform(geometry: str, from_srid: int, srid: int) -> str:
+    """SQL of a geometry in `from_srid` moved to the SRID of a datasource."""
+    if from_srid == srid:
+        return geometry
+    return f"ST_Transform({geometry}, {int(srid)})"
+
+
+def features_query(
+    datasource: DatasourceRead, columns: List[str], at_point: bool = False
+) -> str:
+    """Query text of the features of a datasource in a bbox, or at a point."""
+    geom = GEOMETRY_COLUMN
+    order = ""
+    if at_point:
+        box = transform(POINT_BOX, WEB_MERCATOR_SRID, datasource.srid)
+        # Closest first, when the tolerance takes in several features.
+        order = f"\n    ORDER BY {geom} <-> {transform(POINT, 4326, datasource.srid)}"
+    else:
+        box = transform(BBOX, 4326, datasource.srid)
+    return FEATURES_QUERY.format(
+        id=ID_COLUMN,
+        geometry=GEOJSON_GEOMETRY,
+        columns="".join(f", {quote(name)}" for name in columns),
+        table=quote(datasource.name),
+        geom=geom,
+        box=box,
+        order=order,
+    )
+
+
+def parse_properties(datasource: DatasourceRead, value: Optional[str]) -> List[str]:
+    """
+    Attribute columns of a comma-separated `properties` list, in datasource
+    order: all of them when None, none when empty.
+    """
+    if value is None:
+        return list(datasource.columns)
+    names = {name.strip() for name in value.split(",") if name.strip()}
+    unknown = names.difference(datasource.columns)
+    if unknown:
+        raise DomainException(
+            key="datasource.unknown_columns",
+            params={"columns": ", ".join(sorted(unknown))},
+        )
+    return [name for name in datasource.columns if name in names]
+
+
+class DatasourceQueryService:
+    def __init__(
+        self,
+        datasources: DatasourceService,
+        maps: MapService,
+        settings: Settings,
+        engine: TileEngine | None = None,
+    ):
+        self.datasources = datasources
+        self.maps = maps
+        self.settings = settings
+        self.engine = engine or tile_engine
+
+    async def _fetch(
+        self, datasource: DatasourceRead, query: str, params: Dict[str, Any]
+    ) -> Sequence[Sequence[Any]]:
+        engine = self.engine.engine or get_engine()
+        try:
+            async with engine.connect() as connection:
+                await connection.execute(
+                    text(TIMEOUT_QUERY),
+                    {"timeout": str(self.settings.datasource_query_timeout_ms)},
+                )
+                result = await connection.execute(text(query), params)
+                return result.all()
+        except DBAPIError as e:
+            if isinstance(e.orig, psycopg.errors.QueryCanceled):
+                raise DomainException(
+                    key="datasource.query_timeout", params={"name": datasource.name}
+                )
+            logger.exception(f"Feature query failed for {datasource.name}")
+            raise ExternalServiceException(
+                key="datasource.query_failed", params={"name": datasource.name}
+            )
+
+    async def _chunks(
+        self, rows: Sequence[Sequence[Any]], columns: List[str]
+    ) -> AsyncIterator[bytes]:
+        yield COLLECTION_HEADER
+        size = self.settings.datasource_export_batch_size
+        for start in range(0, len(rows), size):
+            data = await asyncio.to_thread(
+                geojson_features, rows[start : start + size], columns
+            )
+            yield (",\n" + data if start else data).encode()
+        yield COLLECTION_FOOTER
+
+    async def _query(
+        self,
+        datasource: DatasourceRead,
+        columns: List[str],
+        limit: int,
+        params: Dict[str, Any],
+        at_point: bool = False,
+    ) -> StreamingResponse:
+        limit = min(limit, self.settings.datasource_query_max_features)
+        # One more row than returned tells whether the limit cut the results.
+        rows = await self._fetch(
+            datasource,
+            features_query(datasource, columns, at_point),
+            {**params, "limit": limit + 1},
+        )
+        return StreamingResponse(
+            self._chunks(rows[:limit], columns),
+            media_type="application/geo+json",
+            headers={"X-Limit-Reached": str(len(rows) > limit).lower()},
+        )
+
+    async def features_in_bbox(
+        self,
+        datasource_id: int,
+        bbox: Bbox,
+        properties: Optional[str],
+        limit: int,
+        current_user: UserDetail,
+    ) -> StreamingResponse:
+        """
+        At most `limit` features of a datasource (owner, admin or viewer of a
+        map using it) intersecting a WGS84 bbox, with the `properties` columns.
+        """
+        datasource = await self.datasources.get_map_datasource(
+            datasource_id, current_user, self.maps
+        )
+        if bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+            raise DomainException(key="datasource.invalid_bbox")
+        columns = parse_properties(datasource, properties)
+        params = dict(zip(("min_x", "min_y", "max_x", "max_y"), bbox))
+        return await self._query(datasource, columns, limit, params)
+
+    async def features_at_point(
+        self,
+        datasource_id: int,
+        lon: float,
+        lat: float,
+        tolerance: float,
+        properties: Optional[str],
+        limit: int,
+        current_user: UserDetail,
+    ) -> StreamingResponse:
+        """
+        At most `limit` features of a datasource (owner, admin or viewer of a
+        map using it) within `tolerance` Web Mercator meters of a WGS84 point,
+        closest first, with the `properties` columns.
+        """
+        datasource = await self.datasources.get_map_datasource(
+            datasource_id, current_user, self.maps
+        )
+        if not (-180 <= lon <= 180 and -MAX_LATITUDE <= lat <= MAX_LATITUDE) or (
+            tolerance < 0
+        ):
+            raise DomainException(key="datasource.invalid_point")
+        columns = parse_properties(datasource, properties)
+        params = {"lon": lon, "lat": lat, "tolerance": tolerance}
+        return await self._query(datasource, columns, limit, params, at_point=True)
+
+
+# Dependencies
+SettingsDep = Annotated[Settings, Depends(get_settings)]
+
+
+def get_datasource_query_service(
+    settings: SettingsDep, datasources: DatasourceServiceDep, maps: MapServiceDep
+) -> DatasourceQueryService:
+    return DatasourceQueryService(datasources, maps, settings)
+
+
+DatasourceQueryServiceDep = Annotated[
+    DatasourceQueryService, Depends(get_datasource_query_service)
+]
@@ -0,0 +1,427 @@
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from psycopg import AsyncConnection
+from sqlalchemy import func, or_, text, update
+from sqlalchemy.dialects import postgresql
+from sqlmodel import select
+
+from app.core.repository import BaseRepository
+from app.modules.datasources.ingest import (
+    GEOMETRY_COLUMN,
+    ID_COLUMN,
+    MAX_IDENTIFIER_BYTES,
+    quote,
+)
+from app.modules.datasources.models import (
+    Datasource,
+    DatasourceStats,
+    DatasourceUpload,
+)
+
+
+COLUMN_TYPES_QUERY = """
+    SELECT attname, format_type(atttypid, atttypmod)
+    FROM pg_attribute
+    WHERE attrelid = CAST(:table AS regclass) AND attnum > 0 AND NOT attisdropped
+    ORDER BY attnum
+"""
+
+DUPLICATE_KEY_QUERY = """
+    SELECT EXISTS (SELECT 1 FROM {table} WHERE {key} IS NULL)
+        OR EXISTS (SELECT 1 FROM {table} GROUP BY {key} HAVING count(*) > 1)
+"""
+
+# Features of the staging table `s` and of the datasource table `l` that differ,
+# by key: new (no FID), changed, or gone (no staged key).
+DIFF_QUERY = """
+    CREATE TEMPORARY TABLE canopy_diff ON COMMIT DROP AS
+    SELECT s.key AS key, l.{id} AS fid,
+        CASE WHEN l.{id} IS NULL THEN 'insert'
+            WHEN s.key IS NULL THEN 'delete'
+            ELSE 'update'
+        END AS operation
+    FROM (
+        SELECT {staged_key} AS key, {staged_hash} AS hash FROM {staging} s
+    ) s
+    FULL JOIN (
+        SELECT {id}, {key} AS key, {live_hash} AS hash FROM {table}
+    ) l ON s.key = l.key
+    WHERE s.hash IS DISTINCT FROM l.hash
+"""
+
+DIFF_STATEMENTS = (
+    (
+        "deleted",
+        """
+        DELETE FROM {table} l USING canopy_diff d
+        WHERE d.operation = 'delete' AND l.{id} = d.fid
+        """,
+    ),
+    (
+        "updated",
+        """
+        UPDATE {table} l SET {assignments}
+        FROM canopy_diff d JOIN {staging} s ON {staged_key} = d.key
+        WHERE d.operation = 'update' AND l.{id} = d.fid
+        """,
+    ),
+    (
+        "inserted",
+        """
+        INSERT INTO {table} ({columns})
+        SELECT {values}
+        FROM canopy_diff d JOIN {staging} s ON {staged_key} = d.key
+        WHERE d.operation = 'insert'
+        """,
+    ),
+)
+
+SAMPLE_POINT_QUERY = """
+    SELECT ST_X(point), ST_Y(point) FROM (
+        SELECT ST_Transform(ST_PointOnSurface({geom}), 4326) AS point
+        FROM {table} {sample}
+        WHERE NOT ST_IsEmpty({geom})
+        LIMIT 1
+    ) sample
+"""
+# Share of the table blocks sampled by `sample_point`.
+SAMPLE_POINT_PERCENT = 1
+
+
+class DatasourceRepository(BaseRepository[Datasource]):
+    """Repository for Datasource entities and their tables."""
+
+    async def get_by_name(self, name: str) -> Optional[Datasource]:
+        result = await self.session.exec(
+            select(Datasource).where(Datasource.name == name)
+        )
+        return result.first()
+
+    async def lock(self, datasource_id: int) -> Optional[Datasource]:
+        """
+        The datasource, read again and locked until the transaction ends; raises
+        DBAPIError (LockNotAvailable) while another transaction holds it.
+        """
+        result = await self.session.exec(
+            select(Datasource)
+            .where(Datasource.id == datasource_id)
+            .with_for_update(nowait=True)
+            .execution_options(populate_existing=True)
+        )
+        return result.first()
+
+    async def table_exists(self, name: str) -> bool:
+        result = await self.session.execute(
+            text("SELECT to_regclass(:name) IS NOT NULL"), {"name": f'"{name}"'}
+        )
+        return bool(result.scalar())
+
+    async def driver_connection(self) -> AsyncConnection:
+        """psycopg connection of the session, in its current transaction."""
+        connection = await self.session.connection()
+        raw = await connection.get_raw_connection()
+        return raw.driver_connection
+
+    async def create_staging(
+        self, table: str, srid: int, columns: List[Tuple[str, str]]
+    ) -> None:
+        """
+        UNLOGGED table receiving a parallel ingest: no WAL while loading, keys
+        and indexes added once loaded.
+        """
+        definitions = [
+            f"{ID_COLUMN} bigint",
+            f"{GEOMETRY_COLUMN} geometry(Geometry, {int(srid)})",
+            *(f"{quote(name)} {column_type}" for name, column_type in columns),
+        ]
+        await self.session.execute(
+            text(f"CREATE UNLOGGED TABLE {quote(table)} ({', '.join(definitions)})")
+        )
+
+    async def swap_staging(self, staging: str, table: str, ordered: bool) -> None:
+        """
+        Turn a loaded staging table into the datasource table `table`. Setting
+        an unlogged table logged rewrites it: when `ordered`, its rows are
+        instead copied once, in geometry order (Hilbert curve), into the table.
+        """
+        name = quote(table)
+        if ordered:
+            statements = [
+                f"CREATE TABLE {name} AS SELECT * FROM {quote(staging)} "
+                f"ORDER BY {GEOMETRY_COLUMN}",
+                f"DROP TABLE {quote(staging)}",
+            ]
+        else:
+            statements = [
+                f"ALTER TABLE {quote(staging)} SET LOGGED",
+                f"ALTER TABLE {quote(staging)} RENAME TO {name}",
+                f"ALTER TABLE {name} ALTER COLUMN {ID_COLUMN} DROP IDENTITY IF EXISTS",
+            ]
+        for statement in (
+            *statements,
+            f"ALTER TABLE {name} ADD PRIMARY KEY ({ID_COLUMN})",
+            # New features get the FIDs following the loaded ones.
+            f"ALTER TABLE {name} ALTER COLUMN {ID_COLUMN} "
+            "ADD GENERATED BY DEFAULT AS IDENTITY",
+            f"SELECT setval(pg_get_serial_sequence('{name}', '{ID_COLUMN}'), "
+            f"coalesce(max({ID_COLUMN}), 0) + 1, false) FROM {name}",
+        ):
+            await self.session.execute(text(statement))
+
+    async def sample_point(self, table: str) -> Optional[Tuple[float, float]]:
+        """
+        WGS84 point on a feature of a random block sample of the table (the
+        first feature when the sample holds none), None if empty. Both stop at
+        the first feature found instead of scanning the table.
+        """
+        for sample in (f"TABLESAMPLE SYSTEM ({SAMPLE_POINT_PERCENT})", ""):
+            result = await self.session.execute(
+                text(
+                    SAMPLE_POINT_QUERY.format(
+                        geom=GEOMETRY_COLUMN, table=quote(table), sample=sample
+                    )
+                )
+            )
+            row = result.first()
+            if row is not None:
+                return row[0], row[1]
+        return None
+
+    async def index_table(self, table: str, brin: bool = False) -> None:
+        """Index the geometries and collect statistics once the rows are in."""
+        name = quote(table)
+        statements = [
+            f"CREATE INDEX {quote(f'{table[: MAX_IDENTIFIER_BYTES - 9]}_geom_idx')} "
+            f"ON {name} USING gist ({GEOMETRY_COLUMN})",
+        ]
+        if brin:
+            statements.append(
+                "CREATE INDEX "
+                f"{quote(f'{table[: MAX_IDENTIFIER_BYTES - 10]}_geom_brin')} "
+                f"ON {name} USING brin ({GEOMETRY_COLUMN})"
+            )
+        statements.append(f"ANALYZE {name}")
+        for statement in statements:
+            await self.session.execute(text(statement))
+
+    async def drop_table(self, table: str) -> None:
+        await self.session.execute(text(f"DROP TABLE IF EXISTS {quote(table)}"))
+
+    async def column_types(self, table: str) -> Dict[str, str]:
+        """Type (as declared) of the columns of a table, in table order."""
+        result = await self.session.execute(text(COLUMN_TYPES_QUERY), {"table": table})
+        return {name: column_type for name, column_type in result.all()}
+
+    async def duplicate_key(self, table: str, key: str) -> bool:
+        """Whether a key column of a table has a null or repeated value."""
+        result = await self.session.execute(
+            text(DUPLICATE_KEY_QUERY.format(table=quote(table), key=quote(key)))
+        )
+        return bool(result.scalar())
+
+    async def apply_diff(
+        self,
+        table: str,
+        staging: str,
+        key: str,
+        srid: int,
+        columns: Dict[str, str],
+        staged: List[str],
+    ) -> Dict[str, int]:
+        """
+        Make `table` hold the features of `staging`, matched on `key`: rows whose
+        geometry or attributes hash differently are updated in place (keeping
+        their FID), missing ones deleted, new ones inserted. `columns` are the
+        types of the table's attribute columns; those not `staged` become null.
+        Counts of the rows inserted, updated and deleted.
+
+        The differences stay in the `canopy_diff` temporary table until the
+        transaction ends (see `DatasourceStatsRepository.sample_changed`).
+        """
+
+        def value(name: str) -> str:
+            if name == GEOMETRY_COLUMN:
+                return f"ST_Transform(s.{GEOMETRY_COLUMN}, {int(srid)})"
+            if name not in staged:
+                return f"CAST(NULL AS {columns[name]})"
+            return f"CAST(s.{quote(name)} AS {columns[name]})"
+
+        attributes = [GEOMETRY_COLUMN, *columns]
+        names = {
+            "table": quote(table),
+            "id": ID_COLUMN,
+            "staging": quote(staging),
+            "key": quote(key),
+            "staged_key": value(key),
+            "live_hash": "md5(ROW({}, {})::text)".format(
+                f"ST_AsEWKB({GEOMETRY_COLUMN})",
+                ", ".join(quote(name) for name in columns) or "NULL",
+            ),
+            "staged_hash": "md5(ROW({}, {})::text)".format(
+                f"ST_AsEWKB({value(GEOMETRY_COLUMN)})",
+                ", ".join(value(name) for name in columns) or "NULL",
+            ),
+            "columns": ", ".join(quote(name) for name in attributes),
+            "values": ", ".join(value(name) for name in attributes),
+            "assignments": ", ".join(
+                f"{quote(name)} = {value(name)}" for name in attributes
+            ),
+        }
+        # Readers are not blocked; concurrent writers wait for the commit.
+        await self.session.execute(
+            text("LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE".format(**names))
+        )
+        await self.session.execute(text(DIFF_QUERY.format(**names)))
+        counts = {}
+        for operation, statement in DIFF_STATEMENTS:
+            result = await self.session.execute(text(statement.format(**names)))
+            counts[operation] = result.rowcount
+        return counts
+
+
+# Blocks picked at random: about `percent` of the rows, read without a full scan.
+# Values are inlined: TABLESAMPLE takes a real, not a bound double.
+SAMPLE_QUERY = "SELECT {columns} FROM {table} l TABLESAMPLE SYSTEM ({percent})"
+
+# Rows inserted or changed by `apply_diff`, a random `fraction` of them.
+CHANGED_QUERY = """
+    SELECT {columns} FROM {table} l JOIN canopy_diff d ON l.{key} = d.key
+    WHERE d.operation <> 'delete' AND random() < :fraction
+"""
+
+
+class DatasourceStatsRepository(BaseRepository[DatasourceStats]):
+    """Repository for DatasourceStats entities, keyed by datasource."""
+
+    async def get_by_datasource(self, datasource_id: int) -> Optional[DatasourceStats]:
+        # Folded updates are written with upserts: bypass the identity map.
+        result = await self.session.exec(
+            select(DatasourceStats)
+            .where(DatasourceStats.datasource_id == datasource_id)
+            .execution_options(populate_existing=True)
+        )
+        return result.first()
+
+    def _columns(self, columns: List[str]) -> str:
+        return ", ".join(f"l.{quote(name)}" for name in columns) or "NULL"
+
+    async def sample(
+        self, table: str, columns: List[str], percent: Optional[float]
+    ) -> List[tuple]:
+        """Values of `columns` of about `percent` of the rows of a table, or all."""
+        query = f"SELECT {self._columns(columns)} FROM {quote(table)} l"
+        if percent is not None:
+            query = SAMPLE_QUERY.format(
+                columns=self._columns(columns),
+                table=quote(table),
+                percent=f"{min(max(percent, 0.0), 100.0):.6f}",
+            )
+        result = await self.session.execute(text(query))
+        return [tuple(row) for row in result.all()]
+
+    async def sample_changed(
+        self, table: str, columns: List[str], key: str, fraction: float
+    ) -> List[tuple]:
+        """
+        Values of `columns` of a `fraction` of the rows the last `apply_diff` of
+        the transaction inserted or updated.
+        """
+        result = await self.session.execute(
+            text(
+                CHANGED_QUERY.format(
+                    columns=self._columns(columns), table=quote(table), key=quote(key)
+                )
+            ),
+            {"fraction": fraction},
+        )
+        return [tuple(row) for row in result.all()]
+
+    async def upsert(self, values: dict) -> None:
+        """Insert or replace the statistics row of `values["datasource_id"]`."""
+        statement = postgresql.insert(DatasourceStats).values(**values)
+        await self.session.execute(
+            statement.on_conflict_do_update(
+                index_elements=["datasource_id"],
+                set_={k: statement.excluded[k] for k in values if k != "datasource_id"},
+            )
+        )
+
+
+class DatasourceUploadRepository(BaseRepository[DatasourceUpload]):
+    """Repository for resumable uploads."""
+
+    async def lock(self, upload_id: int) -> Optional[DatasourceUpload]:
+        """
+        The upload, locked until the transaction ends; raises DBAPIError
+        (LockNotAvailable) while another request holds it.
+        """
+        result = await self.session.exec(
+            select(DatasourceUpload)
+            .where(DatasourceUpload.id == upload_id)
+            .with_for_update(nowait=True)
+        )
+        return result.first()
+
+    async def claim(
+        self,
+        upload_id: int,
+        offset: int,
+        lock_token: str,
+        now: datetime,
+        locked_until: datetime,
+    ) -> bool:
+        """
+        Lease an open upload still at `offset` to `lock_token`; False while
+        another request holds an unexpired lease (or the upload moved on).
+        """
+        result = await self.session.execute(
+            update(DatasourceUpload)
+            .where(
+                DatasourceUpload.id == upload_id,
+                DatasourceUpload.offset == offset,
+                DatasourceUpload.finalized_at.is_(None),
+                or_(
+                    DatasourceUpload.locked_until.is_(None),
+                    DatasourceUpload.locked_until <= now,
+                ),
+            )
+            .values(lock_token=lock_token, locked_until=locked_until)
+            .execution_options(synchronize_session=False)
+        )
+        return result.rowcount > 0
+
+    async def save_leased(self, upload_id: int, lock_token: str, values: dict) -> bool:
+        """Update an upload leased to `lock_token`; False once the lease is lost."""
+        result = await self.session.execute(
+            update(DatasourceUpload)
+            .where(
+                DatasourceUpload.id == upload_id,
+                DatasourceUpload.lock_token == lock_token,
+            )
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        return result.rowcount > 0
+
+    async def count_active(self, user_id: int, now: datetime) -> int:
+        result = await self.session.exec(
+            select(func.count())
+            .select_from(DatasourceUpload)
+            .where(
+                DatasourceUpload.created_by_id == user_id,
+                DatasourceUpload.finalized_at.is_(None),
+                DatasourceUpload.expires_at > now,
+            )
+        )
+        return result.one()
+
+    async def get_expired(self, now: datetime) -> List[DatasourceUpload]:
+        """Expired uploads never loaded, unfinished or whose ingest job failed."""
+        result = await self.session.exec(
+            select(DatasourceUpload).where(
+                DatasourceUpload.datasource_id.is_(None),
+                DatasourceUpload.expires_at <= now,
+            )
+        )
+        return list(result.all())
@@ -0,0 +1,114 @@
+from datetime import datetime
+from typing import Any, List, Literal, Optional, Tuple
+
+from pydantic import BaseModel, ConfigDict, Field
+
+
+class DatasourceRead(BaseModel):
+    id: int
+    name: str
+    geometry_column: str
+    srid: int
+    feature_count: int
+    columns: List[str]
+    ingest_seconds: Optional[float]
+    optimize_seconds: Optional[float] = None
+    sample_tile: Optional[str] = None
+    tile_ms_before: Optional[float] = None
+    tile_ms_after: Optional[float] = None
+    archive_built_at: Optional[datetime] = None
+    created_at: datetime
+    created_by_id: Optional[int]
+    model_config = ConfigDict(from_attributes=True)
+
+
+class DatasourceUpdateRead(DatasourceRead):
+    """A datasource after an update, with the features it changed."""
+
+    inserted: int
+    updated: int
+    deleted: int
+    update_seconds: float
+
+
+class DatasourceArchiveCreate(BaseModel):
+    """Zoom range of a PMTiles archive (`datasource_pmtiles_max_zoom` at most)."""
+
+    min_zoom: int = Field(default=0, ge=0)
+    max_zoom: Optional[int] = Field(default=None, ge=0)
+
+
+class ValueCount(BaseModel):
+    value: Any
+    count: int
+
+
+class HistogramBin(BaseModel):
+    min: float
+    max: float
+    count: int
+
+
+class ColumnStatsRead(BaseModel):
+    """
+    Estimated statistics of a column: counts scaled up from the sample, `distinct`
+    values seen in the sample (HyperLogLog), `top` its most frequent values and
+    their scaled counts. Numeric columns
+    also have a range, mean, `quantiles` (equal-count class breaks, minimum to
+    maximum) and an equal-interval histogram.
+    """
+
+    name: str
+    type: str
+    count: int
+    nulls: int
+    distinct: int
+    top: List[ValueCount]
+    min: Optional[float] = None
+    max: Optional[float] = None
+    mean: Optional[float] = None
+    quantiles: List[float] = []
+    histogram: List[HistogramBin] = []
+
+
+class DatasourceStatsRead(BaseModel):
+    datasource_id: int
+    feature_count: int
+    sampled_rows: int
+    changed_rows: int
+    columns: List[ColumnStatsRead]
+    computed_at: datetime
+    refreshed_at: datetime
+    model_config = ConfigDict(from_attributes=True)
+
+
+class DatasourceUploadCreate(BaseModel):
+    name: str
+    length: int = Field(gt=0)
+    format: Literal["geojson", "file"] = "file"
+    layer: Optional[str] = None
+    srid: Optional[int] = Field(default=None, gt=0)
+    # "<algorithm> <base64 digest>" of the whole file (sha256, sha1 or md5)
+    checksum: Optional[str] = None
+    # Updates the existing datasource `name`, its features matched on this column
+    update_key: Optional[str] = None
+    # Loads the features of a FlatGeobuf intersecting (min_x, min_y, max_x, max_y)
+    bbox: Optional[Tuple[float, float, float, float]] = None
+
+
+class DatasourceUploadRead(BaseModel):
+    id: int
+    name: str
+    format: str
+    layer: Optional[str]
+    srid: Optional[int]
+    update_key: Optional[str] = None
+    bbox: Optional[Tuple[float, float, float, float]] = None
+    length: int
+    offset: int
+    datasource_id: Optional[int]
+    expires_at: datetime
+    finalized_at: Optional[datetime]
+    created_at: datetime
+    created_by_id: Optional[int]
+    model_config = ConfigDict(from_attributes=True)
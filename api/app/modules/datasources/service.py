@@ -0,0 +1,671 @@
+"""
+Datasource loads.
+
+Uploads are spooled to disk by `uploads` (in one request, or resumable), then
+loaded by an ingest job. A GeoJSON file is parsed as it is read and written with
+binary COPY in batches of `datasource_ingest_batch_size` features, so memory
+does not grow with the file and the ingest runs at COPY speed. The table, its dirty-region
+triggers and its in-API engine configuration are committed together: Martin only
+discovers tables at startup, the engine serves the new datasource right away.
+Its extent and attribute statistics (see `stats`) are computed after the commit.
+
+Loaded tables are reordered, indexed and analyzed before they are published
+(see `optimize`).
+
+The feature ranges of zipped Shapefiles, GeoPackages, FlatGeobuf and GeoParquet
+files are encoded in a process pool and copied in parallel into an UNLOGGED staging table, swapped in as the datasource table once
+complete (see `parallel`). A FlatGeobuf file can be loaded partially, the
+features of a bbox read through its spatial index.
+
+An upload can also update an existing datasource, its features matched on a key
+column: it is staged the same way, then only the differences (features whose
+geometry and attributes hash differently, new ones, missing ones) are applied to
+the datasource table in one transaction. Readers keep reading the table while it
+runs, and the dirty-region triggers log the boxes of the changed rows only. The
+changed rows are folded into the datasource statistics and grow its extent in
+the same transaction. The datasource row stays locked while an update runs: a
+concurrent one is refused.
+
+Staging tables get unique names under a prefix datasource names may not start
+with, so a load or an update never touches another table.
+"""
+
+import asyncio
+import re
+import shutil
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from typing import Annotated, AsyncIterator, Callable, List, Optional, Tuple
+
+import psycopg
+from fastapi import Depends
+from sqlalchemy.exc import DBAPIError
+
+from app.core.config import Settings, get_settings
+from app.core.database import SessionDep, get_engine
+from app.core.exceptions import (
+    DomainException,
+    DuplicateEntityException,
+    EntityNotFoundException,
+    PermissionDeniedException,
+)
+from app.core.logging_config import logger
+from app.core.permissions import has_any_role
+from app.core.utils.geojson import FeatureParser, GeoJSONError
+from app.modules.datasources.ingest import GEOMETRY_COLUMN, ID_COLUMN, FeatureWriter
+from app.modules.datasources.layers import Layer, LayerError, open_layer
+from app.modules.datasources.models import Datasource
+from app.modules.datasources.optimize import TableOptimizer
+from app.modules.datasources.parallel import copy_ranges, ingest_pool
+from app.modules.datasources.repository import DatasourceRepository
+from app.modules.datasources.schemas import (
+    DatasourceRead,
+    DatasourceStatsRead,
+    DatasourceUpdateRead,
+)
+from app.modules.datasources.stats import (
+    DatasourceStatsService,
+    DatasourceStatsServiceDep,
+)
+from app.modules.maps.service import MapService
+from app.modules.proxy.engine import TileEngine, tile_engine
+from app.modules.proxy.extent import TileExtentService, TileExtentServiceDep
+from app.modules.proxy.models import TileDirtyRegion, TileEngineSource
+from app.modules.proxy.repository import (
+    DirtyRegionRepository,
+    TileEngineSourceRepository,
+)
+from app.modules.users.models import UserRole
+from app.modules.users.schemas import UserDetail
+
+# Lowercase, unquoted PostgreSQL identifiers, also valid tile source ids.
+NAME_PATTERN = re.compile(r"^[a-z_][a-z0-9_]{0,62}$")
+# Prefix of staging tables, refused as a datasource name.
+STAGING_PREFIX = "_stg_"
+READ_SIZE = 1024 * 1024
+
+Bbox = Tuple[float, float, float, float]
+
+
+def parse_bbox(value: Optional[str]) -> Optional[Bbox]:
+    """A "min_x,min_y,max_x,max_y" bbox."""
+    if value is None:
+        return None
+    try:
+        min_x, min_y, max_x, max_y = (float(part) for part in value.split(","))
+    except ValueError:
+        raise DomainException(key="datasource.invalid_bbox")
+    return min_x, min_y, max_x, max_y
+
+
+async def read_chunks(path: str) -> AsyncIterator[bytes]:
+    with open(path, "rb") as file:
+        while chunk := await asyncio.to_thread(file.read, READ_SIZE):
+            yield chunk
+
+
+def staging_table(datasource_id: Optional[int] = None) -> str:
+    """Unique name of a staging table, of a new datasource or an update of one."""
+    owner = "new" if datasource_id is None else str(datasource_id)
+    return f"{STAGING_PREFIX}{owner}_{uuid.uuid4().hex}"
+
+
+class DatasourceService:
+    def __init__(
+        self,
+        repository: DatasourceRepository,
+        settings: Settings,
+        extents: TileExtentService,
+        stats: DatasourceStatsService,
+        engine: TileEngine | None = None,
+    ):
+        self.repository = repository
+        self.settings = settings
+        self.extents = extents
+        self.stats = stats
+        self.engine = engine or tile_engine
+
+    def _ensure_can_load(self, current_user: UserDetail) -> None:
+        if not has_any_role(current_user, [UserRole.ADMIN, UserRole.LOAD_DATA]):
+            raise PermissionDeniedException(
+                params={"detail": "datasource.upload_permission_denied"}
+            )
+
+    async def ensure_can_create(self, name: str, current_user: UserDetail) -> None:
+        self._ensure_can_load(current_user)
+        if not NAME_PATTERN.match(name) or name.startswith(STAGING_PREFIX):
+            raise DomainException(key="datasource.invalid_name", params={"name": name})
+        if await self.repository.get_by_name(
+            name
+        ) or await self.repository.table_exists(name):
+            raise DuplicateEntityException(
+                key="datasource.name_exists", params={"name": name}
+            )
+
+    def _ensure_owner(
+        self, datasource: Optional[Datasource], current_user: UserDetail
+    ) -> None:
+        if datasource is None:
+            raise EntityNotFoundException(
+                entity="Datasource", key="datasource.not_found"
+            )
+        if (
+            not has_any_role(current_user, [UserRole.ADMIN])
+            and datasource.created_by_id != current_user.id
+        ):
+            raise PermissionDeniedException(
+                params={"detail": "datasource.read_permission_denied"}
+            )
+
+    async def ensure_can_update(
+        self, name: str, key: str, current_user: UserDetail
+    ) -> Datasource:
+        """The datasource `name`, if the user may update it matching on `key`."""
+        self._ensure_can_load(current_user)
+        datasource = await self.repository.get_by_name(name)
+        self._ensure_owner(datasource, current_user)
+        if key not in datasource.columns:
+            raise DomainException(
+                key="datasource.update_invalid_key", params={"key": key}
+            )
+        return datasource
+
+    async def _lock(self, datasource: Datasource) -> Datasource:
+        """
+        Lock the row of a datasource being updated until the transaction ends,
+        read again; refused while another update holds it.
+        """
+        try:
+            return await self.repository.lock(datasource.id)
+        except DBAPIError as e:
+            await self.repository.session.rollback()
+            if isinstance(e.orig, psycopg.errors.LockNotAvailable):
+                raise DomainException(
+                    key="datasource.update_busy", params={"name": datasource.name}
+                )
+            raise
+
+    async def get_datasource(
+        self, datasource_id: int, current_user: UserDetail
+    ) -> DatasourceRead:
+        datasource = await self.repository.get(datasource_id)
+        self._ensure_owner(datasource, current_user)
+        return DatasourceRead.model_validate(datasource)
+
+    async def get_map_datasource(
+        self, datasource_id: int, current_user: UserDetail, maps: MapService
+    ) -> DatasourceRead:
+        """
+        A datasource of its owner or an admin, or of a user who can view a map
+        whose style uses it (identify and inspect tools of that map).
+        """
+        datasource = await self.repository.get(datasource_id)
+        try:
+            self._ensure_owner(datasource, current_user)
+        except PermissionDeniedException:
+            if not await maps.can_view_datasource(datasource.name, current_user):
+                raise
+        return DatasourceRead.model_validate(datasource)
+
+    async def get_stats(
+        self, datasource_id: int, current_user: UserDetail
+    ) -> DatasourceStatsRead:
+        """Attribute statistics of a datasource (see `stats`)."""
+        datasource = await self.repository.get(datasource_id)
+        self._ensure_owner(datasource, current_user)
+        try:
+            return await self.stats.get_stats(datasource)
+        except DBAPIError:
+            await self.repository.session.rollback()
+            logger.exception(f"Statistics of datasource {datasource.name} failed")
+            raise DomainException(
+                key="datasource.stats_failed", params={"name": datasource.name}
+            )
+
+    async def _ingest(
+        self,
+        name: str,
+        chunks: AsyncIterator[bytes],
+        progress: Optional[Callable[[int], None]],
+    ) -> FeatureWriter:
+        parser = FeatureParser(self.settings.datasource_ingest_max_feature_bytes)
+        writer = FeatureWriter(await self.repository.driver_connection(), name)
+        batch_size = self.settings.datasource_ingest_batch_size
+        batch = []
+        async for chunk in chunks:
+            batch += parser.feed(chunk)
+            if len(batch) >= batch_size:
+                await writer.write(batch, parser.srid)
+                if progress is not None:
+                    progress(len(batch))
+                batch = []
+        batch += parser.close()
+        await writer.write(batch, parser.srid)
+        if progress is not None:
+            progress(len(batch))
+        return writer
+
+    async def _publish(self, name: str, srid: int, columns: List[str]) -> None:
+        """Register a new table for tile invalidation and the in-API engine."""
+        session = self.repository.session
+        await DirtyRegionRepository(session, TileDirtyRegion).install_triggers(
+            name,
+            GEOMETRY_COLUMN,
+            name,
+            self.settings.tile_invalidation_trigger_max_rows,
+        )
+        if self.settings.tile_engine_enabled:
+            await TileEngineSourceRepository(session, TileEngineSource).upsert(
+                {
+                    "datasource": name,
+                    "table_name": name,
+                    "geometry_column": GEOMETRY_COLUMN,
+                    "srid": srid,
+                    "id_column": ID_COLUMN,
+                    "columns": columns,
+                }
+            )
+
+    async def load_geojson(
+        self,
+        name: str,
+        path: str,
+        current_user: UserDetail,
+        progress: Optional[Callable[[int], None]] = None,
+    ) -> DatasourceRead:
+        """
+        Load a GeoJSON FeatureCollection file into a new table `name`, streamed.
+        `progress` is called with the number of features of each batch written.
+        """
+        await self.ensure_can_create(name, current_user)
+
+        started_at = time.monotonic()
+        session = self.repository.session
+        # Staged in the transaction recording the datasource: dropped on failure.
+        staging = staging_table()
+        try:
+            writer = await self._ingest(staging, read_chunks(path), progress)
+            optimizer = TableOptimizer(self.repository, self.settings)
+            await optimizer.prepare(staging, writer.srid, writer.schema.names)
+            await optimizer.publish(staging, name)
+            optimized = await optimizer.finish(name, writer.srid, writer.schema.names)
+            await self._publish(name, writer.srid, writer.schema.names)
+            datasource = await self.repository.create(
+                Datasource.add_audit_info(
+                    {
+                        "name": name,
+                        "geometry_column": GEOMETRY_COLUMN,
+                        "srid": writer.srid,
+                        "feature_count": writer.count,
+                        "columns": writer.schema.names,
+                        "ingest_seconds": time.monotonic() - started_at,
+                        **optimized,
+                    },
+                    current_user.id,
+                )
+            )
+            await session.commit()
+        except GeoJSONError as e:
+            await session.rollback()
+            raise DomainException(
+                key="datasource.invalid_geojson", params={"detail": str(e)}
+            )
+        except (psycopg.Error, DBAPIError) as e:
+            await session.rollback()
+            logger.warning(f"Ingest of datasource {name} failed: {e}")
+            raise DomainException(key="datasource.ingest_failed", params={"name": name})
+
+        return await self._loaded(datasource)
+
+    async def _compute_stats(self, datasource: Datasource) -> None:
+        try:
+            await self.stats.compute(datasource)
+        except DBAPIError:
+            # Computed on the first read instead.
+            await self.repository.session.rollback()
+            logger.exception(f"Statistics of datasource {datasource.name} failed")
+
+    async def _loaded(self, datasource: Datasource) -> DatasourceRead:
+        """Serve a committed datasource, compute its extent and statistics."""
+        if self.settings.tile_engine_enabled:
+            self.engine.expire()
+        if self.settings.tile_extent_enabled:
+            try:
+                await self.extents.compute(datasource.name)
+            except DBAPIError:
+                # Tiles are served without the extent shortcut until recomputed.
+                await self.repository.session.rollback()
+                logger.exception(f"Extent of datasource {datasource.name} failed")
+        if self.settings.datasource_stats_enabled:
+            await self._compute_stats(datasource)
+        return DatasourceRead.model_validate(datasource)
+
+    async def load_file(
+        self,
+        name: str,
+        path: str,
+        current_user: UserDetail,
+        layer: Optional[str] = None,
+        srid: Optional[int] = None,
+        progress: Optional[Callable[[int], None]] = None,
+        bbox: Optional[Bbox] = None,
+    ) -> DatasourceRead:
+        """
+        Load a layer of a zipped Shapefile, a GeoPackage, a FlatGeobuf or a
+        GeoParquet file into a new table `name`, its feature ranges read and
+        copied in parallel; `bbox` keeps the features of a FlatGeobuf it covers.
+        `progress` is called with the number of features of each range copied.
+        """
+        await self.ensure_can_create(name, current_user)
+        started_at = time.monotonic()
+        directory = tempfile.mkdtemp(
+            prefix="upload-", dir=self.settings.datasource_upload_directory
+        )
+        try:
+            source = await self._open_layer(path, directory, layer, srid, bbox)
+            return await self._ingest_layer(
+                name, source, current_user, started_at, progress
+            )
+        finally:
+            await asyncio.to_thread(shutil.rmtree, directory, True)
+
+    async def _open_layer(
+        self,
+        path: str,
+        directory: str,
+        layer: Optional[str],
+        srid: Optional[int],
+        bbox: Optional[Bbox] = None,
+    ) -> Layer:
+        if bbox is not None and not (bbox[0] <= bbox[2] and bbox[1] <= bbox[3]):
+            raise DomainException(key="datasource.invalid_bbox")
+        try:
+            source = await asyncio.to_thread(
+                open_layer,
+                path,
+                directory,
+                layer,
+                self.settings.datasource_ingest_range_size,
+                bbox,
+            )
+        except LayerError as e:
+            raise DomainException(
+                key="datasource.invalid_file", params={"detail": str(e)}
+            )
+        source.srid = srid or source.srid
+        if source.srid is None:
+            raise DomainException(
+                key="datasource.unknown_srid", params={"layer": source.name}
+            )
+        return source
+
+    async def _ingest_layer(
+        self,
+        name: str,
+        source: Layer,
+        current_user: UserDetail,
+        started_at: float,
+        progress: Optional[Callable[[int], None]],
+    ) -> DatasourceRead:
+        session = self.repository.session
+        staging = staging_table()
+        # Committed: the parallel COPY connections must see the staging table.
+        await self.repository.create_staging(staging, source.srid, source.columns)
+        await session.commit()
+        workers = self.settings.datasource_ingest_workers
+        columns = [column for column, _ in source.columns]
+        try:
+            count = await copy_ranges(
+                get_engine(),
+                ingest_pool.get(workers),
+                source,
+                staging,
+                workers,
+                progress,
+            )
+            optimizer = TableOptimizer(self.repository, self.settings)
+            await optimizer.prepare(staging, source.srid, columns)
+            await optimizer.publish(staging, name)
+            optimized = await optimizer.finish(name, source.srid, columns)
+            await self._publish(name, source.srid, columns)
+            datasource = await self.repository.create(
+                Datasource.add_audit_info(
+                    {
+                        "name": name,
+                        "geometry_column": GEOMETRY_COLUMN,
+                        "srid": source.srid,
+                        "feature_count": count,
+                        "columns": columns,
+                        "ingest_seconds": time.monotonic() - started_at,
+                        **optimized,
+                    },
+                    current_user.id,
+                )
+            )
+            await session.commit()
+        except asyncio.CancelledError:
+            # The ingest job was cancelled: its staging table goes too.
+            await asyncio.shield(self._discard(staging))
+            raise
+        except (LayerError, psycopg.Error, DBAPIError) as e:
+            await self._discard(staging)
+            if isinstance(e, LayerError):
+                raise DomainException(
+                    key="datasource.invalid_file", params={"detail": str(e)}
+                )
+            logger.warning(f"Ingest of datasource {name} failed: {e}")
+            raise DomainException(key="datasource.ingest_failed", params={"name": name})
+        return await self._loaded(datasource)
+
+    async def _discard(self, staging: str) -> None:
+        session = self.repository.session
+        await session.rollback()
+        await self.repository.drop_table(staging)
+        await session.commit()
+
+    async def _apply_update(
+        self,
+        datasource: Datasource,
+        staging: str,
+        key: str,
+        srid: int,
+        columns: List[str],
+        count: int,
+        current_user: UserDetail,
+        started_at: float,
+    ) -> DatasourceUpdateRead:
+        """Apply the differences between a staged upload and its datasource."""
+        if count == 0:
+            raise DomainException(key="datasource.update_empty")
+        if key not in columns:
+            raise DomainException(
+                key="datasource.update_invalid_key", params={"key": key}
+            )
+        unknown = [name for name in columns if name not in datasource.columns]
+        if unknown:
+            raise DomainException(
+                key="datasource.update_unknown_columns",
+                params={"columns": ", ".join(unknown)},
+            )
+        if await self.repository.duplicate_key(staging, key):
+            raise DomainException(
+                key="datasource.update_duplicate_key", params={"key": key}
+            )
+
+        types = await self.repository.column_types(datasource.name)
+        counts = await self.repository.apply_diff(
+            datasource.name,
+            staging,
+            key,
+            datasource.srid,
+            {name: types[name] for name in datasource.columns},
+            columns,
+        )
+        await self.repository.drop_table(staging)
+        if self.settings.tile_extent_enabled and counts["inserted"] + counts["updated"]:
+            await self.extents.extend(datasource.name, key)
+        updated = await self.repository.update(
+            datasource.id,
+            {
+                "feature_count": datasource.feature_count
+                + counts["inserted"]
+                - counts["deleted"],
+                "updated_at": datetime.utcnow(),
+                "updated_by_id": current_user.id,
+            },
+        )
+        folded = self.settings.datasource_stats_enabled and await self.stats.fold(
+            updated, key, counts
+        )
+        await self.repository.session.commit()
+        logger.info(f"Datasource {datasource.name} updated: {counts}")
+        if self.settings.datasource_stats_enabled and not folded:
+            await self._compute_stats(updated)
+        return DatasourceUpdateRead(
+            **DatasourceRead.model_validate(updated).model_dump(),
+            **counts,
+            update_seconds=time.monotonic() - started_at,
+        )
+
+    async def load_geojson_update(
+        self,
+        name: str,
+        key: str,
+        path: str,
+        current_user: UserDetail,
+        progress: Optional[Callable[[int], None]] = None,
+    ) -> DatasourceUpdateRead:
+        """
+        Update the datasource `name` to the features of a GeoJSON
+        FeatureCollection file, matched on the `key` column. `progress` is
+        called with the number of features of each batch staged.
+        """
+        datasource = await self.ensure_can_update(name, key, current_user)
+        started_at = time.monotonic()
+        session = self.repository.session
+        datasource = await self._lock(datasource)
+        # Staged in the transaction applying the update: dropped on failure.
+        staging = staging_table(datasource.id)
+        try:
+            writer = await self._ingest(staging, read_chunks(path), progress)
+            return await self._apply_update(
+                datasource,
+                staging,
+                key,
+                writer.srid,
+                writer.schema.names,
+                writer.count,
+                current_user,
+                started_at,
+            )
+        except GeoJSONError as e:
+            await session.rollback()
+            raise DomainException(
+                key="datasource.invalid_geojson", params={"detail": str(e)}
+            )
+        except DomainException:
+            await session.rollback()
+            raise
+        except (psycopg.Error, DBAPIError) as e:
+            await session.rollback()
+            logger.warning(f"Update of datasource {name} failed: {e}")
+            raise DomainException(key="datasource.update_failed", params={"name": name})
+
+    async def load_update(
+        self,
+        name: str,
+        key: str,
+        path: str,
+        current_user: UserDetail,
+        layer: Optional[str] = None,
+        srid: Optional[int] = None,
+        progress: Optional[Callable[[int], None]] = None,
+        bbox: Optional[Bbox] = None,
+    ) -> DatasourceUpdateRead:
+        """
+        Update the datasource `name` to a layer of a file read like with
+        `load_file`, matched on the `key` column.
+        """
+        datasource = await self.ensure_can_update(name, key, current_user)
+        started_at = time.monotonic()
+        directory = tempfile.mkdtemp(
+            prefix="upload-", dir=self.settings.datasource_upload_directory
+        )
+        try:
+            source = await self._open_layer(path, directory, layer, srid, bbox)
+            return await self._update_layer(
+                datasource, key, source, current_user, started_at, progress
+            )
+        finally:
+            await asyncio.to_thread(shutil.rmtree, directory, True)
+
+    async def _update_layer(
+        self,
+        datasource: Datasource,
+        key: str,
+        source: Layer,
+        current_user: UserDetail,
+        started_at: float,
+        progress: Optional[Callable[[int], None]],
+    ) -> DatasourceUpdateRead:
+        name = datasource.name
+        staging = staging_table(datasource.id)
+        # Committed: the parallel COPY connections must see the staging table.
+        await self.repository.create_staging(staging, source.srid, source.columns)
+        await self.repository.session.commit()
+        workers = self.settings.datasource_ingest_workers
+        try:
+            # Held while the ranges are copied, until the update commits.
+            datasource = await self._lock(datasource)
+            count = await copy_ranges(
+                get_engine(),
+                ingest_pool.get(workers),
+                source,
+                staging,
+                workers,
+                progress,
+            )
+            return await self._apply_update(
+                datasource,
+                staging,
+                key,
+                source.srid,
+                [column for column, _ in source.columns],
+                count,
+                current_user,
+                started_at,
+            )
+        except asyncio.CancelledError:
+            await asyncio.shield(self._discard(staging))
+            raise
+        except DomainException:
+            await self._discard(staging)
+            raise
+        except (LayerError, psycopg.Error, DBAPIError) as e:
+            await self._discard(staging)
+            if isinstance(e, LayerError):
+                raise DomainException(
+                    key="datasource.invalid_file", params={"detail": str(e)}
+                )
+            logger.warning(f"Update of datasource {name} failed: {e}")
+            raise DomainException(key="datasource.update_failed", params={"name": name})
+
+
+# Dependencies
+SettingsDep = Annotated[Settings, Depends(get_settings)]
+
+
+def get_datasource_service(
+    session: SessionDep,
+    settings: SettingsDep,
+    extents: TileExtentServiceDep,
+    stats: DatasourceStatsServiceDep,
+) -> DatasourceService:
+    return DatasourceService(
+        DatasourceRepository(session, Datasource), settings, extents, stats
+    )
+
+
+DatasourceServiceDep = Annotated[DatasourceService, Depends(get_datasource_service)]
@@ -0,0 +1,286 @@
+"""
+Attribute statistics of datasources, for the style editor.
+
+After a datasource is loaded, about `datasource_stats_sample_rows` of its
+features are read with TABLESAMPLE SYSTEM (the whole table when smaller) and
+every column is sketched: a HyperLogLog of its distinct values, a Space-Saving
+counter of its most frequent ones and, for numeric columns, a reservoir sample
+answering quantiles and histograms. The summary and the sketches are stored in
+`datasource_stats`, and reads serve the stored summary without touching the
+table.
+
+An update folds a sample of the rows it inserted or changed, at the same rate,
+into the sketches before it commits. Sketches cannot forget: the previous values
+of updated and deleted rows stay counted until the datasource is sampled again,
+once updates changed `datasource_stats_rebuild_ratio` of its features.
+
+SYSTEM sampling picks whole blocks, and optimized tables are ordered along a
+Hilbert curve: the sample is spatially clustered, so attributes that vary with
+location are estimated more coarsely than the sample size suggests.
+"""
+
+import json
+import math
+from datetime import datetime
+from decimal import Decimal
+from typing import Annotated, Any, Dict, List, Optional
+
+from fastapi import Depends
+
+from app.core.config import Settings, get_settings
+from app.core.database import SessionDep
+from app.core.sketches import HyperLogLog, Reservoir, TopK
+from app.modules.datasources.models import Datasource, DatasourceStats
+from app.modules.datasources.repository import (
+    DatasourceRepository,
+    DatasourceStatsRepository,
+)
+from app.modules.datasources.schemas import DatasourceStatsRead
+
+NUMERIC_TYPES = {"smallint", "integer", "bigint", "real", "double precision", "numeric"}
+# Numeric values kept for quantiles and histograms, per column.
+RESERVOIR_SIZE = 4096
+# Counters of the most frequent values, per value returned.
+TOP_CAPACITY_FACTOR = 4
+
+
+class ColumnSketch:
+    """Sketches of the values of one column."""
+
+    def __init__(self, column_type: str, capacity: int):
+        self.type = column_type
+        self.numeric = column_type.split("(")[0] in NUMERIC_TYPES
+        self.count = 0
+        self.nulls = 0
+        self.distinct = HyperLogLog()
+        self.top = TopK(capacity)
+        self.values = Reservoir(RESERVOIR_SIZE)
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def add(self, value: Any) -> None:
+        if isinstance(value, Decimal):
+            value = float(value)
+        # NaN and infinities have no JSON form: counted as nulls.
+        if value is None or (isinstance(value, float) and not math.isfinite(value)):
+            self.nulls += 1
+            return
+        self.count += 1
+        if self.numeric:
+            number = float(value)
+            self.values.add(number)
+            self.total += number
+            self.min = number if self.min is None else min(self.min, number)
+            self.max = number if self.max is None else max(self.max, number)
+        elif not isinstance(value, str):
+            # Booleans and JSON, as their JSON text.
+            value = json.dumps(value, sort_keys=True)
+        self.distinct.add(str(value))
+        self.top.add(value)
+
+    def summary(self, name: str, scale: float, top_values: int, bins: int) -> dict:
+        """Statistics of the column, counts scaled from the sample by `scale`."""
+        count = round(self.count * scale)
+        summary = {
+            "name": name,
+            "type": self.type,
+            "count": count,
+            "nulls": round(self.nulls * scale),
+            "distinct": min(self.distinct.count(), self.count),
+            "top": [
+                {"value": value, "count": round(seen * scale)}
+                for value, seen, _ in self.top.top(top_values)
+            ],
+        }
+        if not self.numeric or self.min is None:
+            return summary
+        summary.update(
+            min=self.min,
+            max=self.max,
+            mean=self.total / self.count,
+            quantiles=[self.values.quantile(i / bins) for i in range(bins + 1)],
+            histogram=self._histogram(count, bins),
+        )
+        return summary
+
+    def _histogram(self, count: int, bins: int) -> List[dict]:
+        """`bins` equal intervals between min and max, counted on the reservoir."""
+        if self.min == self.max:
+            return [{"min": self.min, "max": self.max, "count": count}]
+        width = (self.max - self.min) / bins
+        counts = [0] * bins
+        for value in self.values.items:
+            counts[min(int((value - self.min) / width), bins - 1)] += 1
+        weight = count / len(self.values.items)
+        return [
+            {
+                "min": self.min + i * width,
+                "max": self.min + (i + 1) * width,
+                "count": round(n * weight),
+            }
+            for i, n in enumerate(counts)
+        ]
+
+    def to_dict(self) -> dict:
+        return {
+            "type": self.type,
+            "count": self.count,
+            "nulls": self.nulls,
+            "distinct": self.distinct.to_dict(),
+            "top": self.top.to_dict(),
+            "values": self.values.to_dict(),
+            "total": self.total,
+            "min": self.min,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ColumnSketch":
+        sketch = cls(data["type"], data["top"]["capacity"])
+        sketch.count = data["count"]
+        sketch.nulls = data["nulls"]
+        sketch.distinct = HyperLogLog.from_dict(data["distinct"])
+        sketch.top = TopK.from_dict(data["top"])
+        sketch.values = Reservoir.from_dict(data["values"])
+        sketch.total = data["total"]
+        sketch.min = data["min"]
+        sketch.max = data["max"]
+        return sketch
+
+
+class DatasourceStatsService:
+    def __init__(
+        self,
+        repository: DatasourceStatsRepository,
+        tables: DatasourceRepository,
+        settings: Settings,
+    ):
+        self.repository = repository
+        self.tables = tables
+        self.settings = settings
+
+    def _fraction(self, feature_count: int) -> float:
+        """Fraction of the features sampled."""
+        if feature_count <= self.settings.datasource_stats_sample_rows:
+            return 1.0
+        return self.settings.datasource_stats_sample_rows / feature_count
+
+    def _sketch(
+        self, sketches: Dict[str, ColumnSketch], rows: List[tuple]
+    ) -> Dict[str, ColumnSketch]:
+        for row in rows:
+            for sketch, value in zip(sketches.values(), row):
+                sketch.add(value)
+        return sketches
+
+    def _values(
+        self,
+        datasource: Datasource,
+        sketches: Dict[str, ColumnSketch],
+        sampled_rows: int,
+        **values: Any,
+    ) -> dict:
+        feature_count = datasource.feature_count
+        scale = feature_count / sampled_rows if sampled_rows else 0.0
+        return {
+            "datasource_id": datasource.id,
+            "feature_count": feature_count,
+            "sampled_rows": sampled_rows,
+            "columns": [
+                sketch.summary(
+                    name,
+                    scale,
+                    self.settings.datasource_stats_top_values,
+                    self.settings.datasource_stats_histogram_bins,
+                )
+                for name, sketch in sketches.items()
+            ],
+            "sketches": {name: sketch.to_dict() for name, sketch in sketches.items()},
+            "refreshed_at": datetime.utcnow(),
+            **values,
+        }
+
+    async def compute(self, datasource: Datasource) -> DatasourceStatsRead:
+        """(Re)compute and store the statistics of a datasource from a sample."""
+        types = await self.tables.column_types(datasource.name)
+        capacity = self.settings.datasource_stats_top_values * TOP_CAPACITY_FACTOR
+        sketches = {
+            name: ColumnSketch(types[name], capacity) for name in datasource.columns
+        }
+        fraction = self._fraction(datasource.feature_count)
+        rows = await self.repository.sample(
+            datasource.name, list(sketches), fraction * 100 if fraction < 1 else None
+        )
+        values = self._values(
+            datasource,
+            self._sketch(sketches, rows),
+            len(rows),
+            changed_rows=0,
+            computed_at=datetime.utcnow(),
+        )
+        await self.repository.upsert(values)
+        await self.repository.session.commit()
+        return DatasourceStatsRead(**values)
+
+    async def fold(
+        self, datasource: Datasource, key: str, counts: Dict[str, int]
+    ) -> bool:
+        """
+        Fold the rows an update of a datasource (matched on `key`) inserted or
+        changed into its statistics, in the update's transaction. False when they
+        should be computed again instead, after the commit.
+        """
+        stats = await self.repository.get_by_datasource(datasource.id)
+        if stats is None or set(stats.sketches) != set(datasource.columns):
+            return False
+        changed_rows = stats.changed_rows + sum(counts.values())
+        if changed_rows > (
+            self.settings.datasource_stats_rebuild_ratio * datasource.feature_count
+        ):
+            return False
+        sketches = {
+            name: ColumnSketch.from_dict(stats.sketches[name])
+            for name in datasource.columns
+        }
+        rows = await self.repository.sample_changed(
+            datasource.name,
+            list(sketches),
+            key,
+            self._fraction(datasource.feature_count),
+        )
+        await self.repository.upsert(
+            self._values(
+                datasource,
+                self._sketch(sketches, rows),
+                stats.sampled_rows + len(rows),
+                changed_rows=changed_rows,
+            )
+        )
+        return True
+
+    async def get_stats(self, datasource: Datasource) -> DatasourceStatsRead:
+        """Stored statistics of a datasource, computed if there are none."""
+        stats = await self.repository.get_by_datasource(datasource.id)
+        if stats is None:
+            return await self.compute(datasource)
+        return DatasourceStatsRead.model_validate(stats)
+
+
+# Dependencies
+SettingsDep = Annotated[Settings, Depends(get_settings)]
+
+
+def get_datasource_stats_service(
+    session: SessionDep, settings: SettingsDep
+) -> DatasourceStatsService:
+    return DatasourceStatsService(
+        DatasourceStatsRepository(session, DatasourceStats),
+        DatasourceRepository(session, Datasource),
+        settings,
+    )
+
+
+DatasourceStatsServiceDep = Annotated[
+    DatasourceStatsService, Depends(get_datasource_stats_service)
+]
@@ -0,0 +1,498 @@
+"""
+Resumable datasource uploads.
+
+A tus-like protocol: an upload is created with its length, its bytes are then
+appended by PATCH requests starting at the `Upload-Offset` they declare (with an
+optional `Upload-Checksum` of the chunk), and it is finalized once complete.
+Chunks are written straight into the spool file at their offset. A client cut
+off mid-chunk keeps what was written, unless the chunk carries a checksum, and
+resumes from the offset read back with HEAD. Finalizing queues a job (see
+`app.modules.jobs`) that checks the file and loads it like a direct upload, or
+updates the datasource with it when the upload has an `update_key`.
+
+A file can also be sent whole in one request (`upload`): it is spooled, then
+recorded as a finalized upload and queued the same way, so no request holds a
+connection, a staging table or a datasource lock while its body streams.
+
+Spool files live under `{datasource_upload_directory}/uploads`, which the API
+workers must share.
+"""
+
+import asyncio
+import base64
+import binascii
+import hashlib
+import os
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Annotated, AsyncIterator, Callable, Optional, Tuple
+
+import psycopg
+from fastapi import Depends
+from sqlalchemy.exc import DBAPIError
+from starlette.requests import ClientDisconnect
+
+from app.core.config import Settings, get_settings
+from app.core.database import SessionDep
+from app.core.exceptions import (
+    DomainException,
+    EntityNotFoundException,
+    PermissionDeniedException,
+)
+from app.core.permissions import has_any_role
+from app.modules.datasources.models import DatasourceUpload
+from app.modules.datasources.repository import DatasourceUploadRepository
+from app.modules.datasources.schemas import (
+    DatasourceRead,
+    DatasourceUploadCreate,
+    DatasourceUploadRead,
+)
+from app.modules.datasources.service import (
+    Bbox,
+    DatasourceService,
+    DatasourceServiceDep,
+)
+from app.modules.jobs.schemas import JobRead
+from app.modules.jobs.service import JobService, JobServiceDep
+from app.modules.users.models import UserRole
+from app.modules.users.schemas import UserDetail
+
+CHECKSUM_ALGORITHMS = ("sha256", "sha1", "md5")
+INGEST_UPLOAD = "datasource.ingest_upload"
+
+
+def parse_checksum(value: str) -> Tuple[str, bytes]:
+    """(algorithm, digest) of a "<algorithm> <base64 digest>" checksum."""
+    try:
+        algorithm, encoded = value.strip().split(" ", 1)
+        digest = base64.b64decode(encoded.strip(), validate=True)
+    except (ValueError, binascii.Error):
+        raise DomainException(key="datasource.upload_invalid_checksum")
+    if (
+        algorithm not in CHECKSUM_ALGORITHMS
+        or len(digest) != hashlib.new(algorithm).digest_size
+    ):
+        raise DomainException(key="datasource.upload_invalid_checksum")
+    return algorithm, digest
+
+
+def file_digest(path: str, algorithm: str) -> bytes:
+    with open(path, "rb") as file:
+        return hashlib.file_digest(file, algorithm).digest()
+
+
+def create_file(path: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, "wb").close()
+
+
+def remove_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class DatasourceUploadService:
+    def __init__(
+        self,
+        repository: DatasourceUploadRepository,
+        datasources: DatasourceService,
+        jobs: JobService,
+        settings: Settings,
+    ):
+        self.repository = repository
+        self.datasources = datasources
+        self.jobs = jobs
+        self.settings = settings
+
+    def _path(self, upload_id: int) -> str:
+        root = self.settings.datasource_upload_directory or tempfile.gettempdir()
+        return os.path.join(root, "uploads", str(upload_id))
+
+    def _expires_at(self, now: datetime) -> datetime:
+        return now + timedelta(hours=self.settings.datasource_upload_expire_hours)
+
+    async def _get(
+        self, upload_id: int, current_user: UserDetail, lock: bool = False
+    ) -> DatasourceUpload:
+        if lock:
+            try:
+                upload = await self.repository.lock(upload_id)
+            except DBAPIError as e:
+                await self.repository.session.rollback()
+                if isinstance(e.orig, psycopg.errors.LockNotAvailable):
+                    raise DomainException(key="datasource.upload_busy")
+                raise
+        else:
+            upload = await self.repository.get(upload_id)
+        if upload is None:
+            raise EntityNotFoundException(
+                entity="DatasourceUpload", key="datasource.upload_not_found"
+            )
+        if (
+            not has_any_role(current_user, [UserRole.ADMIN])
+            and upload.created_by_id != current_user.id
+        ):
+            raise PermissionDeniedException(
+                params={"detail": "datasource.read_permission_denied"}
+            )
+        if (
+            lock
+            and upload.locked_until is not None
+            and upload.locked_until > datetime.utcnow()
+        ):
+            # A chunk is being received.
+            raise DomainException(key="datasource.upload_busy")
+        return upload
+
+    def _ensure_open(self, upload: DatasourceUpload) -> None:
+        if upload.finalized_at is not None or upload.expires_at <= datetime.utcnow():
+            raise DomainException(key="datasource.upload_closed")
+
+    async def _ensure_can_load(
+        self, name: str, update_key: Optional[str], current_user: UserDetail
+    ) -> None:
+        if update_key is None:
+            await self.datasources.ensure_can_create(name, current_user)
+        else:
+            await self.datasources.ensure_can_update(name, update_key, current_user)
+
+    async def _purge_expired(self, now: datetime) -> None:
+        for upload in await self.repository.get_expired(now):
+            await asyncio.to_thread(remove_file, self._path(upload.id))
+            await self.repository.delete(upload.id)
+
+    async def create_upload(
+        self, data: DatasourceUploadCreate, current_user: UserDetail
+    ) -> DatasourceUploadRead:
+        """Start an upload of `length` bytes, limited in size and count per user."""
+        await self._ensure_can_load(data.name, data.update_key, current_user)
+        max_bytes = self.settings.datasource_upload_max_bytes
+        if data.length > max_bytes:
+            raise DomainException(
+                key="datasource.upload_too_large", params={"max": max_bytes}
+            )
+        if data.checksum is not None:
+            parse_checksum(data.checksum)
+
+        now = datetime.utcnow()
+        await self._purge_expired(now)
+        max_active = self.settings.datasource_upload_max_active
+        if await self.repository.count_active(current_user.id, now) >= max_active:
+            raise DomainException(
+                key="datasource.upload_limit", params={"max": max_active}
+            )
+        upload = await self.repository.create(
+            DatasourceUpload.add_audit_info(
+                {
+                    **data.model_dump(),
+                    "offset": 0,
+                    "expires_at": self._expires_at(now),
+                },
+                current_user.id,
+            )
+        )
+        await asyncio.to_thread(create_file, self._path(upload.id))
+        await self.repository.session.commit()
+        return DatasourceUploadRead.model_validate(upload)
+
+    async def upload(
+        self,
+        name: str,
+        format: str,
+        chunks: AsyncIterator[bytes],
+        current_user: UserDetail,
+        update_key: Optional[str] = None,
+        layer: Optional[str] = None,
+        srid: Optional[int] = None,
+        bbox: Optional[Bbox] = None,
+    ) -> JobRead:
+        """
+        Receive a whole file in one request and queue the job loading it: an
+        upload created, appended and finalized at once. Nothing is loaded nor
+        locked while the body streams.
+        """
+        await self._ensure_can_load(name, update_key, current_user)
+        max_bytes = self.settings.datasource_upload_max_bytes
+        root = os.path.dirname(self._path(0))
+        await asyncio.to_thread(os.makedirs, root, exist_ok=True)
+        descriptor, path = tempfile.mkstemp(prefix="partial-", dir=root)
+        length = 0
+        try:
+            with os.fdopen(descriptor, "wb") as file:
+                async for chunk in chunks:
+                    length += len(chunk)
+                    if length > max_bytes:
+                        raise DomainException(
+                            key="datasource.upload_too_large",
+                            params={"max": max_bytes},
+                        )
+                    await asyncio.to_thread(file.write, chunk)
+            if length == 0:
+                raise DomainException(key="datasource.upload_empty")
+
+            now = datetime.utcnow()
+            await self._purge_expired(now)
+            upload = await self.repository.create(
+                DatasourceUpload.add_audit_info(
+                    {
+                        "name": name,
+                        "format": format,
+                        "layer": layer,
+                        "srid": srid,
+                        "update_key": update_key,
+                        "bbox": bbox,
+                        "length": length,
+                        "offset": length,
+                        "finalized_at": now,
+                        "expires_at": self._expires_at(now),
+                    },
+                    current_user.id,
+                )
+            )
+            await asyncio.to_thread(os.replace, path, self._path(upload.id))
+            path = self._path(upload.id)
+            job = await self.jobs.enqueue(
+                INGEST_UPLOAD, {"upload_id": upload.id}, current_user
+            )
+            await self.repository.session.commit()
+        except BaseException:
+            await asyncio.shield(asyncio.to_thread(remove_file, path))
+            raise
+        return JobRead.model_validate(job)
+
+    async def get_upload(
+        self, upload_id: int, current_user: UserDetail
+    ) -> DatasourceUploadRead:
+        return DatasourceUploadRead.model_validate(
+            await self._get(upload_id, current_user)
+        )
+
+    async def _renew(self, upload_id: int, token: str) -> None:
+        """Extend the lease of a chunk being received, in its own transaction."""
+        locked_until = datetime.utcnow() + timedelta(
+            seconds=self.settings.datasource_upload_lease_seconds
+        )
+        renewed = await self.repository.save_leased(
+            upload_id, token, {"locked_until": locked_until}
+        )
+        await self.repository.session.commit()
+        if not renewed:
+            raise DomainException(key="datasource.upload_busy")
+
+    async def _release(self, upload_id: int, token: str) -> None:
+        await self.repository.session.rollback()
+        await self.repository.save_leased(
+            upload_id, token, {"lock_token": None, "locked_until": None}
+        )
+        await self.repository.session.commit()
+
+    async def append(
+        self,
+        upload_id: int,
+        offset: int,
+        checksum: Optional[str],
+        chunks: AsyncIterator[bytes],
+        current_user: UserDetail,
+    ) -> DatasourceUploadRead:
+        """
+        Write a chunk at `offset`, which must be the bytes received so far.
+
+        The upload is leased to this request by a short committed update, so no
+        transaction (nor pooled connection) is held while the chunk streams; the
+        lease is renewed meanwhile, and the new offset is only saved while this
+        request still holds it.
+        """
+        upload = await self._get(upload_id, current_user)
+        self._ensure_open(upload)
+        if offset != upload.offset:
+            raise DomainException(
+                key="datasource.upload_offset_mismatch",
+                params={"offset": upload.offset},
+            )
+        expected = parse_checksum(checksum) if checksum is not None else None
+        digest = hashlib.new(expected[0]) if expected is not None else None
+
+        lease = self.settings.datasource_upload_lease_seconds
+        token = uuid.uuid4().hex
+        now = datetime.utcnow()
+        claimed = await self.repository.claim(
+            upload.id, offset, token, now, now + timedelta(seconds=lease)
+        )
+        await self.repository.session.commit()
+        if not claimed:
+            raise DomainException(key="datasource.upload_busy")
+
+        written = 0
+        try:
+            try:
+                file = open(self._path(upload.id), "r+b")
+            except FileNotFoundError:
+                raise DomainException(key="datasource.upload_closed")
+            with file:
+                # Bytes past the offset are left by an interrupted, rejected chunk.
+                file.truncate(offset)
+                file.seek(offset)
+                renew_at = time.monotonic() + lease / 3
+                try:
+                    async for chunk in chunks:
+                        written += len(chunk)
+                        if offset + written > upload.length:
+                            raise DomainException(
+                                key="datasource.upload_too_large",
+                                params={"max": upload.length},
+                            )
+                        if digest is not None:
+                            digest.update(chunk)
+                        await asyncio.to_thread(file.write, chunk)
+                        if time.monotonic() >= renew_at:
+                            await self._renew(upload.id, token)
+                            renew_at = time.monotonic() + lease / 3
+                except ClientDisconnect:
+                    # A partial chunk cannot be checked against its checksum.
+                    if digest is not None:
+                        raise
+                if digest is not None and digest.digest() != expected[1]:
+                    raise DomainException(key="datasource.upload_checksum_mismatch")
+                file.flush()
+                # The offset is only committed once its bytes are on disk.
+                await asyncio.to_thread(os.fsync, file.fileno())
+        except BaseException:
+            await asyncio.shield(self._release(upload.id, token))
+            raise
+
+        now = datetime.utcnow()
+        saved = await self.repository.save_leased(
+            upload.id,
+            token,
+            {
+                "offset": offset + written,
+                "expires_at": self._expires_at(now),
+                "lock_token": None,
+                "locked_until": None,
+                "updated_at": now,
+                "updated_by_id": current_user.id,
+            },
+        )
+        if not saved:
+            await self.repository.session.rollback()
+            raise DomainException(key="datasource.upload_busy")
+        await self.repository.session.refresh(upload)
+        await self.repository.session.commit()
+        return DatasourceUploadRead.model_validate(upload)
+
+    async def finalize(self, upload_id: int, current_user: UserDetail) -> JobRead:
+        """Close a complete upload and queue the job loading it."""
+        upload = await self._get(upload_id, current_user, lock=True)
+        self._ensure_open(upload)
+        if upload.offset != upload.length:
+            raise DomainException(
+                key="datasource.upload_incomplete",
+                params={"offset": upload.offset, "length": upload.length},
+            )
+        await self._ensure_can_load(upload.name, upload.update_key, current_user)
+
+        now = datetime.utcnow()
+        job = await self.jobs.enqueue(
+            INGEST_UPLOAD, {"upload_id": upload.id}, current_user
+        )
+        # Kept until loaded, so that a job retried later still finds the file.
+        await self.repository.update(
+            upload.id,
+            {
+                "finalized_at": now,
+                "expires_at": self._expires_at(now),
+                "updated_at": now,
+                "updated_by_id": current_user.id,
+            },
+        )
+        await self.repository.session.commit()
+        return JobRead.model_validate(job)
+
+    async def load(
+        self,
+        upload_id: int,
+        current_user: UserDetail,
+        progress: Optional[Callable[[int], None]] = None,
+    ) -> DatasourceRead:
+        """
+        Check a finalized upload and load it into its datasource, or update the
+        datasource with it (job handler).
+        """
+        upload = await self._get(upload_id, current_user)
+        path = self._path(upload.id)
+        if upload.datasource_id is not None or not os.path.exists(path):
+            raise DomainException(key="datasource.upload_closed")
+        if upload.checksum is not None:
+            algorithm, expected = parse_checksum(upload.checksum)
+            if await asyncio.to_thread(file_digest, path, algorithm) != expected:
+                raise DomainException(key="datasource.upload_checksum_mismatch")
+
+        upload_id, name, key = upload.id, upload.name, upload.update_key
+        bbox = tuple(upload.bbox) if upload.bbox is not None else None
+        if key is not None and upload.format == "geojson":
+            datasource = await self.datasources.load_geojson_update(
+                name, key, path, current_user, progress
+            )
+        elif key is not None:
+            datasource = await self.datasources.load_update(
+                name,
+                key,
+                path,
+                current_user,
+                upload.layer,
+                upload.srid,
+                progress,
+                bbox=bbox,
+            )
+        elif upload.format == "geojson":
+            datasource = await self.datasources.load_geojson(
+                name, path, current_user, progress
+            )
+        else:
+            datasource = await self.datasources.load_file(
+                name,
+                path,
+                current_user,
+                upload.layer,
+                upload.srid,
+                progress,
+                bbox=bbox,
+            )
+        await self.repository.update(upload_id, {"datasource_id": datasource.id})
+        await self.repository.session.commit()
+        await asyncio.to_thread(remove_file, path)
+        return datasource
+
+    async def delete_upload(self, upload_id: int, current_user: UserDetail) -> None:
+        """Abort an upload and remove its spool file."""
+        upload = await self._get(upload_id, current_user, lock=True)
+        await asyncio.to_thread(remove_file, self._path(upload.id))
+        await self.repository.delete(upload.id)
+        await self.repository.session.commit()
+
+
+# Dependencies
+SettingsDep = Annotated[Settings, Depends(get_settings)]
+
+
+def get_datasource_upload_service(
+    session: SessionDep,
+    settings: SettingsDep,
+    datasources: DatasourceServiceDep,
+    jobs: JobServiceDep,
+) -> DatasourceUploadService:
+    return DatasourceUploadService(
+        DatasourceUploadRepository(session, DatasourceUpload),
+        datasources,
+        jobs,
+        settings,
+    )
+
+
+DatasourceUploadServiceDep = Annotated[
+    DatasourceUploadService, Depends(get_datasource_upload_service)
+]
@@ -0,0 +1,41 @@
+from typing import List
+
+from fastapi import APIRouter, Depends
+
+from app.core.messages import MessageService
+from app.core.security import get_current_user
+from app.modules.jobs.schemas import JobRead
+from app.modules.jobs.service import JobServiceDep
+from app.modules.users.schemas import UserDetail
+
+jobsRouter = APIRouter(prefix="/jobs", tags=["Jobs"])
+
+
+@jobsRouter.get("", response_model=List[JobRead])
+async def get_jobs(
+    service: JobServiceDep,
+    current_user: UserDetail = Depends(get_current_user),
+):
+    """Recent background jobs of the user (of every user for admins)."""
+    return await service.get_jobs(current_user)
+
+
+@jobsRouter.get("/{job_id}", response_model=JobRead)
+async def get_job(
+    job_id: int,
+    service: JobServiceDep,
+    current_user: UserDetail = Depends(get_current_user),
+):
+    """Status and progress of a job: rows processed and rows per second."""
+    return await service.get_job(job_id, current_user)
+
+
+@jobsRouter.delete("/{job_id}")
+async def cancel_job(
+    job_id: int,
+    service: JobServiceDep,
+    current_user: UserDetail = Depends(get_current_user),
+):
+    """Cancel a pending or running job."""
+    await service.cancel_job(job_id, current_user)
+    return {"message": MessageService.get_message("job.cancelled")}
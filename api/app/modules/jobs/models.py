@@ -0,0 +1,47 @@
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import BigInteger
+from sqlalchemy import Enum as SAEnum
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlmodel import Column, Field, SQLModel
+
+from app.core.enums.job_status import JobStatus
+from app.core.mixins.audit_mixin import AuditMixin
+
+
+class Job(AuditMixin, SQLModel, table=True):
+    """
+    Background job, run by the worker of a process that claimed it (see
+    `app.modules.jobs.worker`). `kind` selects the handler called with `payload`;
+    what it produced is stored in `result`.
+
+    A failed attempt is retried after `run_after` until `max_attempts`; a running
+    job whose worker stopped sending heartbeats is taken over by another one.
+    """
+
+    __tablename__ = "job"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    kind: str
+    payload: dict = Field(default={}, sa_column=Column(JSONB, nullable=False))
+    status: JobStatus = Field(
+        default=JobStatus.PENDING,
+        sa_type=SAEnum(
+            JobStatus,
+            name="jobstatus",
+            values_callable=lambda obj: [e.value for e in obj],
+        ),
+        nullable=False,
+        index=True,
+    )
+    attempts: int = Field(default=0)
+    max_attempts: int = Field(default=1)
+    run_after: Optional[datetime] = Field(default=None)
+    rows_processed: int = Field(default=0, sa_column=Column(BigInteger, nullable=False))
+    rows_per_second: float = Field(default=0.0)
+    result: Optional[dict] = Field(default=None, sa_column=Column(JSONB))
+    heartbeat_at: Optional[datetime] = Field(default=None)
+    started_at: Optional[datetime] = Field(default=None)
+    finished_at: Optional[datetime] = Field(default=None)
+    error: Optional[str] = Field(default=None)
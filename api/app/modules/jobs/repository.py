@@ -0,0 +1,80 @@
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import func, update
+from sqlmodel import and_, or_, select
+
+from app.core.enums.job_status import JobStatus
+from app.core.repository import BaseRepository
+from app.modules.jobs.models import Job
+
+
+class JobRepository(BaseRepository[Job]):
+    """Repository for Job entities."""
+
+    async def get_recent(self, limit: int, user_id: Optional[int] = None) -> List[Job]:
+        query = select(Job).order_by(Job.id.desc()).limit(limit)
+        if user_id is not None:
+            query = query.where(Job.created_by_id == user_id)
+        result = await self.session.exec(query)
+        return list(result.all())
+
+    async def claim_next(
+        self, now: datetime, stale_before: datetime, max_running_per_user: int
+    ) -> Optional[Job]:
+        """
+        Lock the next pending job due to run, or a running one whose worker
+        stopped sending heartbeats, and mark it running. Other workers skip the
+        locked row. Jobs of a user already running `max_running_per_user` are
+        left queued.
+        """
+        busy_users = (
+            select(Job.created_by_id)
+            .where(
+                Job.status == JobStatus.RUNNING,
+                Job.heartbeat_at >= stale_before,
+                Job.created_by_id.is_not(None),
+            )
+            .group_by(Job.created_by_id)
+            .having(func.count() >= max_running_per_user)
+        )
+        query = (
+            select(Job)
+            .where(
+                or_(
+                    and_(
+                        Job.status == JobStatus.PENDING,
+                        or_(Job.run_after.is_(None), Job.run_after <= now),
+                    ),
+                    and_(
+                        Job.status == JobStatus.RUNNING,
+                        Job.heartbeat_at < stale_before,
+                    ),
+                ),
+                or_(
+                    Job.created_by_id.is_(None),
+                    Job.created_by_id.not_in(busy_users),
+                ),
+            )
+            .order_by(Job.id)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        )
+        job = (await self.session.exec(query)).first()
+        if job is None:
+            return None
+        job.status = JobStatus.RUNNING
+        job.attempts += 1
+        job.heartbeat_at = now
+        job.started_at = job.started_at or now
+        await self.session.flush()
+        return job
+
+    async def save_progress(self, job_id: int, values: dict) -> bool:
+        """Update a running job; False once it is no longer running (cancelled)."""
+        result = await self.session.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.status == JobStatus.RUNNING)
+            .values(**values)
+        )
+        return result.rowcount > 0
@@ -0,0 +1,25 @@
+from datetime import datetime
+from typing import Optional
+
+from pydantic import BaseModel, ConfigDict
+
+from app.core.enums.job_status import JobStatus
+
+
+class JobRead(BaseModel):
+    id: int
+    kind: str
+    payload: dict
+    status: JobStatus
+    attempts: int
+    max_attempts: int
+    run_after: Optional[datetime]
+    rows_processed: int
+    rows_per_second: float
+    result: Optional[dict]
+    started_at: Optional[datetime]
+    finished_at: Optional[datetime]
+    error: Optional[str]
+    created_at: datetime
+    created_by_id: Optional[int]
+    model_config = ConfigDict(from_attributes=True)
@@ -0,0 +1,91 @@
+"""
+Background jobs of the users: queued by other modules, followed through
+`GET /jobs/{id}` and cancelled by their owner or an admin.
+"""
+
+from datetime import datetime
+from typing import Annotated, List
+
+from fastapi import Depends
+
+from app.core.config import Settings, get_settings
+from app.core.database import SessionDep
+from app.core.enums.job_status import JobStatus
+from app.core.exceptions import DomainException, PermissionDeniedException
+from app.core.permissions import has_any_role
+from app.modules.jobs.models import Job
+from app.modules.jobs.repository import JobRepository
+from app.modules.jobs.schemas import JobRead
+from app.modules.users.models import UserRole
+from app.modules.users.schemas import UserDetail
+
+
+class JobService:
+    def __init__(self, repository: JobRepository, settings: Settings):
+        self.repository = repository
+        self.settings = settings
+
+    async def enqueue(self, kind: str, payload: dict, current_user: UserDetail) -> Job:
+        """Queue a job, committed with the caller's transaction."""
+        return await self.repository.create(
+            Job.add_audit_info(
+                {
+                    "kind": kind,
+                    "payload": payload,
+                    "max_attempts": self.settings.job_max_attempts,
+                },
+                current_user.id,
+            )
+        )
+
+    async def _get(self, job_id: int, current_user: UserDetail) -> Job:
+        job = await self.repository.get_or_raise(job_id, "Job", "job.not_found")
+        if (
+            not has_any_role(current_user, [UserRole.ADMIN])
+            and job.created_by_id != current_user.id
+        ):
+            raise PermissionDeniedException(
+                params={"detail": "job.read_permission_denied"}
+            )
+        return job
+
+    async def get_jobs(self, current_user: UserDetail) -> List[JobRead]:
+        """Recent jobs of the user, of every user for admins."""
+        user_id = (
+            None if has_any_role(current_user, [UserRole.ADMIN]) else current_user.id
+        )
+        jobs = await self.repository.get_recent(limit=100, user_id=user_id)
+        return [JobRead.model_validate(job) for job in jobs]
+
+    async def get_job(self, job_id: int, current_user: UserDetail) -> JobRead:
+        return JobRead.model_validate(await self._get(job_id, current_user))
+
+    async def cancel_job(self, job_id: int, current_user: UserDetail) -> bool:
+        job = await self._get(job_id, current_user)
+        if job.status not in (JobStatus.PENDING, JobStatus.RUNNING):
+            raise DomainException(
+                key="job.not_cancellable", params={"status": job.status.value}
+            )
+        now = datetime.utcnow()
+        await self.repository.update(
+            job_id,
+            {
+                "status": JobStatus.CANCELLED,
+                "finished_at": now,
+                "updated_at": now,
+                "updated_by_id": current_user.id,
+            },
+        )
+        await self.repository.session.commit()
+        return True
+
+
+# Dependencies
+SettingsDep = Annotated[Settings, Depends(get_settings)]
+
+
+def get_job_service(session: SessionDep, settings: SettingsDep) -> JobService:
+    return JobService(JobRepository(session, Job), settings)
+
+
+JobServiceDep = Annotated[JobService, Depends(get_job_service)]
@@ -0,0 +1,215 @@
+"""
+Background job worker.
+
+Jobs are claimed from the `job` table with `FOR UPDATE SKIP LOCKED`, so any
+number of processes (the API workers, or `python -m app.worker`) share the queue
+without running a job twice. Each process runs up to `job_worker_concurrency`
+jobs, and a user has at most `job_max_running_per_user` running across all of
+them. While its handler runs, a job gets a heartbeat with the rows processed so
+far and the throughput; a job cancelled in the meantime has its handler
+cancelled at the next heartbeat. A heartbeat that cannot be saved stops the
+handler too, before the job is retried.
+
+A failed job is retried with an exponential delay, unless the failure is a
+`DomainException` (invalid input, which a retry would not fix). A job whose
+worker was stopped goes back to the queue.
+"""
+
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.config import Settings
+from app.core.database import sessionmanager
+from app.core.enums.job_status import JobStatus
+from app.core.exceptions import DomainException
+from app.core.logging_config import logger
+from app.core.messages import MessageService
+from app.modules.datasources.archive import BUILD_PMTILES
+from app.modules.datasources.jobs import build_pmtiles, ingest_upload
+from app.modules.datasources.uploads import INGEST_UPLOAD
+from app.modules.jobs.models import Job
+from app.modules.jobs.repository import JobRepository
+
+CHECKPOINT_SECONDS = 2.0
+# A running job whose worker sent no heartbeat for this long is taken over.
+STALE_AFTER = timedelta(seconds=60)
+
+JobHandler = Callable[
+    [AsyncSession, Settings, Job, Callable[[int], None]], Awaitable[dict]
+]
+
+HANDLERS: Dict[str, JobHandler] = {
+    INGEST_UPLOAD: ingest_upload,
+    BUILD_PMTILES: build_pmtiles,
+}
+
+
+class JobProgress:
+    """Rows processed by a job handler, which calls it with each batch."""
+
+    def __init__(self):
+        self.rows = 0
+        self.started_at = time.monotonic()
+
+    def __call__(self, rows: int) -> None:
+        self.rows += rows
+
+    @property
+    def rate(self) -> float:
+        elapsed = time.monotonic() - self.started_at
+        if elapsed <= 0:
+            return 0.0
+        return self.rows / elapsed
+
+
+def failure_values(job: Job, exc: Exception, settings: Settings) -> dict:
+    """Retry a failed job later, or fail it for good."""
+    now = datetime.utcnow()
+    if isinstance(exc, DomainException):
+        error = MessageService.get_message(exc.key, **exc.params)
+    else:
+        error = str(exc)
+        if job.attempts < job.max_attempts:
+            delay = settings.job_retry_delay_seconds * 2 ** (job.attempts - 1)
+            return {
+                "status": JobStatus.PENDING,
+                "run_after": now + timedelta(seconds=delay),
+                "heartbeat_at": None,
+                "error": error[:500],
+            }
+    return {"status": JobStatus.FAILED, "finished_at": now, "error": error[:500]}
+
+
+class JobWorker:
+    """Runs queued jobs in the background of one process."""
+
+    def __init__(self, handlers: Optional[Dict[str, JobHandler]] = None):
+        self.handlers = HANDLERS if handlers is None else handlers
+        self.settings: Optional[Settings] = None
+        self._tasks: List[asyncio.Task] = []
+
+    async def _save(self, job_id: int, values: dict) -> bool:
+        async for session in sessionmanager.get_session():
+            repository = JobRepository(session, Job)
+            saved = await repository.save_progress(job_id, values)
+            await session.commit()
+            return saved
+
+    async def claim(self) -> Optional[Job]:
+        async for session in sessionmanager.get_session():
+            repository = JobRepository(session, Job)
+            now = datetime.utcnow()
+            job = await repository.claim_next(
+                now, now - STALE_AFTER, self.settings.job_max_running_per_user
+            )
+            await session.commit()
+            return job
+
+    async def _handle(self, job: Job, progress: JobProgress) -> dict:
+        handler = self.handlers[job.kind]
+        async for session in sessionmanager.get_session():
+            return await handler(session, self.settings, job, progress)
+
+    def _progress_values(self, progress: JobProgress) -> dict:
+        return {
+            "rows_processed": progress.rows,
+            "rows_per_second": progress.rate,
+            "heartbeat_at": datetime.utcnow(),
+        }
+
+    async def _stop(self, task: asyncio.Task) -> None:
+        """Cancel a handler and wait until it has stopped."""
+        task.cancel()
+        await asyncio.wait({task})
+
+    async def run_job(self, job: Job) -> None:
+        progress = JobProgress()
+        task = asyncio.create_task(self._handle(job, progress))
+        try:
+            while not (await asyncio.wait({task}, timeout=CHECKPOINT_SECONDS))[0]:
+                if not await self._save(job.id, self._progress_values(progress)):
+                    logger.info(f"Job {job.id} was cancelled")
+                    return
+        except asyncio.CancelledError:
+            # Worker shutdown: the job is queued again, this attempt not counted.
+            await self._stop(task)
+            values = self._progress_values(progress)
+            values.update(
+                status=JobStatus.PENDING, attempts=job.attempts - 1, heartbeat_at=None
+            )
+            await asyncio.shield(self._save(job.id, values))
+            raise
+        finally:
+            # Whatever ends the heartbeats (a cancelled job, a failed save) ends
+            # the handler: the job may be retried, or taken over, elsewhere.
+            if not task.done():
+                await self._stop(task)
+
+        result = task.result()
+        values = self._progress_values(progress)
+        values.update(
+            status=JobStatus.COMPLETED,
+            result=result,
+            finished_at=datetime.utcnow(),
+            error=None,
+        )
+        await self._save(job.id, values)
+
+    async def _run_next(self) -> bool:
+        """Run the next claimable job, False when there is none."""
+        job = await self.claim()
+        if job is None:
+            return False
+        if job.kind not in self.handlers:
+            error = MessageService.get_message("job.unknown_kind", kind=job.kind)
+        elif job.attempts > job.max_attempts:
+            # Taken over after its last attempt stopped sending heartbeats.
+            error = MessageService.get_message("job.abandoned")
+        else:
+            error = None
+        if error is not None:
+            await self._save(
+                job.id,
+                {
+                    "status": JobStatus.FAILED,
+                    "finished_at": datetime.utcnow(),
+                    "error": error,
+                },
+            )
+            return True
+        try:
+            await self.run_job(job)
+        except Exception as exc:
+            logger.exception(f"Job {job.id} ({job.kind}) failed")
+            await self._save(job.id, failure_values(job, exc, self.settings))
+        return True
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if await self._run_next():
+                    continue
+            except Exception:
+                logger.exception("Failed to claim a job")
+            await asyncio.sleep(self.settings.job_poll_seconds)
+
+    def start(self, settings: Settings) -> None:
+        self.settings = settings
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._run())
+                for _ in range(settings.job_worker_concurrency)
+            ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+job_worker = JobWorker()
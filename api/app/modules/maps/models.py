@@ -1,6 +1,6 @@
 from typing import TYPE_CHECKING, Optional
 
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, Index
 from sqlmodel import TEXT, Column, Field, Relationship, SQLModel, UniqueConstraint
 
 from app.core.mixins.access_policy_mixin import AccessPolicyMixin
@@ -19,3 +19,27 @@ class Map(AuditMixin, AccessPolicyMixin, SQLModel, table=True):
     atlas: "Atlas" = Relationship(back_populates="maps")
 
     __table_args__ = (UniqueConstraint("atlas_id", "name", name="uix_map_atlas_name"),)
+
+
+class MapDatasourceRef(SQLModel, table=True):
+    """
+    Datasource referenced by a Map style, extracted when the style is saved.
+    One row per (style source, source-layer) so access checks never parse styles.
+    """
+
+    __tablename__ = "map_datasource_ref"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    map_id: int = Field(
+        sa_column=Column(
+            ForeignKey("map.id", ondelete="CASCADE"), nullable=False, index=True
+        )
+    )
+    source_id: str
+    datasource: str
+    source_url: Optional[str] = Field(default=None, sa_column=Column(TEXT))
+    source_layer: Optional[str] = Field(default=None)
+
+    __table_args__ = (
+        Index("ix_map_datasource_ref_datasource_map_id", "datasource", "map_id"),
+    )
@@ -1,11 +1,14 @@
 from typing import Any, List, Optional
 
-from sqlmodel import or_, select
+from sqlalchemy import func, insert, update
+from sqlmodel import delete, or_, select
 
 from app.core.enums.access_policy import AccessPolicy
 from app.core.repository import BaseRepository
 from app.modules.atlases.models import Atlas, AtlasTeamLink
-from app.modules.maps.models import Map
+from app.core.utils.style_utils import DatasourceRef
+from app.modules.maps.models import Map, MapDatasourceRef
+from app.modules.tokens.models import ResourceToken, TokenRevocation
 
 
 class MapRepository(BaseRepository[Map]):
@@ -60,3 +63,57 @@ class MapRepository(BaseRepository[Map]):
         query = select(Map).where(Map.atlas_id == atlas_id, Map.name == name)
         result = await self.session.exec(query)
         return result.first()
+
+    async def revoke_map_tokens(self, map_id: int) -> None:
+        """Deactivate the resource tokens of a map and log them as revoked."""
+        tokens = select(ResourceToken.jti, ResourceToken.expires_at).where(
+            ResourceToken.map_id == map_id,
+            ResourceToken.is_active == True,  # noqa: E712
+        )
+        await self.session.execute(
+            insert(TokenRevocation).from_select(["jti", "expires_at"], tokens)
+        )
+        await self.session.execute(
+            update(ResourceToken)
+            .where(ResourceToken.map_id == map_id)
+            .values(is_active=False, revoked_at=func.now())
+        )
+
+    async def replace_datasource_refs(
+        self, map_id: int, refs: List[DatasourceRef]
+    ) -> None:
+        """Replace the datasource index of a map with freshly extracted refs."""
+        await self.session.execute(
+            delete(MapDatasourceRef).where(MapDatasourceRef.map_id == map_id)
+        )
+        self.session.add_all(
+            MapDatasourceRef(
+                map_id=map_id,
+                source_id=ref.source_id,
+                datasource=ref.datasource,
+                source_url=ref.source_url,
+                source_layer=ref.source_layer,
+            )
+            for ref in refs
+        )
+        await self.session.flush()
+
+    async def get_style(self, map_id: int) -> Optional[str]:
+        result = await self.session.exec(select(Map.style).where(Map.id == map_id))
+        return result.first()
+
+    async def get_datasource_refs(self, map_id: int) -> List[MapDatasourceRef]:
+        """Get the sources (and source-layers) a map needs."""
+        query = select(MapDatasourceRef).where(MapDatasourceRef.map_id == map_id)
+        result = await self.session.exec(query)
+        return list(result.all())
+
+    async def get_map_ids_by_datasource(self, datasource: str) -> List[int]:
+        """Get the ids of the maps whose style uses a datasource."""
+        query = (
+            select(MapDatasourceRef.map_id)
+            .where(MapDatasourceRef.datasource == datasource)
+            .distinct()
+        )
+        result = await self.session.exec(query)
+        return list(result.all())
@@ -11,6 +11,7 @@ from app.core.exceptions import (
     PermissionDeniedException,
 )
 from app.core.permissions import has_any_role
+from app.core.utils.style_utils import extract_datasource_refs
 from app.modules.atlases.models import Atlas, AtlasTeamLink
 from app.modules.maps.models import Map
 from app.modules.maps.repository import MapRepository
@@ -55,24 +56,16 @@ class MapService:
 
         map_data = Map.add_audit_info(map.model_dump(), current_user.id)
         new_map = await self.repository.create(map_data)
+        await self.repository.replace_datasource_refs(
+            new_map.id, extract_datasource_refs(map.style)
+        )
         await self.repository.session.commit()
         return new_map
 
     async def get_map(self, map_id: int, current_user: UserDetail) -> MapDetail:
         map_obj = await self.repository.get_or_raise(map_id, "Map", "map.not_found")
 
-        can_view = (
-            has_any_role(
-                current_user, [UserRole.ADMIN, UserRole.MANAGE_ATLASES_AND_MAPS]
-            )
-            or map_obj.access_policy == AccessPolicy.PUBLIC
-            or map_obj.created_by_id == current_user.id
-            or await self._check_team_map_permission(
-                map_obj.atlas_id, current_user, "read"
-            )
-        )
-
-        if not can_view:
+        if not await self.can_view_map(map_obj, current_user):
             raise EntityNotFoundException(
                 entity="Map", key="map.not_found", params={"id": map_id}
             )
@@ -96,15 +89,7 @@ class MapService:
     ) -> MapDetail:
         map_db = await self.repository.get_or_raise(map_id, "Map", "map.not_found")
 
-        can_edit = (
-            has_any_role(current_user, [UserRole.ADMIN])
-            or map_db.created_by_id == current_user.id
-            or await self._check_team_map_permission(
-                map_db.atlas_id, current_user, "edit"
-            )
-        )
-
-        if not can_edit:
+        if not await self.can_edit_map(map_db, current_user):
             raise PermissionDeniedException(
                 params={"detail": "map.update_permission_denied"}
             )
@@ -120,25 +105,22 @@ class MapService:
 
         update_data = Map.add_audit_info(update_data, current_user.id)
         updated_map = await self.repository.update(map_id, update_data)
+        if "style" in update_data:
+            await self.repository.replace_datasource_refs(
+                map_id, extract_datasource_refs(update_data["style"])
+            )
         await self.repository.session.commit()
         return updated_map
 
     async def delete_map(self, map_id: int, current_user: UserDetail) -> bool:
         map_obj = await self.repository.get_or_raise(map_id, "Map", "map.not_found")
 
-        can_delete = (
-            has_any_role(current_user, [UserRole.ADMIN])
-            or map_obj.created_by_id == current_user.id
-            or await self._check_team_map_permission(
-                map_obj.atlas_id, current_user, "edit"
-            )
-        )
-
-        if not can_delete:
+        if not await self.can_edit_map(map_obj, current_user):
             raise PermissionDeniedException(
                 params={"detail": "map.delete_permission_denied"}
             )
 
+        await self.repository.revoke_map_tokens(map_id)
         deleted = await self.repository.delete(map_id)
         if not deleted:
             raise EntityNotFoundException(
@@ -147,6 +129,44 @@ class MapService:
         await self.repository.session.commit()
         return True
 
+    async def get_map_datasources(self, map_id: int) -> List[str]:
+        """Distinct datasources referenced by the map style."""
+        refs = await self.repository.get_datasource_refs(map_id)
+        return list(dict.fromkeys(ref.datasource for ref in refs))
+
+    async def can_view_datasource(
+        self, datasource: str, current_user: UserDetail
+    ) -> bool:
+        """Check if the user can view a map whose style uses the datasource."""
+        for map_id in await self.repository.get_map_ids_by_datasource(datasource):
+            map_obj = await self.repository.get(map_id)
+            if map_obj is not None and await self.can_view_map(map_obj, current_user):
+                return True
+        return False
+
+    async def can_view_map(self, map_obj: Map, current_user: UserDetail) -> bool:
+        """Check if the map is public or user is Admin, Manager, Creator or reader."""
+        return (
+            has_any_role(
+                current_user, [UserRole.ADMIN, UserRole.MANAGE_ATLASES_AND_MAPS]
+            )
+            or map_obj.access_policy == AccessPolicy.PUBLIC
+            or map_obj.created_by_id == current_user.id
+            or await self._check_team_map_permission(
+                map_obj.atlas_id, current_user, "read"
+            )
+        )
+
+    async def can_edit_map(self, map_obj: Map, current_user: UserDetail) -> bool:
+        """Check if user is Admin, Creator, or has Team edit rights on the atlas."""
+        return (
+            has_any_role(current_user, [UserRole.ADMIN])
+            or map_obj.created_by_id == current_user.id
+            or await self._check_team_map_permission(
+                map_obj.atlas_id, current_user, "edit"
+            )
+        )
+
     async def _check_team_map_permission(
         self, atlas_id: int, user: UserDetail, permission_type: str = "read"
     ) -> bool:
@@ -0,0 +1,708 @@
+"""
+Two-tier tile cache placed in front of Martin.
+
+- Memory tier: byte-bounded LRU living in each worker process.
+- Disk tier: SQLite store (WAL mode) shared by every worker and surviving restarts.
+
+Keys carry a version per source (and per source and zoom). Bumping a version
+(purge, large data change) makes every worker miss on the old keys without having
+to reach their memory tiers. Small data changes delete just the tiles they touch.
+
+Small tiles are stored once per content in both tiers: empty tiles, or tiles fully
+inside one polygon (sea, forest), repeat across large areas and every zoom.
+"""
+
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+from typing import (
+    Annotated,
+    Dict,
+    Iterable,
+    List,
+    Literal,
+    Optional,
+    Set,
+    Tuple,
+    get_args,
+)
+
+from fastapi import Depends
+
+from app.core.config import Settings
+from app.core.logging_config import logger
+
+ALL_SOURCES = "*"
+# Rough per-entry bookkeeping overhead counted against the memory budget.
+ENTRY_OVERHEAD = 200
+# Tiles up to this size share one copy of their content.
+SHARED_TILE_MAX_BYTES = 4096
+# Rough per-row overhead (key, columns, index entries) counted against the disk budget.
+DISK_ENTRY_OVERHEAD = 100
+# Least recently used tiles examined per eviction round of the disk tier.
+DISK_EVICTION_BATCH = 1000
+# Disk hits refresh the access time of a tile at most this often (seconds).
+DISK_ACCESS_RESOLUTION = 60.0
+# Bumped when the disk schema changes: older stores are dropped (it is a cache).
+DISK_SCHEMA_VERSION = 4
+
+
+def is_shareable(data: bytes) -> bool:
+    return 0 < len(data) <= SHARED_TILE_MAX_BYTES
+
+
+def content_hash(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def zoom_version_key(source: str, z: int) -> str:
+    return f"{source}/{z}"
+
+
+# Extensions of the vector tiles served: both name the same MVT body.
+TileFormat = Literal["pbf", "mvt"]
+TILE_FORMATS: Tuple[str, ...] = get_args(TileFormat)
+
+
+@dataclass(frozen=True)
+class TileKey:
+    source: str
+    z: int
+    x: int
+    y: int
+    format: TileFormat
+    version: int
+    # Derived copies of a tile (e.g. pruned for a style), "" for Martin's tile.
+    variant: str = ""
+
+
+@dataclass(frozen=True)
+class CachedTile:
+    data: bytes
+    status_code: int = 200
+    content_type: Optional[str] = None
+    content_encoding: Optional[str] = None
+    expires_at: float = 0.0
+
+    @property
+    def size(self) -> int:
+        return len(self.data) + ENTRY_OVERHEAD
+
+
+@dataclass
+class TileCacheStats:
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    stores: int = 0
+    disk_evictions: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0
+
+
+class MemoryTileCache:
+    """
+    LRU bounded by the total size of the cached tiles. Small tiles with the same
+    content share one bytes object, counted once against the budget.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.evictions = 0
+        self.shared_tiles = 0
+        self._entries: "OrderedDict[TileKey, CachedTile]" = OrderedDict()
+        # Content of small tiles -> [shared bytes object, reference count]
+        self._contents: Dict[bytes, list] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: TileKey, now: float) -> Optional[CachedTile]:
+        tile = self._entries.get(key)
+        if tile is None:
+            return None
+        if tile.expires_at <= now:
+            self.delete(key)
+            return None
+        self._entries.move_to_end(key)
+        return tile
+
+    def peek(self, key: TileKey, now: float) -> bool:
+        tile = self._entries.get(key)
+        return tile is not None and tile.expires_at > now
+
+    def _acquire(self, tile: CachedTile) -> CachedTile:
+        """Account for a stored tile, pointing it at the shared copy of its content."""
+        if not is_shareable(tile.data):
+            self.size += tile.size
+            return tile
+        content = self._contents.get(tile.data)
+        if content is None:
+            self._contents[tile.data] = [tile.data, 1]
+            self.size += tile.size
+            return tile
+        content[1] += 1
+        self.size += ENTRY_OVERHEAD
+        self.shared_tiles += 1
+        return replace(tile, data=content[0])
+
+    def _release(self, tile: CachedTile) -> None:
+        if not is_shareable(tile.data):
+            self.size -= tile.size
+            return
+        content = self._contents[tile.data]
+        content[1] -= 1
+        if content[1]:
+            self.size -= ENTRY_OVERHEAD
+            self.shared_tiles -= 1
+        else:
+            del self._contents[tile.data]
+            self.size -= tile.size
+
+    def set(self, key: TileKey, tile: CachedTile) -> None:
+        if tile.size > self.max_bytes:
+            return
+        self.delete(key)
+        self._entries[key] = self._acquire(tile)
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._release(evicted)
+            self.evictions += 1
+
+    def delete(self, key: TileKey) -> None:
+        tile = self._entries.pop(key, None)
+        if tile is not None:
+            self._release(tile)
+
+    def purge(self, source: Optional[str] = None) -> None:
+        if source is None:
+            self._entries.clear()
+            self._contents.clear()
+            self.size = 0
+            self.shared_tiles = 0
+            return
+        for key in [k for k in self._entries if k.source == source]:
+            self.delete(key)
+
+    def delete_tiles(self, source: str, tiles: Set[Tuple[int, int, int]]) -> None:
+        """Drop a source's tiles at (z, x, y), whatever format, version or variant."""
+        for key in [
+            k for k in self._entries if k.source == source and (k.z, k.x, k.y) in tiles
+        ]:
+            self.delete(key)
+
+
+class DiskTileCache:
+    """
+    SQLite tile store. Every method is blocking and meant to run in a thread;
+    each thread keeps its own connection. `prune` keeps it within its byte
+    budget, evicting the tiles least recently read.
+    """
+
+    # Small tiles keep their content in `contents`, referenced by hash.
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS tiles (
+            source TEXT NOT NULL,
+            z INTEGER NOT NULL,
+            x INTEGER NOT NULL,
+            y INTEGER NOT NULL,
+            format TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            variant TEXT NOT NULL,
+            data BLOB,
+            content_hash BLOB,
+            status_code INTEGER NOT NULL,
+            content_type TEXT,
+            content_encoding TEXT,
+            expires_at REAL NOT NULL,
+            accessed_at REAL NOT NULL,
+            PRIMARY KEY (source, z, x, y, format, version, variant)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS tiles_content_hash ON tiles (content_hash)
+        WHERE content_hash IS NOT NULL
+        """,
+        "CREATE INDEX IF NOT EXISTS tiles_accessed_at ON tiles (accessed_at)",
+        """
+        CREATE TABLE IF NOT EXISTS contents (
+            hash BLOB PRIMARY KEY,
+            data BLOB NOT NULL
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS versions (
+            source TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+        """,
+    )
+
+    def __init__(self, path: str, max_bytes: Optional[int] = None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            if connection.execute("PRAGMA user_version").fetchone()[0] < (
+                DISK_SCHEMA_VERSION
+            ):
+                connection.execute("DROP TABLE IF EXISTS tiles")
+                connection.execute("DROP TABLE IF EXISTS contents")
+                connection.execute(f"PRAGMA user_version = {DISK_SCHEMA_VERSION}")
+            for statement in self.SCHEMA:
+                connection.execute(statement)
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        self.prune(time.time())
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self.path, timeout=5.0, isolation_level=None, check_same_thread=False
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def get(self, key: TileKey, now: float, touch: bool = True) -> Optional[CachedTile]:
+        """
+        A live tile. `touch` records the read for eviction, at most once per
+        `DISK_ACCESS_RESOLUTION` so that hits rarely write.
+        """
+        connection = self._connection()
+        params = (key.source, key.z, key.x, key.y, key.format, key.version, key.variant)
+        row = connection.execute(
+            "SELECT coalesce(tiles.data, contents.data), status_code, "
+            "content_type, content_encoding, expires_at, accessed_at "
+            "FROM tiles LEFT JOIN contents ON contents.hash = tiles.content_hash "
+            "WHERE source = ? AND z = ? AND x = ? AND y = ? "
+            "AND format = ? AND version = ? AND variant = ?",
+            params,
+        ).fetchone()
+        if row is None or row[4] <= now or row[0] is None:
+            return None
+        if touch and now - row[5] >= DISK_ACCESS_RESOLUTION:
+            connection.execute(
+                "UPDATE tiles SET accessed_at = ? "
+                "WHERE source = ? AND z = ? AND x = ? AND y = ? "
+                "AND format = ? AND version = ? AND variant = ?",
+                (now, *params),
+            )
+        return CachedTile(
+            data=row[0],
+            status_code=row[1],
+            content_type=row[2],
+            content_encoding=row[3],
+            expires_at=row[4],
+        )
+
+    def set(self, key: TileKey, tile: CachedTile) -> None:
+        connection = self._connection()
+        data, digest = tile.data, None
+        if is_shareable(tile.data):
+            data, digest = None, content_hash(tile.data)
+            connection.execute(
+                "INSERT OR IGNORE INTO contents VALUES (?, ?)", (digest, tile.data)
+            )
+        connection.execute(
+            "INSERT OR REPLACE INTO tiles "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                key.source,
+                key.z,
+                key.x,
+                key.y,
+                key.format,
+                key.version,
+                key.variant,
+                data,
+                digest,
+                tile.status_code,
+                tile.content_type,
+                tile.content_encoding,
+                tile.expires_at,
+                time.time(),
+            ),
+        )
+
+    def delete(self, keys: Iterable[TileKey]) -> None:
+        self._connection().executemany(
+            "DELETE FROM tiles WHERE source = ? AND z = ? AND x = ? AND y = ? "
+            "AND format = ? AND version = ? AND variant = ?",
+            [(k.source, k.z, k.x, k.y, k.format, k.version, k.variant) for k in keys],
+        )
+
+    def delete_tiles(self, source: str, tiles: Iterable[Tuple[int, int, int]]) -> None:
+        self._connection().executemany(
+            "DELETE FROM tiles WHERE source = ? AND z = ? AND x = ? AND y = ?",
+            [(source, z, x, y) for z, x, y in tiles],
+        )
+
+    def get_meta(self, key: str) -> Optional[int]:
+        row = (
+            self._connection()
+            .execute("SELECT value FROM meta WHERE key = ?", (key,))
+            .fetchone()
+        )
+        return row[0] if row else None
+
+    def set_meta_max(self, key: str, value: int) -> None:
+        """Store value, unless a higher one was stored (by another worker)."""
+        self._connection().execute(
+            "INSERT INTO meta VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = max(value, excluded.value)",
+            (key, value),
+        )
+
+    def get_versions(self) -> Dict[str, int]:
+        rows = self._connection().execute("SELECT source, version FROM versions")
+        return dict(rows.fetchall())
+
+    def bump_version(self, source: str) -> None:
+        self._connection().execute(
+            "INSERT INTO versions VALUES (?, 1) "
+            "ON CONFLICT(source) DO UPDATE SET version = version + 1",
+            (source,),
+        )
+
+    def purge(self, source: Optional[str] = None) -> None:
+        connection = self._connection()
+        if source is None:
+            connection.execute("DELETE FROM tiles")
+            connection.execute("DELETE FROM contents")
+        else:
+            connection.execute("DELETE FROM tiles WHERE source = ?", (source,))
+            self._delete_unreferenced_contents()
+
+    def _delete_unreferenced_contents(self) -> None:
+        self._connection().execute(
+            "DELETE FROM contents WHERE NOT EXISTS "
+            "(SELECT 1 FROM tiles WHERE tiles.content_hash = contents.hash)"
+        )
+
+    def size(self) -> int:
+        """Bytes of stored tiles and contents, with a per-row overhead."""
+        connection = self._connection()
+        total = 0
+        for table in ("tiles", "contents"):
+            total += connection.execute(
+                f"SELECT coalesce(sum(length(data)), 0) + count(*) * ? FROM {table}",
+                (DISK_ENTRY_OVERHEAD,),
+            ).fetchone()[0]
+        return total
+
+    def prune(self, now: float) -> int:
+        """
+        Drop expired tiles, then the least recently read ones while the store
+        exceeds `max_bytes`, and contents no tile refers to anymore. Returns
+        the number of evicted (unexpired) tiles.
+        """
+        connection = self._connection()
+        connection.execute("DELETE FROM tiles WHERE expires_at <= ?", (now,))
+        self._delete_unreferenced_contents()
+        evicted = 0
+        if self.max_bytes is None:
+            return evicted
+        excess = self.size() - self.max_bytes
+        while excess > 0:
+            rows = connection.execute(
+                "SELECT source, z, x, y, format, version, variant, "
+                "coalesce(length(data), 0) FROM tiles ORDER BY accessed_at LIMIT ?",
+                (DISK_EVICTION_BATCH,),
+            ).fetchall()
+            if not rows:
+                break
+            victims = []
+            for row in rows:
+                victims.append(row[:7])
+                excess -= row[7] + DISK_ENTRY_OVERHEAD
+                if excess <= 0:
+                    break
+            connection.executemany(
+                "DELETE FROM tiles WHERE source = ? AND z = ? AND x = ? AND y = ? "
+                "AND format = ? AND version = ? AND variant = ?",
+                victims,
+            )
+            self._delete_unreferenced_contents()
+            evicted += len(victims)
+            # Shared contents are only freed with their last tile: measure again.
+            excess = self.size() - self.max_bytes
+        return evicted
+
+    def close(self) -> None:
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+@dataclass
+class TileCache:
+    """Memory LRU backed by the shared disk tier, with per-zoom TTLs."""
+
+    memory: MemoryTileCache
+    disk: Optional[DiskTileCache]
+    zoom_ttls: List[Tuple[int, int]]
+    version_refresh_interval: float = 1.0
+    stats: TileCacheStats = field(default_factory=TileCacheStats)
+    # Changes applied to each source by this worker, see `data_version`.
+    data_versions: Dict[str, int] = field(default_factory=dict)
+    _versions: Dict[str, int] = field(default_factory=dict)
+    _versions_loaded_at: float = float("-inf")
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "TileCache":
+        disk = (
+            DiskTileCache(
+                settings.tile_cache_disk_path, settings.tile_cache_disk_max_bytes
+            )
+            if settings.tile_cache_disk_path
+            else None
+        )
+        return cls(
+            memory=MemoryTileCache(settings.tile_cache_memory_bytes),
+            disk=disk,
+            zoom_ttls=sorted(settings.tile_cache_zoom_ttls.items()),
+            version_refresh_interval=settings.tile_cache_version_refresh_seconds,
+        )
+
+    def ttl_for(self, z: int) -> int:
+        """TTL of the closest configured zoom at or below z."""
+        ttl = 0
+        for min_zoom, zoom_ttl in self.zoom_ttls:
+            if min_zoom > z:
+                break
+            ttl = zoom_ttl
+        return ttl
+
+    async def version(self, source: str, z: Optional[int] = None) -> int:
+        """
+        Current cache version of a source, or of one zoom level of it. The global
+        and per-source counters are added so that bumping any of them moves the
+        tiles below it to unseen versions.
+        """
+        now = time.monotonic()
+        if (
+            self.disk
+            and now - self._versions_loaded_at >= self.version_refresh_interval
+        ):
+            self._versions = await asyncio.to_thread(self.disk.get_versions)
+            self._versions_loaded_at = now
+        version = self._versions.get(ALL_SOURCES, 0) + self._versions.get(source, 0)
+        if z is not None:
+            version += self._versions.get(zoom_version_key(source, z), 0)
+        return version
+
+    async def bump_version(self, source: str = ALL_SOURCES) -> None:
+        if self.disk:
+            await asyncio.to_thread(self.disk.bump_version, source)
+            self._versions_loaded_at = float("-inf")
+        else:
+            self._versions[source] = self._versions.get(source, 0) + 1
+
+    def data_version(self, source: str) -> int:
+        """
+        Counter of data changes applied to a source. A fill started before a
+        change must not be stored after the change invalidated its tile.
+        """
+        return self.data_versions.get(source, 0)
+
+    async def invalidate_tiles(
+        self, source: str, tiles: Set[Tuple[int, int, int]]
+    ) -> None:
+        """Drop the given tiles of a source from both tiers, every format and version."""
+        self.data_versions[source] = self.data_version(source) + 1
+        self.memory.delete_tiles(source, tiles)
+        if self.disk and tiles:
+            await asyncio.to_thread(self.disk.delete_tiles, source, tiles)
+
+    async def bump_data_version(self, source: str, z: Optional[int] = None) -> None:
+        """Move a source (or one of its zoom levels) to a new cache version."""
+        self.data_versions[source] = self.data_version(source) + 1
+        await self.bump_version(source if z is None else zoom_version_key(source, z))
+
+    async def get_meta(self, key: str) -> Optional[int]:
+        if self.disk is None:
+            return None
+        return await asyncio.to_thread(self.disk.get_meta, key)
+
+    async def set_meta_max(self, key: str, value: int) -> None:
+        if self.disk:
+            await asyncio.to_thread(self.disk.set_meta_max, key, value)
+
+    async def get(self, key: TileKey) -> Tuple[Optional[CachedTile], Optional[str]]:
+        """Return the cached tile and the tier that served it."""
+        now = time.time()
+        tile = self.memory.get(key, now)
+        if tile is not None:
+            self.stats.memory_hits += 1
+            return tile, "memory"
+
+        if self.disk:
+            tile = await asyncio.to_thread(self.disk.get, key, now)
+            if tile is not None:
+                self.memory.set(key, tile)
+                self.stats.disk_hits += 1
+                return tile, "disk"
+
+        self.stats.misses += 1
+        return None, None
+
+    async def contains(self, key: TileKey) -> bool:
+        """Whether a tile is cached, without touching stats or LRU order."""
+        now = time.time()
+        if self.memory.peek(key, now):
+            return True
+        if self.disk:
+            tile = await asyncio.to_thread(self.disk.get, key, now, False)
+            return tile is not None
+        return False
+
+    async def set(
+        self, key: TileKey, tile: CachedTile, memory: bool = True
+    ) -> CachedTile:
+        """
+        Store a tile in both tiers. `memory=False` only writes the disk tier
+        (when there is one), leaving the hot tiles of the memory tier in place.
+        """
+        ttl = self.ttl_for(key.z)
+        if ttl <= 0:
+            return tile
+        tile = CachedTile(
+            data=tile.data,
+            status_code=tile.status_code,
+            content_type=tile.content_type,
+            content_encoding=tile.content_encoding,
+            expires_at=time.time() + ttl,
+        )
+        if memory or self.disk is None:
+            self.memory.set(key, tile)
+        if self.disk:
+            await asyncio.to_thread(self.disk.set, key, tile)
+        self.stats.stores += 1
+        return tile
+
+    async def delete(self, keys: List[TileKey]) -> None:
+        for key in keys:
+            self.memory.delete(key)
+        if self.disk and keys:
+            await asyncio.to_thread(self.disk.delete, keys)
+
+    async def purge(self, source: Optional[str] = None) -> None:
+        """Drop cached tiles of one source (or all) in every worker."""
+        await self.bump_version(source or ALL_SOURCES)
+        self.memory.purge(source)
+        if self.disk:
+            await asyncio.to_thread(self.disk.purge, source)
+
+    async def prune(self) -> None:
+        """Bring the disk tier back within its budget, see `DiskTileCache.prune`."""
+        if self.disk:
+            evicted = await asyncio.to_thread(self.disk.prune, time.time())
+            self.stats.disk_evictions += evicted
+
+    def snapshot(self) -> dict:
+        return {
+            "memory_hits": self.stats.memory_hits,
+            "disk_hits": self.stats.disk_hits,
+            "misses": self.stats.misses,
+            "stores": self.stats.stores,
+            "hit_ratio": self.stats.hit_ratio,
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memory.size,
+            "memory_max_bytes": self.memory.max_bytes,
+            "memory_evictions": self.memory.evictions,
+            "memory_shared_tiles": self.memory.shared_tiles,
+            "disk_enabled": self.disk is not None,
+            "disk_evictions": self.stats.disk_evictions,
+        }
+
+    def close(self) -> None:
+        if self.disk:
+            self.disk.close()
+
+
+class TileCacheManager:
+    """
+    Holds the app-scoped tile cache, None when caching is disabled, and the
+    task pruning its disk tier.
+    """
+
+    def __init__(self):
+        self.cache: TileCache | None = None
+        self._task: Optional[asyncio.Task] = None
+
+    def init(self, settings: Settings):
+        if settings.tile_cache_enabled:
+            self.cache = TileCache.from_settings(settings)
+
+    def get_cache(self) -> Optional[TileCache]:
+        return self.cache
+
+    async def _run(self, cache: TileCache, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await cache.prune()
+            except Exception:
+                logger.exception("Failed to prune the tile cache")
+
+    def start(self, settings: Settings) -> None:
+        if self.cache is None or self.cache.disk is None or self._task is not None:
+            return
+        self._task = asyncio.create_task(
+            self._run(self.cache, settings.tile_cache_disk_prune_seconds)
+        )
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def close(self):
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+
+
+tile_cache = TileCacheManager()
+
+
+def get_tile_cache() -> Optional[TileCache]:
+    return tile_cache.get_cache()
+
+
+TileCacheDep = Annotated[Optional[TileCache], Depends(get_tile_cache)]
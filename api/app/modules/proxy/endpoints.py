@@ -0,0 +1,306 @@
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, Header
+
+from app.core.messages import MessageService
+from app.core.security import get_current_user
+from app.core.utils.tile_utils import split_sources
+from app.modules.proxy.engine import TileEngineServiceDep
+from app.modules.proxy.extent import TileExtentServiceDep
+from app.modules.proxy.invalidation import TileInvalidationServiceDep
+from app.modules.proxy.overviews import TileOverviewServiceDep
+from app.modules.proxy.pmtiles import PMTilesServiceDep
+from app.modules.proxy.schemas import (
+    CoalescingStatsRead,
+    DatasourceExtentRead,
+    DatasourceOverviewRead,
+    DatasourceOverviewsUpdate,
+    TileCacheStatsRead,
+    TileEngineSourceRead,
+    TileEngineSourceUpdate,
+    TileSeedJobCreate,
+    TileSeedJobRead,
+)
+from app.modules.proxy.seeding import TileSeedServiceDep
+from app.modules.proxy.service import TileProxyServiceDep
+from app.modules.tokens.signing import ResourceTokenClaims
+from app.modules.tokens.validation import get_composite_tile_token, get_tile_token
+from app.modules.users.schemas import UserDetail
+
+proxyRouter = APIRouter(prefix="/proxy", tags=["Proxy"])
+
+
+@proxyRouter.get("/tiles/{source}/{z}/{x}/{y}")
+@proxyRouter.get("/tiles/{source}/{z}/{x}/{y}.{format}")
+async def get_tile(
+    source: str,
+    z: int,
+    x: int,
+    y: int,
+    service: TileProxyServiceDep,
+    format: Optional[str] = None,
+    prune: bool = False,
+    accept_encoding: Optional[str] = Header(default=None),
+    claims: ResourceTokenClaims = Depends(get_tile_token),
+):
+    """
+    Proxy a vector tile from Martin, authorized by a `?token=` resource token.
+    `?prune=true` drops the layers and properties the token's map style does not read.
+    """
+    return await service.get_tile(
+        source,
+        z,
+        x,
+        y,
+        format=format,
+        accept_encoding=accept_encoding,
+        map_id=claims.map_id if prune else None,
+    )
+
+
+@proxyRouter.get("/composite-tiles/{z}/{x}/{y}")
+@proxyRouter.get("/composite-tiles/{z}/{x}/{y}.{format}")
+async def get_composite_tile(
+    z: int,
+    x: int,
+    y: int,
+    service: TileProxyServiceDep,
+    sources: str = "",
+    format: Optional[str] = None,
+    prune: bool = False,
+    accept_encoding: Optional[str] = Header(default=None),
+    claims: ResourceTokenClaims = Depends(get_composite_tile_token),
+):
+    """
+    One vector tile merging the layers of several sources (`?sources=a,b`),
+    authorized by a single `?token=` resource token covering all of them.
+    """
+    return await service.get_composite_tile(
+        split_sources(sources),
+        z,
+        x,
+        y,
+        format=format,
+        accept_encoding=accept_encoding,
+        map_id=claims.map_id if prune else None,
+    )
+
+
+@proxyRouter.get("/pmtiles/{source}/{z}/{x}/{y}")
+async def get_pmtiles_tile(
+    source: str,
+    z: int,
+    x: int,
+    y: int,
+    service: PMTilesServiceDep,
+    accept_encoding: Optional[str] = Header(default=None),
+    claims: ResourceTokenClaims = Depends(get_tile_token),
+):
+    """A tile read directly from the PMTiles archive of a source, without Martin."""
+    return service.get_tile(source, z, x, y, accept_encoding=accept_encoding)
+
+
+@proxyRouter.get("/pmtiles/{source}.pmtiles")
+async def get_pmtiles_archive(
+    source: str,
+    service: PMTilesServiceDep,
+    range: Optional[str] = Header(default=None),
+    claims: ResourceTokenClaims = Depends(get_tile_token),
+):
+    """The PMTiles archive of a source, with HTTP range requests for PMTiles clients."""
+    return service.get_archive(source, range)
+
+
+@proxyRouter.get("/cache/stats", response_model=TileCacheStatsRead)
+async def get_cache_stats(
+    service: TileProxyServiceDep,
+    current_user: UserDetail = Depends(get_current_user),
+):
+    """Tile cache hit ratio and memory usage (admin only)."""
+    return await service.get_cache_stats(current_user)
+
+
+@proxyRouter.get("/coalescing/stats", response_model=CoalescingStatsRead)
+async def get_coalescing_stats(
+    service: TileProxyServiceDep,
+    current_user: UserDetail = Depends(get_current_user),
+):
+    """Tile misses sent to Martin vs. requests coalesced onto them (admin only)."""
+    return await service.get_coalescing_stats(current_user)
+
+
+@proxyRouter.delete("/cache")
+async def purge_cache(
+    service: TileProxyServiceDep,
+    source: Optional[str] = None,
+    current_user: UserDetail = Depends(get_current_user),
+):
+    """Purge cached tiles of one source, or of every source (admin only)."""
+    await service.purge_cache(current_user, source)
+    return {"message": MessageService.get_message("proxy.cache_purged")}
+
+
+@proxyRouter.put("/sources/{source}/invalidation-triggers")
+async def install_invalidation_triggers(
+    source: str,
+    service: TileInvalidationServiceDep,
+    table: Optional[str] = None,
+    geometry_column: str = "geom",
+    current_user: UserDetail = Depends(get_current_user),
+):
+    """
+    Install the triggers logging changed regions of a datasource table, so edits
+    invalidate the cached tiles they touch (admin only).
+    """
+    await service.install_triggers(current_user, source, table, geometry_column)
+    return {"message": MessageService.get_message("proxy.triggers_installed")}
+
+
+@proxyRouter.get("/sources/{source}/extent", response_model=DatasourceExtentRead)
+async def get_extent(
+    source: str,
+    service: TileExtentServiceDep,
+    current_user: UserDetail = Depends(get_current_user),
+):
+    """Stored extent and occupancy of a datasource (admin only)."""
+    return await service.get_extent(current_user, source)
+
+
+@proxyRouter.put("/sources/{source}/extent", response_model=DatasourceExtentRead)
+async def compute_extent(
+    source: str,
+    service: TileExtentServiceDep,
+    table: Optional[str] = None,
+    geometry_column: str = "geom",
+    current_user: UserDetail = Depends(get_current_user),
+):
+    """
+    Compute the extent and occupancy grid of a datasource table, so tiles outside
+    its data are answered empty without reaching Martin (admin only).
+    """
+    return await service.compute_extent(current_user, source, table, geometry_column)
+
+
+@proxyRouter.delete("/sources/{source}/extent")
+async def delete_extent(
+    source: str,
+    service: TileExtentServiceDep,
+    current_user: UserDetail = Depends(get_current_user),
+):
+    """Forget the extent of a datasource: every tile goes to Martin again (admin only)."""
+    await service.delete_extent(current_user, source)
+    return {"message": MessageService.get_message("proxy.extent_deleted")}
+
+
+@proxyRouter.get("/sources/{source}/engine", response_model=TileEngineSourceRead)
+async def get_engine_source(
+    source: str,
+    service: TileEngineServiceDep,
+    current_user: UserDetail = Depends(get_current_user),
+):
+    """In-API rendering configuration of a datasource (admin only)."""
+    return await service.get_source(current_user, source)
+
+
+@proxyRouter.put("/sources/{source}/engine", response_model=TileEngineSourceRead)
+async def configure_engine_source(
+    source: str,
+    data: TileEngineSourceUpdate,
+    service: TileEngineServiceDep,
+    current_user: UserDetail = Depends(get_current_user),
+):
+    """
+    Render the tiles of a datasource table in the API with ST_AsMVT instead of
+    Martin (admin only).
+    """
+    return await service.configure_source(current_user, source, data)
+
+
+@proxyRouter.delete("/sources/{source}/engine")
+async def delete_engine_source(
+    source: str,
+    service: TileEngineServiceDep,
+    current_user: UserDetail = Depends(get_current_user),
+):
+    """Serve the tiles of a datasource from Martin again (admin only)."""
+    await service.delete_source(current_user, source)
+    return {"message": MessageService.get_message("proxy.engine_source_deleted")}
+
+
+@proxyRouter.get(
+    "/sources/{source}/overviews", response_model=List[DatasourceOverviewRead]
+)
+async def get_overviews(
+    source: str,
+    service: TileOverviewServiceDep,
+    current_user: UserDetail = Depends(get_current_user),
+):
+    """Overview tables of a datasource and their build status (admin only)."""
+    return await service.get_overviews(current_user, source)
+
+
+@proxyRouter.put(
+    "/sources/{source}/overviews", response_model=List[DatasourceOverviewRead]
+)
+async def configure_overviews(
+    source: str,
+    data: DatasourceOverviewsUpdate,
+    service: TileOverviewServiceDep,
+    current_user: UserDetail = Depends(get_current_user),
+):
+    """
+    Render the low zoom bands of a datasource from generalized overview tables,
+    built in the background (admin only).
+    """
+    return await service.configure_overviews(current_user, source, data)
+
+
+@proxyRouter.delete("/sources/{source}/overviews")
+async def delete_overviews(
+    source: str,
+    service: TileOverviewServiceDep,
+    current_user: UserDetail = Depends(get_current_user),
+):
+    """Drop the overview tables of a datasource (admin only)."""
+    await service.delete_overviews(current_user, source)
+    return {"message": MessageService.get_message("proxy.overviews_deleted")}
+
+
+@proxyRouter.get("/seed-jobs", response_model=List[TileSeedJobRead])
+async def get_seed_jobs(
+    service: TileSeedServiceDep,
+    current_user: UserDetail = Depends(get_current_user),
+):
+    """Recent tile seeding jobs (admin only)."""
+    return await service.get_jobs(current_user)
+
+
+@proxyRouter.post("/seed-jobs", response_model=TileSeedJobRead)
+async def create_seed_job(
+    data: TileSeedJobCreate,
+    service: TileSeedServiceDep,
+    current_user: UserDetail = Depends(get_current_user),
+):
+    """Queue the pre-seeding of a bbox and zoom range into the tile cache (admin only)."""
+    return await service.create_job(data, current_user)
+
+
+@proxyRouter.get("/seed-jobs/{job_id}", response_model=TileSeedJobRead)
+async def get_seed_job(
+    job_id: int,
+    service: TileSeedServiceDep,
+    current_user: UserDetail = Depends(get_current_user),
+):
+    """Progress and ETA of a tile seeding job (admin only)."""
+    return await service.get_job(job_id, current_user)
+
+
+@proxyRouter.delete("/seed-jobs/{job_id}")
+async def cancel_seed_job(
+    job_id: int,
+    service: TileSeedServiceDep,
+    current_user: UserDetail = Depends(get_current_user),
+):
+    """Cancel a pending or running tile seeding job (admin only)."""
+    await service.cancel_job(job_id, current_user)
+    return {"message": MessageService.get_message("seed.cancelled")}
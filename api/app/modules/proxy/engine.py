@@ -0,0 +1,445 @@
+"""
+In-API vector tiles: ST_AsMVT over a dedicated read-only connection pool.
+
+Simple, high-traffic datasources can skip Martin. An admin configures the table
+once (`tile_engine_source`), then each tile is one query. The query text is fixed
+per datasource and column set, and the pool's connections prepare it server-side
+on first use (`prepare_threshold=0`), so later tiles only bind and execute it.
+Pruned tiles select the columns the map style reads; every tile goes through the
+same cache as Martin's.
+
+Zoom bands with a built overview table (`app.modules.proxy.overviews`) are
+rendered from it, whichever server renders the other zoom levels.
+
+Sources switched to their PMTiles archive (built offline, see
+`app.modules.datasources.archive`) are read from it without a query, for the
+zooms it holds; the table still renders the others.
+"""
+
+import asyncio
+import gzip
+import time
+from typing import TYPE_CHECKING, Annotated, Dict, FrozenSet, List, Optional, Tuple
+
+from fastapi import Depends
+from sqlalchemy import event, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from app.core.config import Settings, get_settings
+from app.core.database import SessionDep, sessionmanager
+from app.core.exceptions import (
+    DomainException,
+    EntityNotFoundException,
+    ExternalServiceException,
+    PermissionDeniedException,
+)
+from app.core.logging_config import logger
+from app.core.permissions import has_any_role
+from app.core.utils.mvt import LayerProperties, prune_encoded_tile
+from app.core.utils.pmtiles import PMTilesError
+from app.core.utils.tile_utils import SOURCE_PATTERN
+from app.modules.proxy.cache import CachedTile, TileCache, TileCacheDep
+from app.modules.proxy.models import DatasourceOverview, TileEngineSource
+from app.modules.proxy.repository import (
+    OverviewRepository,
+    TileEngineSourceRepository,
+    quote_table,
+)
+from app.modules.proxy.schemas import TileEngineSourceRead, TileEngineSourceUpdate
+from app.modules.users.models import UserRole
+from app.modules.users.schemas import UserDetail
+
+if TYPE_CHECKING:
+    from app.modules.proxy.pmtiles import PMTilesRegistry
+
+WEB_MERCATOR_SRID = 3857
+# Width of the Web Mercator world, in meters.
+WORLD_SIZE = 2 * 20037508.342789244
+MVT_CONTENT_TYPE = "application/x-protobuf"
+
+TILE_QUERY = """
+    WITH mvtgeom AS (
+        SELECT
+            ST_AsMVTGeom(
+                {geom}, ST_TileEnvelope(:z, :x, :y), :extent, :buffer, true
+            ) AS mvt_geom{columns}
+        FROM {table}
+        WHERE {column} && {envelope}
+    )
+    SELECT ST_AsMVT(mvtgeom.*, :layer, :extent, 'mvt_geom'{id_column})
+    FROM mvtgeom
+    WHERE mvt_geom IS NOT NULL
+"""
+
+
+def tile_envelope(source: TileEngineSource) -> str:
+    """SQL of the buffered envelope of a tile, in the SRID of a source."""
+    envelope = "ST_TileEnvelope(:z, :x, :y, margin => :margin)"
+    if source.srid != WEB_MERCATOR_SRID:
+        envelope = f"ST_Transform({envelope}, {int(source.srid)})"
+    return envelope
+
+
+def tile_query(source: TileEngineSource, columns: List[str]) -> str:
+    """Query text of the tiles of a source with the given attribute columns."""
+    quote = postgresql.dialect().identifier_preparer.quote
+    column = quote(source.geometry_column)
+    geom = column
+    if source.srid != WEB_MERCATOR_SRID:
+        geom = f"ST_Transform({geom}, {WEB_MERCATOR_SRID})"
+    if source.simplify > 0:
+        geom = f"ST_Simplify({geom}, :tolerance, true)"
+    selected = list(columns)
+    if source.id_column and source.id_column not in selected:
+        selected.append(source.id_column)
+    return TILE_QUERY.format(
+        geom=geom,
+        columns="".join(f", {quote(name)}" for name in selected),
+        table=quote_table(source.table_name),
+        column=column,
+        envelope=tile_envelope(source),
+        id_column=f", {quote(source.id_column)}" if source.id_column else "",
+    )
+
+
+def tile_params(source: TileEngineSource, z: int, x: int, y: int) -> dict:
+    """Parameters of `tile_query` for one tile."""
+    params = {
+        "z": z,
+        "x": x,
+        "y": y,
+        "extent": source.extent,
+        "buffer": source.buffer,
+        "margin": source.buffer / source.extent,
+        "layer": source.datasource,
+    }
+    if source.simplify > 0:
+        params["tolerance"] = WORLD_SIZE / 2**z / source.extent * source.simplify
+    return params
+
+
+def overview_source(
+    overview: DatasourceOverview, base: Optional[TileEngineSource] = None
+) -> TileEngineSource:
+    """Engine configuration rendering a datasource from one of its overviews."""
+    columns = overview.aggregate_by
+    if columns is None:
+        columns = overview.columns
+    return TileEngineSource(
+        datasource=overview.datasource,
+        table_name=overview.table_name,
+        geometry_column="geom",
+        srid=WEB_MERCATOR_SRID,
+        id_column=overview.id_column if overview.aggregate_by is None else None,
+        columns=list(columns),
+        extent=base.extent if base else 4096,
+        buffer=base.buffer if base else 64,
+    )
+
+
+class TileEngine:
+    """
+    Read-only pool and per-worker copy of the engine sources and built overviews,
+    reloaded after `ttl`.
+    """
+
+    def __init__(self):
+        self.engine: AsyncEngine | None = None
+        self.archives: Optional["PMTilesRegistry"] = None
+        self.ttl = 30.0
+        self._sources: Dict[str, TileEngineSource] = {}
+        # (min zoom, max zoom, source) of the built overviews of each datasource.
+        self._overviews: Dict[str, List[Tuple[int, int, TileEngineSource]]] = {}
+        self._expires_at = 0.0
+
+    def init(
+        self, settings: Settings, archives: Optional["PMTilesRegistry"] = None
+    ) -> None:
+        options = (
+            "-c default_transaction_read_only=on"
+            f" -c statement_timeout={settings.tile_engine_statement_timeout_ms}"
+        )
+        self.engine = create_async_engine(
+            settings.tile_engine_database_url or settings.database_url,
+            pool_size=settings.tile_engine_pool_size,
+            max_overflow=0,
+            pool_pre_ping=True,
+            connect_args={"prepare_threshold": 0, "options": options},
+        )
+        prepared_max = settings.tile_engine_prepared_max
+
+        @event.listens_for(self.engine.sync_engine, "connect")
+        def keep_prepared_statements(dbapi_connection, _):
+            dbapi_connection.driver_connection.prepared_max = prepared_max
+
+        self.ttl = settings.tile_engine_source_ttl_seconds
+        self.archives = archives
+        self._expires_at = 0.0
+
+    def get_engine(self) -> AsyncEngine:
+        if self.engine is None:
+            raise Exception("TileEngine is not initialized")
+        return self.engine
+
+    async def close(self) -> None:
+        if self.engine is not None:
+            await self.engine.dispose()
+            self.engine = None
+
+    async def _load(
+        self,
+    ) -> Tuple[List[TileEngineSource], List[DatasourceOverview]]:
+        async for session in sessionmanager.get_session():
+            sources = await TileEngineSourceRepository(
+                session, TileEngineSource
+            ).get_all()
+            overviews = await OverviewRepository(
+                session, DatasourceOverview
+            ).get_built()
+            return sources, overviews
+
+    async def _refresh(self) -> None:
+        if self._expires_at > time.monotonic():
+            return
+        self._expires_at = time.monotonic() + self.ttl
+        try:
+            sources, overviews = await self._load()
+        except Exception:
+            # Keep the previous configuration until the next reload.
+            logger.exception("Could not load the tile engine sources")
+            return
+        self._sources = {source.datasource: source for source in sources}
+        self.set_overviews(overviews)
+
+    def set_overviews(self, overviews: List[DatasourceOverview]) -> None:
+        self._overviews = {}
+        for overview in overviews:
+            source = overview_source(overview, self._sources.get(overview.datasource))
+            self._overviews.setdefault(overview.datasource, []).append(
+                (overview.min_zoom, overview.max_zoom, source)
+            )
+
+    async def get_source(self, datasource: str) -> Optional[TileEngineSource]:
+        """Engine configuration of a datasource, None when Martin serves it."""
+        if self.engine is None:
+            return None
+        await self._refresh()
+        return self._sources.get(datasource)
+
+    async def route(self, datasource: str, z: int) -> Optional[TileEngineSource]:
+        """
+        What renders a tile: the overview of its zoom band, else the engine
+        configuration of the datasource (always, when it is archived). None when
+        Martin serves it.
+        """
+        if self.engine is None:
+            return None
+        await self._refresh()
+        source = self._sources.get(datasource)
+        if source is not None and source.archive:
+            return source
+        for min_zoom, max_zoom, overview in self._overviews.get(datasource, ()):
+            if min_zoom <= z <= max_zoom:
+                return overview
+        return source
+
+    def expire(self) -> None:
+        """Reload the sources and overviews on the next tile."""
+        self._expires_at = 0.0
+
+    def put(self, source: TileEngineSource) -> None:
+        self._sources[source.datasource] = source
+
+    def remove(self, datasource: str) -> None:
+        self._sources.pop(datasource, None)
+
+    async def render(
+        self,
+        source: TileEngineSource,
+        z: int,
+        x: int,
+        y: int,
+        layers: Optional[LayerProperties] = None,
+    ) -> CachedTile:
+        """
+        Gzipped MVT of a tile, with one layer named after the datasource.
+        With `layers` (see `StyleUsage`), only the columns they read are selected.
+        """
+        columns = source.columns
+        properties = None
+        if layers is not None:
+            if source.datasource not in layers:
+                return CachedTile(data=b"", status_code=204)
+            properties = layers[source.datasource]
+            if properties is not None:
+                columns = [name for name in columns if name in properties]
+
+        if source.archive and self.archives is not None:
+            tile = await self._read_archive(source, z, x, y, layers, properties)
+            if tile is not None:
+                return tile
+
+        try:
+            async with self.get_engine().connect() as connection:
+                result = await connection.execute(
+                    text(tile_query(source, columns)), tile_params(source, z, x, y)
+                )
+                data = result.scalar()
+        except DBAPIError:
+            logger.exception(f"Tile engine query failed for {source.datasource}")
+            raise ExternalServiceException(
+                key="proxy.engine_failed", params={"source": source.datasource}
+            )
+
+        if not data:
+            return CachedTile(data=b"", status_code=204)
+        return CachedTile(
+            data=await asyncio.to_thread(gzip.compress, bytes(data), 6, mtime=0),
+            content_type=MVT_CONTENT_TYPE,
+            content_encoding="gzip",
+        )
+
+    async def _read_archive(
+        self,
+        source: TileEngineSource,
+        z: int,
+        x: int,
+        y: int,
+        layers: Optional[LayerProperties],
+        properties: Optional[FrozenSet[str]],
+    ) -> Optional[CachedTile]:
+        """A tile of the archive of a source, None to render it from the table."""
+        try:
+            archive = self.archives.get(source.datasource)
+            if not archive.header.min_zoom <= z <= archive.header.max_zoom:
+                return None
+            data = archive.find_tile(z, x, y)
+        except (DomainException, EntityNotFoundException, PMTilesError) as e:
+            logger.warning(f"PMTiles archive of {source.datasource} unreadable: {e}")
+            return None
+        if data is None:
+            return CachedTile(data=b"", status_code=204)
+        data = bytes(data)
+        encoding = archive.header.content_encoding
+        if properties is not None:
+            data = await asyncio.to_thread(prune_encoded_tile, data, encoding, layers)
+        return CachedTile(
+            data=data,
+            content_type=archive.header.content_type,
+            content_encoding=encoding,
+        )
+
+
+tile_engine = TileEngine()
+
+
+class TileEngineService:
+    """Admin configuration of the datasources rendered by the in-API engine."""
+
+    def __init__(
+        self,
+        repository: TileEngineSourceRepository,
+        settings: Settings,
+        cache: Optional[TileCache] = None,
+        engine: Optional[TileEngine] = None,
+    ):
+        self.repository = repository
+        self.settings = settings
+        self.cache = cache
+        self.engine = engine or tile_engine
+
+    def _ensure_admin(self, current_user: UserDetail) -> None:
+        if not has_any_role(current_user, [UserRole.ADMIN]):
+            raise PermissionDeniedException(
+                params={"detail": "proxy.cache_permission_denied"}
+            )
+
+    async def _get_or_raise(self, source: str) -> TileEngineSource:
+        engine_source = await self.repository.get_by_datasource(source)
+        if engine_source is None:
+            raise EntityNotFoundException(
+                entity="TileEngineSource",
+                key="proxy.engine_source_not_found",
+                params={"source": source},
+            )
+        return engine_source
+
+    async def get_source(
+        self, current_user: UserDetail, source: str
+    ) -> TileEngineSourceRead:
+        self._ensure_admin(current_user)
+        return TileEngineSourceRead.model_validate(await self._get_or_raise(source))
+
+    async def configure_source(
+        self, current_user: UserDetail, source: str, data: TileEngineSourceUpdate
+    ) -> TileEngineSourceRead:
+        """Render a datasource in the API, reading its columns and SRID now."""
+        self._ensure_admin(current_user)
+        if not SOURCE_PATTERN.match(source):
+            raise DomainException(key="proxy.invalid_source")
+        table = data.table or source
+        try:
+            srid, columns = await self.repository.describe(table, data.geometry_column)
+        except DBAPIError:
+            await self.repository.session.rollback()
+            srid, columns = None, []
+        if srid is None:
+            raise DomainException(
+                key="proxy.engine_invalid_table",
+                params={"table": table, "column": data.geometry_column},
+            )
+        if data.id_column is not None and data.id_column not in columns:
+            raise DomainException(
+                key="proxy.engine_invalid_table",
+                params={"table": table, "column": data.id_column},
+            )
+
+        await self.repository.upsert(
+            {
+                "datasource": source,
+                "table_name": table,
+                "geometry_column": data.geometry_column,
+                "srid": srid,
+                "id_column": data.id_column,
+                "columns": [name for name in columns if name != data.id_column],
+                "simplify": data.simplify,
+                "extent": data.extent,
+                "buffer": data.buffer,
+                # An archive built from the previous configuration is stale.
+                "archive": False,
+            }
+        )
+        await self.repository.session.commit()
+        engine_source = await self.repository.get_by_datasource(source)
+        self.engine.put(engine_source)
+        # Tiles cached from Martin or an older configuration differ.
+        if self.cache is not None:
+            await self.cache.purge(source)
+        return TileEngineSourceRead.model_validate(engine_source)
+
+    async def delete_source(self, current_user: UserDetail, source: str) -> None:
+        """Serve a datasource from Martin again."""
+        self._ensure_admin(current_user)
+        await self._get_or_raise(source)
+        await self.repository.delete_by_datasource(source)
+        await self.repository.session.commit()
+        self.engine.remove(source)
+        if self.cache is not None:
+            await self.cache.purge(source)
+
+
+# Dependencies
+SettingsDep = Annotated[Settings, Depends(get_settings)]
+
+
+def get_tile_engine_service(
+    session: SessionDep, settings: SettingsDep, cache: TileCacheDep
+) -> TileEngineService:
+    return TileEngineService(
+        TileEngineSourceRepository(session, TileEngineSource), settings, cache
+    )
+
+
+TileEngineServiceDep = Annotated[TileEngineService, Depends(get_tile_engine_service)]
@@ -0,0 +1,513 @@
+"""
+Per-datasource extent index, answering "can this tile contain data?" in memory.
+
+Each datasource gets a WGS84 extent and, optionally, an occupancy grid: the tiles
+at a fixed zoom touched by the bbox of at least one feature. Both are computed
+from the datasource table (after ingest, or by an admin) and stored in
+`datasource_extent`; every worker keeps a copy and answers out-of-bounds tile
+requests with an empty tile instead of asking Martin.
+
+Edits never shrink the index: every worker follows the dirty-region log and marks
+changed regions as occupied, persisting what it grew, until the next computation
+replaces the row. The log is read by writing transaction (see `app.core.xact`): a
+region committed after regions with higher ids is applied all the same.
+"""
+
+import asyncio
+import math
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Annotated, Dict, Iterable, List, Optional, Set, Tuple
+
+from fastapi import Depends
+from sqlalchemy.exc import DBAPIError
+
+from app.core.config import Settings, get_settings
+from app.core.database import SessionDep, sessionmanager
+from app.core.exceptions import (
+    DomainException,
+    EntityNotFoundException,
+    PermissionDeniedException,
+)
+from app.core.logging_config import logger
+from app.core.permissions import has_any_role
+from app.core.utils.tile_utils import DEFAULT_TILE_BUFFER, SOURCE_PATTERN, tile_range
+from app.modules.proxy.models import DatasourceExtent, TileDirtyRegion
+from app.modules.proxy.repository import (
+    DatasourceExtentRepository,
+    DirtyRegionRepository,
+)
+from app.modules.proxy.schemas import DatasourceExtentRead
+from app.modules.users.models import UserRole
+from app.modules.users.schemas import UserDetail
+
+BATCH_SIZE = 500
+# `updated_at` is the start time of the writing transaction: re-read rows updated
+# shortly before the last load to catch transactions that committed late.
+LOAD_OVERLAP = timedelta(seconds=60)
+
+Bbox = Tuple[float, float, float, float]
+
+
+class OccupancyGrid:
+    """Occupied tiles at one zoom level, stored as one bitmask int per tile row."""
+
+    def __init__(self, zoom: int, rows: Optional[List[int]] = None):
+        self.zoom = zoom
+        self.size = 2**zoom
+        self.rows = rows if rows is not None else [0] * self.size
+
+    @property
+    def row_bytes(self) -> int:
+        return (self.size + 7) // 8
+
+    @property
+    def occupied(self) -> int:
+        return sum(row.bit_count() for row in self.rows)
+
+    @classmethod
+    def from_cells(cls, zoom: int, cells: Iterable[Tuple[int, int]]) -> "OccupancyGrid":
+        grid = cls(zoom)
+        for x, y in cells:
+            grid.rows[y] |= 1 << x
+        return grid
+
+    @classmethod
+    def from_bytes(cls, zoom: int, data: bytes) -> "OccupancyGrid":
+        grid = cls(zoom)
+        width = grid.row_bytes
+        grid.rows = [
+            int.from_bytes(data[y * width : (y + 1) * width], "little")
+            for y in range(grid.size)
+        ]
+        return grid
+
+    def to_bytes(self) -> bytes:
+        return b"".join(row.to_bytes(self.row_bytes, "little") for row in self.rows)
+
+    def mark(self, min_x: int, min_y: int, max_x: int, max_y: int) -> bool:
+        """Mark an inclusive range of cells, True when a cell was not marked yet."""
+        mask = ((1 << (max_x - min_x + 1)) - 1) << min_x
+        changed = False
+        for y in range(min_y, max_y + 1):
+            if self.rows[y] | mask != self.rows[y]:
+                self.rows[y] |= mask
+                changed = True
+        return changed
+
+    def mark_bbox(self, bbox: Bbox) -> bool:
+        cells = tile_range(bbox, self.zoom, buffer=0)
+        return self.mark(cells.min_x, cells.min_y, cells.max_x, cells.max_y)
+
+    def any(self, min_x: int, min_y: int, max_x: int, max_y: int) -> bool:
+        mask = ((1 << (max_x - min_x + 1)) - 1) << min_x
+        return any(self.rows[y] & mask for y in range(min_y, max_y + 1))
+
+    def merge(self, other: "OccupancyGrid") -> bool:
+        changed = False
+        for y, row in enumerate(other.rows):
+            if self.rows[y] | row != self.rows[y]:
+                self.rows[y] |= row
+                changed = True
+        return changed
+
+    def may_contain(
+        self, z: int, x: int, y: int, buffer: float = DEFAULT_TILE_BUFFER
+    ) -> bool:
+        """Whether a tile (its buffer included) overlaps an occupied cell."""
+        scale = 2.0 ** (self.zoom - z)
+        last = self.size - 1
+        return self.any(
+            max(0, math.floor((x - buffer) * scale)),
+            max(0, math.floor((y - buffer) * scale)),
+            min(last, math.floor((x + 1 + buffer) * scale)),
+            min(last, math.floor((y + 1 + buffer) * scale)),
+        )
+
+
+@dataclass
+class SourceExtent:
+    """In-memory copy of a `datasource_extent` row."""
+
+    datasource: str
+    bbox: Optional[Bbox]
+    grid: Optional[OccupancyGrid] = None
+    computed_at: datetime = field(default_factory=datetime.utcnow)
+    # The regions of transactions below it are part of the extent.
+    region_horizon: int = 0
+
+    @classmethod
+    def from_model(cls, extent: DatasourceExtent) -> "SourceExtent":
+        grid = None
+        if extent.occupancy_zoom is not None and extent.occupancy is not None:
+            grid = OccupancyGrid.from_bytes(extent.occupancy_zoom, extent.occupancy)
+        return cls(
+            datasource=extent.datasource,
+            bbox=extent.bbox,
+            grid=grid,
+            computed_at=extent.computed_at,
+            region_horizon=extent.region_horizon,
+        )
+
+    def bbox_values(self) -> dict:
+        return dict(zip(("min_x", "min_y", "max_x", "max_y"), self.bbox or (None,) * 4))
+
+    def may_contain(self, z: int, x: int, y: int) -> bool:
+        if self.bbox is None:
+            return False
+        tiles = tile_range(self.bbox, z)
+        if not (tiles.min_x <= x <= tiles.max_x and tiles.min_y <= y <= tiles.max_y):
+            return False
+        return self.grid is None or self.grid.may_contain(z, x, y)
+
+    def _grow(self, bbox: Bbox) -> bool:
+        if self.bbox is None:
+            self.bbox = bbox
+            return True
+        grown = (
+            min(self.bbox[0], bbox[0]),
+            min(self.bbox[1], bbox[1]),
+            max(self.bbox[2], bbox[2]),
+            max(self.bbox[3], bbox[3]),
+        )
+        changed = grown != self.bbox
+        self.bbox = grown
+        return changed
+
+    def expand(self, bboxes: Iterable[Bbox]) -> bool:
+        """Grow the extent (and grid) over changed regions, True when it grew."""
+        changed = False
+        for bbox in bboxes:
+            changed = self._grow(bbox) or changed
+            if self.grid is not None:
+                changed = self.grid.mark_bbox(bbox) or changed
+        return changed
+
+    def include(self, bbox: Bbox, cells: Iterable[Tuple[int, int]]) -> bool:
+        """Grow the extent over a bbox and its occupied cells, True when it grew."""
+        changed = self._grow(bbox)
+        if self.grid is not None:
+            for x, y in cells:
+                changed = self.grid.mark(x, y, x, y) or changed
+        return changed
+
+    def merge(self, other: "SourceExtent") -> None:
+        """Union with another copy of the same computation."""
+        if other.bbox is not None:
+            self._grow(other.bbox)
+        if self.grid is not None and other.grid is not None:
+            self.grid.merge(other.grid)
+        self.region_horizon = max(self.region_horizon, other.region_horizon)
+
+
+class ExtentIndex:
+    """Extents of the datasources of this worker, kept in sync with the database."""
+
+    def __init__(self):
+        # Oldest transaction running at the previous poll.
+        self.horizon: Optional[int] = None
+        self._extents: Dict[str, SourceExtent] = {}
+        # Transaction of the regions applied, read again until the horizon
+        # passes it.
+        self._applied: Dict[int, int] = {}
+        self._loaded_at: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._extents)
+
+    def get(self, source: str) -> Optional[SourceExtent]:
+        return self._extents.get(source)
+
+    def may_contain(self, source: str, z: int, x: int, y: int) -> bool:
+        """False only for tiles known to be empty: unknown sources may have data."""
+        extent = self._extents.get(source)
+        return extent is None or extent.may_contain(z, x, y)
+
+    def put(self, extent: SourceExtent) -> None:
+        current = self._extents.get(extent.datasource)
+        if current is None or extent.computed_at > current.computed_at:
+            self._extents[extent.datasource] = extent
+            if self.horizon is not None and extent.region_horizon < self.horizon:
+                # Replay the regions logged since the computation on the new copy.
+                self.horizon = extent.region_horizon
+                self._applied.clear()
+        elif extent.computed_at == current.computed_at:
+            current.merge(extent)
+
+    def remove(self, source: str) -> None:
+        self._extents.pop(source, None)
+
+    def apply(self, regions: List[TileDirtyRegion]) -> Set[str]:
+        """Mark changed regions as occupied, return the datasources that grew."""
+        bboxes_by_source: Dict[str, List[Bbox]] = defaultdict(list)
+        for region in regions:
+            extent = self._extents.get(region.datasource)
+            # Regions below `region_horizon` are already part of the extent.
+            if (
+                extent
+                and region.bbox is not None
+                and region.xid >= extent.region_horizon
+            ):
+                bboxes_by_source[region.datasource].append(region.bbox)
+        return {
+            source
+            for source, bboxes in bboxes_by_source.items()
+            if self._extents[source].expand(bboxes)
+        }
+
+    async def load(self, repository: DatasourceExtentRepository) -> None:
+        """Read the rows written since the last load, drop deleted ones."""
+        after = self._loaded_at - LOAD_OVERLAP if self._loaded_at else None
+        for row in await repository.get_updated_since(after):
+            self.put(SourceExtent.from_model(row))
+            self._loaded_at = max(self._loaded_at or row.updated_at, row.updated_at)
+        datasources = await repository.get_datasources()
+        for source in [s for s in self._extents if s not in datasources]:
+            self.remove(source)
+
+    async def persist(
+        self,
+        repository: DatasourceExtentRepository,
+        source: str,
+        regions: List[TileDirtyRegion],
+    ) -> None:
+        """
+        Merge the regions into the stored row, which other workers may have grown
+        too. A row recomputed meanwhile is left alone: the next load replays the
+        regions onto it.
+
+        The copy of this worker holds every region below the horizon of its
+        previous poll, so the row does too once merged with it.
+        """
+        row = await repository.get_by_datasource(source, for_update=True)
+        extent = self._extents.get(source)
+        if row is None or extent is None or row.computed_at != extent.computed_at:
+            return
+        stored = SourceExtent.from_model(row)
+        stored.expand(
+            r.bbox
+            for r in regions
+            if r.datasource == source
+            and r.bbox is not None
+            and r.xid >= row.region_horizon
+        )
+        extent.merge(stored)
+        extent.region_horizon = max(extent.region_horizon, self.horizon)
+        await repository.update_by_datasource(
+            source,
+            {
+                **extent.bbox_values(),
+                "occupancy": extent.grid.to_bytes() if extent.grid else None,
+                "region_horizon": extent.region_horizon,
+            },
+        )
+
+    async def poll(
+        self,
+        repository: DatasourceExtentRepository,
+        regions_repository: DirtyRegionRepository,
+    ) -> None:
+        """Apply the regions logged since the last poll, persist grown extents."""
+        if self.horizon is None:
+            # Start from the oldest computation, or from now without extents.
+            horizons = [e.region_horizon for e in self._extents.values()]
+            self.horizon = (
+                min(horizons) if horizons else await regions_repository.get_horizon()
+            )
+        horizon = await regions_repository.get_horizon()
+        after_id = 0
+        while True:
+            regions = await regions_repository.get_since(
+                self.horizon, after_id, BATCH_SIZE
+            )
+            new_regions = [r for r in regions if r.id not in self._applied]
+            if new_regions:
+                for source in self.apply(new_regions):
+                    await self.persist(repository, source, new_regions)
+                self._applied.update((r.id, r.xid) for r in new_regions)
+            if len(regions) < BATCH_SIZE:
+                break
+            after_id = regions[-1].id
+        self._applied = {i: x for i, x in self._applied.items() if x >= horizon}
+        self.horizon = horizon
+
+    async def refresh(self) -> None:
+        async for session in sessionmanager.get_session():
+            repository = DatasourceExtentRepository(session, DatasourceExtent)
+            await self.load(repository)
+            await self.poll(repository, DirtyRegionRepository(session, TileDirtyRegion))
+            await session.commit()
+
+    async def _run(self, interval: float) -> None:
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Failed to refresh datasource extents")
+            await asyncio.sleep(interval)
+
+    def start(self, settings: Settings) -> None:
+        if settings.tile_extent_enabled and self._task is None:
+            self._task = asyncio.create_task(
+                self._run(settings.tile_extent_refresh_seconds)
+            )
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._extents.clear()
+        self._loaded_at = None
+        self.horizon = None
+
+
+extent_index = ExtentIndex()
+
+
+class TileExtentService:
+    """Computation and admin operations on datasource extents."""
+
+    def __init__(
+        self,
+        repository: DatasourceExtentRepository,
+        regions_repository: DirtyRegionRepository,
+        settings: Settings,
+        index: Optional[ExtentIndex] = None,
+    ):
+        self.repository = repository
+        self.regions_repository = regions_repository
+        self.settings = settings
+        self.index = index or extent_index
+
+    def _ensure_admin(self, current_user: UserDetail) -> None:
+        if not has_any_role(current_user, [UserRole.ADMIN]):
+            raise PermissionDeniedException(
+                params={"detail": "proxy.cache_permission_denied"}
+            )
+
+    async def compute(
+        self, source: str, table: Optional[str] = None, geometry_column: str = "geom"
+    ) -> DatasourceExtent:
+        """(Re)compute and store the extent of a datasource table."""
+        zoom = self.settings.tile_extent_occupancy_zoom
+        # Regions of the transactions running from here on are replayed onto the
+        # new extent: the computation may not see them.
+        region_horizon = await self.regions_repository.get_horizon()
+        bbox, feature_count, cells = await self.repository.compute(
+            table or source, geometry_column, zoom
+        )
+        extent = SourceExtent(
+            datasource=source,
+            bbox=bbox,
+            grid=OccupancyGrid.from_cells(zoom, cells)
+            if zoom is not None and bbox
+            else None,
+            region_horizon=region_horizon,
+        )
+        await self.repository.upsert(
+            {
+                "datasource": source,
+                **extent.bbox_values(),
+                "feature_count": feature_count,
+                "occupancy_zoom": extent.grid.zoom if extent.grid else None,
+                "occupancy": extent.grid.to_bytes() if extent.grid else None,
+                "region_horizon": region_horizon,
+                "computed_at": extent.computed_at,
+            }
+        )
+        await self.repository.session.commit()
+        self.index.put(extent)
+        return await self.repository.get_by_datasource(source)
+
+    async def extend(
+        self, source: str, key: str, geometry_column: str = "geom"
+    ) -> bool:
+        """
+        Grow the stored extent of a datasource over the features its update
+        inserted or changed, before the update commits: True when it grew.
+        Unlike dirty regions, nothing is lost to the `max_rows` limit of the
+        triggers, and workers load the grown row once the update commits.
+        """
+        row = await self.repository.get_by_datasource(source, for_update=True)
+        if row is None:
+            return False
+        extent = SourceExtent.from_model(row)
+        bbox, cells = await self.repository.compute_changed(
+            source, key, geometry_column, extent.grid.zoom if extent.grid else None
+        )
+        if bbox is None or not extent.include(bbox, cells):
+            return False
+        await self.repository.update_by_datasource(
+            source,
+            {
+                **extent.bbox_values(),
+                "occupancy": extent.grid.to_bytes() if extent.grid else None,
+            },
+        )
+        return True
+
+    async def compute_extent(
+        self,
+        current_user: UserDetail,
+        source: str,
+        table: Optional[str] = None,
+        geometry_column: str = "geom",
+    ) -> DatasourceExtentRead:
+        self._ensure_admin(current_user)
+        if not SOURCE_PATTERN.match(source):
+            raise DomainException(key="proxy.invalid_source")
+        try:
+            extent = await self.compute(source, table, geometry_column)
+        except DBAPIError:
+            await self.repository.session.rollback()
+            raise DomainException(
+                key="proxy.extent_failed", params={"table": table or source}
+            )
+        return DatasourceExtentRead.model_validate(extent)
+
+    async def _get_or_raise(self, source: str) -> DatasourceExtent:
+        extent = await self.repository.get_by_datasource(source)
+        if extent is None:
+            raise EntityNotFoundException(
+                entity="DatasourceExtent",
+                key="proxy.extent_not_found",
+                params={"source": source},
+            )
+        return extent
+
+    async def get_extent(
+        self, current_user: UserDetail, source: str
+    ) -> DatasourceExtentRead:
+        self._ensure_admin(current_user)
+        return DatasourceExtentRead.model_validate(await self._get_or_raise(source))
+
+    async def delete_extent(self, current_user: UserDetail, source: str) -> None:
+        """Stop short-circuiting tiles of a datasource."""
+        self._ensure_admin(current_user)
+        await self._get_or_raise(source)
+        await self.repository.delete_by_datasource(source)
+        await self.repository.session.commit()
+        self.index.remove(source)
+
+
+# Dependencies
+SettingsDep = Annotated[Settings, Depends(get_settings)]
+
+
+def get_tile_extent_service(
+    session: SessionDep, settings: SettingsDep
+) -> TileExtentService:
+    return TileExtentService(
+        DatasourceExtentRepository(session, DatasourceExtent),
+        DirtyRegionRepository(session, TileDirtyRegion),
+        settings,
+    )
+
+
+TileExtentServiceDep = Annotated[TileExtentService, Depends(get_tile_extent_service)]
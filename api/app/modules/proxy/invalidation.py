@@ -0,0 +1,214 @@
+"""
+Tile invalidation driven by the dirty-region log.
+
+Triggers on datasource tables log the bounding boxes of changed geometries in
+`tile_dirty_region`. Every worker follows that log and turns each region into
+the tile keys it touches at each zoom level:
+
+- tiles of zoom levels with few affected tiles are deleted from both tiers,
+- zoom levels with too many affected tiles get their cache version bumped,
+- a region without bbox (TRUNCATE) bumps the version of the whole source.
+
+Regions are read by writing transaction from the horizon of the previous poll
+(see `app.core.xact`): a region committed after regions with higher ids is
+applied all the same.
+"""
+
+import asyncio
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Annotated, Dict, List, Optional, Set, Tuple
+
+from fastapi import Depends
+from sqlalchemy.exc import DBAPIError
+
+from app.core.config import Settings, get_settings
+from app.core.database import SessionDep, sessionmanager
+from app.core.exceptions import DomainException, PermissionDeniedException
+from app.core.logging_config import logger
+from app.core.permissions import has_any_role
+from app.core.utils.tile_utils import MAX_ZOOM, tile_range
+from app.modules.proxy.cache import TileCache
+from app.modules.proxy.models import TileDirtyRegion
+from app.modules.proxy.repository import DirtyRegionRepository
+from app.modules.proxy.service import SOURCE_PATTERN
+from app.modules.users.models import UserRole
+from app.modules.users.schemas import UserDetail
+
+# Horizon of the last poll applied to the shared disk tier.
+HORIZON_META_KEY = "dirty_region_horizon"
+BATCH_SIZE = 500
+PRUNE_INTERVAL = 3600.0
+
+Bbox = Tuple[float, float, float, float]
+
+
+class TileInvalidator:
+    """Applies dirty regions to the tile cache of this worker."""
+
+    def __init__(self):
+        self.cache: Optional[TileCache] = None
+        self.max_tiles_per_zoom = 1024
+        self.retention_seconds = 86400
+        self.horizon: Optional[int] = None
+        # Transaction of the regions applied, read again until the horizon
+        # passes it.
+        self._applied: Dict[int, int] = {}
+        self._pruned_at = float("-inf")
+        self._task: Optional[asyncio.Task] = None
+
+    def configure(self, cache: TileCache, settings: Settings) -> None:
+        self.cache = cache
+        self.max_tiles_per_zoom = settings.tile_invalidation_max_tiles_per_zoom
+        self.retention_seconds = settings.tile_invalidation_retention_seconds
+
+    def affected_tiles(
+        self, bboxes: List[Bbox]
+    ) -> Tuple[Set[Tuple[int, int, int]], List[int]]:
+        """Tiles to delete, and zoom levels touching too many tiles to list."""
+        tiles: Set[Tuple[int, int, int]] = set()
+        for z in range(MAX_ZOOM + 1):
+            zoom_tiles: Set[Tuple[int, int, int]] = set()
+            for bbox in bboxes:
+                zoom_range = tile_range(bbox, z)
+                if len(zoom_tiles) + zoom_range.count > self.max_tiles_per_zoom:
+                    # Tile counts only grow with the zoom level.
+                    return tiles, list(range(z, MAX_ZOOM + 1))
+                zoom_tiles.update(zoom_range.tiles())
+            tiles |= zoom_tiles
+        return tiles, []
+
+    async def apply(self, regions: List[TileDirtyRegion]) -> None:
+        bboxes_by_source: Dict[str, List[Optional[Bbox]]] = defaultdict(list)
+        for region in regions:
+            bboxes_by_source[region.datasource].append(region.bbox)
+
+        for source, bboxes in bboxes_by_source.items():
+            if None in bboxes:
+                await self.cache.bump_data_version(source)
+                continue
+            tiles, overflowing = self.affected_tiles(bboxes)
+            for z in overflowing:
+                await self.cache.bump_data_version(source, z)
+            await self.cache.invalidate_tiles(source, tiles)
+            logger.debug(
+                f"Invalidated {len(tiles)} tiles of {source}",
+                extra={"bumped_zooms": overflowing},
+            )
+
+    async def poll(self, repository: DirtyRegionRepository) -> None:
+        """Apply the regions logged since the last poll, late commits included."""
+        if self.horizon is None:
+            # Resume where the shared disk tier stopped, or start from now.
+            self.horizon = await self.cache.get_meta(HORIZON_META_KEY)
+            if self.horizon is None:
+                self.horizon = await repository.get_horizon()
+        horizon = await repository.get_horizon()
+        after_id = 0
+        while True:
+            regions = await repository.get_since(self.horizon, after_id, BATCH_SIZE)
+            new_regions = [r for r in regions if r.id not in self._applied]
+            if new_regions:
+                await self.apply(new_regions)
+                self._applied.update((r.id, r.xid) for r in new_regions)
+            if len(regions) < BATCH_SIZE:
+                break
+            after_id = regions[-1].id
+
+        self._applied = {i: x for i, x in self._applied.items() if x >= horizon}
+        self.horizon = horizon
+        await self.cache.set_meta_max(HORIZON_META_KEY, horizon)
+
+    async def refresh(self) -> None:
+        async for session in sessionmanager.get_session():
+            repository = DirtyRegionRepository(session, TileDirtyRegion)
+            await self.poll(repository)
+            if time.monotonic() - self._pruned_at >= PRUNE_INTERVAL:
+                await repository.prune(
+                    datetime.utcnow() - timedelta(seconds=self.retention_seconds)
+                )
+                await session.commit()
+                self._pruned_at = time.monotonic()
+
+    async def _run(self, interval: float) -> None:
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Failed to apply tile dirty regions")
+            await asyncio.sleep(interval)
+
+    def start(self, cache: Optional[TileCache], settings: Settings) -> None:
+        if cache is None or not settings.tile_invalidation_enabled:
+            return
+        self.configure(cache, settings)
+        if self._task is None:
+            self._task = asyncio.create_task(
+                self._run(settings.tile_invalidation_poll_seconds)
+            )
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.cache = None
+        self.horizon = None
+
+
+tile_invalidator = TileInvalidator()
+
+
+class TileInvalidationService:
+    """Admin operations on the dirty-region triggers of datasource tables."""
+
+    def __init__(self, repository: DirtyRegionRepository, settings: Settings):
+        self.repository = repository
+        self.settings = settings
+
+    async def install_triggers(
+        self,
+        current_user: UserDetail,
+        source: str,
+        table: Optional[str] = None,
+        geometry_column: str = "geom",
+    ) -> None:
+        if not has_any_role(current_user, [UserRole.ADMIN]):
+            raise PermissionDeniedException(
+                params={"detail": "proxy.cache_permission_denied"}
+            )
+        if not SOURCE_PATTERN.match(source):
+            raise DomainException(key="proxy.invalid_source")
+        try:
+            await self.repository.install_triggers(
+                table or source,
+                geometry_column,
+                source,
+                self.settings.tile_invalidation_trigger_max_rows,
+            )
+        except DBAPIError:
+            await self.repository.session.rollback()
+            raise DomainException(
+                key="proxy.trigger_install_failed", params={"table": table or source}
+            )
+        await self.repository.session.commit()
+
+
+# Dependencies
+SettingsDep = Annotated[Settings, Depends(get_settings)]
+
+
+def get_tile_invalidation_service(
+    session: SessionDep, settings: SettingsDep
+) -> TileInvalidationService:
+    repo = DirtyRegionRepository(session, TileDirtyRegion)
+    return TileInvalidationService(repo, settings)
+
+
+TileInvalidationServiceDep = Annotated[
+    TileInvalidationService, Depends(get_tile_invalidation_service)
+]
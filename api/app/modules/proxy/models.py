@@ -0,0 +1,200 @@
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import Enum as SAEnum
+from sqlalchemy import BigInteger, ForeignKey, LargeBinary, String, func, text
+from sqlmodel import ARRAY, Column, Field, SQLModel, UniqueConstraint
+
+from app.core.enums.seed_job_status import SeedJobStatus
+from app.core.mixins.audit_mixin import AuditMixin
+from app.core.xact import CURRENT_XACT_ID
+
+
+class TileDirtyRegion(SQLModel, table=True):
+    """
+    Bounding box (WGS84) of geometries changed in a datasource table, written by
+    the `canopy_log_dirty_regions` triggers. A region without bbox (TRUNCATE)
+    means the whole datasource changed. Readers follow the log by writing
+    transaction (`xid`, see `app.core.xact`).
+    """
+
+    __tablename__ = "tile_dirty_region"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    datasource: str
+    min_x: Optional[float] = Field(default=None)
+    min_y: Optional[float] = Field(default=None)
+    max_x: Optional[float] = Field(default=None)
+    max_y: Optional[float] = Field(default=None)
+    created_at: datetime = Field(
+        default_factory=datetime.utcnow,
+        sa_column_kwargs={"server_default": func.now()},
+        index=True,
+    )
+    # Set by the database: the triggers insert rows without it.
+    xid: Optional[int] = Field(
+        default=None,
+        sa_column=Column(
+            BigInteger,
+            server_default=text(CURRENT_XACT_ID),
+            nullable=False,
+            index=True,
+        ),
+    )
+
+    @property
+    def bbox(self) -> Optional[tuple]:
+        if None in (self.min_x, self.min_y, self.max_x, self.max_y):
+            return None
+        return self.min_x, self.min_y, self.max_x, self.max_y
+
+
+class TileSeedJob(AuditMixin, SQLModel, table=True):
+    """
+    Pre-seeding of the tile cache over a bbox (WGS84) and zoom range.
+
+    Tiles are walked in a fixed order (datasource, zoom, x, y); `cursor` is the
+    position before which every tile was seeded, so an interrupted job resumes there.
+    """
+
+    __tablename__ = "tile_seed_job"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    map_id: Optional[int] = Field(
+        default=None,
+        sa_column=Column(ForeignKey("map.id", ondelete="SET NULL"), index=True),
+    )
+    datasources: List[str] = Field(default=[], sa_column=Column(ARRAY(String)))
+    min_x: float
+    min_y: float
+    max_x: float
+    max_y: float
+    min_zoom: int
+    max_zoom: int
+    status: SeedJobStatus = Field(
+        default=SeedJobStatus.PENDING,
+        sa_type=SAEnum(
+            SeedJobStatus,
+            name="seedjobstatus",
+            values_callable=lambda obj: [e.value for e in obj],
+        ),
+        nullable=False,
+        index=True,
+    )
+    total_tiles: int = Field(default=0)
+    cursor: int = Field(default=0)
+    tiles_fetched: int = Field(default=0)
+    tiles_skipped: int = Field(default=0)
+    tiles_failed: int = Field(default=0)
+    tiles_per_second: float = Field(default=0.0)
+    # Set by each claim, matched by every save of the claiming worker.
+    claim_token: Optional[str] = Field(default=None)
+    heartbeat_at: Optional[datetime] = Field(default=None)
+    started_at: Optional[datetime] = Field(default=None)
+    finished_at: Optional[datetime] = Field(default=None)
+    error: Optional[str] = Field(default=None)
+
+    @property
+    def bbox(self) -> tuple:
+        return self.min_x, self.min_y, self.max_x, self.max_y
+
+
+class DatasourceExtent(SQLModel, table=True):
+    """
+    WGS84 extent of a datasource table and, optionally, its occupancy grid: a
+    bitmap of the tiles at `occupancy_zoom` touched by a feature (see
+    `app.modules.proxy.extent`). A datasource without features has no extent.
+
+    The dirty regions of transactions below `region_horizon` are merged into the
+    row: edits only grow it until the next computation (`computed_at`).
+    """
+
+    __tablename__ = "datasource_extent"
+
+    datasource: str = Field(primary_key=True)
+    min_x: Optional[float] = Field(default=None)
+    min_y: Optional[float] = Field(default=None)
+    max_x: Optional[float] = Field(default=None)
+    max_y: Optional[float] = Field(default=None)
+    feature_count: int = Field(default=0)
+    occupancy_zoom: Optional[int] = Field(default=None)
+    occupancy: Optional[bytes] = Field(default=None, sa_type=LargeBinary)
+    region_horizon: int = Field(default=0, sa_type=BigInteger)
+    computed_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(
+        default_factory=datetime.utcnow,
+        sa_column_kwargs={"server_default": func.now()},
+        index=True,
+    )
+
+    @property
+    def bbox(self) -> Optional[tuple]:
+        if None in (self.min_x, self.min_y, self.max_x, self.max_y):
+            return None
+        return self.min_x, self.min_y, self.max_x, self.max_y
+
+
+class TileEngineSource(SQLModel, table=True):
+    """
+    Datasource whose tiles the API renders itself with ST_AsMVT instead of asking
+    Martin (see `app.modules.proxy.engine`). `columns` are the attribute columns
+    of the table, read when the source is configured; `simplify` is a tolerance
+    in tile units applied before clipping, 0 to keep geometries as they are.
+    With `archive`, tiles are read from the PMTiles archive built from the table
+    (`{pmtiles_directory}/{datasource}.pmtiles`) for the zooms it holds.
+    """
+
+    __tablename__ = "tile_engine_source"
+
+    datasource: str = Field(primary_key=True)
+    table_name: str
+    geometry_column: str = Field(default="geom")
+    srid: int = Field(default=4326)
+    id_column: Optional[str] = Field(default=None)
+    columns: List[str] = Field(default=[], sa_column=Column(ARRAY(String)))
+    simplify: float = Field(default=0.0)
+    extent: int = Field(default=4096)
+    buffer: int = Field(default=64)
+    archive: bool = Field(default=False)
+    updated_at: datetime = Field(
+        default_factory=datetime.utcnow,
+        sa_column_kwargs={"server_default": func.now()},
+    )
+
+
+class DatasourceOverview(SQLModel, table=True):
+    """
+    Generalized copy of a datasource table for one zoom band (see
+    `app.modules.proxy.overviews`): geometries in EPSG:3857, simplified to the
+    band's resolution, without features smaller than a pixel, optionally merged
+    by `aggregate_by` columns. Tiles of the band are rendered from it.
+
+    An overview is rebuilt when it was never built (`built_at`), or a while after
+    edits of the datasource (`stale_since`); `region_id` is the last dirty region
+    it includes.
+    """
+
+    __tablename__ = "datasource_overview"
+    __table_args__ = (
+        UniqueConstraint("datasource", "min_zoom", name="uix_overview_datasource_zoom"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    datasource: str = Field(index=True)
+    min_zoom: int
+    max_zoom: int
+    table_name: str
+    source_table: str
+    geometry_column: str = Field(default="geom")
+    id_column: Optional[str] = Field(default=None)
+    columns: List[str] = Field(default=[], sa_column=Column(ARRAY(String)))
+    aggregate_by: Optional[List[str]] = Field(
+        default=None, sa_column=Column(ARRAY(String))
+    )
+    tolerance: float
+    feature_count: int = Field(default=0)
+    region_id: int = Field(default=0)
+    stale_since: Optional[datetime] = Field(default=None, index=True)
+    built_at: Optional[datetime] = Field(default=None)
+    build_seconds: Optional[float] = Field(default=None)
+    error: Optional[str] = Field(default=None)
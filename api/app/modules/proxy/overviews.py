@@ -0,0 +1,318 @@
+"""
+Generalized overview tables for low zoom levels.
+
+Rendering a zoom 3 tile from the full-resolution table reads every vertex of
+every feature under it. For each zoom band of a datasource, an overview table
+holds the same features in EPSG:3857, simplified to the band's resolution and
+snapped to its tile grid, without the features smaller than a pixel (optionally
+merged by attribute). The in-API engine renders the tiles of a band from its
+overview; Martin only discovers tables at startup, so overviews are served by
+the engine whichever server renders the other zoom levels.
+
+Each worker builds the overviews it can claim in the background. A build
+replaces the table in one transaction, then moves the band's zoom levels to a
+new cache version. Edits of the datasource (the dirty-region log) mark its
+overviews stale; they are rebuilt once stale for
+`tile_overview_rebuild_delay_seconds`, so a burst of edits costs one rebuild.
+"""
+
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Annotated, List, Optional, Tuple
+
+from fastapi import Depends
+from sqlalchemy.exc import DBAPIError
+
+from app.core.config import Settings, get_settings
+from app.core.database import SessionDep, sessionmanager
+from app.core.exceptions import (
+    DomainException,
+    EntityNotFoundException,
+    PermissionDeniedException,
+)
+from app.core.logging_config import logger
+from app.core.permissions import has_any_role
+from app.core.utils.tile_utils import MAX_ZOOM, SOURCE_PATTERN
+from app.modules.proxy.cache import TileCache, TileCacheDep
+from app.modules.proxy.engine import WORLD_SIZE, TileEngine, tile_engine
+from app.modules.proxy.models import (
+    DatasourceOverview,
+    TileDirtyRegion,
+    TileEngineSource,
+)
+from app.modules.proxy.repository import (
+    DirtyRegionRepository,
+    OverviewRepository,
+    TileEngineSourceRepository,
+)
+from app.modules.proxy.schemas import DatasourceOverviewRead, DatasourceOverviewsUpdate
+from app.modules.users.models import UserRole
+from app.modules.users.schemas import UserDetail
+
+# Overviews are snapped to the grid of a 4096 extent at their highest zoom.
+GRID_EXTENT = 4096
+TILE_SIZE = 256
+# Room for the `_ov_{min}_{max}` suffix in PostgreSQL's 63-byte identifiers.
+MAX_BASE_NAME = 40
+
+
+def band_tolerance(max_zoom: int, pixels: float) -> float:
+    """Simplification tolerance (meters) of `pixels` at the highest band zoom."""
+    return WORLD_SIZE / (TILE_SIZE * 2**max_zoom) * pixels
+
+
+def band_grid(max_zoom: int) -> float:
+    """Size (meters) of a tile grid cell at the highest band zoom."""
+    return WORLD_SIZE / (GRID_EXTENT * 2**max_zoom)
+
+
+def overview_table_name(table: str, min_zoom: int, max_zoom: int) -> str:
+    """Overview of a band, in the schema of the datasource table."""
+    schema, _, name = table.rpartition(".")
+    name = f"{name[:MAX_BASE_NAME]}_ov_{min_zoom}_{max_zoom}"
+    return f"{schema}.{name}" if schema else name
+
+
+def validate_bands(bands: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Sorted zoom bands, raising when empty, out of range or overlapping."""
+    bands = sorted(bands)
+    valid = bool(bands) and all(
+        0 <= min_zoom <= max_zoom <= MAX_ZOOM for min_zoom, max_zoom in bands
+    )
+    valid = valid and all(
+        previous[1] < current[0] for previous, current in zip(bands, bands[1:])
+    )
+    if not valid:
+        raise DomainException(key="proxy.overview_invalid_bands")
+    return bands
+
+
+class OverviewBuilder:
+    """Builds the stale or new overviews in the background of one worker."""
+
+    def __init__(self):
+        self.cache: Optional[TileCache] = None
+        self.engine: TileEngine = tile_engine
+        self.rebuild_delay = timedelta(seconds=300)
+        self._task: Optional[asyncio.Task] = None
+
+    async def build_next(self) -> bool:
+        """Build the next claimable overview, False when there is none."""
+        async for session in sessionmanager.get_session():
+            repository = OverviewRepository(session, DatasourceOverview)
+            await repository.mark_stale()
+            await session.commit()
+            overview = await repository.claim_next(
+                datetime.utcnow() - self.rebuild_delay
+            )
+            if overview is None:
+                await session.commit()
+                return False
+
+            overview_id = overview.id
+            datasource = overview.datasource
+            zooms = range(overview.min_zoom, overview.max_zoom + 1)
+            # Edits logged from here on are not in the snapshot being built.
+            region_id = await DirtyRegionRepository(
+                session, TileDirtyRegion
+            ).get_last_id()
+            started_at = time.monotonic()
+            try:
+                count = await repository.build(overview, band_grid(overview.max_zoom))
+                await repository.save(
+                    overview_id,
+                    {
+                        "feature_count": count,
+                        "region_id": region_id,
+                        "built_at": datetime.utcnow(),
+                        "build_seconds": time.monotonic() - started_at,
+                        "stale_since": None,
+                        "error": None,
+                    },
+                )
+                await session.commit()
+            except DBAPIError as exc:
+                logger.exception(f"Overview {overview_id} of {datasource} failed")
+                await session.rollback()
+                # Retried after the rebuild delay, like an edited datasource.
+                await repository.save(
+                    overview_id,
+                    {"stale_since": datetime.utcnow(), "error": str(exc.orig)[:500]},
+                )
+                await session.commit()
+                return True
+
+            self.engine.expire()
+            if self.cache is not None:
+                for z in zooms:
+                    await self.cache.bump_data_version(datasource, z)
+            return True
+
+    async def _run(self, interval: float) -> None:
+        while True:
+            try:
+                if await self.build_next():
+                    continue
+            except Exception:
+                logger.exception("Failed to build a datasource overview")
+            await asyncio.sleep(interval)
+
+    def start(self, cache: Optional[TileCache], settings: Settings) -> None:
+        if not settings.tile_overview_enabled or not settings.tile_engine_enabled:
+            return
+        self.cache = cache
+        self.rebuild_delay = timedelta(
+            seconds=settings.tile_overview_rebuild_delay_seconds
+        )
+        if self._task is None:
+            self._task = asyncio.create_task(
+                self._run(settings.tile_overview_poll_seconds)
+            )
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.cache = None
+
+
+overview_builder = OverviewBuilder()
+
+
+class TileOverviewService:
+    """Admin configuration of the overview tables of a datasource."""
+
+    def __init__(
+        self,
+        repository: OverviewRepository,
+        settings: Settings,
+        cache: Optional[TileCache] = None,
+        engine: Optional[TileEngine] = None,
+    ):
+        self.repository = repository
+        self.settings = settings
+        self.cache = cache
+        self.engine = engine or tile_engine
+
+    def _ensure_admin(self, current_user: UserDetail) -> None:
+        if not has_any_role(current_user, [UserRole.ADMIN]):
+            raise PermissionDeniedException(
+                params={"detail": "proxy.cache_permission_denied"}
+            )
+
+    async def get_overviews(
+        self, current_user: UserDetail, source: str
+    ) -> List[DatasourceOverviewRead]:
+        self._ensure_admin(current_user)
+        overviews = await self.repository.get_by_datasource(source)
+        return [DatasourceOverviewRead.model_validate(o) for o in overviews]
+
+    async def configure_overviews(
+        self, current_user: UserDetail, source: str, data: DatasourceOverviewsUpdate
+    ) -> List[DatasourceOverviewRead]:
+        """
+        (Re)define the overviews of a datasource; they are built in the background
+        and served once built.
+        """
+        self._ensure_admin(current_user)
+        if (
+            not self.settings.tile_overview_enabled
+            or not self.settings.tile_engine_enabled
+        ):
+            raise DomainException(key="proxy.overview_disabled")
+        if not SOURCE_PATTERN.match(source):
+            raise DomainException(key="proxy.invalid_source")
+        bands = validate_bands(data.bands or self.settings.tile_overview_zoom_bands)
+        table = data.table or source
+        tables = TileEngineSourceRepository(self.repository.session, TileEngineSource)
+        try:
+            srid, columns = await tables.describe(table, data.geometry_column)
+        except DBAPIError:
+            await self.repository.session.rollback()
+            srid, columns = None, []
+        if srid is None:
+            raise DomainException(
+                key="proxy.engine_invalid_table",
+                params={"table": table, "column": data.geometry_column},
+            )
+        for column in [data.id_column, *(data.aggregate_by or [])]:
+            if column is not None and column not in columns:
+                raise DomainException(
+                    key="proxy.engine_invalid_table",
+                    params={"table": table, "column": column},
+                )
+
+        current = await self.repository.get_by_datasource(source)
+        names = {overview_table_name(table, *band) for band in bands}
+        removed = [o for o in current if o.table_name not in names]
+        for overview in removed:
+            await self.repository.drop_table(overview.table_name)
+        if removed:
+            await self.repository.delete_by_ids([o.id for o in removed])
+
+        pixels = self.settings.tile_overview_tolerance_pixels
+        for min_zoom, max_zoom in bands:
+            await self.repository.upsert(
+                {
+                    "datasource": source,
+                    "min_zoom": min_zoom,
+                    "max_zoom": max_zoom,
+                    "table_name": overview_table_name(table, min_zoom, max_zoom),
+                    "source_table": table,
+                    "geometry_column": data.geometry_column,
+                    "id_column": data.id_column,
+                    "columns": [c for c in columns if c != data.id_column],
+                    "aggregate_by": data.aggregate_by,
+                    "tolerance": band_tolerance(max_zoom, pixels),
+                    "region_id": 0,
+                    # Claimed by the next builder poll.
+                    "built_at": None,
+                    "stale_since": None,
+                    "error": None,
+                }
+            )
+        await self.repository.session.commit()
+        self.engine.expire()
+        if removed and self.cache is not None:
+            await self.cache.purge(source)
+        return await self.get_overviews(current_user, source)
+
+    async def delete_overviews(self, current_user: UserDetail, source: str) -> None:
+        """Drop the overview tables; every zoom is rendered from the table again."""
+        self._ensure_admin(current_user)
+        overviews = await self.repository.get_by_datasource(source)
+        if not overviews:
+            raise EntityNotFoundException(
+                entity="DatasourceOverview",
+                key="proxy.overview_not_found",
+                params={"source": source},
+            )
+        for overview in overviews:
+            await self.repository.drop_table(overview.table_name)
+        await self.repository.delete_by_ids([o.id for o in overviews])
+        await self.repository.session.commit()
+        self.engine.expire()
+        if self.cache is not None:
+            await self.cache.purge(source)
+
+
+# Dependencies
+SettingsDep = Annotated[Settings, Depends(get_settings)]
+
+
+def get_tile_overview_service(
+    session: SessionDep, settings: SettingsDep, cache: TileCacheDep
+) -> TileOverviewService:
+    return TileOverviewService(
+        OverviewRepository(session, DatasourceOverview), settings, cache
+    )
+
+
+TileOverviewServiceDep = Annotated[
+    TileOverviewService, Depends(get_tile_overview_service)
+]
@@ -0,0 +1,273 @@
+"""
+PMTiles archives served straight from disk, without Martin.
+
+Each worker memory-maps the archives it serves and keeps their parsed header and
+root directory, plus an LRU of leaf directories. A tile lookup is a couple of
+binary searches in memory, and the tile bytes are sent as a view on the mapping
+(the page cache), without copying them. The raw archive is also served with HTTP
+range requests for clients reading PMTiles themselves.
+
+Archives replaced on disk are picked up within `pmtiles_check_seconds`.
+"""
+
+import gzip
+import mmap
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Annotated, AsyncIterator, Dict, List, Optional, Tuple
+
+from fastapi import Depends, Response
+from fastapi.responses import StreamingResponse
+
+from app.core.config import Settings, get_settings
+from app.core.exceptions import DomainException, EntityNotFoundException
+from app.core.logging_config import logger
+from app.core.utils.pmtiles import (
+    HEADER_SIZE,
+    MAX_DIRECTORY_DEPTH,
+    Entry,
+    Header,
+    PMTilesError,
+    decode_directory,
+    decompress,
+    find_entry,
+    zxy_to_tile_id,
+)
+from app.core.utils.tile_utils import SOURCE_PATTERN
+from app.modules.proxy.service import accepts_gzip, validate_tile
+
+ARCHIVE_CONTENT_TYPE = "application/vnd.pmtiles"
+STREAM_CHUNK_SIZE = 1024 * 1024
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class PMTilesArchive:
+    """A memory-mapped archive with its directories parsed on demand."""
+
+    def __init__(self, path: str, leaf_cache_entries: int = 64):
+        self.path = path
+        self.leaf_cache_entries = leaf_cache_entries
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_size < HEADER_SIZE:
+                raise PMTilesError("Truncated header")
+            # The mapping stays valid after the file is closed or replaced.
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.identity = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        self.size = stat.st_size
+        self.etag = f'"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+        self.view = memoryview(self._mmap)
+        self.header = Header.from_bytes(self.view[:HEADER_SIZE])
+        self.root = self._read_directory(
+            self.header.root_dir_offset, self.header.root_dir_length
+        )
+        self._leaves: OrderedDict[int, List[Entry]] = OrderedDict()
+        self.checked_at = time.monotonic()
+
+    def _read_directory(self, offset: int, length: int) -> List[Entry]:
+        if offset + length > self.size:
+            raise PMTilesError("Directory past the end of the archive")
+        data = bytes(self.view[offset : offset + length])
+        return decode_directory(decompress(data, self.header.internal_compression))
+
+    def _leaf(self, entry: Entry) -> List[Entry]:
+        offset = self.header.leaf_dirs_offset + entry.offset
+        entries = self._leaves.get(offset)
+        if entries is None:
+            entries = self._read_directory(offset, entry.length)
+            self._leaves[offset] = entries
+            if len(self._leaves) > self.leaf_cache_entries:
+                self._leaves.popitem(last=False)
+        else:
+            self._leaves.move_to_end(offset)
+        return entries
+
+    def find_tile(self, z: int, x: int, y: int) -> Optional[memoryview]:
+        """View on the bytes of a tile, None when the archive does not hold it."""
+        if not self.header.min_zoom <= z <= self.header.max_zoom:
+            return None
+        tile_id = zxy_to_tile_id(z, x, y)
+        entries = self.root
+        for _ in range(MAX_DIRECTORY_DEPTH):
+            entry = find_entry(entries, tile_id)
+            if entry is None:
+                return None
+            if entry.run_length > 0:
+                start = self.header.tile_data_offset + entry.offset
+                if start + entry.length > self.size:
+                    raise PMTilesError("Tile past the end of the archive")
+                return self.view[start : start + entry.length]
+            entries = self._leaf(entry)
+        return None
+
+    def changed_on_disk(self) -> bool:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return True
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns) != self.identity
+
+
+class PMTilesRegistry:
+    """Archives of a directory, opened on first use and reopened when replaced."""
+
+    def __init__(self):
+        self.directory: Optional[str] = None
+        self.check_seconds = 5.0
+        self.leaf_cache_entries = 64
+        self._archives: Dict[str, PMTilesArchive] = {}
+
+    def configure(self, settings: Settings) -> None:
+        self.directory = settings.pmtiles_directory
+        self.check_seconds = settings.pmtiles_check_seconds
+        self.leaf_cache_entries = settings.pmtiles_leaf_cache_entries
+        self._archives.clear()
+
+    def path(self, source: str) -> str:
+        return os.path.join(self.directory, f"{source}.pmtiles")
+
+    def get(self, source: str) -> PMTilesArchive:
+        if self.directory is None:
+            raise DomainException(key="proxy.pmtiles_disabled")
+        archive = self._archives.get(source)
+        now = time.monotonic()
+        if archive is not None and now - archive.checked_at >= self.check_seconds:
+            archive.checked_at = now
+            if archive.changed_on_disk():
+                archive = None
+        if archive is None:
+            archive = self._open(source)
+            self._archives[source] = archive
+        return archive
+
+    def _open(self, source: str) -> PMTilesArchive:
+        self._archives.pop(source, None)
+        try:
+            return PMTilesArchive(self.path(source), self.leaf_cache_entries)
+        except FileNotFoundError:
+            raise EntityNotFoundException(
+                entity="Source", key="proxy.source_not_found", params={"source": source}
+            )
+        except (PMTilesError, ValueError) as e:
+            logger.warning(f"Invalid PMTiles archive {source}: {e}")
+            raise DomainException(
+                key="proxy.pmtiles_invalid", params={"source": source}
+            )
+
+    def clear(self) -> None:
+        self._archives.clear()
+
+
+pmtiles_archives = PMTilesRegistry()
+
+
+def parse_range(range_header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Inclusive byte range of a single-range `Range` header, None when it cannot
+    be satisfied. Raises ValueError when the header is not a single byte range.
+    """
+    match = RANGE_PATTERN.match(range_header.strip())
+    if match is None:
+        raise ValueError(range_header)
+    first, last = match.groups()
+    if not first and not last:
+        raise ValueError(range_header)
+    if not first:
+        # Suffix range: the last N bytes.
+        length = int(last)
+        if length == 0:
+            return None
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        return None
+    return start, end
+
+
+class PMTilesService:
+    """Tiles and byte ranges of PMTiles archives."""
+
+    def __init__(self, settings: Settings, archives: PMTilesRegistry):
+        self.settings = settings
+        self.archives = archives
+
+    def get_tile(
+        self,
+        source: str,
+        z: int,
+        x: int,
+        y: int,
+        accept_encoding: Optional[str] = None,
+    ) -> Response:
+        validate_tile(source, z, x, y)
+        archive = self.archives.get(source)
+        try:
+            data = archive.find_tile(z, x, y)
+        except PMTilesError as e:
+            logger.warning(f"Invalid PMTiles archive {source}: {e}")
+            raise DomainException(
+                key="proxy.pmtiles_invalid", params={"source": source}
+            )
+        if data is None:
+            return Response(status_code=204)
+
+        header = archive.header
+        headers = {"ETag": archive.etag}
+        encoding = header.content_encoding
+        if encoding == "gzip" and not accepts_gzip(accept_encoding):
+            data = gzip.decompress(data)
+        elif encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(content=data, media_type=header.content_type, headers=headers)
+
+    def get_archive(self, source: str, range_header: Optional[str] = None) -> Response:
+        """The raw archive, or the byte range asked by a `Range` header."""
+        if not SOURCE_PATTERN.match(source):
+            raise DomainException(key="proxy.invalid_source")
+        archive = self.archives.get(source)
+        headers = {"Accept-Ranges": "bytes", "ETag": archive.etag}
+
+        byte_range = None
+        if range_header:
+            try:
+                byte_range = parse_range(range_header, archive.size)
+            except ValueError:
+                # Multiple or malformed ranges: send the whole archive (RFC 9110).
+                pass
+            else:
+                if byte_range is None:
+                    headers["Content-Range"] = f"bytes */{archive.size}"
+                    return Response(status_code=416, headers=headers)
+
+        if byte_range is not None:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{archive.size}"
+            return Response(
+                content=archive.view[start : end + 1],
+                status_code=206,
+                media_type=ARCHIVE_CONTENT_TYPE,
+                headers=headers,
+            )
+
+        async def chunks() -> AsyncIterator[memoryview]:
+            for start in range(0, archive.size, STREAM_CHUNK_SIZE):
+                yield archive.view[start : start + STREAM_CHUNK_SIZE]
+
+        headers["Content-Length"] = str(archive.size)
+        return StreamingResponse(
+            chunks(), media_type=ARCHIVE_CONTENT_TYPE, headers=headers
+        )
+
+
+# Dependencies
+SettingsDep = Annotated[Settings, Depends(get_settings)]
+
+
+def get_pmtiles_service(settings: SettingsDep) -> PMTilesService:
+    return PMTilesService(settings, pmtiles_archives)
+
+
+PMTilesServiceDep = Annotated[PMTilesService, Depends(get_pmtiles_service)]
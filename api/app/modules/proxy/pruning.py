@@ -0,0 +1,99 @@
+"""
+Style-aware tile pruning.
+
+A map style reads a few source-layers and properties of each datasource; the
+tiles served for that map can drop the rest. Pruned tiles are cached next to the
+full tile under a variant named after the digest of what the style reads, so maps
+reading the same properties share them.
+"""
+
+import asyncio
+import hashlib
+import json
+import time
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, Optional, Tuple
+
+from app.core.config import Settings
+from app.core.database import sessionmanager
+from app.core.singleflight import SingleFlight
+from app.core.utils.mvt import prune_encoded_tile
+from app.core.utils.style_utils import extract_style_usage
+from app.modules.maps.models import Map
+from app.modules.maps.repository import MapRepository
+from app.modules.proxy.cache import CachedTile
+
+
+@dataclass(frozen=True)
+class StyleUsage:
+    """Source-layers of one datasource read by a style, with their properties."""
+
+    layers: Dict[str, Optional[FrozenSet[str]]]
+    digest: str
+
+    @classmethod
+    def from_layers(cls, layers: Dict[str, Optional[FrozenSet[str]]]) -> "StyleUsage":
+        canonical = json.dumps(
+            {
+                name: None if properties is None else sorted(properties)
+                for name, properties in layers.items()
+            },
+            sort_keys=True,
+        )
+        digest = hashlib.blake2b(canonical.encode(), digest_size=8).hexdigest()
+        return cls(layers=layers, digest=digest)
+
+    async def prune(self, tile: CachedTile) -> CachedTile:
+        """Pruned copy of a cached (possibly gzipped) tile."""
+        if tile.status_code == 204:
+            return tile
+        data = await asyncio.to_thread(
+            prune_encoded_tile, tile.data, tile.content_encoding, self.layers
+        )
+        return CachedTile(
+            data=data,
+            status_code=tile.status_code,
+            content_type=tile.content_type,
+            content_encoding=tile.content_encoding,
+        )
+
+
+class StyleUsageCache:
+    """Per-worker usage of each map style, reloaded after `ttl` seconds."""
+
+    def __init__(self, ttl: float = 30.0):
+        self.ttl = ttl
+        self._entries: Dict[int, Tuple[float, Dict[str, StyleUsage]]] = {}
+
+    def configure(self, settings: Settings) -> None:
+        self.ttl = settings.tile_prune_style_ttl_seconds
+        self._entries.clear()
+
+    def put(self, map_id: int, style: Optional[str]) -> Dict[str, StyleUsage]:
+        usages = {
+            datasource: StyleUsage.from_layers(layers)
+            for datasource, layers in extract_style_usage(style).items()
+        }
+        self._entries[map_id] = (time.monotonic() + self.ttl, usages)
+        return usages
+
+    async def _load(self, map_id: int) -> Optional[str]:
+        async for session in sessionmanager.get_session():
+            return await MapRepository(session, Map).get_style(map_id)
+
+    async def get(self, map_id: int, datasource: str) -> Optional[StyleUsage]:
+        """What the style of a map reads from a datasource, None when unknown."""
+        entry = self._entries.get(map_id)
+        if entry is None or entry[0] <= time.monotonic():
+            usages = self.put(map_id, await self._load(map_id))
+        else:
+            usages = entry[1]
+        return usages.get(datasource)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+style_usages = StyleUsageCache()
+# Concurrent requests for one pruned tile share a single pruning.
+prune_flights: SingleFlight[CachedTile] = SingleFlight()
@@ -0,0 +1,600 @@
+from datetime import datetime
+from typing import List, Optional, Set, Tuple
+
+from sqlalchemy import func, text, update
+from sqlalchemy.dialects import postgresql
+from sqlmodel import and_, delete, or_, select
+
+from app.core.enums.seed_job_status import SeedJobStatus
+from app.core.repository import BaseRepository
+from app.core.utils.tile_utils import MAX_LATITUDE
+from app.core.xact import xact_horizon
+from app.modules.proxy.models import (
+    DatasourceExtent,
+    DatasourceOverview,
+    TileDirtyRegion,
+    TileEngineSource,
+    TileSeedJob,
+)
+
+# Statement-level triggers: one INSERT/UPDATE/DELETE logs the boxes of the rows it
+# changed (or their extent past `max_rows`), so bulk edits cost one extra query.
+# Geometries without SRID, or any failure to compute the boxes (an unknown SRID),
+# log the whole datasource instead: the trigger never aborts the edit itself.
+DIRTY_REGION_FUNCTIONS = (
+    """
+    CREATE OR REPLACE FUNCTION canopy_log_dirty_regions() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    DECLARE
+        v_geom_column text := TG_ARGV[0];
+        v_datasource text := TG_ARGV[1];
+        v_max_rows integer := TG_ARGV[2]::integer;
+        v_changed text;
+        v_count bigint;
+        v_unplaced bigint;
+    BEGIN
+        IF TG_OP = 'TRUNCATE' THEN
+            INSERT INTO tile_dirty_region (datasource) VALUES (v_datasource);
+            RETURN NULL;
+        ELSIF TG_OP = 'INSERT' THEN
+            v_changed := format('SELECT %I AS geom FROM new_rows', v_geom_column);
+        ELSIF TG_OP = 'DELETE' THEN
+            v_changed := format('SELECT %I AS geom FROM old_rows', v_geom_column);
+        ELSE
+            v_changed := format(
+                'SELECT %1$I AS geom FROM old_rows UNION ALL SELECT %1$I FROM new_rows',
+                v_geom_column
+            );
+        END IF;
+
+        BEGIN
+            EXECUTE format(
+                'SELECT count(*), count(*) FILTER (WHERE ST_SRID(geom) = 0) '
+                'FROM (%s) changed WHERE geom IS NOT NULL', v_changed
+            ) INTO v_count, v_unplaced;
+            IF v_count = 0 THEN
+                RETURN NULL;
+            END IF;
+            IF v_unplaced > 0 THEN
+                INSERT INTO tile_dirty_region (datasource) VALUES (v_datasource);
+                RETURN NULL;
+            END IF;
+
+            EXECUTE format(
+                'INSERT INTO tile_dirty_region (datasource, min_x, min_y, max_x, max_y) '
+                'SELECT $1, ST_XMin(box), ST_YMin(box), ST_XMax(box), ST_YMax(box) '
+                'FROM (SELECT %s AS box FROM (%s) changed WHERE geom IS NOT NULL) boxes',
+                CASE WHEN v_count > v_max_rows
+                    THEN 'ST_Extent(ST_Transform(geom, 4326))'
+                    ELSE 'Box2D(ST_Transform(geom, 4326))'
+                END,
+                v_changed
+            ) USING v_datasource;
+        EXCEPTION WHEN OTHERS THEN
+            RAISE WARNING 'canopy_log_dirty_regions on %: %', TG_TABLE_NAME, SQLERRM;
+            BEGIN
+                INSERT INTO tile_dirty_region (datasource) VALUES (v_datasource);
+            EXCEPTION WHEN OTHERS THEN
+                RAISE WARNING 'canopy_log_dirty_regions on %: %',
+                    TG_TABLE_NAME, SQLERRM;
+            END;
+        END;
+        RETURN NULL;
+    END;
+    $$
+    """,
+    """
+    CREATE OR REPLACE FUNCTION canopy_install_dirty_region_triggers(
+        target regclass, geom_column text, datasource text, max_rows integer
+    ) RETURNS void
+    LANGUAGE plpgsql AS $$
+    DECLARE
+        v_args text := format('%L, %L, %L', geom_column, datasource, max_rows);
+    BEGIN
+        EXECUTE format('DROP TRIGGER IF EXISTS canopy_dirty_insert ON %s', target);
+        EXECUTE format('DROP TRIGGER IF EXISTS canopy_dirty_update ON %s', target);
+        EXECUTE format('DROP TRIGGER IF EXISTS canopy_dirty_delete ON %s', target);
+        EXECUTE format('DROP TRIGGER IF EXISTS canopy_dirty_truncate ON %s', target);
+        EXECUTE format(
+            'CREATE TRIGGER canopy_dirty_insert AFTER INSERT ON %s '
+            'REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT '
+            'EXECUTE FUNCTION canopy_log_dirty_regions(%s)', target, v_args
+        );
+        EXECUTE format(
+            'CREATE TRIGGER canopy_dirty_update AFTER UPDATE ON %s '
+            'REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows '
+            'FOR EACH STATEMENT EXECUTE FUNCTION canopy_log_dirty_regions(%s)',
+            target, v_args
+        );
+        EXECUTE format(
+            'CREATE TRIGGER canopy_dirty_delete AFTER DELETE ON %s '
+            'REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT '
+            'EXECUTE FUNCTION canopy_log_dirty_regions(%s)', target, v_args
+        );
+        EXECUTE format(
+            'CREATE TRIGGER canopy_dirty_truncate AFTER TRUNCATE ON %s '
+            'FOR EACH STATEMENT EXECUTE FUNCTION canopy_log_dirty_regions(%s)',
+            target, v_args
+        );
+    END;
+    $$
+    """,
+)
+
+
+class DirtyRegionRepository(BaseRepository[TileDirtyRegion]):
+    """Repository for the dirty-region log fed by datasource table triggers."""
+
+    async def get_last_id(self) -> int:
+        result = await self.session.exec(select(func.max(TileDirtyRegion.id)))
+        return result.first() or 0
+
+    async def get_horizon(self) -> int:
+        return await xact_horizon(self.session)
+
+    async def get_since(
+        self, horizon: int, after_id: int, limit: int
+    ) -> List[TileDirtyRegion]:
+        """Regions of transactions from `horizon` on, past `after_id` in id order."""
+        query = (
+            select(TileDirtyRegion)
+            .where(TileDirtyRegion.xid >= horizon, TileDirtyRegion.id > after_id)
+            .order_by(TileDirtyRegion.id)
+            .limit(limit)
+        )
+        result = await self.session.exec(query)
+        return list(result.all())
+
+    async def prune(self, before: datetime) -> None:
+        await self.session.execute(
+            delete(TileDirtyRegion).where(TileDirtyRegion.created_at < before)
+        )
+
+    async def install_triggers(
+        self, table: str, geometry_column: str, datasource: str, max_rows: int
+    ) -> None:
+        """(Re)create the dirty-region triggers on a datasource table."""
+        for statement in DIRTY_REGION_FUNCTIONS:
+            await self.session.execute(text(statement))
+        await self.session.execute(
+            text(
+                "SELECT canopy_install_dirty_region_triggers("
+                "CAST(:table AS regclass), :geometry_column, :datasource, :max_rows)"
+            ),
+            {
+                "table": table,
+                "geometry_column": geometry_column,
+                "datasource": datasource,
+                "max_rows": max_rows,
+            },
+        )
+
+
+class SeedJobRepository(BaseRepository[TileSeedJob]):
+    """Repository for TileSeedJob entities."""
+
+    async def get_recent(self, limit: int) -> List[TileSeedJob]:
+        query = select(TileSeedJob).order_by(TileSeedJob.id.desc()).limit(limit)
+        result = await self.session.exec(query)
+        return list(result.all())
+
+    async def claim_next(
+        self, now: datetime, stale_before: datetime, claim_token: str
+    ) -> Optional[TileSeedJob]:
+        """
+        Lock the next pending job, or a running one whose worker stopped sending
+        heartbeats, and mark it running under `claim_token`. Other workers skip
+        the locked row.
+        """
+        query = (
+            select(TileSeedJob)
+            .where(
+                or_(
+                    TileSeedJob.status == SeedJobStatus.PENDING,
+                    and_(
+                        TileSeedJob.status == SeedJobStatus.RUNNING,
+                        TileSeedJob.heartbeat_at < stale_before,
+                    ),
+                )
+            )
+            .order_by(TileSeedJob.id)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        )
+        job = (await self.session.exec(query)).first()
+        if job is None:
+            return None
+        job.status = SeedJobStatus.RUNNING
+        job.claim_token = claim_token
+        job.heartbeat_at = now
+        job.started_at = job.started_at or now
+        await self.session.flush()
+        return job
+
+    async def save_progress(self, job_id: int, claim_token: str, values: dict) -> bool:
+        """
+        Update a job running under `claim_token`; False once it is no longer
+        (cancelled, or claimed again by another worker).
+        """
+        result = await self.session.execute(
+            update(TileSeedJob)
+            .where(
+                TileSeedJob.id == job_id,
+                TileSeedJob.status == SeedJobStatus.RUNNING,
+                TileSeedJob.claim_token == claim_token,
+            )
+            .values(**values)
+        )
+        return result.rowcount > 0
+
+
+# Cells of the occupancy grid touched by each feature bbox, with the same
+# arithmetic as `app.core.utils.tile_utils.tile_range` (no buffer).
+OCCUPANCY_QUERY = """
+    WITH boxes AS (
+        SELECT Box2D(ST_Transform({geom}, 4326)) AS box
+        FROM {table} WHERE {geom} IS NOT NULL
+    ), ranges AS (
+        SELECT
+            floor((ST_XMin(box) + 180) / 360 * :n) AS x0,
+            floor((ST_XMax(box) + 180) / 360 * :n) AS x1,
+            floor((1 - asinh(tan(radians(LEAST(ST_YMax(box), :max_lat)))) / pi())
+                / 2 * :n) AS y0,
+            floor((1 - asinh(tan(radians(GREATEST(ST_YMin(box), -:max_lat)))) / pi())
+                / 2 * :n) AS y1
+        FROM boxes
+    )
+    SELECT DISTINCT x, y
+    FROM ranges,
+        generate_series(GREATEST(x0, 0)::int, LEAST(x1, :n - 1)::int) AS x,
+        generate_series(GREATEST(y0, 0)::int, LEAST(y1, :n - 1)::int) AS y
+"""
+
+EXTENT_QUERY = """
+    SELECT ST_XMin(extent), ST_YMin(extent), ST_XMax(extent), ST_YMax(extent), n
+    FROM (
+        SELECT ST_Extent(ST_Transform({geom}, 4326)) AS extent, count({geom}) AS n
+        FROM {table}
+    ) stats
+"""
+
+# Geometries of `table` inserted or changed by the datasource update of the
+# transaction (see `DatasourceRepository.apply_diff`), as a `{table}` above.
+CHANGED_ROWS = """(
+    SELECT l.{geom} FROM {table} l JOIN canopy_diff d ON l.{key} = d.key
+    WHERE d.operation <> 'delete'
+) changed"""
+
+
+def quote_table(name: str) -> str:
+    """Quote a (possibly schema-qualified) table name for raw SQL."""
+    preparer = postgresql.dialect().identifier_preparer
+    return ".".join(preparer.quote(part) for part in name.split("."))
+
+
+class DatasourceExtentRepository(BaseRepository[DatasourceExtent]):
+    """Repository for DatasourceExtent entities, keyed by datasource."""
+
+    async def get_by_datasource(
+        self, datasource: str, for_update: bool = False
+    ) -> Optional[DatasourceExtent]:
+        query = select(DatasourceExtent).where(
+            DatasourceExtent.datasource == datasource
+        )
+        if for_update:
+            query = query.with_for_update()
+        result = await self.session.exec(query)
+        return result.first()
+
+    async def get_updated_since(
+        self, after: Optional[datetime]
+    ) -> List[DatasourceExtent]:
+        query = select(DatasourceExtent)
+        if after is not None:
+            query = query.where(DatasourceExtent.updated_at > after)
+        result = await self.session.exec(query)
+        return list(result.all())
+
+    async def get_datasources(self) -> Set[str]:
+        result = await self.session.exec(select(DatasourceExtent.datasource))
+        return set(result.all())
+
+    async def compute(
+        self, table: str, geometry_column: str, zoom: Optional[int]
+    ) -> Tuple[Optional[tuple], int, List[Tuple[int, int]]]:
+        """
+        Extent (WGS84), feature count and occupied cells at `zoom` of a table.
+        No cells are computed without zoom.
+        """
+        names = {
+            "table": quote_table(table),
+            "geom": postgresql.dialect().identifier_preparer.quote(geometry_column),
+        }
+        return await self._compute(names, zoom)
+
+    async def compute_changed(
+        self, table: str, key: str, geometry_column: str, zoom: Optional[int]
+    ) -> Tuple[Optional[tuple], List[Tuple[int, int]]]:
+        """
+        Extent (WGS84) and occupied cells at `zoom` of the features the update
+        running in this transaction inserted or changed, matched on `key`.
+        """
+        preparer = postgresql.dialect().identifier_preparer
+        geom = preparer.quote(geometry_column)
+        names = {
+            "table": CHANGED_ROWS.format(
+                table=quote_table(table), key=preparer.quote(key), geom=geom
+            ),
+            "geom": geom,
+        }
+        bbox, _, cells = await self._compute(names, zoom)
+        return bbox, cells
+
+    async def _compute(
+        self, names: dict, zoom: Optional[int]
+    ) -> Tuple[Optional[tuple], int, List[Tuple[int, int]]]:
+        result = await self.session.execute(text(EXTENT_QUERY.format(**names)))
+        min_x, min_y, max_x, max_y, count = result.one()
+        if min_x is None:
+            return None, 0, []
+        cells: List[Tuple[int, int]] = []
+        if zoom is not None:
+            result = await self.session.execute(
+                text(OCCUPANCY_QUERY.format(**names)),
+                {"n": 2**zoom, "max_lat": MAX_LATITUDE},
+            )
+            cells = [(x, y) for x, y in result.all()]
+        return (min_x, min_y, max_x, max_y), count, cells
+
+    async def upsert(self, values: dict) -> None:
+        """Insert or replace the extent row of `values["datasource"]`."""
+        statement = postgresql.insert(DatasourceExtent).values(**values)
+        await self.session.execute(
+            statement.on_conflict_do_update(
+                index_elements=["datasource"],
+                set_={
+                    **{k: statement.excluded[k] for k in values if k != "datasource"},
+                    "updated_at": func.now(),
+                },
+            )
+        )
+
+    async def update_by_datasource(self, datasource: str, values: dict) -> None:
+        await self.session.execute(
+            update(DatasourceExtent)
+            .where(DatasourceExtent.datasource == datasource)
+            .values(**values, updated_at=func.now())
+        )
+
+    async def delete_by_datasource(self, datasource: str) -> bool:
+        result = await self.session.execute(
+            delete(DatasourceExtent).where(DatasourceExtent.datasource == datasource)
+        )
+        return result.rowcount > 0
+
+
+# Columns of a table with their type, and the SRID declared on the geometry column.
+COLUMNS_QUERY = """
+    SELECT a.attname, t.typname,
+        CASE WHEN t.typname = 'geometry' THEN postgis_typmod_srid(a.atttypmod) END
+    FROM pg_attribute a
+    JOIN pg_type t ON t.oid = a.atttypid
+    WHERE a.attrelid = CAST(:table AS regclass) AND a.attnum > 0 AND NOT a.attisdropped
+    ORDER BY a.attnum
+"""
+
+SRID_QUERY = "SELECT ST_SRID({geom}) FROM {table} WHERE {geom} IS NOT NULL LIMIT 1"
+
+
+class TileEngineSourceRepository(BaseRepository[TileEngineSource]):
+    """Repository for TileEngineSource entities, keyed by datasource."""
+
+    async def get_by_datasource(self, datasource: str) -> Optional[TileEngineSource]:
+        result = await self.session.exec(
+            select(TileEngineSource).where(TileEngineSource.datasource == datasource)
+        )
+        return result.first()
+
+    async def describe(
+        self, table: str, geometry_column: str
+    ) -> Tuple[Optional[int], List[str]]:
+        """
+        SRID of a geometry column (None when the column does not exist) and the
+        other non-spatial columns of its table, in table order.
+        """
+        result = await self.session.execute(text(COLUMNS_QUERY), {"table": table})
+        srid, columns = None, []
+        for name, type_name, typmod_srid in result.all():
+            if name == geometry_column:
+                if type_name == "geometry":
+                    srid = typmod_srid or await self._data_srid(table, name)
+            elif type_name not in ("geometry", "geography"):
+                columns.append(name)
+        return srid, columns
+
+    async def _data_srid(self, table: str, geometry_column: str) -> int:
+        """SRID of the data of an unconstrained geometry column, WGS84 if empty."""
+        names = {
+            "table": quote_table(table),
+            "geom": postgresql.dialect().identifier_preparer.quote(geometry_column),
+        }
+        result = await self.session.execute(text(SRID_QUERY.format(**names)))
+        return result.scalar() or 4326
+
+    async def upsert(self, values: dict) -> None:
+        """Insert or replace the engine configuration of `values["datasource"]`."""
+        statement = postgresql.insert(TileEngineSource).values(**values)
+        await self.session.execute(
+            statement.on_conflict_do_update(
+                index_elements=["datasource"],
+                set_={
+                    **{k: statement.excluded[k] for k in values if k != "datasource"},
+                    "updated_at": func.now(),
+                },
+            )
+        )
+
+    async def delete_by_datasource(self, datasource: str) -> bool:
+        result = await self.session.execute(
+            delete(TileEngineSource).where(TileEngineSource.datasource == datasource)
+        )
+        return result.rowcount > 0
+
+
+# Simplified to the band's tolerance, snapped to its grid, without features
+# smaller than a pixel. Values are inlined: CREATE TABLE AS takes no parameters.
+OVERVIEW_QUERY = """
+    SELECT {columns}geom FROM (
+        SELECT {columns}ST_SnapToGrid(
+            ST_SimplifyPreserveTopology({geom}, {tolerance}), {grid}
+        ) AS geom
+        FROM {table}
+        WHERE {column} IS NOT NULL
+        {group_by}
+    ) simplified
+    WHERE NOT ST_IsEmpty(geom) AND CASE ST_Dimension(geom)
+        WHEN 2 THEN ST_Area(geom) >= {min_area}
+        WHEN 1 THEN ST_Length(geom) >= {tolerance}
+        ELSE true
+    END
+"""
+
+OVERVIEW_BUILD_STATEMENTS = (
+    "DROP TABLE IF EXISTS {tmp}",
+    "CREATE TABLE {tmp} AS {query}",
+    "CREATE INDEX {tmp_index} ON {tmp} USING gist (geom)",
+    "DROP TABLE IF EXISTS {target}",
+    "ALTER TABLE {tmp} RENAME TO {target_name}",
+    "ALTER INDEX {tmp_index_qualified} RENAME TO {target_index}",
+    "ANALYZE {target}",
+)
+
+
+class OverviewRepository(BaseRepository[DatasourceOverview]):
+    """Repository for DatasourceOverview entities and their generalized tables."""
+
+    async def get_by_datasource(self, datasource: str) -> List[DatasourceOverview]:
+        result = await self.session.exec(
+            select(DatasourceOverview)
+            .where(DatasourceOverview.datasource == datasource)
+            .order_by(DatasourceOverview.min_zoom)
+        )
+        return list(result.all())
+
+    async def get_built(self) -> List[DatasourceOverview]:
+        result = await self.session.exec(
+            select(DatasourceOverview).where(DatasourceOverview.built_at.is_not(None))
+        )
+        return list(result.all())
+
+    async def upsert(self, values: dict) -> None:
+        """Insert or replace the overview of a datasource zoom band."""
+        statement = postgresql.insert(DatasourceOverview).values(**values)
+        await self.session.execute(
+            statement.on_conflict_do_update(
+                constraint="uix_overview_datasource_zoom",
+                set_={
+                    k: statement.excluded[k]
+                    for k in values
+                    if k not in ("datasource", "min_zoom")
+                },
+            )
+        )
+
+    async def mark_stale(self) -> None:
+        """Flag the overviews of datasources edited since they were built."""
+        await self.session.execute(
+            update(DatasourceOverview)
+            .where(
+                DatasourceOverview.stale_since.is_(None),
+                DatasourceOverview.built_at.is_not(None),
+                select(TileDirtyRegion.id)
+                .where(
+                    TileDirtyRegion.datasource == DatasourceOverview.datasource,
+                    TileDirtyRegion.id > DatasourceOverview.region_id,
+                )
+                .exists(),
+            )
+            .values(stale_since=func.now())
+        )
+
+    async def claim_next(self, stale_before: datetime) -> Optional[DatasourceOverview]:
+        """
+        Lock the next overview to build: never built, or stale since before
+        `stale_before`. Workers skip the overviews already locked by another.
+        """
+        result = await self.session.exec(
+            select(DatasourceOverview)
+            .where(
+                or_(
+                    and_(
+                        DatasourceOverview.built_at.is_(None),
+                        DatasourceOverview.stale_since.is_(None),
+                    ),
+                    DatasourceOverview.stale_since <= stale_before,
+                )
+            )
+            .order_by(DatasourceOverview.stale_since.asc().nulls_first())
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        )
+        return result.first()
+
+    async def build(self, overview: DatasourceOverview, grid: float) -> int:
+        """
+        (Re)create the generalized table of an overview, in the transaction of
+        the session: readers keep the previous table until commit.
+        """
+        quote = postgresql.dialect().identifier_preparer.quote
+        schema, _, name = overview.table_name.rpartition(".")
+        prefix = f"{quote(schema)}." if schema else ""
+        geom = quote(overview.geometry_column)
+        group = overview.aggregate_by
+        columns = group if group is not None else overview.columns
+        if overview.id_column and group is None:
+            columns = [*columns, overview.id_column]
+        tolerance = float(overview.tolerance)
+        query = OVERVIEW_QUERY.format(
+            columns="".join(f"{quote(c)}, " for c in columns),
+            geom=f"ST_Union(ST_Transform({geom}, 3857))"
+            if group is not None
+            else f"ST_Transform({geom}, 3857)",
+            tolerance=repr(tolerance),
+            grid=repr(float(grid)),
+            min_area=repr(tolerance * tolerance),
+            table=quote_table(overview.source_table),
+            column=geom,
+            group_by=f"GROUP BY {', '.join(quote(c) for c in group)}" if group else "",
+        )
+        names = {
+            "tmp": prefix + quote(f"{name}_tmp"),
+            "tmp_index": quote(f"{name}_tmp_geom_idx"),
+            "tmp_index_qualified": prefix + quote(f"{name}_tmp_geom_idx"),
+            "target": prefix + quote(name),
+            "target_name": quote(name),
+            "target_index": quote(f"{name}_geom_idx"),
+            "query": query,
+        }
+        for statement in OVERVIEW_BUILD_STATEMENTS:
+            await self.session.execute(text(statement.format(**names)))
+        result = await self.session.execute(
+            text(f"SELECT count(*) FROM {names['target']}")
+        )
+        return result.scalar()
+
+    async def delete_by_ids(self, overview_ids: List[int]) -> None:
+        await self.session.execute(
+            delete(DatasourceOverview).where(DatasourceOverview.id.in_(overview_ids))
+        )
+
+    async def drop_table(self, table_name: str) -> None:
+        await self.session.execute(
+            text(f"DROP TABLE IF EXISTS {quote_table(table_name)}")
+        )
+
+    async def save(self, overview_id: int, values: dict) -> None:
+        await self.session.execute(
+            update(DatasourceOverview)
+            .where(DatasourceOverview.id == overview_id)
+            .values(**values)
+        )
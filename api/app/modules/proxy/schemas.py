@@ -0,0 +1,150 @@
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from pydantic import BaseModel, ConfigDict, Field, computed_field
+
+from app.core.enums.seed_job_status import SeedJobStatus
+
+
+class TileCacheStatsRead(BaseModel):
+    """Tile cache counters of the worker that answered the request."""
+
+    memory_hits: int
+    disk_hits: int
+    misses: int
+    stores: int
+    hit_ratio: float
+    memory_entries: int
+    memory_bytes: int
+    memory_max_bytes: int
+    memory_evictions: int
+    memory_shared_tiles: int
+    disk_enabled: bool
+    disk_evictions: int
+
+
+class CoalescingStatsRead(BaseModel):
+    """Single-flight counters of the worker that answered the request."""
+
+    upstream_fetches: int
+    coalesced_requests: int
+    failed_fetches: int
+    in_flight: int
+
+
+class TileSeedJobCreate(BaseModel):
+    """Seed one datasource, or every datasource of a map, over a WGS84 bbox."""
+
+    source: Optional[str] = None
+    map_id: Optional[int] = None
+    bbox: Tuple[float, float, float, float]
+    min_zoom: int = 0
+    max_zoom: int = 12
+
+
+class TileSeedJobRead(BaseModel):
+    id: int
+    status: SeedJobStatus
+    map_id: Optional[int]
+    datasources: List[str]
+    bbox: Tuple[float, float, float, float]
+    min_zoom: int
+    max_zoom: int
+    total_tiles: int
+    cursor: int
+    tiles_fetched: int
+    tiles_skipped: int
+    tiles_failed: int
+    tiles_per_second: float
+    started_at: Optional[datetime]
+    finished_at: Optional[datetime]
+    error: Optional[str]
+    model_config = ConfigDict(from_attributes=True)
+
+    @computed_field
+    @property
+    def progress(self) -> float:
+        return self.cursor / self.total_tiles if self.total_tiles else 1.0
+
+    @computed_field
+    @property
+    def eta_seconds(self) -> Optional[float]:
+        if self.status != SeedJobStatus.RUNNING or self.tiles_per_second <= 0:
+            return None
+        return (self.total_tiles - self.cursor) / self.tiles_per_second
+
+
+class DatasourceExtentRead(BaseModel):
+    datasource: str
+    bbox: Optional[Tuple[float, float, float, float]]
+    feature_count: int
+    occupancy_zoom: Optional[int]
+    occupancy: Optional[bytes] = Field(default=None, exclude=True)
+    computed_at: datetime
+    updated_at: datetime
+    model_config = ConfigDict(from_attributes=True)
+
+    @computed_field
+    @property
+    def occupied_tiles(self) -> Optional[int]:
+        """Occupied tiles at `occupancy_zoom`, when the extent has a grid."""
+        if self.occupancy is None:
+            return None
+        return int.from_bytes(self.occupancy, "little").bit_count()
+
+
+class TileEngineSourceUpdate(BaseModel):
+    """Render a datasource table with ST_AsMVT in the API instead of Martin."""
+
+    table: Optional[str] = None
+    geometry_column: str = "geom"
+    id_column: Optional[str] = None
+    simplify: float = Field(default=0.0, ge=0)
+    extent: int = Field(default=4096, gt=0)
+    buffer: int = Field(default=64, ge=0)
+
+
+class TileEngineSourceRead(BaseModel):
+    datasource: str
+    table_name: str
+    geometry_column: str
+    srid: int
+    id_column: Optional[str]
+    columns: List[str]
+    simplify: float
+    extent: int
+    buffer: int
+    archive: bool
+    updated_at: datetime
+    model_config = ConfigDict(from_attributes=True)
+
+
+class DatasourceOverviewsUpdate(BaseModel):
+    """
+    Generalized overview tables of a datasource table, one per zoom band
+    (`TILE_OVERVIEW_ZOOM_BANDS` by default). `aggregate_by` merges the features
+    sharing these column values into one.
+    """
+
+    table: Optional[str] = None
+    geometry_column: str = "geom"
+    id_column: Optional[str] = None
+    aggregate_by: Optional[List[str]] = None
+    bands: Optional[List[Tuple[int, int]]] = None
+
+
+class DatasourceOverviewRead(BaseModel):
+    datasource: str
+    min_zoom: int
+    max_zoom: int
+    table_name: str
+    source_table: str
+    columns: List[str]
+    aggregate_by: Optional[List[str]]
+    tolerance: float
+    feature_count: int
+    stale_since: Optional[datetime]
+    built_at: Optional[datetime]
+    build_seconds: Optional[float]
+    error: Optional[str]
+    model_config = ConfigDict(from_attributes=True)
@@ -0,0 +1,412 @@
+"""
+Tile cache pre-seeding.
+
+Admins create seeding jobs (bbox x zoom range, for a datasource or every
+datasource of a map). Each API worker runs at most one job at a time, claimed
+from the `tile_seed_job` table, and fetches its tiles through the regular proxy
+pipeline into the disk tier of the cache. Seeding yields to interactive traffic:
+it keeps a few fetches in flight and pauses while user requests wait on Martin.
+
+Heartbeats are sent by the job runner while the tiles are fed in a separate
+task, so pausing does not let the job go stale. Each claim stores a new token
+that every save must match: a worker whose job was cancelled, or taken over
+after its heartbeats stopped, stops seeding at its next heartbeat.
+"""
+
+import asyncio
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Annotated, Iterator, List, Optional, Set, Tuple
+
+from fastapi import Depends
+
+from app.core.config import Settings, get_settings
+from app.core.database import SessionDep, sessionmanager
+from app.core.enums.seed_job_status import SeedJobStatus
+from app.core.exceptions import DomainException, PermissionDeniedException
+from app.core.logging_config import logger
+from app.core.martin import martin_client
+from app.core.permissions import has_any_role
+from app.core.utils.tile_utils import MAX_ZOOM, TileRange, tile_range
+from app.modules.maps.service import MapService, MapServiceDep
+from app.modules.proxy.cache import TileCache
+from app.modules.proxy.engine import tile_engine
+from app.modules.proxy.extent import extent_index
+from app.modules.proxy.models import TileSeedJob
+from app.modules.proxy.repository import SeedJobRepository
+from app.modules.proxy.schemas import TileSeedJobCreate, TileSeedJobRead
+from app.modules.proxy.service import SOURCE_PATTERN, TileProxyService, tile_flights
+from app.modules.users.models import UserRole
+from app.modules.users.schemas import UserDetail
+
+CHECKPOINT_SECONDS = 2.0
+# A running job whose worker sent no heartbeat for this long is taken over.
+STALE_AFTER = timedelta(seconds=60)
+YIELD_DELAY = 0.05
+
+SeedRange = Tuple[str, TileRange]
+
+
+def seed_ranges(
+    datasources: List[str],
+    bbox: Tuple[float, float, float, float],
+    min_zoom: int,
+    max_zoom: int,
+) -> List[SeedRange]:
+    """Tile ranges of a job, in seeding order."""
+    return [
+        (source, tile_range(bbox, z, buffer=0))
+        for source in datasources
+        for z in range(min_zoom, max_zoom + 1)
+    ]
+
+
+def iter_seed_tiles(
+    ranges: List[SeedRange], start: int = 0
+) -> Iterator[Tuple[int, str, int, int, int]]:
+    """(position, source, z, x, y) of every tile from `start` on."""
+    position = 0
+    for source, zoom_range in ranges:
+        if position + zoom_range.count <= start:
+            position += zoom_range.count
+            continue
+        height = zoom_range.max_y - zoom_range.min_y + 1
+        offset = max(start - position, 0)
+        for index in range(offset, zoom_range.count):
+            x = zoom_range.min_x + index // height
+            y = zoom_range.min_y + index % height
+            yield position + index, source, zoom_range.z, x, y
+        position += zoom_range.count
+
+
+class SeedProgress:
+    """Tracks completed positions, which finish out of order, and the cursor."""
+
+    def __init__(self, job: TileSeedJob):
+        self.cursor = job.cursor
+        self.fetched = job.tiles_fetched
+        self.skipped = job.tiles_skipped
+        self.failed = job.tiles_failed
+        # The rate only counts this run, not tiles seeded before a resume.
+        self._resumed_from = self.processed
+        self.started_at = time.monotonic()
+        self._done: Set[int] = set()
+
+    def complete(self, position: int, outcome: str) -> None:
+        setattr(self, outcome, getattr(self, outcome) + 1)
+        self._done.add(position)
+        while self.cursor in self._done:
+            self._done.remove(self.cursor)
+            self.cursor += 1
+
+    @property
+    def processed(self) -> int:
+        return self.fetched + self.skipped + self.failed
+
+    @property
+    def rate(self) -> float:
+        elapsed = time.monotonic() - self.started_at
+        if elapsed <= 0:
+            return 0.0
+        return (self.processed - self._resumed_from) / elapsed
+
+
+class TileSeeder:
+    """Runs seeding jobs in the background of one worker."""
+
+    def __init__(self):
+        self.cache: Optional[TileCache] = None
+        self.settings: Optional[Settings] = None
+        self.in_flight = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _save(self, job: TileSeedJob, values: dict) -> bool:
+        async for session in sessionmanager.get_session():
+            repository = SeedJobRepository(session, TileSeedJob)
+            saved = await repository.save_progress(job.id, job.claim_token, values)
+            await session.commit()
+            return saved
+
+    async def claim(self) -> Optional[TileSeedJob]:
+        async for session in sessionmanager.get_session():
+            repository = SeedJobRepository(session, TileSeedJob)
+            now = datetime.utcnow()
+            job = await repository.claim_next(now, now - STALE_AFTER, uuid.uuid4().hex)
+            await session.commit()
+            return job
+
+    async def _yield_to_interactive(self) -> None:
+        """Wait while user requests keep Martin busy."""
+        while (
+            tile_flights.in_flight - self.in_flight
+            >= self.settings.tile_seed_yield_threshold
+        ):
+            await asyncio.sleep(YIELD_DELAY)
+
+    async def _seed_tile(
+        self,
+        service: TileProxyService,
+        progress: SeedProgress,
+        position: int,
+        tile: Tuple[str, int, int, int],
+    ) -> None:
+        self.in_flight += 1
+        try:
+            fetched = await service.prefetch_tile(*tile)
+            progress.complete(position, "fetched" if fetched else "skipped")
+        except Exception:
+            # Martin errors are counted, the job goes on with the next tiles.
+            progress.complete(position, "failed")
+        finally:
+            self.in_flight -= 1
+
+    def _progress_values(self, progress: SeedProgress) -> dict:
+        return {
+            "cursor": progress.cursor,
+            "tiles_fetched": progress.fetched,
+            "tiles_skipped": progress.skipped,
+            "tiles_failed": progress.failed,
+            "tiles_per_second": progress.rate,
+            "heartbeat_at": datetime.utcnow(),
+        }
+
+    async def _seed(
+        self, job: TileSeedJob, service: TileProxyService, progress: SeedProgress
+    ) -> None:
+        """Fetch the tiles of a job from its cursor on."""
+        ranges = seed_ranges(job.datasources, job.bbox, job.min_zoom, job.max_zoom)
+        concurrency = asyncio.Semaphore(self.settings.tile_seed_concurrency)
+        tasks: Set[asyncio.Task] = set()
+
+        def release(task: asyncio.Task) -> None:
+            tasks.discard(task)
+            concurrency.release()
+
+        try:
+            for position, *tile in iter_seed_tiles(ranges, job.cursor):
+                await concurrency.acquire()
+                await self._yield_to_interactive()
+                task = asyncio.create_task(
+                    self._seed_tile(service, progress, position, tuple(tile))
+                )
+                tasks.add(task)
+                task.add_done_callback(release)
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _stop(self, task: asyncio.Task) -> None:
+        """Cancel the seeding of a job and wait until it has stopped."""
+        task.cancel()
+        await asyncio.wait({task})
+
+    async def run_job(self, job: TileSeedJob) -> None:
+        service = TileProxyService(
+            martin_client.get_client(),
+            self.settings,
+            self.cache,
+            extents=extent_index if self.settings.tile_extent_enabled else None,
+            engine=tile_engine if self.settings.tile_engine_enabled else None,
+        )
+        progress = SeedProgress(job)
+        task = asyncio.create_task(self._seed(job, service, progress))
+        try:
+            while not (await asyncio.wait({task}, timeout=CHECKPOINT_SECONDS))[0]:
+                if not await self._save(job, self._progress_values(progress)):
+                    logger.info(
+                        f"Tile seeding job {job.id} was cancelled or taken over"
+                    )
+                    return
+        except asyncio.CancelledError:
+            # Worker shutdown: the heartbeat goes stale and another worker resumes.
+            await self._stop(task)
+            await asyncio.shield(self._save(job, self._progress_values(progress)))
+            raise
+        finally:
+            if not task.done():
+                await self._stop(task)
+
+        task.result()
+        values = self._progress_values(progress)
+        values.update(
+            status=SeedJobStatus.COMPLETED,
+            finished_at=datetime.utcnow(),
+            tiles_per_second=0.0,
+        )
+        await self._save(job, values)
+
+    async def _run_next(self) -> bool:
+        """Run the next claimable job, False when there is none."""
+        job = await self.claim()
+        if job is None:
+            return False
+        try:
+            await self.run_job(job)
+        except Exception as exc:
+            logger.exception(f"Tile seeding job {job.id} failed")
+            await self._save(
+                job,
+                {
+                    "status": SeedJobStatus.FAILED,
+                    "finished_at": datetime.utcnow(),
+                    "error": str(exc)[:500],
+                },
+            )
+        return True
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if await self._run_next():
+                    continue
+            except Exception:
+                logger.exception("Failed to claim a tile seeding job")
+            await asyncio.sleep(self.settings.tile_seed_poll_seconds)
+
+    def start(self, cache: Optional[TileCache], settings: Settings) -> None:
+        if cache is None or not settings.tile_seed_enabled:
+            return
+        self.cache = cache
+        self.settings = settings
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.cache = None
+
+
+tile_seeder = TileSeeder()
+
+
+class TileSeedService:
+    """Admin API of the seeding jobs."""
+
+    def __init__(
+        self,
+        repository: SeedJobRepository,
+        map_service: MapService,
+        settings: Settings,
+    ):
+        self.repository = repository
+        self.map_service = map_service
+        self.settings = settings
+
+    def _ensure_admin(self, current_user: UserDetail) -> None:
+        if not has_any_role(current_user, [UserRole.ADMIN]):
+            raise PermissionDeniedException(
+                params={"detail": "proxy.cache_permission_denied"}
+            )
+
+    async def create_job(
+        self, data: TileSeedJobCreate, current_user: UserDetail
+    ) -> TileSeedJobRead:
+        self._ensure_admin(current_user)
+
+        if (data.source is None) == (data.map_id is None):
+            raise DomainException(key="seed.target_required")
+        if data.map_id is not None:
+            await self.map_service.get_map(data.map_id, current_user)
+            datasources = await self.map_service.get_map_datasources(data.map_id)
+            if not datasources:
+                raise DomainException(key="seed.no_datasource")
+        else:
+            if not SOURCE_PATTERN.match(data.source):
+                raise DomainException(key="proxy.invalid_source")
+            datasources = [data.source]
+
+        if not 0 <= data.min_zoom <= data.max_zoom <= MAX_ZOOM:
+            raise DomainException(key="seed.invalid_zoom_range")
+        min_x, min_y, max_x, max_y = data.bbox
+        if not (-180 <= min_x < max_x <= 180 and -90 <= min_y < max_y <= 90):
+            raise DomainException(key="seed.invalid_bbox")
+
+        total_tiles = sum(
+            zoom_range.count
+            for _, zoom_range in seed_ranges(
+                datasources, data.bbox, data.min_zoom, data.max_zoom
+            )
+        )
+        if total_tiles > self.settings.tile_seed_max_tiles:
+            raise DomainException(
+                key="seed.too_many_tiles",
+                params={
+                    "total": total_tiles,
+                    "max": self.settings.tile_seed_max_tiles,
+                },
+            )
+
+        job_data = TileSeedJob.add_audit_info(
+            {
+                "map_id": data.map_id,
+                "datasources": datasources,
+                "min_x": min_x,
+                "min_y": min_y,
+                "max_x": max_x,
+                "max_y": max_y,
+                "min_zoom": data.min_zoom,
+                "max_zoom": data.max_zoom,
+                "total_tiles": total_tiles,
+            },
+            current_user.id,
+        )
+        job = await self.repository.create(job_data)
+        await self.repository.session.commit()
+        return TileSeedJobRead.model_validate(job)
+
+    async def get_jobs(self, current_user: UserDetail) -> List[TileSeedJobRead]:
+        self._ensure_admin(current_user)
+        jobs = await self.repository.get_recent(limit=100)
+        return [TileSeedJobRead.model_validate(job) for job in jobs]
+
+    async def get_job(self, job_id: int, current_user: UserDetail) -> TileSeedJobRead:
+        self._ensure_admin(current_user)
+        job = await self.repository.get_or_raise(
+            job_id, "TileSeedJob", "seed.not_found"
+        )
+        return TileSeedJobRead.model_validate(job)
+
+    async def cancel_job(self, job_id: int, current_user: UserDetail) -> bool:
+        self._ensure_admin(current_user)
+        job = await self.repository.get_or_raise(
+            job_id, "TileSeedJob", "seed.not_found"
+        )
+        if job.status not in (SeedJobStatus.PENDING, SeedJobStatus.RUNNING):
+            raise DomainException(
+                key="seed.not_cancellable", params={"status": job.status.value}
+            )
+        await self.repository.update(
+            job_id,
+            TileSeedJob.add_audit_info(
+                {
+                    "status": SeedJobStatus.CANCELLED,
+                    "finished_at": datetime.utcnow(),
+                },
+                current_user.id,
+            ),
+        )
+        await self.repository.session.commit()
+        return True
+
+
+# Dependencies
+SettingsDep = Annotated[Settings, Depends(get_settings)]
+
+
+def get_tile_seed_service(
+    session: SessionDep, map_service: MapServiceDep, settings: SettingsDep
+) -> TileSeedService:
+    repo = SeedJobRepository(session, TileSeedJob)
+    return TileSeedService(repo, map_service, settings)
+
+
+TileSeedServiceDep = Annotated[TileSeedService, Depends(get_tile_seed_service)]
@@ -0,0 +1,489 @@
+import asyncio
+import gzip
+from collections import Counter
+from dataclasses import replace
+from typing import Annotated, List, Optional, Sequence, Tuple
+
+import httpx
+from fastapi import Depends, Response
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+
+from app.core.config import Settings, get_settings
+from app.core.exceptions import (
+    DomainException,
+    EntityNotFoundException,
+    ExternalServiceException,
+    PermissionDeniedException,
+)
+from app.core.martin import MartinClientDep, martin_timeout
+from app.core.permissions import has_any_role
+from app.core.singleflight import SingleFlight
+from app.core.utils.mvt import (
+    TILE_LAYERS,
+    layer_name,
+    length_delimited,
+    rename_layer,
+    tile_layers,
+)
+from app.core.utils.tile_utils import MAX_ZOOM, SOURCE_PATTERN
+from app.modules.proxy.cache import (
+    TILE_FORMATS,
+    CachedTile,
+    TileCache,
+    TileCacheDep,
+    TileFormat,
+    TileKey,
+)
+from app.modules.proxy.engine import TileEngine, tile_engine
+from app.modules.proxy.extent import ExtentIndex, extent_index
+from app.modules.proxy.pruning import (
+    StyleUsage,
+    StyleUsageCache,
+    prune_flights,
+    style_usages,
+)
+from app.modules.proxy.schemas import CoalescingStatsRead, TileCacheStatsRead
+from app.modules.users.models import UserRole
+from app.modules.users.schemas import UserDetail
+
+DEFAULT_FORMAT: TileFormat = "pbf"
+MVT_CONTENT_TYPE = "application/x-protobuf"
+
+# Upstream headers forwarded untouched: the body is streamed as raw bytes,
+# so Content-Encoding and Content-Length still describe what the client receives.
+PASSTHROUGH_HEADERS = (
+    "content-type",
+    "content-encoding",
+    "content-length",
+    "etag",
+    "last-modified",
+)
+
+
+# Concurrent misses on one tile key share a single Martin request (per worker).
+tile_flights: SingleFlight[CachedTile] = SingleFlight()
+
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    return bool(accept_encoding) and "gzip" in accept_encoding.lower()
+
+
+def validate_tile(source: str, z: int, x: int, y: int) -> None:
+    if not SOURCE_PATTERN.match(source):
+        raise DomainException(key="proxy.invalid_source")
+    if not 0 <= z <= MAX_ZOOM or not 0 <= x < 2**z or not 0 <= y < 2**z:
+        raise DomainException(key="proxy.invalid_tile", params={"z": z, "x": x, "y": y})
+
+
+def tile_format(format: Optional[str]) -> TileFormat:
+    """The format of a tile URL, `DEFAULT_FORMAT` without extension."""
+    if format is None:
+        return DEFAULT_FORMAT
+    if format not in TILE_FORMATS:
+        raise DomainException(key="proxy.invalid_format", params={"format": format})
+    return format
+
+
+def combine_tiles(
+    tiles: Sequence[Tuple[str, CachedTile]], compress: bool
+) -> Optional[bytes]:
+    """
+    Merge the MVTs of (source, tile) pairs into one, None when all of them are
+    empty. Layer names must be unique in a tile: a name found in several
+    sources is prefixed with each source, as `<source>.<layer>`.
+    """
+    layers = [
+        (source, layer)
+        for source, tile in tiles
+        if tile.status_code != 204 and tile.data
+        for layer in tile_layers(
+            gzip.decompress(tile.data) if tile.content_encoding == "gzip" else tile.data
+        )
+    ]
+    if not layers:
+        return None
+    names = [layer_name(layer) for _, layer in layers]
+    counts = Counter(names)
+    parts, seen = [], set()
+    for (source, layer), name in zip(layers, names):
+        if counts[name] > 1:
+            name = f"{source}.{name}"
+            layer = rename_layer(layer, name)
+        if name in seen:
+            raise DomainException(
+                key="proxy.composite_layer_conflict", params={"name": name}
+            )
+        seen.add(name)
+        parts.append(length_delimited(TILE_LAYERS, layer))
+    data = b"".join(parts)
+    return gzip.compress(data, mtime=0) if compress else data
+
+
+class TileProxyService:
+    """Forwards tile requests to Martin over the app-scoped HTTP client."""
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        settings: Settings,
+        cache: Optional[TileCache] = None,
+        flights: Optional[SingleFlight[CachedTile]] = None,
+        extents: Optional[ExtentIndex] = None,
+        style_usages: Optional[StyleUsageCache] = None,
+        engine: Optional[TileEngine] = None,
+    ):
+        self.client = client
+        self.settings = settings
+        self.cache = cache
+        self.flights = flights or tile_flights
+        self.extents = extents
+        self.style_usages = style_usages
+        self.engine = engine
+
+    def validate_tile(self, source: str, z: int, x: int, y: int) -> None:
+        validate_tile(source, z, x, y)
+
+    async def get_tile(
+        self,
+        source: str,
+        z: int,
+        x: int,
+        y: int,
+        format: Optional[str] = None,
+        accept_encoding: Optional[str] = None,
+        map_id: Optional[int] = None,
+    ) -> Response:
+        """
+        Serve a tile from the cache, or from Martin (or the in-API engine) on a miss.
+        Without cache, Martin's body is streamed without decoding or re-encoding.
+        Tiles outside the data of their source are answered empty right away.
+        With `map_id`, layers and properties its style does not read are dropped.
+        """
+        self.validate_tile(source, z, x, y)
+        format = tile_format(format)
+        if self.extents is not None and not self.extents.may_contain(source, z, x, y):
+            return Response(status_code=204, headers={"X-Cache": "EXTENT"})
+
+        usage = await self._style_usage(map_id, source)
+        if self.cache is None and usage is None and not await self._rendered(source, z):
+            return await self._stream_tile(source, z, x, y, accept_encoding)
+        tile, tier = await self._load_tile(source, z, x, y, format, usage)
+        return self._tile_response(tile, accept_encoding, tier)
+
+    async def get_composite_tile(
+        self,
+        sources: List[str],
+        z: int,
+        x: int,
+        y: int,
+        format: Optional[str] = None,
+        accept_encoding: Optional[str] = None,
+        map_id: Optional[int] = None,
+    ) -> Response:
+        """
+        Serve the tiles of several sources at one z/x/y as a single MVT.
+        Each source goes through the same cache, extent and pruning steps as
+        a single tile, all of them concurrently.
+        """
+        format = tile_format(format)
+        if not sources:
+            raise DomainException(key="proxy.composite_no_source")
+        if len(sources) > self.settings.tile_composite_max_sources:
+            raise DomainException(
+                key="proxy.composite_too_many_sources",
+                params={"max": self.settings.tile_composite_max_sources},
+            )
+        if len(set(sources)) < len(sources):
+            raise DomainException(key="proxy.composite_duplicate_source")
+        for source in sources:
+            self.validate_tile(source, z, x, y)
+
+        async def load(source: str) -> Tuple[Optional[CachedTile], str]:
+            if self.extents is not None and not self.extents.may_contain(
+                source, z, x, y
+            ):
+                return None, "extent"
+            usage = await self._style_usage(map_id, source)
+            return await self._load_tile(source, z, x, y, format, usage)
+
+        parts = await asyncio.gather(*(load(source) for source in sources))
+        tiles = [
+            (source, tile)
+            for source, (tile, _) in zip(sources, parts)
+            if tile is not None
+        ]
+        headers = {"X-Cache": ", ".join(tier.upper() for _, tier in parts)}
+        data = await asyncio.to_thread(
+            combine_tiles, tiles, accepts_gzip(accept_encoding)
+        )
+        if data is None:
+            return Response(status_code=204, headers=headers)
+        if accepts_gzip(accept_encoding):
+            headers["Content-Encoding"] = "gzip"
+        return Response(content=data, media_type=MVT_CONTENT_TYPE, headers=headers)
+
+    async def _style_usage(
+        self, map_id: Optional[int], source: str
+    ) -> Optional[StyleUsage]:
+        if map_id is None or self.style_usages is None:
+            return None
+        return await self.style_usages.get(map_id, source)
+
+    async def _load_tile(
+        self,
+        source: str,
+        z: int,
+        x: int,
+        y: int,
+        format: TileFormat,
+        usage: Optional[StyleUsage],
+    ) -> Tuple[CachedTile, str]:
+        """A whole tile from the cache or Martin, with the cache tier it came from."""
+        if self.cache is None:
+            tile = await self._render_tile(source, z, x, y, usage)
+            if tile is None:
+                tile = await self._fetch_tile(source, z, x, y)
+                if usage is not None:
+                    tile = await usage.prune(tile)
+            return tile, "miss"
+
+        key = await self._tile_key(source, z, x, y, format)
+        if usage is not None:
+            key = replace(key, variant=usage.digest)
+        tile, tier = await self.cache.get(key)
+        if tile is None:
+            if usage is None:
+                tile = await self.flights.do(key, lambda: self._fill_cache(key))
+            else:
+                tile = await prune_flights.do(
+                    key, lambda: self._fill_pruned(key, usage)
+                )
+        return tile, tier or "miss"
+
+    async def _tile_key(
+        self, source: str, z: int, x: int, y: int, format: TileFormat
+    ) -> TileKey:
+        return TileKey(
+            source=source,
+            z=z,
+            x=x,
+            y=y,
+            format=format,
+            version=await self.cache.version(source, z),
+        )
+
+    async def prefetch_tile(self, source: str, z: int, x: int, y: int) -> bool:
+        """
+        Warm the cache with a tile, False when it was already cached. Prefetched
+        tiles only go to the disk tier so they do not evict hot tiles from memory.
+        """
+        if self.extents is not None and not self.extents.may_contain(source, z, x, y):
+            return False
+        key = await self._tile_key(source, z, x, y, DEFAULT_FORMAT)
+        if await self.cache.contains(key):
+            return False
+        await self.flights.do(key, lambda: self._fill_cache(key, memory=False))
+        return True
+
+    async def _fill_cache(self, key: TileKey, memory: bool = True) -> CachedTile:
+        data_version = self.cache.data_version(key.source)
+        tile = await self._render_tile(key.source, key.z, key.x, key.y)
+        if tile is None:
+            # Cached tiles are always fetched gzipped, whatever the client accepts.
+            tile = await self._fetch_tile(key.source, key.z, key.x, key.y)
+        if self.cache.data_version(key.source) != data_version:
+            # The source changed meanwhile: the tile may predate the change.
+            return tile
+        return await self.cache.set(key, tile, memory=memory)
+
+    async def _fill_pruned(self, key: TileKey, usage: StyleUsage) -> CachedTile:
+        """
+        Prune the full tile (cached on the disk tier) and cache the result.
+        The in-API engine renders the pruned tile directly instead.
+        """
+        data_version = self.cache.data_version(key.source)
+        tile = await self._render_tile(key.source, key.z, key.x, key.y, usage)
+        if tile is None:
+            full_key = replace(key, variant="")
+            tile, _ = await self.cache.get(full_key)
+            if tile is None:
+                tile = await self.flights.do(
+                    full_key, lambda: self._fill_cache(full_key, memory=False)
+                )
+            tile = await usage.prune(tile)
+        if self.cache.data_version(key.source) != data_version:
+            return tile
+        return await self.cache.set(key, tile)
+
+    async def _rendered(self, source: str, z: int) -> bool:
+        """Whether the in-API engine renders the tiles of a source at a zoom."""
+        return (
+            self.engine is not None and await self.engine.route(source, z) is not None
+        )
+
+    async def _render_tile(
+        self,
+        source: str,
+        z: int,
+        x: int,
+        y: int,
+        usage: Optional[StyleUsage] = None,
+    ) -> Optional[CachedTile]:
+        """
+        Tile rendered by the in-API engine (from an overview table within its
+        zoom bands), None when Martin serves it.
+        """
+        if self.engine is None:
+            return None
+        engine_source = await self.engine.route(source, z)
+        if engine_source is None:
+            return None
+        return await self.engine.render(
+            engine_source, z, x, y, usage.layers if usage is not None else None
+        )
+
+    def _request(
+        self, source: str, z: int, x: int, y: int, accept_encoding: Optional[str]
+    ) -> httpx.Request:
+        headers = {"Accept-Encoding": accept_encoding} if accept_encoding else {}
+        return self.client.build_request(
+            "GET",
+            f"/{source}/{z}/{x}/{y}",
+            headers=headers,
+            timeout=martin_timeout(self.settings),
+        )
+
+    async def _send(self, request: httpx.Request, source: str) -> httpx.Response:
+        try:
+            upstream = await self.client.send(request, stream=True)
+        except httpx.TimeoutException:
+            raise ExternalServiceException(
+                key="proxy.martin_timeout", params={"source": source}
+            )
+        except httpx.HTTPError:
+            raise ExternalServiceException(
+                key="proxy.martin_unavailable", params={"source": source}
+            )
+
+        if upstream.status_code == 404:
+            await upstream.aclose()
+            raise EntityNotFoundException(
+                entity="Source", key="proxy.source_not_found", params={"source": source}
+            )
+        if upstream.status_code not in (200, 204):
+            await upstream.aclose()
+            raise ExternalServiceException(
+                key="proxy.martin_error", params={"status": upstream.status_code}
+            )
+        return upstream
+
+    async def _stream_tile(
+        self, source: str, z: int, x: int, y: int, accept_encoding: Optional[str]
+    ) -> Response:
+        upstream = await self._send(
+            self._request(source, z, x, y, accept_encoding), source
+        )
+
+        passthrough = {
+            name: upstream.headers[name]
+            for name in PASSTHROUGH_HEADERS
+            if name in upstream.headers
+        }
+        if upstream.status_code == 204:
+            await upstream.aclose()
+            return Response(status_code=204)
+
+        return StreamingResponse(
+            upstream.aiter_raw(),
+            status_code=upstream.status_code,
+            headers=passthrough,
+            background=BackgroundTask(upstream.aclose),
+        )
+
+    async def _fetch_tile(self, source: str, z: int, x: int, y: int) -> CachedTile:
+        """Read a whole tile from Martin, keeping its encoded bytes."""
+        upstream = await self._send(self._request(source, z, x, y, "gzip"), source)
+        try:
+            data = b"".join([chunk async for chunk in upstream.aiter_raw()])
+        except httpx.TimeoutException:
+            raise ExternalServiceException(
+                key="proxy.martin_timeout", params={"source": source}
+            )
+        finally:
+            await upstream.aclose()
+
+        if upstream.status_code == 204:
+            return CachedTile(data=b"", status_code=204)
+        return CachedTile(
+            data=data,
+            content_type=upstream.headers.get("content-type"),
+            content_encoding=upstream.headers.get("content-encoding"),
+        )
+
+    def _tile_response(
+        self, tile: CachedTile, accept_encoding: Optional[str], cache_status: str
+    ) -> Response:
+        headers = {"X-Cache": cache_status.upper()}
+        if tile.status_code == 204:
+            return Response(status_code=204, headers=headers)
+
+        data = tile.data
+        if tile.content_encoding == "gzip" and not accepts_gzip(accept_encoding):
+            data = gzip.decompress(data)
+        elif tile.content_encoding:
+            headers["Content-Encoding"] = tile.content_encoding
+        return Response(content=data, media_type=tile.content_type, headers=headers)
+
+    def _ensure_admin(self, current_user: UserDetail) -> None:
+        if not has_any_role(current_user, [UserRole.ADMIN]):
+            raise PermissionDeniedException(
+                params={"detail": "proxy.cache_permission_denied"}
+            )
+
+    async def get_cache_stats(self, current_user: UserDetail) -> TileCacheStatsRead:
+        self._ensure_admin(current_user)
+        if self.cache is None:
+            raise DomainException(key="proxy.cache_disabled")
+        return TileCacheStatsRead(**self.cache.snapshot())
+
+    async def get_coalescing_stats(
+        self, current_user: UserDetail
+    ) -> CoalescingStatsRead:
+        self._ensure_admin(current_user)
+        return CoalescingStatsRead(
+            upstream_fetches=self.flights.stats.upstream_calls,
+            coalesced_requests=self.flights.stats.coalesced,
+            failed_fetches=self.flights.stats.failures,
+            in_flight=self.flights.in_flight,
+        )
+
+    async def purge_cache(
+        self, current_user: UserDetail, source: Optional[str] = None
+    ) -> None:
+        self._ensure_admin(current_user)
+        if self.cache is None:
+            raise DomainException(key="proxy.cache_disabled")
+        if source is not None and not SOURCE_PATTERN.match(source):
+            raise DomainException(key="proxy.invalid_source")
+        await self.cache.purge(source)
+
+
+# Dependencies
+SettingsDep = Annotated[Settings, Depends(get_settings)]
+
+
+def get_tile_proxy_service(
+    client: MartinClientDep, settings: SettingsDep, cache: TileCacheDep
+) -> TileProxyService:
+    return TileProxyService(
+        client,
+        settings,
+        cache,
+        extents=extent_index if settings.tile_extent_enabled else None,
+        style_usages=style_usages if settings.tile_prune_enabled else None,
+        engine=tile_engine if settings.tile_engine_enabled else None,
+    )
+
+
+TileProxyServiceDep = Annotated[TileProxyService, Depends(get_tile_proxy_service)]
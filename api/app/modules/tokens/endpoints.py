@@ -0,0 +1,44 @@
+from typing import List
+
+from fastapi import APIRouter, Depends
+
+from app.core.messages import MessageService
+from app.core.security import get_current_user
+from app.modules.tokens.schemas import (
+    ResourceTokenCreate,
+    ResourceTokenCreated,
+    ResourceTokenRead,
+)
+from app.modules.tokens.service import TokenServiceDep
+from app.modules.users.schemas import UserDetail
+
+tokensRouter = APIRouter(prefix="/tokens", tags=["Tokens"])
+
+
+@tokensRouter.get("", response_model=List[ResourceTokenRead])
+async def get_tokens(
+    service: TokenServiceDep, current_user: UserDetail = Depends(get_current_user)
+):
+    """List the resource tokens issued by the current user."""
+    return await service.get_tokens(current_user)
+
+
+@tokensRouter.post("", response_model=ResourceTokenCreated)
+async def create_token(
+    token: ResourceTokenCreate,
+    service: TokenServiceDep,
+    current_user: UserDetail = Depends(get_current_user),
+):
+    """Issue a SESSION or STYLE token scoped to the datasources of a map."""
+    return await service.create_token(token, current_user)
+
+
+@tokensRouter.delete("/{token_id}")
+async def revoke_token(
+    token_id: int,
+    service: TokenServiceDep,
+    current_user: UserDetail = Depends(get_current_user),
+):
+    """Revoke a resource token."""
+    await service.revoke_token(token_id, current_user)
+    return {"message": MessageService.get_message("token.revoked_success")}
@@ -0,0 +1,68 @@
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import Enum as SAEnum
+from sqlalchemy import BigInteger, ForeignKey, String, func, text
+from sqlmodel import ARRAY, Column, Field, SQLModel
+
+from app.core.enums.token_type import TokenType
+from app.core.xact import CURRENT_XACT_ID
+from app.core.mixins.audit_mixin import AuditMixin
+
+
+class ResourceToken(AuditMixin, SQLModel, table=True):
+    """
+    Record of an issued resource token (SESSION for Maputnik, STYLE for third-party apps).
+    The token itself is self-contained and signed; this row only exists to list
+    and revoke it, the tile path never reads it.
+    """
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    jti: str = Field(unique=True, index=True)
+    name: Optional[str] = Field(default=None)
+    token_type: TokenType = Field(
+        sa_type=SAEnum(
+            TokenType,
+            name="tokentype",
+            values_callable=lambda obj: [e.value for e in obj],
+        ),
+        nullable=False,
+    )
+    # Kept (set to NULL) when the map is deleted so the token stays revoked.
+    map_id: Optional[int] = Field(
+        default=None,
+        sa_column=Column(ForeignKey("map.id", ondelete="SET NULL"), index=True),
+    )
+    datasources: List[str] = Field(default=[], sa_column=Column(ARRAY(String)))
+    allowed_origins: List[str] = Field(default=[], sa_column=Column(ARRAY(String)))
+    expires_at: Optional[datetime] = Field(default=None)
+    is_active: bool = Field(default=True)
+    revoked_at: Optional[datetime] = Field(default=None)
+
+
+class TokenRevocation(SQLModel, table=True):
+    """
+    Append-only log of revoked token ids. Workers follow it by writing transaction
+    (`xid`, see `app.core.xact`) to keep their revocation index in sync; entries
+    are pruned once the token expired.
+    """
+
+    __tablename__ = "token_revocation"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    jti: str = Field(index=True)
+    expires_at: Optional[datetime] = Field(default=None, index=True)
+    created_at: datetime = Field(
+        default_factory=datetime.utcnow,
+        sa_column_kwargs={"server_default": func.now()},
+    )
+    # Set by the database: rows are inserted without it.
+    xid: Optional[int] = Field(
+        default=None,
+        sa_column=Column(
+            BigInteger,
+            server_default=text(CURRENT_XACT_ID),
+            nullable=False,
+            index=True,
+        ),
+    )
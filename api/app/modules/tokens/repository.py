@@ -0,0 +1,61 @@
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import insert
+from sqlmodel import delete, or_, select
+
+from app.core.repository import BaseRepository
+from app.core.xact import xact_horizon
+from app.modules.tokens.models import ResourceToken, TokenRevocation
+
+
+class TokenRepository(BaseRepository[ResourceToken]):
+    """Repository for ResourceToken entities."""
+
+    async def get_by_owner(self, user_id: int) -> List[ResourceToken]:
+        query = (
+            select(ResourceToken)
+            .where(ResourceToken.created_by_id == user_id)
+            .order_by(ResourceToken.id)
+        )
+        result = await self.session.exec(query)
+        return list(result.all())
+
+    async def log_revocation(self, jti: str, expires_at: Optional[datetime]) -> None:
+        # A Core insert: the database fills `xid`.
+        await self.session.execute(
+            insert(TokenRevocation).values(jti=jti, expires_at=expires_at)
+        )
+
+    async def get_horizon(self) -> int:
+        return await xact_horizon(self.session)
+
+    async def get_revocations(
+        self, horizon: Optional[int], after_id: int, now: datetime, limit: int
+    ) -> List[Tuple[int, str, Optional[datetime]]]:
+        """
+        Unexpired revocation log entries written by transactions from `horizon`
+        on (all of them when None), past `after_id` in id order.
+        """
+        query = (
+            select(TokenRevocation.id, TokenRevocation.jti, TokenRevocation.expires_at)
+            .where(
+                TokenRevocation.id > after_id,
+                or_(
+                    TokenRevocation.expires_at == None,  # noqa: E711
+                    TokenRevocation.expires_at > now,
+                ),
+            )
+            .order_by(TokenRevocation.id)
+            .limit(limit)
+        )
+        if horizon is not None:
+            query = query.where(TokenRevocation.xid >= horizon)
+        result = await self.session.exec(query)
+        return list(result.all())
+
+    async def prune_revocations(self, now: datetime) -> None:
+        """Drop log entries of tokens which expired: they are rejected anyway."""
+        await self.session.execute(
+            delete(TokenRevocation).where(TokenRevocation.expires_at <= now)
+        )
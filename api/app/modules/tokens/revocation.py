@@ -0,0 +1,149 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+
+from app.core.bloom import BloomFilter
+from app.core.database import sessionmanager
+from app.core.logging_config import logger
+from app.modules.tokens.models import ResourceToken
+from app.modules.tokens.repository import TokenRepository
+from app.modules.tokens.signing import utc_timestamp
+
+BATCH_SIZE = 1000
+MIN_CAPACITY = 1024
+
+
+@dataclass
+class RevocationStats:
+    lookups: int = 0
+    bloom_positives: int = 0
+    false_positives: int = 0
+
+
+class RevocationIndex:
+    """
+    Per-worker index of revoked token ids.
+
+    A Bloom filter answers the common case (token not revoked) with a few hashes;
+    its positives are confirmed against the exact set. Both are built from the
+    `token_revocation` log: each refresh reads only the entries of transactions
+    from the horizon of the previous one (see `app.core.xact`), so a revocation
+    committed late is read all the same, and a periodic rebuild from the pruned
+    log forgets expired tokens and resizes the filter.
+
+    Until a first refresh has read the log, the index is not `loaded`: tokens
+    cannot be checked, and validators reject them.
+    """
+
+    def __init__(self, error_rate: float = 0.001):
+        self.error_rate = error_rate
+        # Oldest transaction running at the previous read.
+        self.horizon: Optional[int] = None
+        self.stats = RevocationStats()
+        self.loaded = False
+        self._revoked: Dict[str, Optional[float]] = {}
+        self._bloom = BloomFilter(MIN_CAPACITY, error_rate)
+        self._rebuilt_at = float("-inf")
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._revoked)
+
+    def is_revoked(self, jti: str) -> bool:
+        self.stats.lookups += 1
+        if jti not in self._bloom:
+            return False
+        self.stats.bloom_positives += 1
+        if jti in self._revoked:
+            return True
+        self.stats.false_positives += 1
+        return False
+
+    def add(self, jti: str, expires_at: Optional[float] = None) -> None:
+        """Apply a revocation, e.g. one made by this worker, without a refresh."""
+        if jti in self._revoked:
+            return
+        self._revoked[jti] = expires_at
+        if self._bloom.is_full:
+            self._rebuild_bloom()
+        else:
+            self._bloom.add(jti)
+
+    def replace(self, jtis: Iterable[str]) -> None:
+        self._revoked = dict.fromkeys(jtis)
+        self._rebuild_bloom()
+        self.loaded = True
+
+    def _rebuild_bloom(self) -> None:
+        # Twice the current size leaves room to grow before the next rebuild.
+        capacity = max(MIN_CAPACITY, 2 * len(self._revoked))
+        self._bloom = BloomFilter.from_items(self._revoked, capacity, self.error_rate)
+
+    async def _read_log(
+        self, repository: TokenRepository, horizon: Optional[int]
+    ) -> Dict[str, Optional[float]]:
+        """Unexpired log entries of transactions from `horizon` on (None: all)."""
+        now = datetime.utcnow()
+        entries: Dict[str, Optional[float]] = {}
+        after_id = 0
+        while True:
+            rows = await repository.get_revocations(horizon, after_id, now, BATCH_SIZE)
+            for row_id, jti, expires_at in rows:
+                entries[jti] = utc_timestamp(expires_at)
+                after_id = row_id
+            if len(rows) < BATCH_SIZE:
+                return entries
+
+    async def refresh(self, rebuild_interval: float = float("inf")) -> None:
+        """Read new log entries, or rebuild from the whole log when it is due."""
+        async for session in sessionmanager.get_session():
+            repository = TokenRepository(session, ResourceToken)
+            now = time.monotonic()
+            if now - self._rebuilt_at >= rebuild_interval:
+                await repository.prune_revocations(datetime.utcnow())
+                await session.commit()
+                horizon = await repository.get_horizon()
+                entries = await self._read_log(repository, None)
+                # Swapped in at once: lookups never see a partially loaded index.
+                self._revoked = entries
+                self._rebuild_bloom()
+                self._rebuilt_at = now
+                self.loaded = True
+            else:
+                horizon = await repository.get_horizon()
+                entries = await self._read_log(repository, self.horizon)
+                for jti, expires_at in entries.items():
+                    self.add(jti, expires_at)
+            self.horizon = horizon
+
+    async def _refresh(self, rebuild_interval: float) -> None:
+        try:
+            await self.refresh(rebuild_interval)
+        except Exception:
+            logger.exception("Failed to refresh resource token revocations")
+
+    async def _run(self, interval: float, rebuild_interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            await self._refresh(rebuild_interval)
+
+    async def start(self, interval: float, rebuild_interval: float) -> None:
+        """Load the index, then refresh it every `interval` seconds."""
+        if self._task is None:
+            # Tokens are rejected until a refresh succeeds, should this one fail.
+            await self._refresh(rebuild_interval)
+            self._task = asyncio.create_task(self._run(interval, rebuild_interval))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+revocation_index = RevocationIndex()
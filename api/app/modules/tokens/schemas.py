@@ -0,0 +1,38 @@
+from datetime import datetime
+from typing import List, Optional
+
+from pydantic import BaseModel, ConfigDict, field_validator
+from sqlmodel import Field
+
+from app.core.enums.token_type import TokenType
+
+
+class ResourceTokenCreate(BaseModel):
+    map_id: int
+    token_type: TokenType = TokenType.SESSION
+    name: Optional[str] = Field(default=None)
+    allowed_origins: List[str] = Field(default=[])
+    # Only used by STYLE tokens, SESSION tokens have a fixed lifetime.
+    expires_at: Optional[datetime] = Field(default=None)
+
+    @field_validator("allowed_origins")
+    @classmethod
+    def normalize_origins(cls, v: List[str]) -> List[str]:
+        return [origin.strip().rstrip("/") for origin in v if origin.strip()]
+
+
+class ResourceTokenRead(BaseModel):
+    id: int
+    name: Optional[str]
+    token_type: TokenType
+    map_id: Optional[int]
+    datasources: List[str]
+    allowed_origins: List[str]
+    expires_at: Optional[datetime]
+    is_active: bool
+    created_at: datetime
+    model_config = ConfigDict(from_attributes=True)
+
+
+class ResourceTokenCreated(ResourceTokenRead):
+    token: str
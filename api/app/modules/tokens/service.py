@@ -0,0 +1,145 @@
+import secrets
+from datetime import datetime, timedelta, timezone
+from typing import Annotated, List
+
+from fastapi import Depends
+
+from app.core.config import Settings, get_settings
+from app.core.database import SessionDep
+from app.core.enums.token_type import TokenType
+from app.core.exceptions import (
+    DomainException,
+    EntityNotFoundException,
+    PermissionDeniedException,
+)
+from app.core.permissions import has_any_role
+from app.modules.maps.service import MapService, MapServiceDep
+from app.modules.tokens.models import ResourceToken
+from app.modules.tokens.repository import TokenRepository
+from app.modules.tokens.revocation import RevocationIndex, revocation_index
+from app.modules.tokens.schemas import (
+    ResourceTokenCreate,
+    ResourceTokenCreated,
+    ResourceTokenRead,
+)
+from app.modules.tokens.signing import (
+    ResourceTokenClaims,
+    sign_resource_token,
+    utc_timestamp,
+)
+from app.modules.tokens.validation import resource_token_key
+from app.modules.users.models import UserRole
+from app.modules.users.schemas import UserDetail
+
+
+def _to_utc_naive(value: datetime) -> datetime:
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+class TokenService:
+    """Issues, lists and revokes resource tokens scoped to a Map's datasources."""
+
+    def __init__(
+        self,
+        repository: TokenRepository,
+        map_service: MapService,
+        revocations: RevocationIndex,
+        settings: Settings,
+    ):
+        self.repository = repository
+        self.map_service = map_service
+        self.revocations = revocations
+        self.settings = settings
+
+    async def create_token(
+        self, data: ResourceTokenCreate, current_user: UserDetail
+    ) -> ResourceTokenCreated:
+        map_obj = await self.map_service.get_map(data.map_id, current_user)
+
+        now = datetime.utcnow()
+        if data.token_type == TokenType.SESSION:
+            expires_at = now + timedelta(
+                minutes=self.settings.session_token_expire_minutes
+            )
+        else:
+            if not await self.map_service.can_edit_map(map_obj, current_user):
+                raise PermissionDeniedException(
+                    params={"detail": "token.style_permission_denied"}
+                )
+            expires_at = _to_utc_naive(data.expires_at) if data.expires_at else None
+            if expires_at is not None and expires_at <= now:
+                raise DomainException(key="token.invalid_expiry")
+
+        datasources = await self.map_service.get_map_datasources(data.map_id)
+        token_data = ResourceToken.add_audit_info(
+            {
+                "jti": secrets.token_urlsafe(16),
+                "name": data.name,
+                "token_type": data.token_type,
+                "map_id": data.map_id,
+                "datasources": datasources,
+                "allowed_origins": data.allowed_origins,
+                "expires_at": expires_at,
+            },
+            current_user.id,
+        )
+        db_token = await self.repository.create(token_data)
+        await self.repository.session.commit()
+
+        claims = ResourceTokenClaims(
+            jti=db_token.jti,
+            token_type=data.token_type,
+            map_id=data.map_id,
+            datasources=frozenset(datasources),
+            allowed_origins=tuple(data.allowed_origins),
+            expires_at=int(utc_timestamp(expires_at)) if expires_at else None,
+        )
+        token = sign_resource_token(claims, resource_token_key(self.settings))
+        return ResourceTokenCreated(
+            **ResourceTokenRead.model_validate(db_token).model_dump(), token=token
+        )
+
+    async def get_tokens(self, current_user: UserDetail) -> List[ResourceTokenRead]:
+        return await self.repository.get_by_owner(current_user.id)
+
+    async def revoke_token(self, token_id: int, current_user: UserDetail) -> bool:
+        db_token = await self.repository.get_or_raise(
+            token_id, "ResourceToken", "token.not_found"
+        )
+
+        if db_token.created_by_id != current_user.id and not has_any_role(
+            current_user, [UserRole.ADMIN]
+        ):
+            raise EntityNotFoundException(
+                entity="ResourceToken", key="token.not_found", params={"id": token_id}
+            )
+
+        await self.repository.update(
+            token_id,
+            ResourceToken.add_audit_info(
+                {"is_active": False, "revoked_at": datetime.utcnow()},
+                current_user.id,
+            ),
+        )
+        await self.repository.log_revocation(db_token.jti, db_token.expires_at)
+        await self.repository.session.commit()
+        self.revocations.add(db_token.jti, utc_timestamp(db_token.expires_at))
+        return True
+
+
+# Dependencies
+SettingsDep = Annotated[Settings, Depends(get_settings)]
+
+
+def get_token_service(
+    session: SessionDep,
+    map_service: MapServiceDep,
+    settings: SettingsDep,
+) -> TokenService:
+    repo = TokenRepository(session, ResourceToken)
+    return TokenService(repo, map_service, revocation_index, settings)
+
+
+TokenServiceDep = Annotated[TokenService, Depends(get_token_service)]
@@ -0,0 +1,105 @@
+"""
+Self-contained resource tokens: `<prefix>_<base64url(claims)>.<base64url(hmac)>`.
+
+Claims carry everything the tile path needs (scope, expiry, allowed origins),
+so a token is validated with one HMAC and no database access.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import FrozenSet, Optional, Tuple
+
+from app.core.enums.token_type import TokenType
+from app.core.exceptions import AuthenticationException
+
+TOKEN_PREFIXES = {TokenType.SESSION: "sess", TokenType.STYLE: "style"}
+PREFIX_TYPES = {prefix: token_type for token_type, prefix in TOKEN_PREFIXES.items()}
+
+
+@dataclass(frozen=True)
+class ResourceTokenClaims:
+    jti: str
+    token_type: TokenType
+    map_id: int
+    datasources: FrozenSet[str] = field(default_factory=frozenset)
+    allowed_origins: Tuple[str, ...] = ()
+    expires_at: Optional[int] = None
+
+    def to_payload(self) -> dict:
+        return {
+            "jti": self.jti,
+            "map": self.map_id,
+            "ds": sorted(self.datasources),
+            "org": list(self.allowed_origins),
+            "exp": self.expires_at,
+        }
+
+    @classmethod
+    def from_payload(
+        cls, token_type: TokenType, payload: dict
+    ) -> "ResourceTokenClaims":
+        return cls(
+            jti=str(payload["jti"]),
+            token_type=token_type,
+            map_id=int(payload["map"]),
+            datasources=frozenset(payload.get("ds") or []),
+            allowed_origins=tuple(payload.get("org") or []),
+            expires_at=payload.get("exp"),
+        )
+
+
+def utc_timestamp(value: Optional[datetime]) -> Optional[float]:
+    """Epoch seconds of a naive UTC datetime, as stored in the database."""
+    if value is None:
+        return None
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+def derive_signing_key(secret: str) -> bytes:
+    """Derive a key dedicated to resource tokens from the application secret."""
+    return hmac.new(secret.encode(), b"canopy-resource-token", hashlib.sha256).digest()
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _signature(key: bytes, signed: str) -> str:
+    return _b64encode(hmac.new(key, signed.encode("ascii"), hashlib.sha256).digest())
+
+
+def sign_resource_token(claims: ResourceTokenClaims, key: bytes) -> str:
+    payload = json.dumps(claims.to_payload(), separators=(",", ":")).encode()
+    signed = f"{TOKEN_PREFIXES[claims.token_type]}_{_b64encode(payload)}"
+    return f"{signed}.{_signature(key, signed)}"
+
+
+def verify_resource_token(token: str, key: bytes, now: float) -> ResourceTokenClaims:
+    """Check signature and expiry, then return the token claims."""
+    signed, _, signature = token.rpartition(".")
+    prefix, _, payload = signed.partition("_")
+    token_type = PREFIX_TYPES.get(prefix)
+    if token_type is None or not payload or not signature:
+        raise AuthenticationException(params={"detail": "token.invalid"})
+
+    if not hmac.compare_digest(_signature(key, signed), signature):
+        raise AuthenticationException(params={"detail": "token.invalid"})
+
+    try:
+        claims = ResourceTokenClaims.from_payload(
+            token_type, json.loads(_b64decode(payload))
+        )
+    except (ValueError, KeyError, TypeError):
+        raise AuthenticationException(params={"detail": "token.invalid"})
+
+    if claims.expires_at is not None and claims.expires_at <= now:
+        raise AuthenticationException(params={"detail": "token.expired"})
+    return claims
@@ -0,0 +1,119 @@
+import time
+from functools import lru_cache
+from typing import Annotated, Iterable, Optional
+from urllib.parse import urlsplit
+
+from fastapi import Depends, Header, Query
+
+from app.core.config import Settings, get_settings
+from app.core.exceptions import (
+    AuthenticationException,
+    ExternalServiceException,
+    PermissionDeniedException,
+)
+from app.core.utils.tile_utils import split_sources
+from app.modules.tokens.revocation import RevocationIndex, revocation_index
+from app.modules.tokens.signing import (
+    ResourceTokenClaims,
+    derive_signing_key,
+    verify_resource_token,
+)
+
+
+@lru_cache
+def _signing_key(secret: str) -> bytes:
+    return derive_signing_key(secret)
+
+
+def resource_token_key(settings: Settings) -> bytes:
+    return _signing_key(settings.resource_token_secret or settings.private_key)
+
+
+def request_origin(origin: Optional[str], referer: Optional[str]) -> Optional[str]:
+    """Origin header, or the origin of the Referer when browsers omit it."""
+    if origin:
+        return origin.rstrip("/")
+    if referer:
+        parts = urlsplit(referer)
+        if parts.scheme and parts.netloc:
+            return f"{parts.scheme}://{parts.netloc}"
+    return None
+
+
+class ResourceTokenValidator:
+    """Validates resource tokens with CPU work only: HMAC, expiry, revocation set."""
+
+    def __init__(self, settings: Settings, revocations: RevocationIndex):
+        self.key = resource_token_key(settings)
+        self.revocations = revocations
+
+    def validate(self, token: str, now: Optional[float] = None) -> ResourceTokenClaims:
+        claims = verify_resource_token(token, self.key, now or time.time())
+        if not self.revocations.loaded:
+            # Fail closed: a revoked token must not pass while the log is unread.
+            raise ExternalServiceException(key="token.revocations_unavailable")
+        if self.revocations.is_revoked(claims.jti):
+            raise AuthenticationException(params={"detail": "token.revoked"})
+        return claims
+
+    def authorize(
+        self, token: str, datasource: str, origin: Optional[str] = None
+    ) -> ResourceTokenClaims:
+        """Validate a token and check it grants access to a datasource."""
+        return self.authorize_all(token, [datasource], origin)
+
+    def authorize_all(
+        self, token: str, datasources: Iterable[str], origin: Optional[str] = None
+    ) -> ResourceTokenClaims:
+        """Validate a token once and check it grants access to every datasource."""
+        claims = self.validate(token)
+        if claims.allowed_origins and origin not in claims.allowed_origins:
+            raise PermissionDeniedException(
+                params={"detail": "token.origin_not_allowed"}
+            )
+        if any(datasource not in claims.datasources for datasource in datasources):
+            raise PermissionDeniedException(
+                params={"detail": "token.datasource_not_in_scope"}
+            )
+        return claims
+
+
+# Dependencies
+SettingsDep = Annotated[Settings, Depends(get_settings)]
+
+
+def get_resource_token_validator(settings: SettingsDep) -> ResourceTokenValidator:
+    return ResourceTokenValidator(settings, revocation_index)
+
+
+ResourceTokenValidatorDep = Annotated[
+    ResourceTokenValidator, Depends(get_resource_token_validator)
+]
+
+
+async def get_tile_token(
+    source: str,
+    validator: ResourceTokenValidatorDep,
+    token: Optional[str] = Query(default=None),
+    origin: Optional[str] = Header(default=None),
+    referer: Optional[str] = Header(default=None),
+) -> ResourceTokenClaims:
+    """Resource token of a tile request, authorized for the requested source."""
+    if not token:
+        raise AuthenticationException(params={"detail": "token.missing"})
+    return validator.authorize(token, source, request_origin(origin, referer))
+
+
+async def get_composite_tile_token(
+    validator: ResourceTokenValidatorDep,
+    sources: str = Query(default=""),
+    token: Optional[str] = Query(default=None),
+    origin: Optional[str] = Header(default=None),
+    referer: Optional[str] = Header(default=None),
+) -> ResourceTokenClaims:
+    """Resource token of a composite tile request, authorized for all its sources."""
+    if not token:
+        raise AuthenticationException(params={"detail": "token.missing"})
+    return validator.authorize_all(
+        token, split_sources(sources), request_origin(origin, referer)
+    )
@@ -0,0 +1,40 @@
+"""
+Standalone job worker, run alongside `app.main`: `python -m app.worker`.
+
+It runs the background jobs (datasource ingests) in its own process, set
+`JOB_WORKER_ENABLED=false` on the API so that its workers only serve requests.
+The API workers pick up the datasources it loads on their next source refresh.
+"""
+
+import asyncio
+import signal
+
+from app.core.config import get_settings
+from app.core.database import sessionmanager
+from app.core.logging_config import logger
+from app.core.messages import MessageService
+from app.modules.datasources.parallel import ingest_pool
+from app.modules.jobs.worker import job_worker
+
+
+async def main() -> None:
+    settings = get_settings()
+    sessionmanager.init(str(settings.database_url))
+    MessageService.load_messages()
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopping.set)
+
+    job_worker.start(settings)
+    logger.info("Job worker started")
+    await stopping.wait()
+    # Running jobs go back to the queue for the next worker.
+    await job_worker.stop()
+    ingest_pool.close()
+    await sessionmanager.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
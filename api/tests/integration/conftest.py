@@ -1,6 +1,48 @@
 from unittest.mock import AsyncMock, patch
 
 import pytest
+import pytest_asyncio
+from sqlalchemy import pool, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from testcontainers.core.waiting_utils import wait_for_logs
+from testcontainers.postgres import PostgresContainer
+
+POSTGIS_IMAGE = "postgis/postgis:16-3.4"
+POSTGIS_READY = "database system is ready to accept connections"
+
+# Ten north-south lines in Paris, stored in Lambert-93 (EPSG:2154) like an
+# ingested datasource: `fid` identity key, `geom` column, GiST index.
+ROADS_STATEMENTS = [
+    "CREATE EXTENSION IF NOT EXISTS postgis",
+    "DROP TABLE IF EXISTS roads CASCADE",
+    """
+    CREATE TABLE roads (
+        fid bigint GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+        name text,
+        lanes bigint,
+        geom geometry(LineString, 2154)
+    )
+    """,
+    """
+    INSERT INTO roads (name, lanes, geom)
+    SELECT
+        'road ' || i,
+        i % 3 + 1,
+        ST_Transform(
+            ST_SetSRID(
+                ST_MakeLine(
+                    ST_MakePoint(2.30 + i * 0.01, 48.85),
+                    ST_MakePoint(2.30 + i * 0.01, 48.86)
+                ),
+                4326
+            ),
+            2154
+        )
+    FROM generate_series(1, 10) AS i
+    """,
+    "CREATE INDEX roads_geom_idx ON roads USING gist (geom)",
+    "ANALYZE roads",
+]
 
 
 @pytest.fixture(autouse=True)
@@ -11,3 +53,35 @@ def mock_email_service():
         new_callable=AsyncMock,
     ) as mock:
         yield mock
+
+
+@pytest.fixture(name="postgis_container", scope="session")
+def postgis_container_fixture():
+    """Starts a PostGIS container once per session, for the spatial queries."""
+    postgis = PostgresContainer(
+        image=POSTGIS_IMAGE,
+        username="tester",
+        password="tester",
+        dbname="spatial_database",
+    )
+    with postgis:
+        # The server restarts once the image has installed PostGIS.
+        wait_for_logs(
+            container=postgis,
+            predicate=lambda logs: logs.count(POSTGIS_READY) >= 2,
+        )
+        yield postgis
+
+
+@pytest_asyncio.fixture(name="postgis")
+async def postgis_fixture(postgis_container: PostgresContainer):
+    """Engine on the PostGIS database, its `roads` table recreated for each test."""
+    engine = create_async_engine(
+        postgis_container.get_connection_url(driver="psycopg"),
+        poolclass=pool.NullPool,
+    )
+    async with engine.begin() as connection:
+        for statement in ROADS_STATEMENTS:
+            await connection.execute(text(statement))
+    yield engine
+    await engine.dispose()
@@ -0,0 +1,93 @@
+import csv
+import gzip
+import io
+import json
+from datetime import datetime
+
+import pytest
+from app.core.config import Settings
+from app.core.utils.flatgeobuf import FlatGeobuf
+from app.modules.datasources import export as export_module
+from app.modules.datasources.export import DatasourceExportService
+from app.modules.datasources.models import Datasource
+from app.modules.datasources.repository import DatasourceRepository
+from app.modules.datasources.schemas import DatasourceRead
+from app.modules.users.models import UserRole
+from app.modules.users.schemas import UserDetail
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+LOADER = UserDetail(
+    id=3,
+    username="loader",
+    email="loader@test.com",
+    roles=[UserRole.LOAD_DATA],
+    teams=[],
+)
+
+
+class FakeDatasources:
+    async def get_datasource(self, datasource_id, current_user):
+        return DatasourceRead(
+            id=7,
+            name="roads",
+            geometry_column="geom",
+            srid=2154,
+            feature_count=10,
+            columns=["name", "lanes"],
+            ingest_seconds=0.1,
+            created_at=datetime.utcnow(),
+            created_by_id=LOADER.id,
+        )
+
+
+@pytest.fixture
+def service(postgis, monkeypatch):
+    monkeypatch.setattr(export_module, "get_engine", lambda: postgis)
+    return DatasourceExportService(
+        DatasourceRepository(AsyncSession(bind=postgis), Datasource),
+        FakeDatasources(),
+        Settings(datasource_export_batch_size=3),
+    )
+
+
+async def download(response) -> bytes:
+    return b"".join([chunk async for chunk in response.body_iterator])
+
+
+class TestDatasourceExport:
+    @pytest.mark.asyncio
+    async def test_geojson_is_reprojected_to_wgs84(self, service):
+        response = await service.export(7, "geojson", None, False, LOADER)
+
+        features = json.loads(await download(response))["features"]
+        assert [feature["id"] for feature in features] == list(range(1, 11))
+        assert features[0]["properties"] == {"name": "road 1", "lanes": 2}
+        [(lon, lat), _] = features[0]["geometry"]["coordinates"]
+        assert lon == pytest.approx(2.31) and lat == pytest.approx(48.85)
+
+    @pytest.mark.asyncio
+    async def test_bbox_subset_as_gzipped_csv(self, service):
+        response = await service.export(
+            7, "csv", (2.305, 48.84, 2.325, 48.87), True, LOADER
+        )
+
+        rows = list(
+            csv.reader(io.StringIO(gzip.decompress(await download(response)).decode()))
+        )
+        assert rows[0] == ["fid", "geom", "name", "lanes"]
+        assert [row[2] for row in rows[1:]] == ["road 1", "road 2"]
+
+    @pytest.mark.asyncio
+    async def test_flatgeobuf_keeps_the_datasource_srid(self, service, tmp_path):
+        response = await service.export(7, "fgb", None, False, LOADER)
+        path = tmp_path / "roads.fgb"
+        path.write_bytes(await download(response))
+
+        fgb = FlatGeobuf(str(path))
+        records = list(fgb.records(0, 10, fgb.srid, offset=0))
+        assert fgb.srid == 2154
+        assert [name for name, _ in fgb.fields] == ["name", "lanes"]
+        assert [values for _, _, values in records][:2] == [
+            ["road 1", 2],
+            ["road 2", 3],
+        ]
@@ -0,0 +1,81 @@
+import json
+from datetime import datetime
+
+import pytest
+from app.core.config import Settings
+from app.modules.datasources.query import DatasourceQueryService
+from app.modules.datasources.schemas import DatasourceRead
+from app.modules.proxy.engine import TileEngine
+from app.modules.users.models import UserRole
+from app.modules.users.schemas import UserDetail
+
+LOADER = UserDetail(
+    id=3,
+    username="loader",
+    email="loader@test.com",
+    roles=[UserRole.LOAD_DATA],
+    teams=[],
+)
+
+
+class FakeDatasources:
+    async def get_map_datasource(self, datasource_id, current_user, maps):
+        return DatasourceRead(
+            id=7,
+            name="roads",
+            geometry_column="geom",
+            srid=2154,
+            feature_count=10,
+            columns=["name", "lanes"],
+            ingest_seconds=0.1,
+            created_at=datetime.utcnow(),
+            created_by_id=LOADER.id,
+        )
+
+
+@pytest.fixture
+def service(postgis):
+    engine = TileEngine()
+    engine.engine = postgis
+    return DatasourceQueryService(FakeDatasources(), None, Settings(), engine)
+
+
+async def collection(response) -> dict:
+    return json.loads(b"".join([chunk async for chunk in response.body_iterator]))
+
+
+class TestFeatureQuery:
+    @pytest.mark.asyncio
+    async def test_features_in_a_wgs84_bbox(self, service):
+        response = await service.features_in_bbox(
+            7, (2.305, 48.84, 2.325, 48.87), None, 10, LOADER
+        )
+
+        features = (await collection(response))["features"]
+        assert response.headers["x-limit-reached"] == "false"
+        assert sorted(feature["id"] for feature in features) == [1, 2]
+        [(lon, lat), _] = features[0]["geometry"]["coordinates"]
+        assert lon == pytest.approx(2.31, abs=0.011) and lat == pytest.approx(48.85)
+
+    @pytest.mark.asyncio
+    async def test_limit_and_properties(self, service):
+        response = await service.features_in_bbox(
+            7, (2.0, 48.0, 3.0, 49.0), "lanes", 3, LOADER
+        )
+
+        features = (await collection(response))["features"]
+        assert response.headers["x-limit-reached"] == "true"
+        assert len(features) == 3
+        assert set(features[0]["properties"]) == {"lanes"}
+
+    @pytest.mark.asyncio
+    async def test_features_at_a_point_closest_first(self, service):
+        # In Web Mercator meters, road 3 is about 20 from the point, roads 4
+        # and 2 about 1100, the others further than the tolerance.
+        response = await service.features_at_point(
+            7, 2.3302, 48.855, 1500.0, "name", 10, LOADER
+        )
+
+        features = (await collection(response))["features"]
+        assert [feature["id"] for feature in features] == [3, 4, 2]
+        assert features[0]["properties"] == {"name": "road 3"}
@@ -1,5 +1,13 @@
+import json
+
 import pytest
+from app.core.config import get_settings
+from app.modules.maps.models import Map
+from app.modules.maps.repository import MapRepository
+from app.modules.maps.service import MapService
+from app.modules.users.schemas import UserDetail
 from httpx import AsyncClient
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 
 @pytest.mark.asyncio
@@ -329,3 +337,66 @@ async def test_update_map_to_duplicate_name(client: AsyncClient, auth_token_fact
         headers=headers,
     )
     assert response.status_code == 409
+
+
+@pytest.mark.asyncio
+async def test_map_style_datasource_refs(
+    client: AsyncClient, session: AsyncSession, auth_token_factory
+):
+    token = await auth_token_factory("admin", "admin")
+    headers = {"Authorization": f"Bearer {token}"}
+
+    resp = await client.post(
+        "/atlases",
+        json={"name": "Atlas for Refs", "description": "Atlas Desc"},
+        headers=headers,
+    )
+    atlas_id = resp.json()["id"]
+
+    style = {
+        "version": 8,
+        "sources": {"osm": {"type": "vector", "url": "http://martin:3000/roads"}},
+        "layers": [{"id": "r", "source": "osm", "source-layer": "primary"}],
+    }
+    response = await client.post(
+        "/maps",
+        json={
+            "name": "Styled Map",
+            "style": json.dumps(style),
+            "description": "Test Map",
+            "atlas_id": atlas_id,
+        },
+        headers=headers,
+    )
+    assert response.status_code == 200
+    map_id = response.json()["id"]
+
+    repository = MapRepository(session, Map)
+    refs = await repository.get_datasource_refs(map_id)
+    assert [(r.datasource, r.source_layer) for r in refs] == [("roads", "primary")]
+    assert await repository.get_map_ids_by_datasource("roads") == [map_id]
+
+    style["sources"]["osm"]["url"] = "http://martin:3000/rivers"
+    response = await client.patch(
+        f"/maps/{map_id}", json={"style": json.dumps(style)}, headers=headers
+    )
+    assert response.status_code == 200
+
+    assert await repository.get_map_ids_by_datasource("roads") == []
+    assert await repository.get_map_ids_by_datasource("rivers") == [map_id]
+
+    # Viewers of a map may read the datasources its style uses, only those.
+    service = MapService(repository, get_settings())
+    creator = UserDetail(
+        id=(await repository.get(map_id)).created_by_id,
+        username="admin",
+        email="admin@test.com",
+        roles=[],
+        teams=[],
+    )
+    stranger = UserDetail(
+        id=-1, username="stranger", email="s@test.com", roles=[], teams=[]
+    )
+    assert await service.can_view_datasource("rivers", creator)
+    assert not await service.can_view_datasource("roads", creator)
+    assert not await service.can_view_datasource("rivers", stranger)
@@ -0,0 +1,87 @@
+import gzip
+
+import pytest
+from app.core.utils.mvt import iter_fields, tile_layers
+from app.modules.proxy.engine import TileEngine, overview_source
+from app.modules.proxy.models import DatasourceOverview
+from app.modules.proxy.overviews import band_grid, band_tolerance
+from app.modules.proxy.repository import OverviewRepository
+from sqlalchemy import text
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+# The zoom 10 tile holding every road.
+TILE = (10, 518, 352)
+
+
+def overview(min_zoom=8, max_zoom=10, **overrides) -> DatasourceOverview:
+    values = {
+        "datasource": "roads",
+        "min_zoom": min_zoom,
+        "max_zoom": max_zoom,
+        "table_name": f"roads_ov_{min_zoom}_{max_zoom}",
+        "source_table": "roads",
+        "id_column": "fid",
+        "columns": ["name"],
+        "tolerance": band_tolerance(max_zoom, 1.0),
+    }
+    values.update(overrides)
+    return DatasourceOverview(**values)
+
+
+async def build(postgis, band: DatasourceOverview) -> int:
+    async with AsyncSession(bind=postgis) as session:
+        count = await OverviewRepository(session, DatasourceOverview).build(
+            band, band_grid(band.max_zoom)
+        )
+        await session.commit()
+    return count
+
+
+class TestOverviewBuild:
+    @pytest.mark.asyncio
+    async def test_builds_a_web_mercator_table(self, postgis):
+        band = overview()
+
+        assert await build(postgis, band) == 10
+
+        async with postgis.connect() as connection:
+            result = await connection.execute(
+                text("SELECT DISTINCT ST_SRID(geom) FROM roads_ov_8_10")
+            )
+            assert result.scalars().all() == [3857]
+            result = await connection.execute(
+                text("SELECT indexname FROM pg_indexes WHERE tablename = :table"),
+                {"table": "roads_ov_8_10"},
+            )
+            assert result.scalars().all() == ["roads_ov_8_10_geom_idx"]
+
+    @pytest.mark.asyncio
+    async def test_rebuild_replaces_the_table(self, postgis):
+        band = overview()
+        await build(postgis, band)
+
+        assert await build(postgis, band) == 10
+
+    @pytest.mark.asyncio
+    async def test_features_smaller_than_a_pixel_are_dropped(self, postgis):
+        # The roads are shorter than a pixel up to zoom 5.
+        assert await build(postgis, overview(0, 5)) == 0
+
+    @pytest.mark.asyncio
+    async def test_aggregated_features_are_merged(self, postgis):
+        band = overview(aggregate_by=["lanes"])
+
+        assert await build(postgis, band) == 3
+
+    @pytest.mark.asyncio
+    async def test_band_tiles_are_rendered_from_the_overview(self, postgis):
+        band = overview()
+        await build(postgis, band)
+        engine = TileEngine()
+        engine.engine = postgis
+
+        tile = await engine.render(overview_source(band), *TILE)
+
+        [layer] = tile_layers(gzip.decompress(tile.data))
+        features = [value for field, _, value, _ in iter_fields(layer) if field == 2]
+        assert len(features) == 10
@@ -0,0 +1,57 @@
+import gzip
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from app.core.config import Settings
+from app.core.utils.mvt import layer_name, tile_layers
+from app.modules.datasources.archive import PyramidBuilder
+from app.modules.proxy.models import TileEngineSource
+from app.modules.proxy.pmtiles import PMTilesArchive
+
+# WGS84 bounds of the PostGIS roads.
+ROADS_BOUNDS = (2.31, 48.85, 2.40, 48.86)
+
+
+def builder(postgis, **settings) -> PyramidBuilder:
+    source = TileEngineSource(
+        datasource="roads",
+        table_name="roads",
+        srid=2154,
+        id_column="fid",
+        columns=["name", "lanes"],
+    )
+    return PyramidBuilder(
+        postgis,
+        ThreadPoolExecutor(1),
+        source,
+        Settings(datasource_pmtiles_workers=2, **settings),
+    )
+
+
+class TestPyramidBuilder:
+    @pytest.mark.asyncio
+    async def test_descends_only_into_tiles_with_roads(self, postgis, tmp_path):
+        path = tmp_path / "roads.pmtiles"
+
+        stats = await builder(postgis).build(str(path), ROADS_BOUNDS, 8, 11)
+
+        # One tile per zoom holds the roads; the children of the others are
+        # never rendered.
+        assert stats["tiles"] == 4
+        assert stats["tiles_rendered"] == 1 + 4 + 4 + 4
+        archive = PMTilesArchive(str(path))
+        for z, x, y in ((8, 129, 88), (10, 518, 352), (11, 1037, 704)):
+            [layer] = tile_layers(gzip.decompress(archive.find_tile(z, x, y)))
+            assert layer_name(layer) == "roads"
+        assert archive.find_tile(11, 1036, 704) is None
+
+    @pytest.mark.asyncio
+    async def test_oversized_tiles_are_simplified_then_kept(self, postgis, tmp_path):
+        path = tmp_path / "roads.pmtiles"
+
+        stats = await builder(postgis, datasource_pmtiles_max_tile_bytes=10).build(
+            str(path), ROADS_BOUNDS, 8, 8
+        )
+
+        assert stats["tiles"] == 1 and stats["tiles_oversized"] == 1
+        assert PMTilesArchive(str(path)).find_tile(8, 129, 88) is not None
@@ -0,0 +1,80 @@
+import gzip
+
+import pytest
+from app.core.utils.mvt import iter_fields, layer_name, tile_layers
+from app.modules.proxy.engine import TileEngine
+from app.modules.proxy.models import TileEngineSource
+from app.modules.proxy.repository import TileEngineSourceRepository
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+# The zoom 10 tile holding every road.
+TILE = (10, 518, 352)
+
+
+def roads_source(**overrides) -> TileEngineSource:
+    values = {
+        "datasource": "roads",
+        "table_name": "roads",
+        "geometry_column": "geom",
+        "srid": 2154,
+        "id_column": "fid",
+        "columns": ["name", "lanes"],
+    }
+    values.update(overrides)
+    return TileEngineSource(**values)
+
+
+def decode(data: bytes):
+    """Name, feature ids and keys of the single layer of a gzipped tile."""
+    [layer] = tile_layers(gzip.decompress(data))
+    ids, keys = [], []
+    for field, _, value, _ in iter_fields(layer):
+        if field == 2:
+            ids += [v for f, _, v, _ in iter_fields(value) if f == 1]
+        elif field == 3:
+            keys.append(value.decode())
+    return layer_name(layer), sorted(ids), keys
+
+
+@pytest.fixture
+def engine(postgis):
+    tile_engine = TileEngine()
+    tile_engine.engine = postgis
+    return tile_engine
+
+
+class TestTileEngine:
+    @pytest.mark.asyncio
+    async def test_renders_the_features_of_a_tile(self, engine):
+        tile = await engine.render(roads_source(), *TILE)
+
+        assert tile.status_code == 200 and tile.content_encoding == "gzip"
+        name, ids, keys = decode(tile.data)
+        assert name == "roads"
+        assert ids == list(range(1, 11))
+        assert sorted(keys) == ["lanes", "name"]
+
+    @pytest.mark.asyncio
+    async def test_style_columns_and_simplification(self, engine):
+        source = roads_source(simplify=1.0)
+
+        tile = await engine.render(source, *TILE, {"roads": frozenset({"lanes"})})
+
+        _, ids, keys = decode(tile.data)
+        assert ids == list(range(1, 11))
+        assert keys == ["lanes"]
+
+    @pytest.mark.asyncio
+    async def test_tiles_without_features_are_empty(self, engine):
+        tile = await engine.render(roads_source(), 10, 0, 0)
+
+        assert tile.status_code == 204 and tile.data == b""
+
+    @pytest.mark.asyncio
+    async def test_describe_reads_the_srid_and_columns(self, postgis):
+        async with AsyncSession(bind=postgis) as session:
+            repository = TileEngineSourceRepository(session, TileEngineSource)
+
+            described = await repository.describe("roads", "geom")
+
+        assert described == (2154, ["fid", "name", "lanes"])
@@ -0,0 +1,344 @@
+import asyncio
+import gzip
+
+import httpx
+import pytest
+import pytest_asyncio
+from app.core.config import Settings, get_settings
+from app.core.martin import martin_client
+from app.core.security import get_current_user
+from app.core.enums.token_type import TokenType
+from app.main import app
+from app.modules.proxy.cache import tile_cache
+from app.modules.tokens.revocation import revocation_index
+from app.modules.tokens.signing import ResourceTokenClaims, sign_resource_token
+from app.modules.tokens.validation import resource_token_key
+from app.modules.users.models import UserRole
+from app.modules.users.schemas import UserDetail
+from httpx import ASGITransport, AsyncClient
+from starlette.applications import Starlette
+from starlette.responses import Response
+from starlette.routing import Route
+
+MVT_BODY = b"\x1a\x0c\n\x05roads\x28\x80\x20\x78\x02"
+SOURCES = {"roads", "missing", "empty", "broken", "slow"}
+SETTINGS = Settings(env="test", martin_internal_url="http://martin:3000")
+
+
+def make_token(
+    datasources=SOURCES, allowed_origins=(), expires_at=None, jti="tile-token"
+) -> str:
+    claims = ResourceTokenClaims(
+        jti=jti,
+        token_type=TokenType.SESSION,
+        map_id=1,
+        datasources=frozenset(datasources),
+        allowed_origins=tuple(allowed_origins),
+        expires_at=expires_at,
+    )
+    return sign_resource_token(claims, resource_token_key(SETTINGS))
+
+
+def build_fake_martin(calls: list) -> Starlette:
+    """Minimal stand-in for Martin's /{source}/{z}/{x}/{y} tile route."""
+
+    async def tile(request):
+        calls.append(request)
+        source = request.path_params["source"]
+        if source == "missing":
+            return Response(status_code=404)
+        if source == "empty":
+            return Response(status_code=204)
+        if source == "broken":
+            await asyncio.sleep(0.01)
+            return Response(status_code=500)
+        if source == "slow":
+            await asyncio.sleep(0.01)
+        if "gzip" in request.headers.get("accept-encoding", ""):
+            return Response(
+                gzip.compress(MVT_BODY),
+                media_type="application/x-protobuf",
+                headers={"Content-Encoding": "gzip"},
+            )
+        return Response(MVT_BODY, media_type="application/x-protobuf")
+
+    return Starlette(routes=[Route("/{source}/{z}/{x}/{y}", tile)])
+
+
+@pytest.fixture(name="martin_calls")
+def martin_calls_fixture():
+    return []
+
+
+@pytest_asyncio.fixture(name="proxy_client")
+async def proxy_client_fixture(martin_calls):
+    martin_client.init(
+        SETTINGS, transport=ASGITransport(app=build_fake_martin(martin_calls))
+    )
+    app.dependency_overrides[get_settings] = lambda: SETTINGS
+    revocation_index.replace([])
+    app.dependency_overrides[get_current_user] = lambda: UserDetail(
+        id=1, username="user", email="user@test.com", roles=[UserRole.USER], teams=[]
+    )
+
+    async with AsyncClient(
+        transport=ASGITransport(app=app),
+        base_url="http://test",
+        params={"token": make_token()},
+    ) as client:
+        yield client
+
+    app.dependency_overrides.clear()
+    revocation_index.replace([])
+    await martin_client.close()
+
+
+@pytest.mark.asyncio
+async def test_proxy_tile(proxy_client: AsyncClient, martin_calls):
+    response = await proxy_client.get(
+        "/proxy/tiles/roads/3/4/2.pbf", headers={"Accept-Encoding": "identity"}
+    )
+
+    assert response.status_code == 200
+    assert response.content == MVT_BODY
+    assert response.headers["content-type"] == "application/x-protobuf"
+    assert martin_calls[0].url.path == "/roads/3/4/2"
+
+
+@pytest.mark.asyncio
+async def test_proxy_tile_keeps_content_encoding(proxy_client: AsyncClient):
+    async with proxy_client.stream(
+        "GET", "/proxy/tiles/roads/3/4/2", headers={"Accept-Encoding": "gzip"}
+    ) as response:
+        raw = b"".join([chunk async for chunk in response.aiter_raw()])
+
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert gzip.decompress(raw) == MVT_BODY
+
+
+@pytest.mark.asyncio
+async def test_proxy_empty_tile(proxy_client: AsyncClient):
+    response = await proxy_client.get("/proxy/tiles/empty/0/0/0")
+    assert response.status_code == 204
+    assert response.content == b""
+
+
+@pytest.mark.asyncio
+async def test_proxy_unknown_source(proxy_client: AsyncClient):
+    response = await proxy_client.get("/proxy/tiles/missing/0/0/0")
+    assert response.status_code == 404
+    assert response.json()["key"] == "proxy.source_not_found"
+
+
+@pytest.mark.asyncio
+async def test_proxy_upstream_error(proxy_client: AsyncClient):
+    response = await proxy_client.get("/proxy/tiles/broken/0/0/0")
+    assert response.status_code == 502
+    assert response.json()["key"] == "proxy.martin_error"
+
+
+@pytest.mark.asyncio
+async def test_proxy_tile_outside_grid(proxy_client: AsyncClient, martin_calls):
+    response = await proxy_client.get("/proxy/tiles/roads/2/4/0")
+    assert response.status_code == 400
+    assert response.json()["key"] == "proxy.invalid_tile"
+    assert martin_calls == []
+
+
+@pytest.mark.asyncio
+async def test_proxy_upstream_timeout(proxy_client: AsyncClient):
+    async def timeout_handler(request):
+        raise httpx.ReadTimeout("timed out", request=request)
+
+    settings = Settings(env="test")
+    await martin_client.close()
+    martin_client.init(settings, transport=httpx.MockTransport(timeout_handler))
+
+    response = await proxy_client.get("/proxy/tiles/roads/0/0/0")
+    assert response.status_code == 502
+    assert response.json()["key"] == "proxy.martin_timeout"
+
+
+async def get_with_token(token: str | None, path: str, **kwargs) -> httpx.Response:
+    params = {"token": token} if token else {}
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as client:
+        return await client.get(path, params=params, **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_proxy_requires_token(proxy_client: AsyncClient):
+    response = await get_with_token(None, "/proxy/tiles/roads/0/0/0")
+    assert response.status_code == 401
+    assert response.json()["params"]["detail"] == "token.missing"
+
+
+@pytest.mark.asyncio
+async def test_proxy_rejects_tampered_token(proxy_client: AsyncClient):
+    signature = make_token().rpartition(".")[2]
+    forged = make_token(datasources={"roads", "secret"})
+    response = await get_with_token(
+        f"{forged.rpartition('.')[0]}.{signature}", "/proxy/tiles/secret/0/0/0"
+    )
+    assert response.status_code == 401
+    assert response.json()["params"]["detail"] == "token.invalid"
+
+
+@pytest.mark.asyncio
+async def test_proxy_rejects_expired_token(proxy_client: AsyncClient):
+    response = await get_with_token(
+        make_token(expires_at=1), "/proxy/tiles/roads/0/0/0"
+    )
+    assert response.status_code == 401
+    assert response.json()["params"]["detail"] == "token.expired"
+
+
+@pytest.mark.asyncio
+async def test_proxy_rejects_revoked_token(proxy_client: AsyncClient, martin_calls):
+    revocation_index.replace(["tile-token"])
+    response = await proxy_client.get("/proxy/tiles/roads/0/0/0")
+    assert response.status_code == 401
+    assert response.json()["params"]["detail"] == "token.revoked"
+    assert martin_calls == []
+
+
+@pytest.mark.asyncio
+async def test_proxy_rejects_source_out_of_scope(proxy_client: AsyncClient):
+    response = await get_with_token(
+        make_token(datasources={"rivers"}), "/proxy/tiles/roads/0/0/0"
+    )
+    assert response.status_code == 403
+    assert response.json()["params"]["detail"] == "token.datasource_not_in_scope"
+
+
+@pytest.mark.asyncio
+async def test_proxy_checks_allowed_origins(proxy_client: AsyncClient):
+    token = make_token(allowed_origins=["https://app.example.com"])
+
+    allowed = await get_with_token(
+        token,
+        "/proxy/tiles/roads/0/0/0",
+        headers={"Origin": "https://app.example.com"},
+    )
+    from_referer = await get_with_token(
+        token,
+        "/proxy/tiles/roads/0/0/0",
+        headers={"Referer": "https://app.example.com/maps/1"},
+    )
+    denied = await get_with_token(
+        token, "/proxy/tiles/roads/0/0/0", headers={"Origin": "https://evil.example"}
+    )
+
+    assert allowed.status_code == 200
+    assert from_referer.status_code == 200
+    assert denied.status_code == 403
+    assert denied.json()["params"]["detail"] == "token.origin_not_allowed"
+
+
+@pytest_asyncio.fixture(name="cached_proxy_client")
+async def cached_proxy_client_fixture(proxy_client: AsyncClient, tmp_path):
+    tile_cache.init(
+        Settings(
+            env="test",
+            tile_cache_disk_path=str(tmp_path / "tiles.sqlite"),
+            tile_cache_version_refresh_seconds=0,
+        )
+    )
+    yield proxy_client
+    tile_cache.close()
+
+
+@pytest.mark.asyncio
+async def test_cached_tile_served_without_martin(
+    cached_proxy_client: AsyncClient, martin_calls
+):
+    first = await cached_proxy_client.get("/proxy/tiles/roads/3/4/2.pbf")
+    second = await cached_proxy_client.get("/proxy/tiles/roads/3/4/2.pbf")
+
+    assert first.headers["x-cache"] == "MISS"
+    assert second.headers["x-cache"] == "MEMORY"
+    assert first.content == second.content == MVT_BODY
+    assert second.headers["content-encoding"] == "gzip"
+    assert len(martin_calls) == 1
+    assert martin_calls[0].headers["accept-encoding"] == "gzip"
+
+
+@pytest.mark.asyncio
+async def test_cached_tile_decoded_for_clients_without_gzip(
+    cached_proxy_client: AsyncClient,
+):
+    await cached_proxy_client.get("/proxy/tiles/roads/3/4/2")
+    response = await cached_proxy_client.get(
+        "/proxy/tiles/roads/3/4/2", headers={"Accept-Encoding": "identity"}
+    )
+
+    assert "content-encoding" not in response.headers
+    assert response.content == MVT_BODY
+
+
+@pytest.mark.asyncio
+async def test_cached_empty_tile(cached_proxy_client: AsyncClient, martin_calls):
+    await cached_proxy_client.get("/proxy/tiles/empty/0/0/0")
+    response = await cached_proxy_client.get("/proxy/tiles/empty/0/0/0")
+
+    assert response.status_code == 204
+    assert len(martin_calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_purge_cache_requires_admin(cached_proxy_client: AsyncClient):
+    response = await cached_proxy_client.delete("/proxy/cache")
+    assert response.status_code == 403
+
+
+@pytest.mark.asyncio
+async def test_admin_purges_cache(cached_proxy_client: AsyncClient, martin_calls):
+    app.dependency_overrides[get_current_user] = lambda: UserDetail(
+        id=1, username="admin", email="admin@test.com", roles=[UserRole.ADMIN]
+    )
+    await cached_proxy_client.get("/proxy/tiles/roads/3/4/2")
+
+    response = await cached_proxy_client.delete("/proxy/cache?source=roads")
+    assert response.status_code == 200
+
+    response = await cached_proxy_client.get("/proxy/tiles/roads/3/4/2")
+    assert response.headers["x-cache"] == "MISS"
+    assert len(martin_calls) == 2
+
+    stats = (await cached_proxy_client.get("/proxy/cache/stats")).json()
+    assert stats["misses"] == 2
+    assert stats["hit_ratio"] == 0.0
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_are_coalesced(
+    cached_proxy_client: AsyncClient, martin_calls
+):
+    app.dependency_overrides[get_current_user] = lambda: UserDetail(
+        id=1, username="admin", email="admin@test.com", roles=[UserRole.ADMIN]
+    )
+    responses = await asyncio.gather(
+        *(cached_proxy_client.get("/proxy/tiles/slow/5/3/7") for _ in range(8))
+    )
+
+    assert all(r.status_code == 200 for r in responses)
+    assert all(r.content == MVT_BODY for r in responses)
+    assert len(martin_calls) == 1
+
+    stats = (await cached_proxy_client.get("/proxy/coalescing/stats")).json()
+    assert stats["coalesced_requests"] >= 7
+    assert stats["in_flight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_coalesced_failure_reaches_every_request(
+    cached_proxy_client: AsyncClient, martin_calls
+):
+    responses = await asyncio.gather(
+        *(cached_proxy_client.get("/proxy/tiles/broken/0/0/0") for _ in range(4))
+    )
+
+    assert [r.status_code for r in responses] == [502] * 4
+    assert len(martin_calls) == 1
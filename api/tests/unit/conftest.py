@@ -0,0 +1,72 @@
+import pytest
+
+
+class FakeResult:
+    """Result of a statement: a scalar, rows, or rows streamed by partitions."""
+
+    def __init__(self, value, size=None):
+        self.value = value
+        self.size = size
+
+    def scalar(self):
+        return self.value
+
+    def all(self):
+        return list(self.value)
+
+    async def partitions(self):
+        rows = list(self.value)
+        for start in range(0, len(rows), self.size):
+            yield rows[start : start + self.size]
+
+
+class FakeConnection:
+    def __init__(self, engine):
+        self.engine = engine
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def execute(self, statement, params=None):
+        return FakeResult(self.engine.run(statement, params))
+
+    async def stream(self, statement, params=None):
+        size = statement.get_execution_options()["yield_per"]
+        return FakeResult(self.engine.run(statement, params), size)
+
+    async def commit(self):
+        pass
+
+    async def rollback(self):
+        pass
+
+
+class FakeEngine:
+    """
+    Stand-in for an async engine (and, through `connect()`, a session): records
+    the SQL and parameters of every statement in `queries`, and answers it with
+    `respond(sql, params)`, or with `respond` itself when it is not callable.
+    """
+
+    def __init__(self, respond=None):
+        self.respond = respond
+        self.queries = []
+
+    def connect(self):
+        return FakeConnection(self)
+
+    def run(self, statement, params):
+        sql = str(statement)
+        self.queries.append((sql, params))
+        if callable(self.respond):
+            return self.respond(sql, params)
+        return self.respond
+
+
+@pytest.fixture
+def fake_engine():
+    """Factory of engines answering statements without a database."""
+    return FakeEngine
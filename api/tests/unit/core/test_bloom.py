@@ -0,0 +1,24 @@
+from app.core.bloom import BloomFilter
+
+
+def test_added_items_are_always_found():
+    bloom = BloomFilter.from_items((f"jti-{i}" for i in range(500)), capacity=500)
+    assert all(f"jti-{i}" in bloom for i in range(500))
+    assert bloom.count == 500
+    assert bloom.is_full
+
+
+def test_false_positive_rate_close_to_target():
+    bloom = BloomFilter.from_items(
+        (f"jti-{i}" for i in range(1000)), capacity=1000, error_rate=0.01
+    )
+    false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+def test_sizing():
+    bloom = BloomFilter(capacity=1000, error_rate=0.001)
+    # ~14.4 bits and ~10 hashes per item for a 0.1% error rate.
+    assert 14000 <= bloom.num_bits <= 14500
+    assert bloom.num_hashes == 10
+    assert "anything" not in bloom
@@ -0,0 +1,128 @@
+import json
+import struct
+
+import pytest
+from app.core.utils.geojson import FeatureParser, GeoJSONError, geometry_to_ewkb
+
+
+def collection(count: int, **members) -> bytes:
+    features = [
+        {
+            "type": "Feature",
+            "properties": {"n": i, "name": "é" * i},
+            "geometry": {"type": "Point", "coordinates": [i, 1.5]},
+        }
+        for i in range(count)
+    ]
+    return json.dumps(
+        {"type": "FeatureCollection", **members, "features": features, "bbox": [0, 1]}
+    ).encode()
+
+
+def parse(document: bytes, chunk_size: int, **kwargs):
+    parser = FeatureParser(**kwargs)
+    features = []
+    for start in range(0, len(document), chunk_size):
+        features += parser.feed(document[start : start + chunk_size])
+    features += parser.close()
+    return parser, features
+
+
+class TestFeatureParser:
+    @pytest.mark.parametrize("chunk_size", [1, 7, 64, 1 << 20])
+    def test_any_chunking(self, chunk_size):
+        parser, features = parse(collection(30), chunk_size)
+
+        assert [f["properties"]["n"] for f in features] == list(range(30))
+        assert features[29]["properties"]["name"] == "é" * 29
+        assert parser.members == {"type": "FeatureCollection", "bbox": [0, 1]}
+
+    def test_features_are_returned_as_they_complete(self):
+        document = collection(10)
+        parser = FeatureParser()
+
+        first = parser.feed(document[: len(document) // 2])
+
+        assert 0 < len(first) < 10
+        rest = parser.feed(document[len(document) // 2 :]) + parser.close()
+        assert len(first) + len(rest) == 10
+
+    def test_legacy_crs(self):
+        crs = {"type": "name", "properties": {"name": "urn:ogc:def:crs:EPSG::2154"}}
+        parser, _ = parse(collection(1, crs=crs), 16)
+
+        assert parser.srid == 2154
+        assert FeatureParser().srid == 4326
+
+    def test_single_feature(self):
+        document = b'{"type": "Feature", "properties": {}, "geometry": null}'
+
+        _, features = parse(document, 5)
+
+        assert features == [{"type": "Feature", "properties": {}, "geometry": None}]
+
+    @pytest.mark.parametrize(
+        "document",
+        [
+            b"[1, 2]",
+            b'{"type": "FeatureCollection", "features": [{"type": "Feature"}',
+            b'{"type": "FeatureCollection", "features": [1]}',
+            b'{"type": "FeatureCollection", "features": {}}',
+            b'{"type": "Topology"}',
+            b'{"features": []} trailing',
+        ],
+    )
+    def test_invalid_documents(self, document):
+        with pytest.raises(GeoJSONError):
+            parse(document, 4)
+
+    def test_oversized_feature(self):
+        with pytest.raises(GeoJSONError):
+            parse(collection(50), 16, max_feature_size=32)
+
+
+class TestGeometryToEwkb:
+    def test_point_matches_postgis(self):
+        ewkb = geometry_to_ewkb({"type": "Point", "coordinates": [1, 2]}, 4326)
+
+        # SELECT ST_AsEWKB('SRID=4326;POINT(1 2)')
+        assert ewkb.hex() == "0101000020e6100000000000000000f03f0000000000000040"
+
+    def test_polygon_rings(self):
+        ring = [[0, 0], [1, 0], [1, 1], [0, 0]]
+        ewkb = geometry_to_ewkb({"type": "Polygon", "coordinates": [ring]}, 3857)
+
+        assert struct.unpack_from("<BIIII", ewkb) == (1, 0x20000003, 3857, 1, 4)
+        assert struct.unpack_from("<8d", ewkb, 17) == (0, 0, 1, 0, 1, 1, 0, 0)
+
+    def test_multi_parts_and_z(self):
+        ewkb = geometry_to_ewkb(
+            {"type": "MultiPoint", "coordinates": [[1, 2, 3], [4, 5]]}, 4326
+        )
+
+        assert struct.unpack_from("<BIII", ewkb) == (1, 0xA0000004, 4326, 2)
+        assert struct.unpack_from("<BI3d", ewkb, 13) == (1, 0x80000001, 1, 2, 3)
+        assert struct.unpack_from("<BI3d", ewkb, 42) == (1, 0x80000001, 4, 5, 0)
+
+    def test_geometry_collection(self):
+        ewkb = geometry_to_ewkb(
+            {
+                "type": "GeometryCollection",
+                "geometries": [{"type": "LineString", "coordinates": [[0, 0], [1, 1]]}],
+            },
+            4326,
+        )
+
+        assert struct.unpack_from("<BIII", ewkb) == (1, 0x20000007, 4326, 1)
+        assert struct.unpack_from("<BII", ewkb, 13) == (1, 2, 2)
+
+    def test_null_and_invalid_geometries(self):
+        assert geometry_to_ewkb(None, 4326) is None
+        for geometry in (
+            {"type": "Circle", "coordinates": [0, 0]},
+            {"type": "LineString", "coordinates": [["a", "b"]]},
+            {"type": "Polygon", "coordinates": None},
+            "POINT(0 0)",
+        ):
+            with pytest.raises(GeoJSONError):
+                geometry_to_ewkb(geometry, 4326)
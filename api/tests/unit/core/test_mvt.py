@@ -0,0 +1,154 @@
+import gzip
+
+import pytest
+from app.core.utils.mvt import (
+    FEATURE_TAGS,
+    LAYER_FEATURES,
+    LAYER_KEYS,
+    LAYER_NAME,
+    LAYER_VALUES,
+    LENGTH_DELIMITED,
+    TILE_LAYERS,
+    VARINT,
+    iter_fields,
+    layer_name,
+    length_delimited,
+    prune_encoded_tile,
+    prune_tile,
+    read_varint,
+    rename_layer,
+    tile_layers,
+    write_varint,
+)
+
+GEOMETRY = b"\x09\x02\x04"
+
+
+def string_value(text: str) -> bytes:
+    return length_delimited(1, text.encode())
+
+
+def feature(feature_id: int, tags) -> bytes:
+    return (
+        write_varint(1 << 3 | VARINT)
+        + write_varint(feature_id)
+        + length_delimited(FEATURE_TAGS, b"".join(write_varint(t) for t in tags))
+        + write_varint(3 << 3 | VARINT)
+        + write_varint(1)
+        + length_delimited(4, GEOMETRY)
+    )
+
+
+def layer(name: str, keys, values, features) -> bytes:
+    return (
+        write_varint(15 << 3 | VARINT)
+        + write_varint(2)
+        + length_delimited(LAYER_NAME, name.encode())
+        + b"".join(length_delimited(LAYER_FEATURES, f) for f in features)
+        + b"".join(length_delimited(LAYER_KEYS, k.encode()) for k in keys)
+        + b"".join(length_delimited(LAYER_VALUES, string_value(v)) for v in values)
+        + write_varint(5 << 3 | VARINT)
+        + write_varint(4096)
+    )
+
+
+def tile(*layers) -> bytes:
+    return b"".join(length_delimited(TILE_LAYERS, layer) for layer in layers)
+
+
+def decode(data: bytes) -> dict:
+    """{layer: [(feature id, {key: value}), ...]} of a tile."""
+    decoded = {}
+    for _, _, layer_bytes, _ in iter_fields(data):
+        name, keys, values, features = None, [], [], []
+        for field, _, value, _ in iter_fields(layer_bytes):
+            if field == LAYER_NAME:
+                name = value.decode()
+            elif field == LAYER_KEYS:
+                keys.append(value.decode())
+            elif field == LAYER_VALUES:
+                values.append(next(iter_fields(value))[2].decode())
+            elif field == LAYER_FEATURES:
+                features.append(value)
+        rows = []
+        for feature_bytes in features:
+            fields = {f: v for f, _, v, _ in iter_fields(feature_bytes)}
+            tags, pos = [], 0
+            while pos < len(fields.get(FEATURE_TAGS, b"")):
+                tag, pos = read_varint(fields[FEATURE_TAGS], pos)
+                tags.append(tag)
+            properties = {keys[k]: values[v] for k, v in zip(tags[::2], tags[1::2])}
+            assert fields[4] == GEOMETRY
+            rows.append((fields[1], properties))
+        decoded[name] = rows
+    return decoded
+
+
+ROADS = layer(
+    "roads",
+    keys=["name", "class", "surface"],
+    values=["Main St", "primary", "asphalt", "Side St"],
+    features=[feature(1, [0, 0, 1, 1, 2, 2]), feature(2, [0, 3, 2, 2])],
+)
+RIVERS = layer("rivers", keys=["name"], values=["Seine"], features=[feature(3, [0, 0])])
+
+
+class TestVarint:
+    @pytest.mark.parametrize("value", [0, 1, 127, 128, 300, 2**35])
+    def test_round_trip(self, value):
+        assert read_varint(write_varint(value), 0) == (value, len(write_varint(value)))
+
+    def test_truncated(self):
+        with pytest.raises(ValueError):
+            read_varint(b"\x80", 0)
+
+
+class TestPruneTile:
+    def test_drops_unused_properties_and_values(self):
+        pruned = prune_tile(tile(ROADS), {"roads": frozenset({"surface"})})
+
+        assert decode(pruned) == {
+            "roads": [(1, {"surface": "asphalt"}), (2, {"surface": "asphalt"})]
+        }
+        layer_bytes = next(iter_fields(pruned))[2]
+        fields = [f for f, _, _, _ in iter_fields(layer_bytes)]
+        assert fields.count(LAYER_KEYS) == 1
+        assert fields.count(LAYER_VALUES) == 1
+
+    def test_drops_unused_layers(self):
+        pruned = prune_tile(tile(ROADS, RIVERS), {"rivers": None})
+
+        assert decode(pruned) == {"rivers": [(3, {"name": "Seine"})]}
+
+    def test_layer_read_entirely_is_copied(self):
+        original = tile(ROADS)
+        assert prune_tile(original, {"roads": None}) == original
+
+    def test_features_without_kept_properties(self):
+        pruned = prune_tile(tile(ROADS), {"roads": frozenset()})
+
+        assert decode(pruned) == {"roads": [(1, {}), (2, {})]}
+
+    def test_gzipped_tile(self):
+        pruned = prune_encoded_tile(
+            gzip.compress(tile(ROADS, RIVERS)), "gzip", {"roads": frozenset({"name"})}
+        )
+
+        assert decode(gzip.decompress(pruned)) == {
+            "roads": [(1, {"name": "Main St"}), (2, {"name": "Side St"})]
+        }
+
+    def test_invalid_tile(self):
+        with pytest.raises(ValueError):
+            prune_tile(bytes([TILE_LAYERS << 3 | LENGTH_DELIMITED, 10, 1]), {})
+
+
+class TestLayers:
+    def test_tile_layers(self):
+        assert tile_layers(tile(ROADS, RIVERS)) == [ROADS, RIVERS]
+
+    def test_rename_layer_keeps_its_features(self):
+        renamed = rename_layer(ROADS, "osm.roads")
+
+        assert layer_name(renamed) == "osm.roads"
+        assert decode(tile(renamed))["osm.roads"] == decode(tile(ROADS))["roads"]
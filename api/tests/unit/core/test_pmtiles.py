@@ -0,0 +1,144 @@
+import gzip
+import json
+import os
+
+import pytest
+from app.core.utils import pmtiles
+from app.core.utils.pmtiles import (
+    COMPRESSION_GZIP,
+    ArchiveWriter,
+    Entry,
+    Header,
+    PMTilesError,
+    compress,
+    decode_directory,
+    decompress,
+    encode_directory,
+    find_entry,
+    zxy_to_tile_id,
+)
+from app.modules.proxy.pmtiles import PMTilesArchive
+
+
+@pytest.mark.parametrize(
+    "zxy,tile_id",
+    [
+        ((0, 0, 0), 0),
+        ((1, 0, 0), 1),
+        ((1, 0, 1), 2),
+        ((1, 1, 1), 3),
+        ((1, 1, 0), 4),
+        ((2, 0, 0), 5),
+        ((3, 0, 0), 21),
+        ((20, 0, 0), 366503875925),
+    ],
+)
+def test_tile_ids_follow_reference(zxy, tile_id):
+    assert zxy_to_tile_id(*zxy) == tile_id
+
+
+def test_tile_ids_are_unique_per_zoom():
+    ids = {zxy_to_tile_id(3, x, y) for x in range(8) for y in range(8)}
+    assert ids == set(range(21, 21 + 64))
+
+
+def test_directory_round_trip():
+    entries = [
+        Entry(tile_id=1, offset=0, length=10, run_length=1),
+        Entry(tile_id=2, offset=10, length=5, run_length=3),
+        Entry(tile_id=9, offset=0, length=10, run_length=1),
+        Entry(tile_id=40, offset=200, length=30, run_length=0),
+    ]
+
+    data = compress(encode_directory(entries), COMPRESSION_GZIP)
+
+    assert decode_directory(decompress(data, COMPRESSION_GZIP)) == entries
+
+
+def test_find_entry():
+    entries = [
+        Entry(tile_id=1, offset=0, length=10, run_length=1),
+        Entry(tile_id=2, offset=10, length=5, run_length=3),
+        Entry(tile_id=40, offset=0, length=30, run_length=0),
+    ]
+
+    assert find_entry(entries, 0) is None
+    assert find_entry(entries, 1) == entries[0]
+    # Run of three identical tiles.
+    assert find_entry(entries, 4) == entries[1]
+    assert find_entry(entries, 5) is None
+    # Past the first id of a leaf directory: the leaf may hold it.
+    assert find_entry(entries, 1000) == entries[2]
+
+
+def test_header_rejects_other_files():
+    with pytest.raises(PMTilesError):
+        Header.from_bytes(b"\x89PNG" + bytes(200))
+    with pytest.raises(PMTilesError):
+        Header.from_bytes(b"PMTiles")
+
+
+def write_tiles(path, tiles):
+    writer = ArchiveWriter(str(path))
+    for zxy, data in sorted(tiles.items(), key=lambda t: zxy_to_tile_id(*t[0])):
+        writer.add(zxy_to_tile_id(*zxy), gzip.compress(data, mtime=0))
+    max_zoom = max(z for z, _, _ in tiles)
+    return writer.finish(0, max_zoom, (-10.0, -5.0, 10.0, 5.0), {"name": "roads"})
+
+
+class TestArchiveWriter:
+    def test_round_trip(self, tmp_path):
+        path = tmp_path / "roads.pmtiles"
+        tiles = {(0, 0, 0): b"world", (1, 1, 0): b"ne", (2, 3, 1): b"east"}
+
+        header = write_tiles(path, tiles)
+
+        archive = PMTilesArchive(str(path))
+        assert archive.header == header
+        assert header.clustered and header.min_lon_e7 == -100000000
+        for zxy, data in tiles.items():
+            assert gzip.decompress(archive.find_tile(*zxy)) == data
+        assert archive.find_tile(1, 0, 0) is None
+        metadata = archive.view[
+            header.metadata_offset : header.metadata_offset + header.metadata_length
+        ]
+        assert json.loads(gzip.decompress(metadata)) == {"name": "roads"}
+        assert os.listdir(tmp_path) == ["roads.pmtiles"]
+
+    def test_identical_tiles_are_stored_once(self, tmp_path):
+        path = tmp_path / "grid.pmtiles"
+        # Tile ids 5, 6, 7, 8 then 20.
+        tiles = {(2, 0, 0): b"sea", (2, 1, 0): b"sea", (2, 1, 1): b"sea"}
+        tiles.update({(2, 0, 1): b"land", (2, 3, 0): b"sea"})
+
+        header = write_tiles(path, tiles)
+
+        assert header.addressed_tiles_count == 5
+        assert header.tile_contents_count == 2
+        # A run of three, then "land", then "sea" again.
+        assert header.tile_entries_count == 3
+        archive = PMTilesArchive(str(path))
+        for zxy, data in tiles.items():
+            assert gzip.decompress(archive.find_tile(*zxy)) == data
+
+    def test_large_directories_are_split_in_leaves(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(pmtiles, "MAX_ROOT_DIRECTORY_BYTES", 40)
+        monkeypatch.setattr(pmtiles, "LEAF_DIRECTORY_ENTRIES", 16)
+        path = tmp_path / "dense.pmtiles"
+        tiles = {(4, x, y): f"{x}/{y}".encode() for x in range(16) for y in range(16)}
+
+        header = write_tiles(path, tiles)
+
+        assert header.leaf_dirs_length > 0
+        archive = PMTilesArchive(str(path))
+        assert len(archive.root) < 256
+        for zxy, data in tiles.items():
+            assert gzip.decompress(archive.find_tile(*zxy)) == data
+
+    def test_tiles_out_of_order_are_rejected(self, tmp_path):
+        writer = ArchiveWriter(str(tmp_path / "roads.pmtiles"))
+        writer.add(5, b"a")
+        with pytest.raises(PMTilesError):
+            writer.add(5, b"b")
+        writer.close()
+        assert os.listdir(tmp_path) == []
@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+from app.core.singleflight import SingleFlight
+
+
+class TestSingleFlight:
+    @pytest.mark.asyncio
+    async def test_concurrent_calls_share_one_execution(self):
+        flights = SingleFlight()
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "tile"
+
+        results = await asyncio.gather(*(flights.do("k", fetch) for _ in range(10)))
+
+        assert results == ["tile"] * 10
+        assert len(calls) == 1
+        assert flights.stats.upstream_calls == 1
+        assert flights.stats.coalesced == 9
+        assert flights.in_flight == 0
+
+    @pytest.mark.asyncio
+    async def test_distinct_keys_are_not_coalesced(self):
+        flights = SingleFlight()
+
+        async def fetch():
+            await asyncio.sleep(0)
+            return 1
+
+        await asyncio.gather(flights.do("a", fetch), flights.do("b", fetch))
+        assert flights.stats.upstream_calls == 2
+
+    @pytest.mark.asyncio
+    async def test_failure_reaches_every_caller(self):
+        flights = SingleFlight()
+
+        async def fetch():
+            await asyncio.sleep(0.01)
+            raise TimeoutError("upstream timeout")
+
+        results = await asyncio.gather(
+            *(flights.do("k", fetch) for _ in range(3)), return_exceptions=True
+        )
+
+        assert all(isinstance(r, TimeoutError) for r in results)
+        assert flights.stats.failures == 1
+        assert flights.in_flight == 0
+
+    @pytest.mark.asyncio
+    async def test_next_call_after_completion_runs_again(self):
+        flights = SingleFlight()
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            return len(calls)
+
+        assert await flights.do("k", fetch) == 1
+        assert await flights.do("k", fetch) == 2
+
+    @pytest.mark.asyncio
+    async def test_cancelled_caller_does_not_cancel_followers(self):
+        flights = SingleFlight()
+        release = asyncio.Event()
+
+        async def fetch():
+            await release.wait()
+            return "tile"
+
+        leader = asyncio.ensure_future(flights.do("k", fetch))
+        follower = asyncio.ensure_future(flights.do("k", fetch))
+        await asyncio.sleep(0)
+
+        leader.cancel()
+        release.set()
+
+        assert await follower == "tile"
+        with pytest.raises(asyncio.CancelledError):
+            await leader
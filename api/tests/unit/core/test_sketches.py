@@ -0,0 +1,66 @@
+import pytest
+from app.core.sketches import HyperLogLog, Reservoir, TopK
+
+
+def test_hyperloglog_estimates_distinct_items():
+    hll = HyperLogLog()
+    for i in range(50000):
+        hll.add(f"value-{i % 20000}")
+    assert hll.count() == pytest.approx(20000, rel=0.05)
+
+
+def test_hyperloglog_small_cardinalities_are_close_to_exact():
+    hll = HyperLogLog()
+    for item in ["a", "b", "c", "a", "b"] * 10:
+        hll.add(item)
+    assert hll.count() == 3
+    assert HyperLogLog().count() == 0
+
+
+def test_hyperloglog_merge_and_round_trip():
+    left, right = HyperLogLog(), HyperLogLog()
+    for i in range(3000):
+        left.add(str(i))
+        right.add(str(i + 2000))
+    left.merge(HyperLogLog.from_dict(right.to_dict()))
+    assert left.count() == pytest.approx(5000, rel=0.05)
+    with pytest.raises(ValueError):
+        left.merge(HyperLogLog(precision=10))
+
+
+def test_top_k_keeps_frequent_items():
+    top = TopK(capacity=8)
+    for i in range(1000):
+        top.add("road" if i % 2 else f"rare-{i}")
+        if i % 5 == 0:
+            top.add("path", weight=2)
+
+    (first, count, error), (second, _, _) = top.top(2)
+    assert (first, count, error) == ("road", 500, 0)
+    assert second == "path"
+    restored = TopK.from_dict(top.to_dict())
+    assert restored.top(2) == top.top(2)
+
+
+def test_reservoir_quantiles():
+    reservoir = Reservoir(size=2000, seed=1)
+    for i in range(100000):
+        reservoir.add(float(i))
+
+    assert reservoir.seen == 100000
+    assert len(reservoir.items) == 2000
+    assert reservoir.quantile(0.5) == pytest.approx(50000, abs=3000)
+    assert reservoir.quantile(0.9) == pytest.approx(90000, abs=3000)
+    assert Reservoir.from_dict(reservoir.to_dict()).quantile(0.5) == (
+        reservoir.quantile(0.5)
+    )
+
+
+def test_reservoir_interpolates_small_samples():
+    reservoir = Reservoir()
+    assert reservoir.quantile(0.5) is None
+    for value in (1.0, 2.0, 3.0, 4.0):
+        reservoir.add(value)
+    assert reservoir.quantile(0) == 1.0
+    assert reservoir.quantile(0.5) == 2.5
+    assert reservoir.quantile(1) == 4.0
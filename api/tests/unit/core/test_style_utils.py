@@ -0,0 +1,152 @@
+import json
+
+from app.core.utils.style_utils import (
+    DatasourceRef,
+    datasource_from_url,
+    extract_datasource_refs,
+    extract_style_usage,
+)
+
+
+def _style(**kwargs) -> str:
+    return json.dumps({"version": 8, **kwargs})
+
+
+class TestDatasourceFromUrl:
+    def test_tile_template(self):
+        url = "https://canopy.dev/api/proxy/tiles/roads/{z}/{x}/{y}.pbf?token=abc"
+        assert datasource_from_url(url) == "roads"
+
+    def test_tilejson_url(self):
+        assert datasource_from_url("http://martin:3000/buildings") == "buildings"
+
+    def test_pmtiles_url(self):
+        assert datasource_from_url("pmtiles://https://cdn/parcels.pmtiles") == "parcels"
+
+    def test_empty_path(self):
+        assert datasource_from_url("http://martin:3000/") is None
+
+
+class TestExtractDatasourceRefs:
+    def test_non_json_style(self):
+        assert extract_datasource_refs("dark") == []
+        assert extract_datasource_refs("{not json") == []
+
+    def test_source_layers_per_source(self):
+        style = _style(
+            sources={
+                "osm": {"type": "vector", "url": "http://martin:3000/roads"},
+                "bati": {
+                    "type": "vector",
+                    "tiles": ["/proxy/tiles/buildings/{z}/{x}/{y}"],
+                },
+            },
+            layers=[
+                {"id": "bg", "type": "background"},
+                {"id": "a", "source": "osm", "source-layer": "primary"},
+                {"id": "b", "source": "osm", "source-layer": "secondary"},
+                {"id": "c", "source": "osm", "source-layer": "primary"},
+            ],
+        )
+
+        refs = extract_datasource_refs(style)
+
+        assert refs == [
+            DatasourceRef("osm", "roads", "http://martin:3000/roads", "primary"),
+            DatasourceRef("osm", "roads", "http://martin:3000/roads", "secondary"),
+            DatasourceRef(
+                "bati", "buildings", "/proxy/tiles/buildings/{z}/{x}/{y}", None
+            ),
+        ]
+
+    def test_inline_sources_ignored(self):
+        style = _style(
+            sources={"pts": {"type": "geojson", "data": {"type": "FeatureCollection"}}},
+            layers=[{"id": "p", "source": "pts"}],
+        )
+        assert extract_datasource_refs(style) == []
+
+
+class TestExtractStyleUsage:
+    SOURCES = {
+        "osm": {"type": "vector", "url": "http://martin:3000/roads"},
+        "bati": {"type": "vector", "url": "http://martin:3000/buildings"},
+    }
+
+    def test_properties_read_by_layers(self):
+        style = _style(
+            sources=self.SOURCES,
+            layers=[
+                {
+                    "id": "a",
+                    "source": "osm",
+                    "source-layer": "roads",
+                    "filter": ["==", ["get", "class"], "primary"],
+                    "paint": {
+                        "line-width": ["interpolate", ["linear"], ["get", "lanes"]]
+                    },
+                },
+                {
+                    "id": "b",
+                    "source": "osm",
+                    "source-layer": "roads",
+                    "filter": [
+                        "all",
+                        ["==", "$type", "LineString"],
+                        ["in", "surface", "a"],
+                    ],
+                    "layout": {"text-field": "{name} ({ref})"},
+                },
+                {
+                    "id": "c",
+                    "source": "bati",
+                    "source-layer": "buildings",
+                    "paint": {
+                        "fill-color": {"property": "height", "stops": [[0, "#fff"]]}
+                    },
+                },
+            ],
+        )
+
+        assert extract_style_usage(style) == {
+            "roads": {"roads": frozenset({"class", "lanes", "surface", "name", "ref"})},
+            "buildings": {"buildings": frozenset({"height"})},
+        }
+
+    def test_properties_expression_reads_everything(self):
+        style = _style(
+            sources=self.SOURCES,
+            layers=[
+                {"id": "a", "source": "osm", "source-layer": "roads"},
+                {
+                    "id": "b",
+                    "source": "osm",
+                    "source-layer": "roads",
+                    "layout": {"text-field": ["to-string", ["properties"]]},
+                },
+                {
+                    "id": "c",
+                    "source": "osm",
+                    "source-layer": "roads",
+                    "filter": ["has", "name"],
+                },
+            ],
+        )
+
+        assert extract_style_usage(style) == {"roads": {"roads": None}}
+
+    def test_object_lookups_and_promoted_ids(self):
+        sources = {"osm": {**self.SOURCES["osm"], "promoteId": {"roads": "osm_id"}}}
+        style = _style(
+            sources=sources,
+            layers=[
+                {
+                    "id": "a",
+                    "source": "osm",
+                    "source-layer": "roads",
+                    "filter": ["get", "x", ["literal", {"x": 1}]],
+                }
+            ],
+        )
+
+        assert extract_style_usage(style) == {"roads": {"roads": frozenset({"osm_id"})}}
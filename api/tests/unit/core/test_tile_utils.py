@@ -0,0 +1,35 @@
+import pytest
+from app.core.utils.tile_utils import split_sources, tile_bounds, tile_range
+
+
+def test_tile_range_of_point():
+    # Paris at zoom 10 is tile 518/352.
+    assert tile_range((2.35, 48.85, 2.35, 48.85), 10, buffer=0).count == 1
+    assert tile_range((2.35, 48.85, 2.35, 48.85), 10, buffer=0)[1:3] == (518, 352)
+
+
+def test_tile_range_world():
+    world = tile_range((-180, -90, 180, 90), 2)
+    assert (world.min_x, world.min_y, world.max_x, world.max_y) == (0, 0, 3, 3)
+    assert len(list(world.tiles())) == 16
+
+
+def test_tile_range_includes_buffer_neighbours():
+    min_lon, min_lat, max_lon, max_lat = tile_bounds(10, 518, 352)
+    # A point right on the tile edge also touches the neighbour through the buffer.
+    edge = tile_range(
+        (min_lon + 1e-9, min_lat + 1e-3, min_lon + 1e-9, min_lat + 1e-3), 10
+    )
+    assert edge.min_x == 517 and edge.max_x == 518
+
+
+@pytest.mark.parametrize("z,x,y", [(0, 0, 0), (5, 16, 10), (14, 8300, 5635)])
+def test_tile_bounds_round_trip(z, x, y):
+    min_lon, min_lat, max_lon, max_lat = tile_bounds(z, x, y)
+    center = ((min_lon + max_lon) / 2, (min_lat + max_lat) / 2)
+    assert tile_range(center * 2, z, buffer=0)[1:3] == (x, y)
+
+
+def test_split_sources():
+    assert split_sources("roads, rivers,,roads") == ["roads", "rivers"]
+    assert split_sources("") == []
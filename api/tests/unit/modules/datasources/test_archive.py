@@ -0,0 +1,194 @@
+import gzip
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pytest
+from app.core.config import Settings
+from app.core.enums.job_status import JobStatus
+from app.core.exceptions import DomainException
+from app.modules.datasources.archive import (
+    BUILD_PMTILES,
+    DatasourceArchiveService,
+    PyramidBuilder,
+)
+from app.modules.datasources.schemas import DatasourceArchiveCreate, DatasourceRead
+from app.modules.jobs.models import Job
+from app.modules.proxy.models import TileEngineSource
+from app.modules.proxy.pmtiles import PMTilesArchive
+from app.modules.users.models import UserRole
+from app.modules.users.schemas import UserDetail
+
+LOADER = UserDetail(
+    id=3,
+    username="loader",
+    email="loader@test.com",
+    roles=[UserRole.LOAD_DATA],
+    teams=[],
+)
+WORLD = (-180.0, -85.0, 180.0, 85.0)
+
+
+def tile_engine(fake_engine, tiles, occupied=()):
+    """Tiles of a table, and the tiles whose features are too small to show."""
+
+    def respond(sql, params):
+        tile = (params["z"], params["x"], params["y"])
+        if "EXISTS" in sql:
+            return tile in occupied
+        data = tiles.get(tile, b"")
+        return data(params["tolerance"]) if callable(data) else data
+
+    return fake_engine(respond)
+
+
+def rendered(engine):
+    return [
+        ((params["z"], params["x"], params["y"]), params.get("tolerance"))
+        for sql, params in engine.queries
+        if "EXISTS" not in sql
+    ]
+
+
+def builder(engine, **settings):
+    source = TileEngineSource(
+        datasource="roads", table_name="roads", srid=4326, columns=["name"]
+    )
+    return PyramidBuilder(
+        engine,
+        ThreadPoolExecutor(1),
+        source,
+        Settings(datasource_pmtiles_workers=2, **settings),
+    )
+
+
+class TestPyramidBuilder:
+    @pytest.mark.asyncio
+    async def test_descends_into_tiles_with_features(self, fake_engine, tmp_path):
+        engine = tile_engine(
+            fake_engine,
+            {
+                (0, 0, 0): b"world",
+                (1, 0, 0): b"sea",
+                (2, 0, 0): b"sea",
+                (2, 1, 0): b"sea",
+                (2, 0, 1): b"sea",
+                (2, 1, 1): b"sea",
+                (2, 2, 0): b"island",
+            },
+            # Only holds a feature too small to show at zoom 1.
+            occupied=[(1, 1, 0)],
+        )
+        path = tmp_path / "roads.pmtiles"
+        counted = []
+
+        stats = await builder(engine).build(str(path), WORLD, 0, 2, counted.append)
+
+        # Zoom 1 tiles (0, 1) and (1, 1) hold nothing: their children are skipped.
+        assert len(rendered(engine)) == 1 + 4 + 8
+        assert sum(counted) == 13
+        assert stats["tiles"] == 7 and stats["tile_contents"] == 3
+        archive = PMTilesArchive(str(path))
+        assert (archive.header.min_zoom, archive.header.max_zoom) == (0, 2)
+        assert gzip.decompress(archive.find_tile(2, 2, 0)) == b"island"
+        assert gzip.decompress(archive.find_tile(2, 1, 1)) == b"sea"
+        assert archive.find_tile(1, 1, 0) is None
+
+    @pytest.mark.asyncio
+    async def test_oversized_tiles_are_simplified_further(self, fake_engine, tmp_path):
+        def tile(tolerance):
+            return b"x" * (2000 if tolerance < 50000 else 10)
+
+        engine = tile_engine(
+            fake_engine, {(0, 0, 0): tile, (1, 0, 0): lambda _: b"x" * 2000}
+        )
+
+        stats = await builder(engine, datasource_pmtiles_max_tile_bytes=1000).build(
+            str(tmp_path / "roads.pmtiles"), WORLD, 0, 1
+        )
+
+        tolerances = [t for zxy, t in rendered(engine) if zxy == (0, 0, 0)]
+        assert tolerances == pytest.approx([9783.94, 19567.88, 39135.76, 78271.52])
+        # Still over the budget after the retries: kept, and counted.
+        assert stats["tiles_oversized"] == 1
+        assert stats["tiles"] == 2
+
+    @pytest.mark.asyncio
+    async def test_tile_count_is_limited(self, fake_engine, tmp_path):
+        engine = tile_engine(fake_engine, {(0, 0, 0): b"world", (1, 0, 0): b"nw"})
+
+        with pytest.raises(DomainException) as exc:
+            await builder(engine, datasource_pmtiles_max_tiles=4).build(
+                str(tmp_path / "roads.pmtiles"), WORLD, 0, 1
+            )
+
+        assert exc.value.key == "datasource.pmtiles_too_many_tiles"
+        assert list(tmp_path.iterdir()) == []
+
+
+class FakeSession:
+    async def commit(self):
+        pass
+
+
+class FakeRepository:
+    session = FakeSession()
+
+
+class FakeDatasources:
+    async def get_datasource(self, datasource_id, current_user):
+        return DatasourceRead(
+            id=datasource_id,
+            name="roads",
+            geometry_column="geom",
+            srid=4326,
+            feature_count=1,
+            columns=[],
+            ingest_seconds=0.1,
+            created_at=datetime.utcnow(),
+            created_by_id=current_user.id,
+        )
+
+
+class FakeJobs:
+    def __init__(self):
+        self.queued = []
+
+    async def enqueue(self, kind, payload, current_user):
+        self.queued.append((kind, payload))
+        return Job(
+            id=len(self.queued),
+            kind=kind,
+            payload=payload,
+            status=JobStatus.PENDING,
+            attempts=0,
+            max_attempts=3,
+            rows_processed=0,
+            rows_per_second=0.0,
+            created_at=datetime.utcnow(),
+            created_by_id=current_user.id,
+        )
+
+
+class TestDatasourceArchiveService:
+    @pytest.mark.asyncio
+    async def test_build_is_queued_within_the_zoom_limit(self, tmp_path):
+        service = DatasourceArchiveService(
+            FakeRepository(),
+            FakeDatasources(),
+            FakeJobs(),
+            Settings(pmtiles_directory=str(tmp_path), datasource_pmtiles_max_zoom=12),
+        )
+
+        job = await service.queue_build(7, DatasourceArchiveCreate(min_zoom=2), LOADER)
+
+        assert job.kind == BUILD_PMTILES
+        assert service.jobs.queued == [
+            (BUILD_PMTILES, {"datasource_id": 7, "min_zoom": 2, "max_zoom": 12})
+        ]
+        for data in (
+            DatasourceArchiveCreate(max_zoom=13),
+            DatasourceArchiveCreate(min_zoom=5, max_zoom=4),
+        ):
+            with pytest.raises(DomainException) as exc:
+                await service.queue_build(7, data, LOADER)
+            assert exc.value.key == "datasource.pmtiles_invalid_zooms"
@@ -0,0 +1,233 @@
+import csv
+import gzip
+import io
+import json
+import struct
+import zlib
+from datetime import datetime
+
+import pytest
+from app.core.config import Settings
+from app.core.exceptions import DomainException
+from app.core.utils.flatgeobuf import FlatGeobuf
+from app.core.utils.geojson import EWKB_SRID
+from app.modules.datasources import export as export_module
+from app.modules.datasources.export import (
+    CSVEncoder,
+    DatasourceExportService,
+    FlatGeobufEncoder,
+    GeoJSONEncoder,
+)
+from app.modules.datasources.schemas import DatasourceRead
+from app.modules.users.models import UserRole
+from app.modules.users.schemas import UserDetail
+
+LOADER = UserDetail(
+    id=3,
+    username="loader",
+    email="loader@test.com",
+    roles=[UserRole.LOAD_DATA],
+    teams=[],
+)
+TYPES = {"name": "text", "lanes": "bigint", "lit": "boolean", "tags": "jsonb"}
+
+
+def roads():
+    return DatasourceRead(
+        id=7,
+        name="roads",
+        geometry_column="geom",
+        srid=2154,
+        feature_count=3,
+        columns=list(TYPES),
+        ingest_seconds=0.1,
+        created_at=datetime.utcnow(),
+        created_by_id=LOADER.id,
+    )
+
+
+def wkb_point(x, y):
+    return struct.pack("<BI2d", 1, 1, x, y)
+
+
+def wkb_polygon(*rings):
+    data = struct.pack("<BII", 1, 3, len(rings))
+    for ring in rings:
+        data += struct.pack(f"<I{2 * len(ring)}d", len(ring), *sum(ring, ()))
+    return data
+
+
+SQUARE = [(0, 0), (4, 0), (4, 4), (0, 4), (0, 0)]
+HOLE = [(1, 1), (2, 1), (2, 2), (1, 1)]
+
+
+class TestEncoders:
+    def test_geojson_features_are_joined_across_batches(self):
+        encoder = GeoJSONEncoder(roads(), TYPES)
+        rows = [
+            (1, '{"type":"Point","coordinates":[1,2]}', "A1", 2, True, {"k": "é"}),
+            (2, None, None, None, None, None),
+        ]
+
+        data = (
+            encoder.header()
+            + encoder.encode(rows[:1])
+            + encoder.encode([])
+            + encoder.encode(rows[1:])
+            + encoder.footer()
+        )
+
+        collection = json.loads(data)
+        first, second = collection["features"]
+        assert first["id"] == 1
+        assert first["geometry"] == {"type": "Point", "coordinates": [1, 2]}
+        assert first["properties"] == {
+            "name": "A1",
+            "lanes": 2,
+            "lit": True,
+            "tags": {"k": "é"},
+        }
+        assert second["geometry"] is None
+
+    def test_csv_rows_hold_wkt_and_json_text(self):
+        encoder = CSVEncoder(roads(), TYPES)
+
+        data = encoder.header() + encoder.encode(
+            [
+                (1, "POINT(1 2)", "A, 1", 2, False, {"k": 1}),
+                (2, None, None, 3, None, None),
+            ]
+        )
+
+        assert list(csv.reader(io.StringIO(data.decode()))) == [
+            ["fid", "geom", "name", "lanes", "lit", "tags"],
+            ["1", "POINT(1 2)", "A, 1", "2", "false", '{"k": 1}'],
+            ["2", "", "", "3", "", ""],
+        ]
+
+    def test_flatgeobuf_reads_back(self, tmp_path):
+        encoder = FlatGeobufEncoder(roads(), TYPES)
+        polygon = wkb_polygon(SQUARE, HOLE)
+        multipolygon = struct.pack("<BII", 1, 6, 2) + polygon + wkb_polygon(SQUARE)
+        rows = [
+            (1, wkb_point(1, 2), "A1", 2, True, {"k": 1}),
+            (2, polygon, None, None, None, None),
+            (3, multipolygon, "é", -3, False, None),
+            (4, None, "x", None, None, None),
+        ]
+        path = tmp_path / "roads.fgb"
+        path.write_bytes(encoder.header() + encoder.encode(rows) + encoder.footer())
+
+        fgb = FlatGeobuf(str(path))
+        assert (fgb.name, fgb.srid, fgb.indexed) == ("roads", 2154, False)
+        assert [name for name, _ in fgb.fields] == list(TYPES)
+        records = list(fgb.records(0, 10, 2154, offset=0))
+
+        # EWKB read back: the WKB written, with the SRID.
+        geometries = [
+            None
+            if ewkb is None
+            else ewkb[:1]
+            + struct.pack("<I", struct.unpack_from("<I", ewkb, 1)[0] & ~EWKB_SRID)
+            + ewkb[9:]
+            for _, ewkb, _ in records
+        ]
+        assert geometries == [wkb_point(1, 2), polygon, multipolygon, None]
+        assert [values for _, _, values in records] == [
+            ["A1", 2, True, '{"k": 1}'],
+            [None, None, None, None],
+            ["é", -3, False, None],
+            ["x", None, None, None],
+        ]
+
+
+class FakeSession:
+    def __init__(self):
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeRepository:
+    def __init__(self):
+        self.session = FakeSession()
+
+    async def column_types(self, table):
+        return {"fid": "bigint", "geom": "geometry", **TYPES}
+
+
+class FakeDatasources:
+    async def get_datasource(self, datasource_id, current_user):
+        return roads()
+
+
+ROWS = [
+    (i, f'{{"type":"Point","coordinates":[{i},0]}}', f"n{i}", i, None, None)
+    for i in range(1, 6)
+]
+
+
+class TestDatasourceExportService:
+    @pytest.fixture
+    def engine(self, fake_engine, monkeypatch):
+        engine = fake_engine(ROWS)
+        monkeypatch.setattr(export_module, "get_engine", lambda: engine)
+        return engine
+
+    def service(self):
+        return DatasourceExportService(
+            FakeRepository(),
+            FakeDatasources(),
+            Settings(datasource_export_batch_size=2),
+        )
+
+    async def body(self, response):
+        return [chunk async for chunk in response.body_iterator]
+
+    @pytest.mark.asyncio
+    async def test_streams_a_batch_per_chunk(self, engine):
+        service = self.service()
+
+        response = await service.export(7, "geojson", None, False, LOADER)
+        chunks = await self.body(response)
+
+        assert service.repository.session.closed
+        assert response.media_type == "application/geo+json"
+        assert response.headers["content-disposition"] == (
+            'attachment; filename="roads.geojson"'
+        )
+        # Header, three batches, footer.
+        assert len(chunks) == 5
+        features = json.loads(b"".join(chunks))["features"]
+        assert [feature["id"] for feature in features] == [1, 2, 3, 4, 5]
+        query, params = engine.queries[0]
+        assert query.startswith("SELECT fid, ST_AsGeoJSON(ST_Transform(geom, 4326))")
+        assert "FROM roads" in query and "WHERE" not in query
+        assert params == {}
+
+    @pytest.mark.asyncio
+    async def test_bbox_subsets_are_gzipped(self, engine):
+        response = await self.service().export(
+            7, "csv", (0.0, 1.0, 2.0, 3.0), True, LOADER
+        )
+        chunks = await self.body(response)
+
+        assert response.media_type == "application/gzip"
+        assert response.headers["content-disposition"].endswith('roads.csv.gz"')
+        # Every chunk decodes on its own as it arrives.
+        decompressor = zlib.decompressobj(31)
+        assert decompressor.decompress(chunks[0]).startswith(b"fid,geom,name")
+        lines = gzip.decompress(b"".join(chunks)).decode().splitlines()
+        assert len(lines) == 6
+        query, params = engine.queries[0]
+        assert "ST_Intersects(" in query and "4326), 2154)" in query
+        assert params == {"min_x": 0.0, "min_y": 1.0, "max_x": 2.0, "max_y": 3.0}
+
+    @pytest.mark.asyncio
+    async def test_inverted_bbox_is_rejected(self, engine):
+        with pytest.raises(DomainException) as exc:
+            await self.service().export(7, "fgb", (2.0, 0.0, 1.0, 1.0), False, LOADER)
+
+        assert exc.value.key == "datasource.invalid_bbox"
+        assert engine.queries == []
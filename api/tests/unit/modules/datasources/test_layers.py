@@ -0,0 +1,756 @@
+import io
+import json
+import sqlite3
+import struct
+import zipfile
+from datetime import date, datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from app.core.config import Settings
+from app.core.exceptions import DomainException
+from app.core.utils import flatgeobuf as flatgeobuf_module
+from app.core.utils.flatgeobuf import level_bounds
+from app.core.utils.geojson import EWKB_SRID
+from app.core.utils.parquet import crs_srid
+from app.core.utils.shapefile import shape_to_ewkb
+from app.modules.datasources import service as datasource_service
+from app.modules.datasources.ingest import BIGINT, DOUBLE, TEXT
+from app.modules.datasources.layers import (
+    LayerError,
+    encode_range,
+    open_layer,
+    prj_srid,
+)
+from app.modules.datasources.models import Datasource
+from app.modules.datasources.service import DatasourceService, parse_bbox
+from app.modules.users.models import UserRole
+from app.modules.users.schemas import UserDetail
+
+LOADER = UserDetail(
+    id=3,
+    username="loader",
+    email="loader@test.com",
+    roles=[UserRole.LOAD_DATA],
+    teams=[],
+)
+LAMBERT_93 = (
+    'PROJCS["RGF93 / Lambert-93",GEOGCS["RGF93",AUTHORITY["EPSG","4171"]],'
+    'UNIT["metre",1,AUTHORITY["EPSG","9001"]],AUTHORITY["EPSG","2154"]]'
+)
+
+
+def point(x, y):
+    return struct.pack("<i2d", 1, x, y)
+
+
+def polygon(*rings):
+    points = [p for ring in rings for p in ring]
+    starts, start = [], 0
+    for ring in rings:
+        starts.append(start)
+        start += len(ring)
+    return (
+        struct.pack("<i4d2i", 5, 0, 0, 0, 0, len(rings), len(points))
+        + struct.pack(f"<{len(rings)}i", *starts)
+        + b"".join(struct.pack("<2d", *p) for p in points)
+    )
+
+
+def shapefile_zip(shapes, fields, rows, deleted=(), prj=None) -> bytes:
+    """Zipped shapefile of `shapes` with DBF `fields` (name, type, length, decimals)."""
+    shp, shx = io.BytesIO(), io.BytesIO()
+    shp.write(bytes(100))
+    shx.write(bytes(100))
+    for number, content in enumerate(shapes, 1):
+        shx.write(struct.pack(">2i", shp.tell() // 2, len(content) // 2))
+        shp.write(struct.pack(">2i", number, len(content) // 2) + content)
+
+    record_length = 1 + sum(field[2] for field in fields)
+    header_length = 32 + 32 * len(fields) + 1
+    dbf = io.BytesIO()
+    dbf.write(struct.pack("<B3xIHH20x", 3, len(rows), header_length, record_length))
+    for name, kind, length, decimals in fields:
+        dbf.write(
+            struct.pack("<11sc4xBB14x", name.encode(), kind.encode(), length, decimals)
+        )
+    dbf.write(b"\x0d")
+    for i, row in enumerate(rows):
+        dbf.write(b"*" if i in deleted else b" ")
+        for (_, _, length, _), value in zip(fields, row):
+            dbf.write(value.encode("utf-8").ljust(length)[:length])
+
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as z:
+        z.writestr("data/roads.shp", shp.getvalue())
+        z.writestr("data/roads.shx", shx.getvalue())
+        z.writestr("data/roads.dbf", dbf.getvalue())
+        z.writestr("data/roads.cpg", "UTF-8")
+        if prj is not None:
+            z.writestr("data/roads.prj", prj)
+    return archive.getvalue()
+
+
+def geopackage(path, rows):
+    connection = sqlite3.connect(path)
+    connection.executescript(
+        """
+        CREATE TABLE gpkg_spatial_ref_sys (srs_name TEXT, srs_id INTEGER,
+            organization TEXT, organization_coordsys_id INTEGER);
+        INSERT INTO gpkg_spatial_ref_sys VALUES ('WGS 84', 4326, 'EPSG', 4326);
+        CREATE TABLE gpkg_contents (table_name TEXT, data_type TEXT);
+        INSERT INTO gpkg_contents VALUES ('places', 'features');
+        CREATE TABLE gpkg_geometry_columns (table_name TEXT, column_name TEXT,
+            srs_id INTEGER);
+        INSERT INTO gpkg_geometry_columns VALUES ('places', 'shape', 4326);
+        CREATE TABLE places (fid INTEGER PRIMARY KEY, shape BLOB,
+            name TEXT(20), rank MEDIUMINT, thumbnail BLOB);
+        """
+    )
+    connection.executemany("INSERT INTO places VALUES (?, ?, ?, ?, ?)", rows)
+    connection.commit()
+    connection.close()
+
+
+def gpkg_point(x, y) -> bytes:
+    # Header with a 2D envelope (indicator 1), little-endian.
+    return (
+        b"GP\x00\x03"
+        + struct.pack("<i4d", 4326, x, x, y, y)
+        + struct.pack("<BI2d", 1, 1, x, y)
+    )
+
+
+def decode_copy(data: bytes, types):
+    """Rows of a binary COPY stream."""
+    assert data.startswith(b"PGCOPY\n\xff\r\n\x00")
+    position, rows = 19, []
+    while True:
+        (count,) = struct.unpack_from(">h", data, position)
+        position += 2
+        if count == -1:
+            return rows
+        row = []
+        for column_type in types:
+            (length,) = struct.unpack_from(">i", data, position)
+            position += 4
+            if length == -1:
+                row.append(None)
+                continue
+            raw = data[position : position + length]
+            position += length
+            row.append(
+                {
+                    "int8": lambda b: struct.unpack(">q", b)[0],
+                    "float8": lambda b: struct.unpack(">d", b)[0],
+                    "bool": lambda b: b == b"\x01",
+                    "text": bytes.decode,
+                    "bytea": bytes,
+                }[column_type](raw)
+            )
+        rows.append(row)
+
+
+FIELDS = [("NAME", "C", 10, 0), ("LANES", "N", 4, 0), ("WIDTH", "N", 8, 2)]
+
+
+class TestShapes:
+    def test_polygon_rings_are_grouped(self):
+        outer = [(0, 0), (0, 10), (10, 10), (10, 0), (0, 0)]
+        hole = [(2, 2), (4, 2), (4, 4), (2, 4), (2, 2)]
+        other = [(20, 0), (20, 5), (25, 5), (20, 0)]
+
+        single = shape_to_ewkb(memoryview(polygon(outer, hole)), 2154)
+        multi = shape_to_ewkb(memoryview(polygon(outer, other, hole)), 2154)
+
+        assert struct.unpack_from("<BIII", single) == (1, 3 | EWKB_SRID, 2154, 2)
+        assert struct.unpack_from("<BIII", multi) == (1, 6 | EWKB_SRID, 2154, 2)
+        # The hole goes with the outer ring containing it.
+        assert struct.unpack_from("<BII", multi, 13) == (1, 3, 2)
+
+    def test_prj_srid(self):
+        assert prj_srid(LAMBERT_93) == 2154
+        assert prj_srid('GEOGCS["GCS_WGS_1984",DATUM["D_WGS_1984"]]') == 4326
+        assert prj_srid('PROJCS["WGS_1984_UTM_Zone_31N",GEOGCS[]]') == 32631
+        assert prj_srid('PROJCS["Custom",GEOGCS[]]') is None
+
+
+class TestShapefileLayer:
+    def test_ranges_are_encoded_independently(self, tmp_path):
+        upload = tmp_path / "upload"
+        upload.write_bytes(
+            shapefile_zip(
+                [point(1, 2), point(3, 4), point(5, 6)],
+                FIELDS,
+                [["Rue Été", "2", "7.50"], ["A1", "", ""], ["gone", "1", "1"]],
+                deleted={2},
+                prj=LAMBERT_93,
+            )
+        )
+
+        layer = open_layer(str(upload), str(tmp_path), None, 2)
+        first, first_count = encode_range(layer, *layer.ranges[0])
+        second, second_count = encode_range(layer, *layer.ranges[1])
+
+        assert layer.name == "roads" and layer.srid == 2154 and layer.count == 3
+        assert layer.columns == [("name", TEXT), ("lanes", BIGINT), ("width", DOUBLE)]
+        assert layer.ranges == [(0, 2), (2, 3)]
+        types = ["int8", "bytea", "text", "int8", "float8"]
+        rows = decode_copy(first, types)
+        assert (first_count, second_count) == (2, 0)
+        assert rows[0][0] == 1 and rows[0][2:] == ["Rue Été", 2, 7.5]
+        assert rows[1][2:] == ["A1", None, None]
+        assert rows[1][1] == struct.pack("<BII2d", 1, 1 | EWKB_SRID, 2154, 3, 4)
+
+    def test_invalid_uploads(self, tmp_path):
+        upload = tmp_path / "upload"
+        upload.write_bytes(b'{"type": "FeatureCollection"}')
+        with pytest.raises(LayerError):
+            open_layer(str(upload), str(tmp_path), None, 10)
+
+        upload.write_bytes(shapefile_zip([point(1, 2)], FIELDS, [["a", "1", "1"]]))
+        with pytest.raises(LayerError):
+            open_layer(str(upload), str(tmp_path), "rivers", 10)
+
+
+class TestGeoPackageLayer:
+    def test_fid_ranges_and_loose_types(self, tmp_path):
+        path = tmp_path / "upload"
+        geopackage(
+            str(path),
+            [
+                (1, gpkg_point(1, 2), "Paris", 1, b"png"),
+                (2, None, "Lyon", "2", None),
+                (10, gpkg_point(5, 6), None, "n/a", None),
+            ],
+        )
+
+        layer = open_layer(str(path), str(tmp_path), None, 2)
+        rows = []
+        for start, stop in layer.ranges:
+            data, _ = encode_range(layer, start, stop)
+            rows += decode_copy(data, ["int8", "bytea", "text", "int8"])
+
+        assert layer.name == "places" and layer.srid == 4326
+        assert layer.columns == [("name", TEXT), ("rank", BIGINT)]
+        assert [row[0] for row in rows] == [1, 2, 10]
+        assert rows[0][1] == struct.pack("<BII2d", 1, 1 | EWKB_SRID, 4326, 1, 2)
+        assert rows[1][1:] == [None, "Lyon", 2]
+        assert rows[2][3] is None
+
+
+def fb_table(fields) -> bytes:
+    """
+    FlatBuffers bytes of a root table. `fields` maps field ids to (kind, value):
+    a struct format ("B", "H", "i", "Q"), "str", "table", "tables", or a vector
+    format ("d*", "I*", "B*").
+    """
+    out = bytearray(4)
+    struct.pack_into("<I", out, 0, _fb_write(out, fields))
+    return bytes(out)
+
+
+def _fb_write(out, fields) -> int:
+    """Append a table, after its vtable and before what it points to."""
+    count = max(fields) + 1 if fields else 0
+    offsets, size = {}, 4
+    for field, (kind, _) in sorted(fields.items()):
+        offsets[field] = size
+        size += struct.calcsize(kind) if kind in ("B", "H", "i", "Q") else 4
+    vtable = len(out)
+    out += struct.pack(
+        f"<HH{count}H", 4 + 2 * count, size, *(offsets.get(i, 0) for i in range(count))
+    )
+    table = len(out)
+    out += struct.pack("<i", table - vtable) + bytes(size - 4)
+    for field, (kind, value) in sorted(fields.items()):
+        at = table + offsets[field]
+        if kind in ("B", "H", "i", "Q"):
+            struct.pack_into(f"<{kind}", out, at, value)
+            continue
+        target = len(out)
+        if kind == "str":
+            out += struct.pack("<I", len(value.encode())) + value.encode()
+        elif kind == "B*":
+            out += struct.pack("<I", len(value)) + value
+        elif kind.endswith("*"):
+            out += struct.pack(f"<I{len(value)}{kind[0]}", len(value), *value)
+        elif kind == "table":
+            target = _fb_write(out, value)
+        else:
+            out += struct.pack("<I", len(value))
+            slots = len(out)
+            out += bytes(4 * len(value))
+            for i, child in enumerate(value):
+                slot = slots + 4 * i
+                struct.pack_into("<I", out, slot, _fb_write(out, child) - slot)
+        struct.pack_into("<I", out, at, target - at)
+    return table
+
+
+def fgb_properties(*values) -> bytes:
+    """(column, struct format or None for a string, value) properties."""
+    data = b""
+    for column, kind, value in values:
+        if kind is None:
+            data += struct.pack("<HI", column, len(value.encode())) + value.encode()
+        else:
+            data += struct.pack(f"<H{kind}", column, value)
+    return data
+
+
+def flatgeobuf(path, features, node_size=2):
+    """
+    FlatGeobuf of (bbox, geometry fields, properties) features, indexed by a
+    packed R-tree of `node_size` unless 0.
+    """
+    columns = [
+        {0: ("str", "name"), 1: ("B", flatgeobuf_module.STRING)},
+        {0: ("str", "lanes"), 1: ("B", flatgeobuf_module.INT)},
+        {0: ("str", "photo"), 1: ("B", flatgeobuf_module.BINARY)},
+    ]
+    header = fb_table(
+        {
+            0: ("str", "roads"),
+            7: ("tables", columns),
+            8: ("Q", len(features)),
+            9: ("H", node_size),
+            10: ("table", {0: ("str", "EPSG"), 1: ("i", 2154)}),
+        }
+    )
+    data, offsets = b"", []
+    for _, geometry, properties in features:
+        feature = fb_table({0: ("table", geometry), 1: ("B*", properties)})
+        offsets.append(len(data))
+        data += struct.pack("<I", len(feature)) + feature
+
+    index = b""
+    if node_size:
+        bounds = level_bounds(len(features), node_size)
+        nodes = [None] * bounds[0][1]
+        for i, (bbox, _, _) in enumerate(features):
+            nodes[bounds[0][0] + i] = (*bbox, offsets[i])
+        for (child_start, child_end), (start, end) in zip(bounds, bounds[1:]):
+            for position in range(start, end):
+                first = child_start + (position - start) * node_size
+                children = nodes[first : min(first + node_size, child_end)]
+                nodes[position] = (
+                    min(c[0] for c in children),
+                    min(c[1] for c in children),
+                    max(c[2] for c in children),
+                    max(c[3] for c in children),
+                    first,
+                )
+        index = b"".join(struct.pack("<4dQ", *node) for node in nodes)
+    with open(path, "wb") as file:
+        file.write(b"fgb\x03fgb\x00" + struct.pack("<I", len(header)) + header)
+        file.write(index + data)
+
+
+def fgb_point(x, y):
+    return (
+        (x, y, x, y),
+        {1: ("d*", [x, y]), 6: ("B", flatgeobuf_module.POINT)},
+    )
+
+
+FGB_SQUARE = [0, 0, 0, 4, 4, 4, 0, 0]
+FGB_HOLE = [1, 1, 2, 1, 1, 2, 1, 1]
+FGB_FEATURES = [
+    (*fgb_point(1, 1), fgb_properties((0, None, "A1"), (1, "i", 2))),
+    (*fgb_point(10, 10), fgb_properties((0, None, "A2"))),
+    (
+        (20, 20, 24, 24),
+        {
+            0: ("I*", [4, 8]),
+            1: ("d*", [v + 20 for v in FGB_SQUARE + FGB_HOLE]),
+            6: ("B", flatgeobuf_module.POLYGON),
+        },
+        fgb_properties((2, "I", 0), (1, "i", 3)),
+    ),
+    (*fgb_point(2, 2), b""),
+]
+
+
+def ewkb_point(x, y, srid=2154):
+    return struct.pack("<BII2d", 1, 1 | EWKB_SRID, srid, x, y)
+
+
+class TestFlatGeobufLayer:
+    def test_level_bounds(self):
+        assert level_bounds(1, 16) == [(1, 2), (0, 1)]
+        assert level_bounds(5, 2) == [(6, 11), (3, 6), (1, 3), (0, 1)]
+
+    def test_ranges_of_an_indexed_file(self, tmp_path):
+        path = tmp_path / "upload"
+        flatgeobuf(str(path), FGB_FEATURES)
+
+        layer = open_layer(str(path), str(tmp_path), None, 3)
+        rows = []
+        for start, stop in layer.ranges:
+            data, _ = encode_range(layer, start, stop)
+            rows += decode_copy(data, ["int8", "bytea", "text", "int8"])
+
+        assert layer.name == "roads" and layer.srid == 2154 and layer.count == 4
+        # The binary column is not loaded.
+        assert layer.columns == [("name", TEXT), ("lanes", BIGINT)]
+        assert layer.ranges == [(0, 3), (3, 4)]
+        assert [row[0] for row in rows] == [1, 2, 3, 4]
+        assert rows[0] == [1, ewkb_point(1, 1), "A1", 2]
+        assert rows[1][2:] == ["A2", None] and rows[2][2:] == [None, 3]
+        ring = struct.pack("<I8d", 4, *(v + 20 for v in FGB_SQUARE))
+        hole = struct.pack("<I8d", 4, *(v + 20 for v in FGB_HOLE))
+        assert (
+            rows[2][1] == struct.pack("<BIII", 1, 3 | EWKB_SRID, 2154, 2) + ring + hole
+        )
+
+    def test_bbox_reads_the_intersecting_features(self, tmp_path):
+        path = tmp_path / "upload"
+        flatgeobuf(str(path), FGB_FEATURES)
+
+        layer = open_layer(str(path), str(tmp_path), None, 1, bbox=(0, 0, 3, 3))
+        rows = []
+        for start, stop in layer.ranges:
+            data, count = encode_range(layer, start, stop)
+            assert count == 1
+            rows += decode_copy(data, ["int8", "bytea", "text", "int8"])
+
+        assert layer.count == 2 and layer.ranges == [(0, 1), (3, 4)]
+        assert [row[0] for row in rows] == [1, 4]
+        assert rows[1][1] == ewkb_point(2, 2)
+
+    def test_file_without_index_is_scanned(self, tmp_path):
+        path = tmp_path / "upload"
+        flatgeobuf(str(path), FGB_FEATURES, node_size=0)
+
+        layer = open_layer(str(path), str(tmp_path), None, 3)
+        data, count = encode_range(layer, *layer.ranges[1])
+
+        assert layer.ranges == [(0, 3), (3, 4)] and layer.count == 4
+        assert count == 1
+        assert decode_copy(data, ["int8", "bytea", "text", "int8"]) == [
+            [4, ewkb_point(2, 2), None, None]
+        ]
+        with pytest.raises(LayerError):
+            open_layer(str(path), str(tmp_path), None, 3, bbox=(0, 0, 3, 3))
+
+    def test_bbox_needs_a_flatgeobuf(self, tmp_path):
+        upload = tmp_path / "upload"
+        upload.write_bytes(shapefile_zip([point(1, 2)], FIELDS, [["a", "1", "1"]]))
+
+        with pytest.raises(LayerError):
+            open_layer(str(upload), str(tmp_path), None, 10, bbox=(0, 0, 1, 1))
+
+
+def wkb_point(x, y, z=None):
+    if z is None:
+        return struct.pack("<BI2d", 1, 1, x, y)
+    return struct.pack("<BI3d", 1, 1001, x, y, z)
+
+
+def geoparquet(path, row_groups, crs=None, compression="snappy"):
+    """
+    GeoParquet of row groups ({column: values}), with a binary `photo` and a
+    nested `tags` column.
+    """
+    schema = pa.schema(
+        [
+            ("geometry", pa.binary()),
+            ("name", pa.dictionary(pa.int32(), pa.string())),
+            ("photo", pa.binary()),
+            ("tags", pa.list_(pa.string())),
+            ("rank", pa.int64()),
+            ("seen", pa.timestamp("ms")),
+            ("day", pa.date32()),
+        ]
+    )
+    geometry = {"encoding": "WKB", "geometry_types": ["Point"]}
+    if crs is not None:
+        geometry["crs"] = crs
+    geo = {
+        "version": "1.1.0",
+        "primary_column": "geometry",
+        "columns": {"geometry": geometry},
+    }
+    schema = schema.with_metadata({"geo": json.dumps(geo)})
+    with pq.ParquetWriter(path, schema, compression=compression) as writer:
+        for rows in row_groups:
+            count = len(rows["rank"])
+            rows = {
+                "tags": [None] * count,
+                "seen": [None] * count,
+                "day": [None] * count,
+                **rows,
+            }
+            writer.write_table(pa.Table.from_pydict(rows, schema=schema))
+
+
+class TestGeoParquetLayer:
+    def test_row_groups_are_ranges(self, tmp_path):
+        path = tmp_path / "upload"
+        geoparquet(
+            str(path),
+            [
+                {
+                    "geometry": [wkb_point(1, 2), None],
+                    "name": ["Paris", None],
+                    "photo": [b"png", b"jpg"],
+                    "rank": [1, 2],
+                },
+                {
+                    "geometry": [wkb_point(3, 4, 5)],
+                    "name": ["Lyon"],
+                    "photo": [None],
+                    "rank": [3],
+                },
+            ],
+            crs={"id": {"authority": "EPSG", "code": 2154}},
+        )
+
+        layer = open_layer(str(path), str(tmp_path), None, 1)
+        rows = []
+        for start, stop in layer.ranges:
+            data, _ = encode_range(layer, start, stop)
+            rows += decode_copy(data, ["int8", "bytea", "text", "int8", "text", "text"])
+
+        assert layer.name == "geometry" and layer.srid == 2154 and layer.count == 3
+        # Binary and nested columns are not loaded.
+        assert layer.columns == [
+            ("name", TEXT),
+            ("rank", BIGINT),
+            ("seen", TEXT),
+            ("day", TEXT),
+        ]
+        assert layer.ranges == [(0, 2), (2, 3)]
+        assert rows[0] == [1, ewkb_point(1, 2), "Paris", 1, None, None]
+        assert rows[1] == [2, None, None, 2, None, None]
+        assert rows[2][1] == struct.pack("<BII3d", 1, 1001 | EWKB_SRID, 2154, 3, 4, 5)
+        assert rows[2][2:4] == ["Lyon", 3]
+        # Small row groups are merged into one range.
+        assert open_layer(str(path), str(tmp_path), None, 10).ranges == [(0, 3)]
+
+    def test_zstd_and_dates(self, tmp_path):
+        path = tmp_path / "upload"
+        geoparquet(
+            str(path),
+            [
+                {
+                    "geometry": [wkb_point(1, 2)],
+                    "name": ["Paris"],
+                    "photo": [None],
+                    "rank": [1],
+                    "seen": [datetime(2024, 5, 1, 12, 30)],
+                    "day": [date(2024, 5, 1)],
+                }
+            ],
+            compression="zstd",
+        )
+
+        layer = open_layer(str(path), str(tmp_path), None, 10)
+        data, count = encode_range(layer, 0, 1)
+
+        assert count == 1
+        assert decode_copy(data, ["int8", "bytea", "text", "int8", "text", "text"]) == [
+            [
+                1,
+                ewkb_point(1, 2, srid=4326),
+                "Paris",
+                1,
+                "2024-05-01T12:30:00",
+                "2024-05-01",
+            ]
+        ]
+
+    def test_crs(self, tmp_path):
+        path = tmp_path / "upload"
+        rows = {"geometry": [None], "name": [None], "photo": [None], "rank": [1]}
+        geoparquet(str(path), [rows])
+        assert open_layer(str(path), str(tmp_path), None, 1).srid == 4326
+        # Named geometry column: not one.
+        with pytest.raises(LayerError):
+            open_layer(str(path), str(tmp_path), "rank", 1)
+        assert crs_srid(None) is None
+        assert crs_srid({"id": {"authority": "OGC", "code": "CRS84"}}) == 4326
+
+    def test_corrupt_file(self, tmp_path):
+        path = tmp_path / "upload"
+        path.write_bytes(b"PAR1" + b"\x00" * 32 + b"PAR1")
+        with pytest.raises(LayerError):
+            open_layer(str(path), str(tmp_path), None, 1)
+
+
+class FakeSession:
+    def __init__(self):
+        self.commits = 0
+
+    async def execute(self, statement, params=None):
+        pass
+
+    async def commit(self):
+        self.commits += 1
+
+    async def rollback(self):
+        pass
+
+
+class FakeDatasourceRepository:
+    def __init__(self):
+        self.session = FakeSession()
+        self.calls = []
+
+    async def get_by_name(self, name):
+        return None
+
+    async def table_exists(self, name):
+        return False
+
+    async def create_staging(self, table, srid, columns):
+        self.calls.append(("create", table, srid, columns))
+
+    async def swap_staging(self, staging, table, ordered):
+        self.calls.append(("swap", staging, table, ordered))
+
+    async def sample_point(self, table):
+        return 2.35, 48.85
+
+    async def index_table(self, table, brin=False):
+        self.calls.append(("index", table, brin))
+
+    async def drop_table(self, table):
+        self.calls.append(("drop", table))
+
+    async def create(self, attributes):
+        return Datasource(id=1, **attributes)
+
+
+class FakeExtents:
+    async def compute(self, source):
+        pass
+
+
+class FakeStats:
+    async def compute(self, datasource):
+        pass
+
+
+class FakeEngine:
+    def expire(self):
+        pass
+
+
+def spooled(tmp_path, data: bytes) -> str:
+    path = tmp_path / "upload"
+    path.write_bytes(data)
+    return str(path)
+
+
+class TestLoadFile:
+    @pytest.fixture
+    def copied(self, monkeypatch):
+        copied = []
+
+        async def copy_ranges(engine, executor, layer, table, workers, progress):
+            for start, stop in layer.ranges:
+                copied.append((table, encode_range(layer, start, stop)[1]))
+            return sum(count for _, count in copied)
+
+        monkeypatch.setattr(datasource_service, "copy_ranges", copy_ranges)
+        monkeypatch.setattr(datasource_service, "get_engine", lambda: None)
+        return copied
+
+    def service(self, repository, tmp_path):
+        return DatasourceService(
+            repository,
+            Settings(
+                datasource_upload_directory=str(tmp_path),
+                datasource_ingest_range_size=1,
+            ),
+            FakeExtents(),
+            FakeStats(),
+            engine=FakeEngine(),
+        )
+
+    @pytest.mark.asyncio
+    async def test_stages_copies_and_swaps(self, copied, tmp_path):
+        repository = FakeDatasourceRepository()
+        data = shapefile_zip([point(1, 2), point(3, 4)], FIELDS, [["a", "1", "1"]] * 2)
+
+        path = spooled(tmp_path, data)
+
+        read = await self.service(repository, tmp_path).load_file(
+            "roads", path, LOADER, srid=3857
+        )
+
+        staging = repository.calls[0][1]
+        assert staging.startswith("_stg_new_")
+        assert repository.calls == [
+            (
+                "create",
+                staging,
+                3857,
+                [("name", TEXT), ("lanes", BIGINT), ("width", DOUBLE)],
+            ),
+            ("swap", staging, "roads", True),
+            ("index", "roads", False),
+        ]
+        assert copied == [(staging, 1), (staging, 1)]
+        assert read.feature_count == 2 and read.srid == 3857
+        assert read.sample_tile == "14/8298/5637"
+        assert read.tile_ms_before is not None and read.tile_ms_after is not None
+        assert read.columns == ["name", "lanes", "width"]
+        # The extraction directory is removed, the spooled upload is left to
+        # its owner.
+        assert [str(entry) for entry in tmp_path.iterdir()] == [path]
+
+    @pytest.mark.asyncio
+    async def test_unknown_srid(self, copied, tmp_path):
+        data = shapefile_zip(
+            [point(1, 2)], FIELDS, [["a", "1", "1"]], prj='PROJCS["Custom"]'
+        )
+
+        with pytest.raises(DomainException) as exc:
+            await self.service(FakeDatasourceRepository(), tmp_path).load_file(
+                "roads", spooled(tmp_path, data), LOADER
+            )
+
+        assert exc.value.key == "datasource.unknown_srid"
+        assert copied == []
+
+    @pytest.mark.asyncio
+    async def test_failed_copy_drops_the_staging_table(self, monkeypatch, tmp_path):
+        async def copy_ranges(*args):
+            raise LayerError("Invalid shape of record 3")
+
+        monkeypatch.setattr(datasource_service, "copy_ranges", copy_ranges)
+        monkeypatch.setattr(datasource_service, "get_engine", lambda: None)
+        repository = FakeDatasourceRepository()
+        data = shapefile_zip([point(1, 2)], FIELDS, [["a", "1", "1"]])
+
+        with pytest.raises(DomainException) as exc:
+            await self.service(repository, tmp_path).load_file(
+                "roads", spooled(tmp_path, data), LOADER
+            )
+
+        assert exc.value.key == "datasource.invalid_file"
+        assert repository.calls[-1] == ("drop", repository.calls[0][1])
+
+    @pytest.mark.asyncio
+    async def test_flatgeobuf_bbox(self, copied, tmp_path):
+        path = tmp_path / "roads.fgb"
+        flatgeobuf(str(path), FGB_FEATURES)
+
+        read = await self.service(FakeDatasourceRepository(), tmp_path).load_file(
+            "roads", str(path), LOADER, bbox=(0, 0, 3, 3)
+        )
+
+        assert read.feature_count == 2 and read.srid == 2154
+        for bbox in ("1,2,3", "a,b,c,d"):
+            with pytest.raises(DomainException) as exc:
+                parse_bbox(bbox)
+            assert exc.value.key == "datasource.invalid_bbox"
+        with pytest.raises(DomainException) as exc:
+            await self.service(FakeDatasourceRepository(), tmp_path).load_file(
+                "roads", str(path), LOADER, bbox=(3, 3, 0, 0)
+            )
+        assert exc.value.key == "datasource.invalid_bbox"
@@ -0,0 +1,180 @@
+import json
+from datetime import datetime
+
+import psycopg
+import pytest
+from app.core.config import Settings
+from app.core.exceptions import DomainException, ExternalServiceException
+from app.modules.datasources.query import DatasourceQueryService
+from app.modules.datasources.schemas import DatasourceRead
+from app.modules.users.models import UserRole
+from app.modules.users.schemas import UserDetail
+from sqlalchemy.exc import DBAPIError
+
+LOADER = UserDetail(
+    id=3,
+    username="loader",
+    email="loader@test.com",
+    roles=[UserRole.LOAD_DATA],
+    teams=[],
+)
+
+
+def roads(srid=2154):
+    return DatasourceRead(
+        id=7,
+        name="roads",
+        geometry_column="geom",
+        srid=srid,
+        feature_count=5,
+        columns=["name", "lanes", "tags"],
+        ingest_seconds=0.1,
+        created_at=datetime.utcnow(),
+        created_by_id=LOADER.id,
+    )
+
+
+class FakeDatasources:
+    def __init__(self, datasource):
+        self.datasource = datasource
+
+    async def get_map_datasource(self, datasource_id, current_user, maps):
+        return self.datasource
+
+
+def rows_engine(fake_engine, rows, error=None):
+    """Features answering the queries, or `error` once the timeout is set."""
+
+    def respond(sql, params):
+        if error is not None and "statement_timeout" not in sql:
+            raise error
+        return rows[: params.get("limit")]
+
+    return fake_engine(respond)
+
+
+class FakeTileEngine:
+    def __init__(self, engine):
+        self.engine = engine
+
+
+def feature_rows(count, *values):
+    """(fid, GeoJSON point, *values) rows."""
+    return [
+        (i, f'{{"type":"Point","coordinates":[{i},0]}}', *values)
+        for i in range(1, count + 1)
+    ]
+
+
+def query_service(engine, srid=2154, **settings):
+    return DatasourceQueryService(
+        FakeDatasources(roads(srid)),
+        None,
+        Settings(datasource_export_batch_size=2, **settings),
+        FakeTileEngine(engine),
+    )
+
+
+async def body(response):
+    return b"".join([chunk async for chunk in response.body_iterator])
+
+
+class TestDatasourceQueryService:
+    @pytest.mark.asyncio
+    async def test_bbox_query_uses_the_index_and_a_timeout(self, fake_engine):
+        engine = rows_engine(fake_engine, feature_rows(5, "A1", 2, {"k": 1}))
+
+        response = await query_service(engine).features_in_bbox(
+            7, (0.0, 1.0, 2.0, 3.0), None, 100, LOADER
+        )
+        collection = json.loads(await body(response))
+
+        assert response.media_type == "application/geo+json"
+        assert response.headers["x-limit-reached"] == "false"
+        ids = [feature["id"] for feature in collection["features"]]
+        assert ids == [1, 2, 3, 4, 5]
+        assert collection["features"][0]["properties"] == {
+            "name": "A1",
+            "lanes": 2,
+            "tags": {"k": 1},
+        }
+        (timeout, timeout_params), (query, params) = engine.queries
+        assert "statement_timeout" in timeout and timeout_params == {"timeout": "2000"}
+        assert "geom && ST_Transform(ST_MakeEnvelope(" in query
+        assert "ST_Intersects(geom, ST_Transform(" in query
+        assert "LIMIT :limit" in query and "ORDER BY" not in query
+        assert params == {
+            "min_x": 0.0,
+            "min_y": 1.0,
+            "max_x": 2.0,
+            "max_y": 3.0,
+            "limit": 101,
+        }
+
+    @pytest.mark.asyncio
+    async def test_properties_and_limit_shape_the_query(self, fake_engine):
+        engine = rows_engine(fake_engine, feature_rows(5, 2))
+
+        response = await query_service(
+            engine, datasource_query_max_features=3
+        ).features_in_bbox(7, (0.0, 0.0, 1.0, 1.0), "lanes", 50, LOADER)
+        collection = json.loads(await body(response))
+
+        assert response.headers["x-limit-reached"] == "true"
+        assert len(collection["features"]) == 3
+        assert collection["features"][0]["properties"] == {"lanes": 2}
+        query, params = engine.queries[1]
+        assert "4326)), lanes FROM roads" in " ".join(query.split())
+        assert params["limit"] == 4
+
+    @pytest.mark.asyncio
+    async def test_point_query_orders_by_distance(self, fake_engine):
+        engine = rows_engine(fake_engine, feature_rows(1))
+
+        response = await query_service(engine, srid=3857).features_at_point(
+            7, 2.35, 48.85, 5.0, "", 10, LOADER
+        )
+        collection = json.loads(await body(response))
+
+        assert collection["features"][0]["properties"] == {}
+        query, params = engine.queries[1]
+        assert "ST_Expand(ST_Transform(ST_SetSRID(ST_MakePoint(" in query
+        # Already in Web Mercator: the expanded box is not transformed back.
+        assert "3857), :tolerance) AND ST_Intersects(" in query
+        assert "ORDER BY geom <-> ST_Transform(ST_SetSRID(" in query
+        assert params == {"lon": 2.35, "lat": 48.85, "tolerance": 5.0, "limit": 11}
+
+    @pytest.mark.asyncio
+    async def test_invalid_requests_are_rejected_before_querying(self, fake_engine):
+        engine = rows_engine(fake_engine, [])
+        service = query_service(engine)
+
+        with pytest.raises(DomainException) as exc:
+            await service.features_in_bbox(7, (0.0, 0.0, 1.0, 1.0), "name,x", 1, LOADER)
+        assert exc.value.key == "datasource.unknown_columns"
+        assert exc.value.params == {"columns": "x"}
+        with pytest.raises(DomainException) as exc:
+            await service.features_in_bbox(7, (2.0, 0.0, 1.0, 1.0), None, 1, LOADER)
+        assert exc.value.key == "datasource.invalid_bbox"
+        with pytest.raises(DomainException) as exc:
+            await service.features_at_point(7, 0.0, 89.0, 0.0, None, 1, LOADER)
+        assert exc.value.key == "datasource.invalid_point"
+        assert engine.queries == []
+
+    @pytest.mark.asyncio
+    async def test_cancelled_queries_report_a_timeout(self, fake_engine):
+        cancelled = DBAPIError(
+            "SELECT", {}, psycopg.errors.QueryCanceled("canceling statement")
+        )
+        failed = DBAPIError("SELECT", {}, psycopg.errors.InternalError("boom"))
+
+        with pytest.raises(DomainException) as exc:
+            await query_service(
+                rows_engine(fake_engine, [], cancelled)
+            ).features_in_bbox(7, (0.0, 0.0, 1.0, 1.0), None, 1, LOADER)
+        assert exc.value.key == "datasource.query_timeout"
+        with pytest.raises(ExternalServiceException) as exc:
+            await query_service(rows_engine(fake_engine, [], failed)).features_at_point(
+                7, 0.0, 0.0, 0.0, None, 1, LOADER
+            )
+        assert exc.value.key == "datasource.query_failed"
@@ -0,0 +1,484 @@
+import json
+
+import psycopg
+import pytest
+from app.core.config import Settings
+from app.core.exceptions import (
+    DomainException,
+    DuplicateEntityException,
+    PermissionDeniedException,
+)
+from app.modules.datasources.ingest import (
+    BIGINT,
+    DOUBLE,
+    JSONB,
+    TEXT,
+    FeatureTable,
+    column_name,
+    merge_types,
+)
+from app.modules.datasources.models import Datasource
+from app.modules.datasources import service as datasource_service
+from app.modules.datasources.service import DatasourceService
+from app.modules.users.models import UserRole
+from app.modules.users.schemas import UserDetail
+from sqlalchemy.exc import DBAPIError
+
+LOADER = UserDetail(
+    id=3,
+    username="loader",
+    email="loader@test.com",
+    roles=[UserRole.LOAD_DATA],
+    teams=[],
+)
+USER = UserDetail(
+    id=4, username="user", email="user@test.com", roles=[UserRole.USER], teams=[]
+)
+
+
+def feature(properties, coordinates=(1, 2)):
+    return {
+        "type": "Feature",
+        "properties": properties,
+        "geometry": {"type": "Point", "coordinates": list(coordinates)},
+    }
+
+
+def document(features) -> bytes:
+    return json.dumps({"type": "FeatureCollection", "features": features}).encode()
+
+
+@pytest.fixture
+def spool(tmp_path, monkeypatch):
+    """Write a body to a spool file, read back in chunks of 50 bytes."""
+    monkeypatch.setattr(datasource_service, "READ_SIZE", 50)
+
+    def write(data: bytes) -> str:
+        path = tmp_path / f"upload-{len(list(tmp_path.iterdir()))}"
+        path.write_bytes(data)
+        return str(path)
+
+    return write
+
+
+class FakeCopy:
+    def __init__(self, connection, statement):
+        self.connection = connection
+        self.connection.copies.append({"statement": statement, "rows": []})
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    def set_types(self, types):
+        self.connection.copies[-1]["types"] = types
+
+    async def write_row(self, row):
+        self.connection.copies[-1]["rows"].append(row)
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def execute(self, statement):
+        self.connection.statements.append(statement)
+
+    def copy(self, statement):
+        return FakeCopy(self.connection, statement)
+
+
+class FakeConnection:
+    def __init__(self):
+        self.statements = []
+        self.copies = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+class FakeSession:
+    def __init__(self):
+        self.executed = 0
+        self.committed = False
+        self.rolled_back = False
+
+    async def execute(self, statement, params=None):
+        self.executed += 1
+
+    async def commit(self):
+        self.committed = True
+
+    async def rollback(self):
+        self.rolled_back = True
+
+
+class FakeDatasourceRepository:
+    def __init__(self, existing=False, datasource=None, duplicates=False, busy=False):
+        self.session = FakeSession()
+        self.connection = FakeConnection()
+        self.existing = existing
+        self.datasource = datasource
+        self.duplicates = duplicates
+        self.busy = busy
+        self.locked = []
+        self.optimized = []
+        self.dropped = []
+        self.diffs = []
+
+    async def get(self, datasource_id):
+        return self.datasource
+
+    async def get_by_name(self, name):
+        return self.datasource
+
+    async def table_exists(self, name):
+        return self.existing
+
+    async def lock(self, datasource_id):
+        if self.busy:
+            raise DBAPIError(
+                "SELECT", {}, psycopg.errors.LockNotAvailable("could not lock")
+            )
+        self.locked.append(datasource_id)
+        return self.datasource
+
+    async def driver_connection(self):
+        return self.connection
+
+    async def sample_point(self, table):
+        return None
+
+    async def swap_staging(self, staging, table, ordered):
+        self.optimized.append(("swap", staging, table, ordered))
+
+    async def index_table(self, table, brin=False):
+        self.optimized.append(("index", table, brin))
+
+    async def create(self, attributes):
+        return Datasource(id=1, **attributes)
+
+    async def update(self, datasource_id, attributes):
+        for key, value in attributes.items():
+            setattr(self.datasource, key, value)
+        return self.datasource
+
+    async def drop_table(self, table):
+        self.dropped.append(table)
+
+    async def duplicate_key(self, table, key):
+        return self.duplicates
+
+    async def column_types(self, table):
+        return {"fid": "bigint", "geom": "geometry", "ref": "text", "name": "text"}
+
+    async def apply_diff(self, table, staging, key, srid, columns, staged):
+        self.diffs.append((table, staging, key, srid, columns, staged))
+        return {"deleted": 1, "updated": 2, "inserted": 3}
+
+
+class FakeExtents:
+    def __init__(self):
+        self.computed = []
+        self.extended = []
+
+    async def compute(self, source):
+        self.computed.append(source)
+
+    async def extend(self, source, key):
+        self.extended.append((source, key))
+        return True
+
+
+class FakeStats:
+    def __init__(self, folds=True):
+        self.folds = folds
+        self.computed = []
+        self.folded = []
+
+    async def compute(self, datasource):
+        self.computed.append(datasource.name)
+
+    async def fold(self, datasource, key, counts):
+        self.folded.append((datasource.name, key, counts))
+        return self.folds
+
+
+class FakeEngine:
+    def expire(self):
+        pass
+
+
+def service(repository, stats=None, **settings):
+    return DatasourceService(
+        repository,
+        Settings(datasource_ingest_batch_size=2, **settings),
+        FakeExtents(),
+        stats or FakeStats(),
+        engine=FakeEngine(),
+    )
+
+
+class TestFeatureTable:
+    def test_merge_types(self):
+        assert merge_types(None, BIGINT) == BIGINT
+        assert merge_types(BIGINT, DOUBLE) == DOUBLE
+        assert merge_types(BIGINT, JSONB) == JSONB
+        assert merge_types(JSONB, TEXT) == TEXT
+        assert merge_types(DOUBLE, None) == DOUBLE
+
+    def test_column_names(self):
+        assert column_name("geom", {"fid", "geom"}) == "geom_2"
+        long_name = column_name("é" * 40, set())
+        assert len(long_name.encode()) <= 63
+
+    def test_columns_follow_the_features(self):
+        table = FeatureTable()
+
+        added, widened = table.update(
+            [feature({"a": 1, "b": None}), feature({"a": 2, "c": {"x": 1}})]
+        )
+        assert added == [("a", BIGINT), ("b", TEXT), ("c", JSONB)]
+        assert widened == []
+
+        added, widened = table.update([feature({"a": 1.5, "d": True})])
+        assert added == [("d", "boolean")]
+        assert widened == [("a", DOUBLE)]
+        assert table.row(feature({"a": 3, "c": "x"}), 4326)[1:] == (
+            3.0,
+            None,
+            "x",
+            None,
+        )
+
+
+class TestUploadGeojson:
+    @pytest.mark.asyncio
+    async def test_streams_batches_through_copy(self, spool):
+        repository = FakeDatasourceRepository()
+        datasources = service(repository)
+        features = [feature({"name": f"n{i}", "rank": i}) for i in range(5)]
+
+        read = await datasources.load_geojson(
+            "roads", spool(document(features)), LOADER
+        )
+
+        connection = repository.connection
+        staging = repository.optimized[0][1]
+        assert staging.startswith("_stg_new_")
+        assert connection.statements[0].startswith(
+            f"CREATE UNLOGGED TABLE {staging} (fid bigint GENERATED ALWAYS AS IDENTITY,"
+        )
+        assert (
+            "geom geometry(Geometry, 4326), name text, rank bigint"
+            in (connection.statements[0])
+        )
+        assert [len(copy["rows"]) for copy in connection.copies] == [2, 2, 1]
+        assert connection.copies[0]["statement"] == (
+            f"COPY {staging} (geom, name, rank) FROM STDIN (FORMAT binary)"
+        )
+        assert connection.copies[0]["types"] == ["bytea", "text", "int8"]
+        assert connection.copies[0]["rows"][1][1:] == ("n1", 1)
+        assert repository.optimized == [
+            ("swap", staging, "roads", True),
+            ("index", "roads", False),
+        ]
+        assert read.feature_count == 5
+        assert read.columns == ["name", "rank"]
+        assert repository.session.committed
+        assert datasources.extents.computed == ["roads"]
+        assert datasources.stats.computed == ["roads"]
+
+    @pytest.mark.asyncio
+    async def test_new_properties_alter_the_table(self, spool):
+        repository = FakeDatasourceRepository()
+        features = [feature({"a": 1}), feature({"a": 2}), feature({"a": "x", "b": 1})]
+
+        await service(repository).load_geojson(
+            "roads", spool(document(features)), LOADER
+        )
+
+        staging = repository.optimized[0][1]
+        statements = repository.connection.statements
+        assert f"ALTER TABLE {staging} ADD COLUMN b bigint" in statements
+        assert (
+            f"ALTER TABLE {staging} ALTER COLUMN a TYPE text USING a::text"
+            in statements
+        )
+
+    @pytest.mark.asyncio
+    async def test_invalid_geojson_rolls_back(self, spool):
+        repository = FakeDatasourceRepository()
+
+        with pytest.raises(DomainException) as exc:
+            await service(repository).load_geojson(
+                "roads", spool(b'{"type": "FeatureCollection", "features": [1'), LOADER
+            )
+
+        assert exc.value.key == "datasource.invalid_geojson"
+        assert repository.session.rolled_back
+        assert not repository.session.committed
+
+    @pytest.mark.asyncio
+    async def test_checks_permission_name_and_existing_tables(self, spool):
+        with pytest.raises(PermissionDeniedException):
+            await service(FakeDatasourceRepository()).load_geojson(
+                "roads", spool(b""), USER
+            )
+        for name in ("Roads;", "_stg_7_roads"):
+            with pytest.raises(DomainException) as exc:
+                await service(FakeDatasourceRepository()).load_geojson(
+                    name, spool(b""), LOADER
+                )
+            assert exc.value.key == "datasource.invalid_name"
+        with pytest.raises(DuplicateEntityException):
+            await service(FakeDatasourceRepository(existing=True)).load_geojson(
+                "roads", spool(b""), LOADER
+            )
+
+
+def roads(**values):
+    return Datasource(
+        id=7,
+        name="roads",
+        srid=2154,
+        feature_count=10,
+        columns=["ref", "name"],
+        created_by_id=LOADER.id,
+        **values,
+    )
+
+
+class TestUpdateGeojson:
+    @pytest.mark.asyncio
+    async def test_applies_the_differences_of_the_staged_features(self, spool):
+        repository = FakeDatasourceRepository(datasource=roads())
+        features = [feature({"ref": i, "name": f"n{i}"}) for i in range(3)]
+        datasources = service(repository)
+
+        read = await datasources.load_geojson_update(
+            "roads", "ref", spool(document(features)), LOADER
+        )
+
+        ((table, staging, *diff),) = repository.diffs
+        assert table == "roads" and staging.startswith("_stg_7_")
+        assert repository.connection.statements[0].startswith(
+            f"CREATE UNLOGGED TABLE {staging} "
+        )
+        assert diff == ["ref", 2154, {"ref": "text", "name": "text"}, ["ref", "name"]]
+        assert repository.dropped == [staging]
+        assert repository.locked == [7]
+        assert (read.inserted, read.updated, read.deleted) == (3, 2, 1)
+        assert read.feature_count == 12
+        assert repository.session.committed
+        assert datasources.stats.folded == [
+            ("roads", "ref", {"deleted": 1, "updated": 2, "inserted": 3})
+        ]
+        assert datasources.stats.computed == []
+        assert datasources.extents.extended == [("roads", "ref")]
+
+    @pytest.mark.asyncio
+    async def test_statistics_are_computed_again_when_not_folded(self, spool):
+        repository = FakeDatasourceRepository(datasource=roads())
+        datasources = service(repository, FakeStats(folds=False))
+
+        await datasources.load_geojson_update(
+            "roads", "ref", spool(document([feature({"ref": 1})])), LOADER
+        )
+
+        assert len(datasources.stats.folded) == 1
+        assert datasources.stats.computed == ["roads"]
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize(
+        "key,properties,duplicates,error",
+        [
+            ("rank", {"ref": 1}, False, "datasource.update_invalid_key"),
+            ("ref", {"name": "x"}, False, "datasource.update_invalid_key"),
+            ("ref", {"ref": 1, "lanes": 2}, False, "datasource.update_unknown_columns"),
+            ("ref", {"ref": 1}, True, "datasource.update_duplicate_key"),
+        ],
+    )
+    async def test_invalid_updates_change_nothing(
+        self, key, properties, duplicates, error, spool
+    ):
+        repository = FakeDatasourceRepository(datasource=roads(), duplicates=duplicates)
+
+        with pytest.raises(DomainException) as exc:
+            await service(repository).load_geojson_update(
+                "roads", key, spool(document([feature(properties)])), LOADER
+            )
+
+        assert exc.value.key == error
+        assert repository.diffs == []
+        assert not repository.session.committed
+
+    @pytest.mark.asyncio
+    async def test_concurrent_updates_are_refused(self, spool):
+        repository = FakeDatasourceRepository(datasource=roads(), busy=True)
+
+        with pytest.raises(DomainException) as exc:
+            await service(repository).load_geojson_update(
+                "roads", "ref", spool(document([feature({"ref": 1})])), LOADER
+            )
+
+        assert exc.value.key == "datasource.update_busy"
+        assert repository.connection.statements == []
+        assert repository.session.rolled_back
+
+    @pytest.mark.asyncio
+    async def test_only_owners_update(self, spool):
+        other = UserDetail(
+            id=5,
+            username="other",
+            email="other@test.com",
+            roles=[UserRole.LOAD_DATA],
+            teams=[],
+        )
+        repository = FakeDatasourceRepository(datasource=roads())
+
+        with pytest.raises(PermissionDeniedException):
+            await service(repository).load_geojson_update(
+                "roads", "ref", spool(b""), other
+            )
+
+
+class FakeMaps:
+    def __init__(self, viewed):
+        self.viewed = viewed
+        self.checked = []
+
+    async def can_view_datasource(self, datasource, current_user):
+        self.checked.append((datasource, current_user.id))
+        return datasource in self.viewed
+
+
+class TestGetMapDatasource:
+    @pytest.mark.asyncio
+    async def test_owners_need_no_map(self):
+        maps = FakeMaps(set())
+        repository = FakeDatasourceRepository(datasource=roads())
+
+        datasource = await service(repository).get_map_datasource(7, LOADER, maps)
+
+        assert datasource.name == "roads"
+        assert maps.checked == []
+
+    @pytest.mark.asyncio
+    async def test_viewers_of_a_map_using_it_may_read_it(self):
+        repository = FakeDatasourceRepository(datasource=roads())
+
+        datasource = await service(repository).get_map_datasource(
+            7, USER, FakeMaps({"roads"})
+        )
+        assert datasource.name == "roads"
+        with pytest.raises(PermissionDeniedException):
+            await service(repository).get_map_datasource(7, USER, FakeMaps({"rivers"}))
@@ -0,0 +1,165 @@
+import pytest
+from app.core.config import Settings
+from app.modules.datasources.models import Datasource, DatasourceStats
+from app.modules.datasources.stats import ColumnSketch, DatasourceStatsService
+
+
+class FakeSession:
+    def __init__(self):
+        self.committed = False
+
+    async def commit(self):
+        self.committed = True
+
+
+class FakeStatsRepository:
+    def __init__(self, rows, changed=()):
+        self.session = FakeSession()
+        self.rows = rows
+        self.changed = list(changed)
+        self.samples = []
+        self.stored = None
+
+    async def get_by_datasource(self, datasource_id):
+        return DatasourceStats(**self.stored) if self.stored else None
+
+    async def sample(self, table, columns, percent):
+        self.samples.append((table, columns, percent))
+        return self.rows
+
+    async def sample_changed(self, table, columns, key, fraction):
+        self.samples.append((table, columns, key, fraction))
+        return self.changed
+
+    async def upsert(self, values):
+        self.stored = values
+
+
+class FakeTables:
+    async def column_types(self, table):
+        return {"fid": "bigint", "geom": "geometry", "kind": "text", "lanes": "bigint"}
+
+
+def roads(feature_count):
+    return Datasource(
+        id=7,
+        name="roads",
+        srid=4326,
+        feature_count=feature_count,
+        columns=["kind", "lanes"],
+    )
+
+
+def stats_service(repository, **settings):
+    return DatasourceStatsService(
+        repository,
+        FakeTables(),
+        Settings(
+            datasource_stats_sample_rows=100,
+            datasource_stats_top_values=2,
+            datasource_stats_histogram_bins=4,
+            **settings,
+        ),
+    )
+
+
+ROWS = [("road", i % 5 or None) for i in range(80)] + [("path", 8)] * 20
+
+
+class TestDatasourceStatsService:
+    @pytest.mark.asyncio
+    async def test_small_tables_are_read_whole(self):
+        repository = FakeStatsRepository(ROWS)
+
+        stats = await stats_service(repository).compute(roads(100))
+
+        assert repository.samples == [("roads", ["kind", "lanes"], None)]
+        assert repository.session.committed
+        kind, lanes = stats.columns
+        assert (kind.name, kind.type, kind.count, kind.nulls) == (
+            "kind",
+            "text",
+            100,
+            0,
+        )
+        assert kind.distinct == 2
+        assert [(top.value, top.count) for top in kind.top] == [
+            ("road", 80),
+            ("path", 20),
+        ]
+        assert kind.quantiles == [] and kind.min is None
+        assert (lanes.count, lanes.nulls, lanes.distinct) == (84, 16, 5)
+        assert (lanes.min, lanes.max) == (1, 8)
+        assert lanes.quantiles[0] == 1 and lanes.quantiles[-1] == 8
+        assert [bin.count for bin in lanes.histogram] == [32, 32, 0, 20]
+        assert sum(bin.count for bin in lanes.histogram) == lanes.count
+
+    @pytest.mark.asyncio
+    async def test_large_tables_are_sampled_and_scaled(self):
+        repository = FakeStatsRepository(ROWS)
+
+        stats = await stats_service(repository).compute(roads(10000))
+
+        assert repository.samples == [("roads", ["kind", "lanes"], 1.0)]
+        assert stats.sampled_rows == 100
+        assert stats.columns[0].top[0].count == 8000
+        assert stats.columns[1].nulls == 1600
+
+    @pytest.mark.asyncio
+    async def test_updates_are_folded_into_the_sketches(self):
+        repository = FakeStatsRepository(ROWS, changed=[("track", 2)] * 10)
+        service = stats_service(repository)
+        await service.compute(roads(10000))
+
+        folded = await service.fold(
+            roads(10100), "ref", {"inserted": 100, "updated": 0, "deleted": 0}
+        )
+
+        assert folded
+        assert repository.samples[-1] == (
+            "roads",
+            ["kind", "lanes"],
+            "ref",
+            100 / 10100,
+        )
+        assert repository.stored["sampled_rows"] == 110
+        assert repository.stored["changed_rows"] == 100
+        kind = repository.stored["columns"][0]
+        assert kind["distinct"] == 3
+        assert kind["count"] == 10100
+
+    @pytest.mark.asyncio
+    async def test_large_changes_are_not_folded(self):
+        repository = FakeStatsRepository(ROWS)
+        service = stats_service(repository, datasource_stats_rebuild_ratio=0.1)
+
+        assert not await service.fold(roads(100), "ref", {"inserted": 1})
+        await service.compute(roads(100))
+        assert not await service.fold(
+            roads(100), "ref", {"inserted": 6, "updated": 5, "deleted": 0}
+        )
+        assert await service.fold(roads(100), "ref", {"updated": 10})
+
+    @pytest.mark.asyncio
+    async def test_stored_statistics_are_served(self):
+        repository = FakeStatsRepository(ROWS)
+        service = stats_service(repository)
+
+        computed = await service.get_stats(roads(100))
+        repository.rows = []
+        served = await service.get_stats(roads(100))
+
+        assert len(repository.samples) == 1
+        assert served == computed
+
+
+def test_column_sketch_round_trip():
+    sketch = ColumnSketch("double precision", 8)
+    for value in (1.5, None, float("nan"), 2.5, 1.5):
+        sketch.add(value)
+
+    restored = ColumnSketch.from_dict(sketch.to_dict())
+
+    assert (restored.count, restored.nulls, restored.total) == (3, 2, 5.5)
+    assert restored.summary("width", 1, 1, 2) == sketch.summary("width", 1, 1, 2)
+    assert restored.summary("width", 1, 1, 2)["top"] == [{"value": 1.5, "count": 2}]
@@ -0,0 +1,487 @@
+import base64
+import hashlib
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from app.core.config import Settings
+from app.core.enums.job_status import JobStatus
+from app.core.exceptions import DomainException, PermissionDeniedException
+from app.modules.datasources.models import DatasourceUpload
+from app.modules.datasources.schemas import DatasourceRead, DatasourceUploadCreate
+from app.modules.datasources.uploads import (
+    INGEST_UPLOAD,
+    DatasourceUploadService,
+    parse_checksum,
+)
+from app.modules.jobs.models import Job
+from app.modules.users.models import UserRole
+from app.modules.users.schemas import UserDetail
+from starlette.requests import ClientDisconnect
+
+LOADER = UserDetail(
+    id=3,
+    username="loader",
+    email="loader@test.com",
+    roles=[UserRole.LOAD_DATA],
+    teams=[],
+)
+OTHER = UserDetail(
+    id=4,
+    username="other",
+    email="other@test.com",
+    roles=[UserRole.LOAD_DATA],
+    teams=[],
+)
+
+
+def checksum(data: bytes) -> str:
+    return "sha256 " + base64.b64encode(hashlib.sha256(data).digest()).decode()
+
+
+async def body(*chunks, disconnect=False):
+    for chunk in chunks:
+        yield chunk
+    if disconnect:
+        raise ClientDisconnect()
+
+
+class FakeSession:
+    def __init__(self):
+        self.commits = 0
+
+    async def commit(self):
+        self.commits += 1
+
+    async def rollback(self):
+        pass
+
+    async def refresh(self, instance):
+        pass
+
+
+class FakeUploadRepository:
+    def __init__(self):
+        self.session = FakeSession()
+        self.uploads = {}
+
+    async def create(self, attributes):
+        upload = DatasourceUpload(id=len(self.uploads) + 1, **attributes)
+        self.uploads[upload.id] = upload
+        return upload
+
+    async def get(self, upload_id):
+        return self.uploads.get(upload_id)
+
+    lock = get
+
+    async def claim(self, upload_id, offset, lock_token, now, locked_until):
+        upload = self.uploads[upload_id]
+        if upload.offset != offset or upload.finalized_at is not None:
+            return False
+        if upload.locked_until is not None and upload.locked_until > now:
+            return False
+        upload.lock_token, upload.locked_until = lock_token, locked_until
+        return True
+
+    async def save_leased(self, upload_id, lock_token, values):
+        upload = self.uploads.get(upload_id)
+        if upload is None or upload.lock_token != lock_token:
+            return False
+        await self.update(upload_id, values)
+        return True
+
+    async def update(self, upload_id, attributes):
+        upload = self.uploads[upload_id]
+        for key, value in attributes.items():
+            setattr(upload, key, value)
+        return upload
+
+    async def delete(self, upload_id):
+        return self.uploads.pop(upload_id, None) is not None
+
+    async def count_active(self, user_id, now):
+        return sum(
+            1
+            for u in self.uploads.values()
+            if u.created_by_id == user_id and u.finalized_at is None
+        )
+
+    async def get_expired(self, now):
+        return [
+            u
+            for u in self.uploads.values()
+            if u.datasource_id is None and u.expires_at <= now
+        ]
+
+
+class FakeJobs:
+    def __init__(self):
+        self.queued = []
+
+    async def enqueue(self, kind, payload, current_user):
+        self.queued.append((kind, payload))
+        return Job(
+            id=len(self.queued),
+            kind=kind,
+            payload=payload,
+            status=JobStatus.PENDING,
+            attempts=0,
+            max_attempts=3,
+            rows_processed=0,
+            rows_per_second=0.0,
+            created_at=datetime.utcnow(),
+            created_by_id=current_user.id,
+        )
+
+
+class FakeDatasources:
+    def __init__(self):
+        self.loaded = []
+        self.updatable = []
+
+    async def ensure_can_create(self, name, current_user):
+        pass
+
+    async def ensure_can_update(self, name, key, current_user):
+        self.updatable.append((name, key))
+
+    async def load_update(
+        self,
+        name,
+        key,
+        path,
+        current_user,
+        layer=None,
+        srid=None,
+        progress=None,
+        bbox=None,
+    ):
+        with open(path, "rb") as file:
+            self.loaded.append((name, file.read(), key))
+        return await self.load_file(name, path, current_user, layer, srid, progress)
+
+    async def load_geojson(self, name, path, current_user, progress=None):
+        with open(path, "rb") as file:
+            self.loaded.append((name, file.read()))
+        return await self.load_file(name, path, current_user, progress=progress)
+
+    async def load_file(
+        self,
+        name,
+        path,
+        current_user,
+        layer=None,
+        srid=None,
+        progress=None,
+        bbox=None,
+    ):
+        with open(path, "rb") as file:
+            self.loaded.append((name, file.read(), layer, srid, bbox))
+        if progress is not None:
+            progress(1)
+        return DatasourceRead(
+            id=9,
+            name=name,
+            geometry_column="geom",
+            srid=srid or 4326,
+            feature_count=1,
+            columns=[],
+            ingest_seconds=0.1,
+            created_at=datetime.utcnow(),
+            created_by_id=current_user.id,
+        )
+
+
+@pytest.fixture
+def service(tmp_path):
+    return DatasourceUploadService(
+        FakeUploadRepository(),
+        FakeDatasources(),
+        FakeJobs(),
+        Settings(
+            datasource_upload_directory=str(tmp_path),
+            datasource_upload_max_bytes=100,
+            datasource_upload_max_active=2,
+        ),
+    )
+
+
+async def create(service, length=10, **values):
+    return await service.create_upload(
+        DatasourceUploadCreate(name="roads", length=length, **values), LOADER
+    )
+
+
+class TestCreateUpload:
+    @pytest.mark.asyncio
+    async def test_limits_size_and_uploads_per_user(self, service, tmp_path):
+        upload = await create(service)
+
+        assert upload.offset == 0
+        assert (tmp_path / "uploads" / str(upload.id)).read_bytes() == b""
+        with pytest.raises(DomainException) as exc:
+            await create(service, length=101)
+        assert exc.value.key == "datasource.upload_too_large"
+        await create(service)
+        with pytest.raises(DomainException) as exc:
+            await create(service)
+        assert exc.value.key == "datasource.upload_limit"
+
+    @pytest.mark.asyncio
+    async def test_expired_uploads_are_purged(self, service, tmp_path):
+        first = await create(service)
+        await create(service)
+        service.repository.uploads[first.id].expires_at = datetime.utcnow() - timedelta(
+            seconds=1
+        )
+
+        await create(service)
+
+        assert first.id not in service.repository.uploads
+        assert not (tmp_path / "uploads" / str(first.id)).exists()
+
+    def test_parse_checksum(self):
+        assert parse_checksum(checksum(b"abc")) == (
+            "sha256",
+            hashlib.sha256(b"abc").digest(),
+        )
+        for value in ("sha256", "crc32 AAAA", "sha256 AAAA", "sha256 !!"):
+            with pytest.raises(DomainException) as exc:
+                parse_checksum(value)
+            assert exc.value.key == "datasource.upload_invalid_checksum"
+
+
+class TestAppend:
+    @pytest.mark.asyncio
+    async def test_chunks_are_appended_at_their_offset(self, service, tmp_path):
+        upload = await create(service)
+
+        await service.append(upload.id, 0, None, body(b"abc", b"de"), LOADER)
+        upload = await service.append(
+            upload.id, 5, checksum(b"fgh"), body(b"fgh"), LOADER
+        )
+
+        assert upload.offset == 8
+        assert (tmp_path / "uploads" / str(upload.id)).read_bytes() == b"abcdefgh"
+        with pytest.raises(DomainException) as exc:
+            await service.append(upload.id, 5, None, body(b"x"), LOADER)
+        assert exc.value.key == "datasource.upload_offset_mismatch"
+        assert exc.value.params == {"offset": 8}
+
+    @pytest.mark.asyncio
+    async def test_interrupted_chunks_keep_their_bytes(self, service, tmp_path):
+        upload = await create(service)
+
+        upload = await service.append(
+            upload.id, 0, None, body(b"abc", disconnect=True), LOADER
+        )
+
+        assert upload.offset == 3
+
+    @pytest.mark.asyncio
+    async def test_rejected_chunks_are_not_stored(self, service, tmp_path):
+        upload = await create(service, length=6)
+        path = tmp_path / "uploads" / str(upload.id)
+
+        with pytest.raises(DomainException) as exc:
+            await service.append(upload.id, 0, checksum(b"abc"), body(b"abd"), LOADER)
+        assert exc.value.key == "datasource.upload_checksum_mismatch"
+        with pytest.raises(DomainException) as exc:
+            await service.append(upload.id, 0, None, body(b"abcdefg"), LOADER)
+        assert exc.value.key == "datasource.upload_too_large"
+        with pytest.raises(PermissionDeniedException):
+            await service.append(upload.id, 0, None, body(b"abc"), OTHER)
+
+        upload = await service.append(upload.id, 0, None, body(b"abc"), LOADER)
+        assert upload.offset == 3
+        assert path.read_bytes() == b"abc"
+
+
+class TestLease:
+    @pytest.mark.asyncio
+    async def test_chunk_holds_the_upload_while_streaming(self, service):
+        upload = await create(service)
+        stored = service.repository.uploads[upload.id]
+        leases = []
+
+        async def watched():
+            yield b"abc"
+            # The lease is committed before the chunk streams.
+            commits = service.repository.session.commits
+            leases.append((stored.lock_token, stored.locked_until, commits))
+            with pytest.raises(DomainException) as exc:
+                await service.append(upload.id, 0, None, body(b"x"), LOADER)
+            assert exc.value.key == "datasource.upload_busy"
+            with pytest.raises(DomainException) as exc:
+                await service.delete_upload(upload.id, LOADER)
+            assert exc.value.key == "datasource.upload_busy"
+            yield b"de"
+
+        upload = await service.append(upload.id, 0, None, watched(), LOADER)
+
+        assert upload.offset == 5
+        token, locked_until, commits = leases[0]
+        assert token is not None and locked_until > datetime.utcnow()
+        assert commits == 2
+        assert (stored.lock_token, stored.locked_until) == (None, None)
+
+    @pytest.mark.asyncio
+    async def test_lost_lease_does_not_move_the_offset(self, service, tmp_path):
+        upload = await create(service)
+        stored = service.repository.uploads[upload.id]
+
+        async def taken_over():
+            yield b"abc"
+            # The lease expired and another request claimed the upload.
+            stored.lock_token = "other"
+
+        with pytest.raises(DomainException) as exc:
+            await service.append(upload.id, 0, None, taken_over(), LOADER)
+
+        assert exc.value.key == "datasource.upload_busy"
+        assert stored.offset == 0
+
+    @pytest.mark.asyncio
+    async def test_failed_chunk_releases_the_lease(self, service):
+        upload = await create(service, length=6)
+        stored = service.repository.uploads[upload.id]
+
+        with pytest.raises(DomainException):
+            await service.append(upload.id, 0, checksum(b"abc"), body(b"abd"), LOADER)
+
+        assert (stored.lock_token, stored.locked_until) == (None, None)
+        upload = await service.append(upload.id, 0, None, body(b"abc"), LOADER)
+        assert upload.offset == 3
+
+    @pytest.mark.asyncio
+    async def test_expired_lease_can_be_claimed(self, service):
+        upload = await create(service)
+        stored = service.repository.uploads[upload.id]
+        stored.lock_token = "crashed"
+        stored.locked_until = datetime.utcnow() - timedelta(seconds=1)
+
+        upload = await service.append(upload.id, 0, None, body(b"abc"), LOADER)
+
+        assert upload.offset == 3
+
+
+class TestFinalize:
+    @pytest.mark.asyncio
+    async def test_complete_upload_is_queued_then_loaded(self, service, tmp_path):
+        upload = await create(
+            service,
+            length=6,
+            checksum=checksum(b"abcdef"),
+            layer="roads",
+            srid=2154,
+            bbox=(0, 0, 10, 10),
+        )
+        await service.append(upload.id, 0, None, body(b"abc"), LOADER)
+
+        with pytest.raises(DomainException) as exc:
+            await service.finalize(upload.id, LOADER)
+        assert exc.value.key == "datasource.upload_incomplete"
+
+        await service.append(upload.id, 3, None, body(b"def"), LOADER)
+        job = await service.finalize(upload.id, LOADER)
+
+        assert job.status == JobStatus.PENDING
+        assert service.jobs.queued == [(INGEST_UPLOAD, {"upload_id": upload.id})]
+        assert service.datasources.loaded == []
+        with pytest.raises(DomainException) as exc:
+            await service.append(upload.id, 6, None, body(b"x"), LOADER)
+        assert exc.value.key == "datasource.upload_closed"
+
+        rows = []
+        datasource = await service.load(upload.id, LOADER, rows.append)
+
+        assert service.datasources.loaded == [
+            ("roads", b"abcdef", "roads", 2154, (0, 0, 10, 10))
+        ]
+        assert datasource.id == 9 and rows == [1]
+        assert service.repository.uploads[upload.id].datasource_id == 9
+        assert not (tmp_path / "uploads" / str(upload.id)).exists()
+        with pytest.raises(DomainException) as exc:
+            await service.load(upload.id, LOADER)
+        assert exc.value.key == "datasource.upload_closed"
+
+    @pytest.mark.asyncio
+    async def test_upload_with_update_key_updates_the_datasource(self, service):
+        upload = await create(service, length=3, update_key="ref")
+        await service.append(upload.id, 0, None, body(b"abc"), LOADER)
+        await service.finalize(upload.id, LOADER)
+
+        await service.load(upload.id, LOADER, lambda rows: None)
+
+        assert service.datasources.updatable == [("roads", "ref"), ("roads", "ref")]
+        assert service.datasources.loaded[0] == ("roads", b"abc", "ref")
+
+    @pytest.mark.asyncio
+    async def test_checksum_of_the_file_is_checked(self, service):
+        upload = await create(service, length=3, checksum=checksum(b"abc"))
+        await service.append(upload.id, 0, None, body(b"abd"), LOADER)
+        await service.finalize(upload.id, LOADER)
+
+        with pytest.raises(DomainException) as exc:
+            await service.load(upload.id, LOADER)
+
+        assert exc.value.key == "datasource.upload_checksum_mismatch"
+        assert service.datasources.loaded == []
+
+
+class TestUpload:
+    @pytest.mark.asyncio
+    async def test_body_is_spooled_and_queued(self, service, tmp_path):
+        job = await service.upload("roads", "geojson", body(b"abc", b"de"), LOADER)
+
+        assert job.status == JobStatus.PENDING
+        assert service.datasources.loaded == []
+        [upload] = service.repository.uploads.values()
+        assert (upload.format, upload.length, upload.offset) == ("geojson", 5, 5)
+        assert upload.finalized_at is not None
+        assert service.jobs.queued == [(INGEST_UPLOAD, {"upload_id": upload.id})]
+        assert service.repository.session.commits == 1
+        assert os.listdir(tmp_path / "uploads") == [str(upload.id)]
+
+        await service.load(upload.id, LOADER)
+
+        assert service.datasources.loaded[0] == ("roads", b"abcde")
+        assert not (tmp_path / "uploads" / str(upload.id)).exists()
+
+    @pytest.mark.asyncio
+    async def test_update_key_is_checked_and_kept(self, service):
+        await service.upload(
+            "roads", "file", body(b"abc"), LOADER, update_key="ref", srid=2154
+        )
+
+        [upload] = service.repository.uploads.values()
+        assert service.datasources.updatable == [("roads", "ref")]
+        assert (upload.format, upload.update_key, upload.srid) == ("file", "ref", 2154)
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize(
+        "chunks, key",
+        [
+            ((b"a" * 60, b"a" * 60), "datasource.upload_too_large"),
+            ((), "datasource.upload_empty"),
+        ],
+    )
+    async def test_rejected_bodies_are_removed(self, service, tmp_path, chunks, key):
+        with pytest.raises(DomainException) as exc:
+            await service.upload("roads", "geojson", body(*chunks), LOADER)
+
+        assert exc.value.key == key
+        assert service.repository.uploads == {}
+        assert service.jobs.queued == []
+        assert os.listdir(tmp_path / "uploads") == []
+
+    @pytest.mark.asyncio
+    async def test_interrupted_body_is_removed(self, service, tmp_path):
+        with pytest.raises(ClientDisconnect):
+            await service.upload(
+                "roads", "geojson", body(b"abc", disconnect=True), LOADER
+            )
+
+        assert service.repository.uploads == {}
+        assert os.listdir(tmp_path / "uploads") == []
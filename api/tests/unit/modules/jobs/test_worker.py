@@ -0,0 +1,234 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from app.core.config import Settings
+from app.core.enums.job_status import JobStatus
+from app.core.exceptions import DomainException, PermissionDeniedException
+from app.modules.jobs import worker
+from app.modules.jobs.models import Job
+from app.modules.jobs.service import JobService
+from app.modules.jobs.worker import JobWorker
+from app.modules.users.models import UserRole
+from app.modules.users.schemas import UserDetail
+
+OWNER = UserDetail(
+    id=3,
+    username="loader",
+    email="loader@test.com",
+    roles=[UserRole.LOAD_DATA],
+    teams=[],
+)
+OTHER = UserDetail(
+    id=4, username="other", email="other@test.com", roles=[UserRole.USER], teams=[]
+)
+
+
+def make_job(**overrides) -> Job:
+    values = {
+        "id": 1,
+        "kind": "count",
+        "payload": {"rows": 3},
+        "status": JobStatus.RUNNING,
+        "attempts": 1,
+        "max_attempts": 3,
+        "created_by_id": OWNER.id,
+        "created_at": datetime.utcnow(),
+    }
+    values.update(overrides)
+    return Job(**values)
+
+
+class FakeSessionManager:
+    async def get_session(self):
+        yield None
+
+
+class TestJobWorker:
+    @pytest.fixture
+    def job_worker(self, monkeypatch):
+        monkeypatch.setattr(worker, "sessionmanager", FakeSessionManager())
+        monkeypatch.setattr(worker, "CHECKPOINT_SECONDS", 0.01)
+        job_worker = JobWorker({})
+        job_worker.settings = Settings(job_retry_delay_seconds=10)
+        job_worker.saved = []
+
+        async def save(job_id, values):
+            job_worker.saved.append(values)
+            return True
+
+        job_worker._save = save
+        return job_worker
+
+    def claims(self, job_worker, job):
+        async def claim():
+            return job
+
+        job_worker.claim = claim
+
+    @pytest.mark.asyncio
+    async def test_job_reports_rows_and_result(self, job_worker):
+        async def count(session, settings, job, progress):
+            for _ in range(job.payload["rows"]):
+                progress(1000)
+                await asyncio.sleep(0.01)
+            return {"rows": 3000}
+
+        job_worker.handlers["count"] = count
+        self.claims(job_worker, make_job())
+
+        assert await job_worker._run_next()
+
+        assert any(0 < v["rows_processed"] < 3000 for v in job_worker.saved[:-1])
+        final = job_worker.saved[-1]
+        assert final["status"] == JobStatus.COMPLETED
+        assert final["result"] == {"rows": 3000}
+        assert final["rows_processed"] == 3000 and final["rows_per_second"] > 0
+
+    @pytest.mark.asyncio
+    async def test_cancelled_job_stops_its_handler(self, job_worker):
+        stopped = asyncio.Event()
+
+        async def forever(session, settings, job, progress):
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                stopped.set()
+                raise
+
+        async def cancelled(job_id, values):
+            return False
+
+        job_worker.handlers["count"] = forever
+        job_worker._save = cancelled
+
+        await job_worker.run_job(make_job())
+
+        assert stopped.is_set()
+
+    @pytest.mark.asyncio
+    async def test_failed_heartbeat_stops_the_handler(self, job_worker):
+        stopped = asyncio.Event()
+
+        async def forever(session, settings, job, progress):
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                stopped.set()
+                raise
+
+        saved = job_worker.saved
+
+        async def unreachable(job_id, values):
+            if values.get("status") is None:
+                raise ConnectionError("database unreachable")
+            saved.append(values)
+            return True
+
+        job_worker.handlers["count"] = forever
+        job_worker._save = unreachable
+        self.claims(job_worker, make_job())
+
+        await job_worker._run_next()
+
+        # Stopped before the job is queued again for another worker.
+        assert stopped.is_set()
+        assert saved[-1]["status"] == JobStatus.PENDING
+
+    @pytest.mark.asyncio
+    async def test_failed_job_is_retried_then_fails(self, job_worker):
+        async def broken(session, settings, job, progress):
+            raise RuntimeError("connection lost")
+
+        job_worker.handlers["count"] = broken
+        self.claims(job_worker, make_job(attempts=2))
+        await job_worker._run_next()
+        retry = job_worker.saved[-1]
+        assert retry["status"] == JobStatus.PENDING
+        # 10s, doubled after the first attempt.
+        delay = (retry["run_after"] - datetime.utcnow()).total_seconds()
+        assert 19 < delay <= 20
+
+        self.claims(job_worker, make_job(attempts=3))
+        await job_worker._run_next()
+        assert job_worker.saved[-1]["status"] == JobStatus.FAILED
+        assert job_worker.saved[-1]["error"] == "connection lost"
+
+    @pytest.mark.asyncio
+    async def test_invalid_input_is_not_retried(self, job_worker):
+        async def invalid(session, settings, job, progress):
+            raise DomainException(key="datasource.upload_checksum_mismatch")
+
+        job_worker.handlers["count"] = invalid
+        self.claims(job_worker, make_job())
+
+        await job_worker._run_next()
+
+        assert job_worker.saved[-1]["status"] == JobStatus.FAILED
+
+    @pytest.mark.asyncio
+    async def test_abandoned_and_unknown_jobs_fail(self, job_worker):
+        job_worker.handlers["count"] = None
+        for job in (make_job(attempts=4), make_job(kind="unknown")):
+            self.claims(job_worker, job)
+            await job_worker._run_next()
+            assert job_worker.saved[-1]["status"] == JobStatus.FAILED
+
+    @pytest.mark.asyncio
+    async def test_stopped_worker_queues_its_job_again(self, job_worker):
+        started = asyncio.Event()
+
+        async def forever(session, settings, job, progress):
+            started.set()
+            await asyncio.sleep(60)
+
+        job_worker.handlers["count"] = forever
+        task = asyncio.create_task(job_worker.run_job(make_job(attempts=2)))
+        await started.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        final = job_worker.saved[-1]
+        assert final["status"] == JobStatus.PENDING and final["attempts"] == 1
+
+
+class FakeJobRepository:
+    def __init__(self, job):
+        self.job = job
+        self.session = self
+        self.updates = []
+
+    async def get_or_raise(self, job_id, entity, key):
+        return self.job
+
+    async def update(self, job_id, attributes):
+        self.updates.append(attributes)
+
+    async def commit(self):
+        pass
+
+
+class TestJobService:
+    @pytest.mark.asyncio
+    async def test_owner_cancels_a_running_job(self):
+        repository = FakeJobRepository(make_job())
+        service = JobService(repository, Settings())
+
+        with pytest.raises(PermissionDeniedException):
+            await service.cancel_job(1, OTHER)
+        await service.cancel_job(1, OWNER)
+
+        assert repository.updates[-1]["status"] == JobStatus.CANCELLED
+        assert "created_by_id" not in repository.updates[-1]
+
+    @pytest.mark.asyncio
+    async def test_finished_job_is_not_cancellable(self):
+        service = JobService(
+            FakeJobRepository(make_job(status=JobStatus.COMPLETED)), Settings()
+        )
+
+        with pytest.raises(DomainException) as exc:
+            await service.cancel_job(1, OWNER)
+
+        assert exc.value.key == "job.not_cancellable"
@@ -67,6 +67,7 @@ class TestMapService:
 
         assert result.id == 10
         mock_repo.create.assert_awaited_once()
+        mock_repo.replace_datasource_refs.assert_awaited_once_with(10, [])
         mock_repo.session.commit.assert_awaited_once()
 
     @pytest.mark.asyncio
@@ -129,6 +130,40 @@ class TestMapService:
 
         assert exc.value.params["detail"] == "map.update_permission_denied"
 
+    @pytest.mark.asyncio
+    async def test_update_map_style_refreshes_datasource_refs(
+        self, service, mock_repo, admin_user
+    ):
+        """Test updating the style re-indexes its datasources."""
+        map_obj = Mock(id=10, created_by_id=1, atlas_id=1)
+        map_obj.name = "Map"
+        mock_repo.get_or_raise.return_value = map_obj
+        style = (
+            '{"version": 8, "sources": {"s": {"type": "vector", '
+            '"url": "http://martin:3000/roads"}}, '
+            '"layers": [{"id": "l", "source": "s", "source-layer": "primary"}]}'
+        )
+
+        await service.update_map(10, MapUpdate(style=style), admin_user)
+
+        mock_repo.replace_datasource_refs.assert_awaited_once()
+        map_id, refs = mock_repo.replace_datasource_refs.await_args.args
+        assert map_id == 10
+        assert [(r.datasource, r.source_layer) for r in refs] == [("roads", "primary")]
+
+    @pytest.mark.asyncio
+    async def test_update_map_without_style_keeps_datasource_refs(
+        self, service, mock_repo, admin_user
+    ):
+        """Test updates not touching the style skip the parsing pass."""
+        map_obj = Mock(id=10, created_by_id=1, atlas_id=1)
+        map_obj.name = "Map"
+        mock_repo.get_or_raise.return_value = map_obj
+
+        await service.update_map(10, MapUpdate(description="New"), admin_user)
+
+        mock_repo.replace_datasource_refs.assert_not_awaited()
+
     @pytest.mark.asyncio
     async def test_delete_map_success(self, service, mock_repo, admin_user):
         """Test delete map success."""
@@ -0,0 +1,292 @@
+import asyncio
+import sqlite3
+import time
+
+import pytest
+from app.core.config import Settings
+from app.modules.proxy.cache import (
+    DISK_ACCESS_RESOLUTION,
+    DISK_ENTRY_OVERHEAD,
+    ENTRY_OVERHEAD,
+    SHARED_TILE_MAX_BYTES,
+    CachedTile,
+    DiskTileCache,
+    MemoryTileCache,
+    TileCache,
+    TileCacheManager,
+    TileKey,
+)
+
+
+def key(source="roads", z=3, x=1, y=2, version=0) -> TileKey:
+    return TileKey(source=source, z=z, x=x, y=y, format="pbf", version=version)
+
+
+def tile(data=b"tile", expires_in=60.0) -> CachedTile:
+    return CachedTile(data=data, expires_at=time.time() + expires_in)
+
+
+class TestMemoryTileCache:
+    def test_evicts_least_recently_used_by_size(self):
+        cache = MemoryTileCache(max_bytes=2 * (ENTRY_OVERHEAD + 4))
+        cache.set(key(x=0), tile(b"til0"))
+        cache.set(key(x=1), tile(b"til1"))
+        cache.get(key(x=0), time.time())
+        cache.set(key(x=2), tile(b"til2"))
+
+        assert cache.get(key(x=1), time.time()) is None
+        assert cache.get(key(x=0), time.time()) is not None
+        assert cache.evictions == 1
+        assert cache.size == 2 * (ENTRY_OVERHEAD + 4)
+
+    def test_expired_entry_is_dropped(self):
+        cache = MemoryTileCache(max_bytes=10_000)
+        cache.set(key(), tile(expires_in=-1))
+
+        assert cache.get(key(), time.time()) is None
+        assert len(cache) == 0
+        assert cache.size == 0
+
+    def test_purge_source(self):
+        cache = MemoryTileCache(max_bytes=10_000)
+        cache.set(key(source="roads"), tile())
+        cache.set(key(source="rivers"), tile())
+
+        cache.purge("roads")
+
+        assert cache.get(key(source="roads"), time.time()) is None
+        assert cache.get(key(source="rivers"), time.time()) is not None
+
+    def test_identical_small_tiles_share_content(self):
+        cache = MemoryTileCache(max_bytes=10_000)
+        cache.set(key(x=0), tile(b"sea"))
+        cache.set(key(x=1), tile(bytes(b"sea")))
+
+        assert cache.get(key(x=0), 0).data is cache.get(key(x=1), 0).data
+        assert cache.size == 2 * ENTRY_OVERHEAD + 3
+        assert cache.shared_tiles == 1
+
+        cache.delete(key(x=0))
+        assert cache.size == ENTRY_OVERHEAD + 3
+        cache.delete(key(x=1))
+        assert cache.size == 0
+        assert cache.shared_tiles == 0
+
+    def test_large_tiles_are_not_shared(self):
+        cache = MemoryTileCache(max_bytes=100_000)
+        data = b"x" * (SHARED_TILE_MAX_BYTES + 1)
+        cache.set(key(x=0), tile(data))
+        cache.set(key(x=1), tile(data))
+
+        assert cache.size == 2 * (ENTRY_OVERHEAD + len(data))
+        assert cache.shared_tiles == 0
+
+
+class TestDiskTileCache:
+    def test_survives_reopening(self, tmp_path):
+        path = str(tmp_path / "tiles.sqlite")
+        disk = DiskTileCache(path)
+        disk.set(
+            key(),
+            CachedTile(
+                data=b"abc", content_encoding="gzip", expires_at=time.time() + 60
+            ),
+        )
+        disk.close()
+
+        reopened = DiskTileCache(path)
+        cached = reopened.get(key(), time.time())
+        assert cached.data == b"abc"
+        assert cached.content_encoding == "gzip"
+
+    def test_identical_small_tiles_are_stored_once(self, tmp_path):
+        disk = DiskTileCache(str(tmp_path / "tiles.sqlite"))
+        for x in range(3):
+            disk.set(key(x=x), tile(b"sea"))
+        disk.set(key(x=3), tile(b"land"))
+
+        assert disk.get(key(x=2), time.time()).data == b"sea"
+        contents = disk._connection().execute("SELECT count(*) FROM contents")
+        assert contents.fetchone()[0] == 2
+
+        disk.delete([key(x=3)])
+        disk.prune(time.time())
+        contents = disk._connection().execute("SELECT count(*) FROM contents")
+        assert contents.fetchone()[0] == 1
+
+    def test_purge_source_drops_its_unshared_contents(self, tmp_path):
+        disk = DiskTileCache(str(tmp_path / "tiles.sqlite"))
+        disk.set(key(source="roads", x=0), tile(b"sea"))
+        disk.set(key(source="roads", x=1), tile(b"road"))
+        disk.set(key(source="rivers"), tile(b"sea"))
+
+        disk.purge("roads")
+
+        contents = disk._connection().execute("SELECT data FROM contents")
+        assert contents.fetchall() == [(b"sea",)]
+        assert disk.get(key(source="rivers"), time.time()).data == b"sea"
+
+    def test_prune_evicts_least_recently_read_tiles(self, tmp_path):
+        data = b"x" * (SHARED_TILE_MAX_BYTES + 1)
+        entry = len(data) + DISK_ENTRY_OVERHEAD
+        disk = DiskTileCache(str(tmp_path / "tiles.sqlite"), max_bytes=2 * entry)
+        for x in range(3):
+            disk.set(key(x=x), tile(data))
+        connection = disk._connection()
+        connection.execute("UPDATE tiles SET accessed_at = 0")
+        # Reading x=0 makes x=1 the least recently read tile.
+        disk.get(key(x=0), DISK_ACCESS_RESOLUTION)
+
+        assert disk.prune(time.time()) == 1
+        assert disk.size() == 2 * entry
+        assert disk.get(key(x=1), time.time()) is None
+        assert disk.get(key(x=0), time.time()) is not None
+        assert disk.get(key(x=2), time.time()) is not None
+
+    def test_prune_frees_shared_contents_with_their_last_tile(self, tmp_path):
+        disk = DiskTileCache(str(tmp_path / "tiles.sqlite"), max_bytes=0)
+        for x in range(3):
+            disk.set(key(x=x), tile(b"sea"))
+
+        assert disk.prune(time.time()) == 3
+        assert disk.size() == 0
+
+    def test_drops_tiles_of_older_schema(self, tmp_path):
+        path = str(tmp_path / "tiles.sqlite")
+        connection = sqlite3.connect(path)
+        connection.execute("CREATE TABLE tiles (source TEXT, data BLOB NOT NULL)")
+        connection.execute("INSERT INTO tiles VALUES ('roads', x'00')")
+        connection.commit()
+        connection.close()
+
+        disk = DiskTileCache(path)
+        disk.set(key(), tile(b"abc"))
+        assert disk.get(key(), time.time()).data == b"abc"
+
+    def test_drops_contents_of_older_schema(self, tmp_path):
+        path = str(tmp_path / "tiles.sqlite")
+        connection = sqlite3.connect(path)
+        connection.execute("CREATE TABLE contents (hash BLOB PRIMARY KEY)")
+        connection.execute("PRAGMA user_version = 3")
+        connection.commit()
+        connection.close()
+
+        disk = DiskTileCache(path)
+        disk.set(key(), tile(b"sea"))
+        assert disk.get(key(), time.time()).data == b"sea"
+
+    def test_versions(self, tmp_path):
+        disk = DiskTileCache(str(tmp_path / "tiles.sqlite"))
+        disk.bump_version("roads")
+        disk.bump_version("roads")
+        assert disk.get_versions() == {"roads": 2}
+
+
+class TestTileCache:
+    @pytest.fixture
+    def settings(self, tmp_path):
+        return Settings(
+            tile_cache_memory_bytes=10_000,
+            tile_cache_disk_path=str(tmp_path / "tiles.sqlite"),
+            tile_cache_zoom_ttls={0: 3600, 10: 60, 16: 0},
+            tile_cache_version_refresh_seconds=0,
+        )
+
+    def test_ttl_for_zoom(self, settings):
+        cache = TileCache.from_settings(settings)
+        assert cache.ttl_for(0) == 3600
+        assert cache.ttl_for(9) == 3600
+        assert cache.ttl_for(12) == 60
+        assert cache.ttl_for(18) == 0
+
+    @pytest.mark.asyncio
+    async def test_disk_hit_promotes_to_memory(self, settings):
+        writer = TileCache.from_settings(settings)
+        await writer.set(key(), tile())
+
+        reader = TileCache.from_settings(settings)
+        cached, tier = await reader.get(key())
+        assert (cached.data, tier) == (b"tile", "disk")
+        cached, tier = await reader.get(key())
+        assert tier == "memory"
+        assert reader.stats.hit_ratio == 1.0
+
+    @pytest.mark.asyncio
+    async def test_zero_ttl_is_not_cached(self, settings):
+        cache = TileCache.from_settings(settings)
+        await cache.set(key(z=17, x=0, y=0), tile())
+
+        cached, _ = await cache.get(key(z=17, x=0, y=0))
+        assert cached is None
+        assert cache.stats.misses == 1
+
+    @pytest.mark.asyncio
+    async def test_purge_bumps_version_for_every_worker(self, settings):
+        worker_a = TileCache.from_settings(settings)
+        worker_b = TileCache.from_settings(settings)
+        assert await worker_b.version("roads") == 0
+
+        await worker_a.purge("roads")
+        assert await worker_b.version("roads") == 1
+        assert await worker_b.version("rivers") == 0
+
+        await worker_a.purge()
+        assert await worker_b.version("roads") == 2
+        assert await worker_b.version("rivers") == 1
+
+    @pytest.mark.asyncio
+    async def test_zoom_version(self, settings):
+        cache = TileCache.from_settings(settings)
+        await cache.bump_data_version("roads", z=12)
+
+        assert await cache.version("roads", 12) == 1
+        assert await cache.version("roads", 11) == 0
+        assert cache.data_version("roads") == 1
+
+    @pytest.mark.asyncio
+    async def test_invalidate_tiles_in_both_tiers(self, settings):
+        cache = TileCache.from_settings(settings)
+        await cache.set(key(x=1), tile())
+        await cache.set(key(x=2), tile())
+        await cache.set(key(source="rivers", x=1), tile())
+
+        await cache.invalidate_tiles("roads", {(3, 1, 2)})
+
+        reader = TileCache.from_settings(settings)
+        assert (await cache.get(key(x=1)))[0] is None
+        assert (await reader.get(key(x=1)))[0] is None
+        assert (await reader.get(key(x=2)))[0] is not None
+        assert (await reader.get(key(source="rivers", x=1)))[0] is not None
+        assert cache.data_version("roads") == 1
+
+    @pytest.mark.asyncio
+    async def test_meta_keeps_highest_value(self, settings):
+        cache = TileCache.from_settings(settings)
+        assert await cache.get_meta("cursor") is None
+        await cache.set_meta_max("cursor", 5)
+        await cache.set_meta_max("cursor", 3)
+        assert await cache.get_meta("cursor") == 5
+
+
+class TestTileCacheManager:
+    @pytest.mark.asyncio
+    async def test_prunes_the_disk_tier_periodically(self, tmp_path):
+        settings = Settings(
+            tile_cache_disk_path=str(tmp_path / "tiles.sqlite"),
+            tile_cache_disk_max_bytes=0,
+            tile_cache_disk_prune_seconds=0.01,
+        )
+        manager = TileCacheManager()
+        manager.init(settings)
+        await manager.cache.set(key(), tile(), memory=False)
+
+        manager.start(settings)
+        for _ in range(100):
+            if manager.cache.stats.disk_evictions:
+                break
+            await asyncio.sleep(0.01)
+        await manager.stop()
+
+        assert manager.cache.stats.disk_evictions == 1
+        assert (await manager.cache.get(key()))[0] is None
+        manager.close()
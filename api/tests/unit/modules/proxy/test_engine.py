@@ -0,0 +1,241 @@
+import gzip
+import math
+
+import httpx
+import pytest
+from app.core.config import Settings
+from app.core.exceptions import DomainException
+from app.core.utils.pmtiles import ArchiveWriter, zxy_to_tile_id
+from app.modules.proxy.cache import TileCache
+from app.modules.proxy.engine import TileEngine, TileEngineService, tile_query
+from app.modules.proxy.models import DatasourceOverview, TileEngineSource
+from app.modules.proxy.pmtiles import PMTilesRegistry
+from app.modules.proxy.pruning import StyleUsage
+from app.modules.proxy.schemas import TileEngineSourceUpdate
+from app.modules.proxy.service import TileProxyService
+from app.modules.users.models import UserRole
+from app.modules.users.schemas import UserDetail
+
+
+def engine_source(**overrides) -> TileEngineSource:
+    values = {
+        "datasource": "roads",
+        "table_name": "public.roads",
+        "geometry_column": "geom",
+        "srid": 4326,
+        "columns": ["name", "class", "Lanes"],
+    }
+    values.update(overrides)
+    return TileEngineSource(**values)
+
+
+@pytest.fixture
+def engine(fake_engine):
+    tile_engine = TileEngine()
+    tile_engine.engine = fake_engine(b"mvt")
+    tile_engine._expires_at = math.inf
+    tile_engine.put(engine_source())
+    return tile_engine
+
+
+class TestTileQuery:
+    def test_transforms_and_quotes(self):
+        query = tile_query(engine_source(id_column="id"), ["name", "Lanes"])
+
+        assert "ST_Transform(geom, 3857)" in query
+        assert (
+            "ST_Transform(ST_TileEnvelope(:z, :x, :y, margin => :margin), 4326)"
+            in query
+        )
+        assert ', name, "Lanes", id' in query
+        assert "public.roads" in query
+        assert "'mvt_geom', id)" in query
+        assert "ST_Simplify" not in query
+
+    def test_web_mercator_and_simplification(self):
+        query = tile_query(engine_source(srid=3857, simplify=1.0), [])
+
+        assert "ST_Transform" not in query
+        assert "ST_Simplify(geom, :tolerance, true)" in query
+
+
+class TestTileEngine:
+    @pytest.mark.asyncio
+    async def test_render_selects_style_columns(self, engine):
+        layers = {"roads": frozenset({"Lanes", "unknown"})}
+
+        source = await engine.get_source("roads")
+
+        tile = await engine.render(source, 3, 1, 2, layers)
+
+        query, params = engine.engine.queries[0]
+        assert '"Lanes"' in query and "name" not in query
+        assert params["layer"] == "roads"
+        assert params["margin"] == 64 / 4096
+        assert tile.content_encoding == "gzip"
+        assert gzip.decompress(tile.data) == b"mvt"
+
+    @pytest.mark.asyncio
+    async def test_render_skips_unread_layer_and_empty_tiles(self, engine):
+        source = await engine.get_source("roads")
+
+        unread = await engine.render(source, 0, 0, 0, {"rivers": None})
+        assert unread.status_code == 204
+        assert engine.engine.queries == []
+
+        engine.engine.respond = b""
+        assert (await engine.render(source, 0, 0, 0)).status_code == 204
+
+    @pytest.mark.asyncio
+    async def test_zoom_dependent_tolerance(self, engine):
+        source = engine_source(simplify=2.0)
+
+        await engine.render(source, 0, 0, 0)
+        await engine.render(source, 1, 0, 0)
+
+        tolerances = [params["tolerance"] for _, params in engine.engine.queries]
+        assert tolerances[0] == pytest.approx(2 * 40075016.68557849 / 4096)
+        assert tolerances[1] == pytest.approx(tolerances[0] / 2)
+
+    @pytest.mark.asyncio
+    async def test_archived_source_is_read_from_its_archive(self, engine, tmp_path):
+        writer = ArchiveWriter(str(tmp_path / "roads.pmtiles"))
+        writer.add(zxy_to_tile_id(1, 0, 0), gzip.compress(b"archived", mtime=0))
+        writer.finish(0, 1, (-180.0, -85.0, 180.0, 85.0), {})
+        engine.archives = PMTilesRegistry()
+        engine.archives.configure(Settings(pmtiles_directory=str(tmp_path)))
+        engine.put(engine_source(archive=True))
+        engine.set_overviews(
+            [
+                DatasourceOverview(
+                    datasource="roads",
+                    min_zoom=0,
+                    max_zoom=5,
+                    table_name="roads_ov",
+                    columns=[],
+                )
+            ]
+        )
+
+        source = await engine.route("roads", 1)
+        tile = await engine.render(source, 1, 0, 0)
+        empty = await engine.render(source, 1, 1, 1)
+        rendered = await engine.render(source, 2, 0, 0)
+
+        assert source.table_name == "public.roads"
+        assert gzip.decompress(tile.data) == b"archived"
+        assert tile.content_encoding == "gzip"
+        assert empty.status_code == 204
+        assert gzip.decompress(rendered.data) == b"mvt"
+        assert len(engine.engine.queries) == 1
+
+    @pytest.mark.asyncio
+    async def test_missing_archive_falls_back_to_the_table(self, engine, tmp_path):
+        engine.archives = PMTilesRegistry()
+        engine.archives.configure(Settings(pmtiles_directory=str(tmp_path)))
+
+        tile = await engine.render(engine_source(archive=True), 0, 0, 0)
+
+        assert gzip.decompress(tile.data) == b"mvt"
+
+
+class TestTileProxyServiceWithEngine:
+    @pytest.mark.asyncio
+    async def test_engine_tiles_skip_martin_and_are_cached(self, engine):
+        requests = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            requests.append(request)
+            return httpx.Response(200, stream=httpx.ByteStream(b"martin"))
+
+        client = httpx.AsyncClient(
+            base_url="http://martin:3000", transport=httpx.MockTransport(handler)
+        )
+        cache = TileCache.from_settings(
+            Settings(tile_cache_disk_path=None, tile_cache_memory_bytes=100_000)
+        )
+        service = TileProxyService(client, Settings(), cache, engine=engine)
+
+        first = await service.get_tile("roads", 2, 1, 1, accept_encoding="gzip")
+        second = await service.get_tile("roads", 2, 1, 1, accept_encoding="gzip")
+        other = await service.get_tile("rivers", 2, 1, 1)
+
+        assert gzip.decompress(first.body) == b"mvt"
+        assert first.headers["x-cache"] == "MISS"
+        assert second.headers["x-cache"] == "MEMORY"
+        assert len(engine.engine.queries) == 1
+        assert other.body == b"martin"
+        assert [r.url.path for r in requests] == ["/rivers/2/1/1"]
+
+    @pytest.mark.asyncio
+    async def test_pruned_tiles_are_rendered_directly(self, engine):
+        cache = TileCache.from_settings(
+            Settings(tile_cache_disk_path=None, tile_cache_memory_bytes=100_000)
+        )
+        service = TileProxyService(
+            httpx.AsyncClient(), Settings(), cache, engine=engine
+        )
+        usage = StyleUsage.from_layers({"roads": frozenset({"class"})})
+
+        class Usages:
+            async def get(self, map_id, datasource):
+                return usage
+
+        service.style_usages = Usages()
+
+        await service.get_tile("roads", 2, 1, 1, map_id=1)
+
+        query, _ = engine.engine.queries[0]
+        assert ", class" in query and "name" not in query
+
+
+class FakeEngineSourceRepository:
+    def __init__(self, srid=4326, columns=("id", "name")):
+        self.description = (srid, list(columns))
+        self.rows = {}
+        self.session = self
+
+    async def commit(self):
+        pass
+
+    async def rollback(self):
+        pass
+
+    async def describe(self, table, geometry_column):
+        return self.description
+
+    async def upsert(self, values):
+        self.rows[values["datasource"]] = TileEngineSource(**values)
+
+    async def get_by_datasource(self, datasource):
+        return self.rows.get(datasource)
+
+
+ADMIN = UserDetail(
+    id=1, username="admin", email="admin@test.com", roles=[UserRole.ADMIN], teams=[]
+)
+
+
+class TestTileEngineService:
+    @pytest.mark.asyncio
+    async def test_configure_reads_columns(self, engine):
+        repository = FakeEngineSourceRepository()
+        service = TileEngineService(repository, Settings(), engine=engine)
+
+        read = await service.configure_source(
+            ADMIN, "parcels", TileEngineSourceUpdate(id_column="id", simplify=1)
+        )
+
+        assert read.table_name == "parcels"
+        assert read.columns == ["name"]
+        assert (await engine.get_source("parcels")).id_column == "id"
+
+    @pytest.mark.asyncio
+    async def test_configure_rejects_missing_geometry(self, engine):
+        service = TileEngineService(
+            FakeEngineSourceRepository(srid=None), Settings(), engine=engine
+        )
+
+        with pytest.raises(DomainException) as exc:
+            await service.configure_source(ADMIN, "parcels", TileEngineSourceUpdate())
+        assert exc.value.key == "proxy.engine_invalid_table"
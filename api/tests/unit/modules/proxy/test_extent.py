@@ -0,0 +1,306 @@
+from datetime import datetime, timedelta
+
+import pytest
+from app.core.config import Settings
+from app.core.utils.tile_utils import tile_bounds
+from app.modules.proxy.extent import (
+    BATCH_SIZE,
+    ExtentIndex,
+    OccupancyGrid,
+    SourceExtent,
+    TileExtentService,
+)
+from app.modules.proxy.models import DatasourceExtent, TileDirtyRegion
+
+COMPUTED_AT = datetime(2026, 1, 1)
+
+
+def inner_bbox(z, x, y):
+    """A small bbox in the middle of a tile, away from the buffer."""
+    min_lon, min_lat, max_lon, max_lat = tile_bounds(z, x, y)
+    lon, lat = (min_lon + max_lon) / 2, (min_lat + max_lat) / 2
+    return lon, lat, lon, lat
+
+
+def region(id, bbox, datasource="roads", xid=None) -> TileDirtyRegion:
+    values = dict(zip(("min_x", "min_y", "max_x", "max_y"), bbox))
+    # One transaction per region by default.
+    return TileDirtyRegion(id=id, datasource=datasource, xid=xid or id, **values)
+
+
+def extent(bbox=None, cells=(), computed_at=COMPUTED_AT, region_horizon=0):
+    return SourceExtent(
+        datasource="roads",
+        bbox=bbox,
+        grid=OccupancyGrid.from_cells(4, cells),
+        computed_at=computed_at,
+        region_horizon=region_horizon,
+    )
+
+
+class TestOccupancyGrid:
+    def test_bytes_round_trip(self):
+        grid = OccupancyGrid.from_cells(4, [(0, 0), (15, 15), (3, 7)])
+
+        restored = OccupancyGrid.from_bytes(4, grid.to_bytes())
+
+        assert restored.rows == grid.rows
+        assert restored.occupied == 3
+        assert len(grid.to_bytes()) == 16 * 2
+
+    def test_tiles_at_every_zoom(self):
+        grid = OccupancyGrid.from_cells(4, [(5, 6)])
+
+        assert grid.may_contain(4, 5, 6)
+        assert not grid.may_contain(4, 9, 9)
+        # Parent tiles cover the cell, child tiles lie inside it.
+        assert grid.may_contain(0, 0, 0)
+        assert grid.may_contain(2, 1, 1)
+        assert not grid.may_contain(2, 2, 2)
+        assert grid.may_contain(8, 5 * 16 + 7, 6 * 16 + 3)
+        assert not grid.may_contain(8, 9 * 16, 9 * 16)
+
+    def test_tile_buffer_reaches_neighbour_cell(self):
+        grid = OccupancyGrid.from_cells(4, [(5, 6)])
+
+        # Last child tile of cell (4, 6) at zoom 8: its buffer overlaps cell (5, 6).
+        assert grid.may_contain(8, 5 * 16 - 1, 6 * 16 + 8)
+        assert not grid.may_contain(8, 5 * 16 - 2, 6 * 16 + 8)
+
+    def test_mark_bbox(self):
+        grid = OccupancyGrid(4)
+
+        assert grid.mark_bbox(inner_bbox(4, 2, 3))
+        assert not grid.mark_bbox(inner_bbox(4, 2, 3))
+        assert grid.may_contain(4, 2, 3)
+        assert grid.occupied == 1
+
+
+class TestSourceExtent:
+    def test_empty_datasource_has_no_tiles(self):
+        assert not extent().may_contain(0, 0, 0)
+
+    def test_bbox_and_grid(self):
+        source_extent = extent(tile_bounds(4, 5, 6), [(5, 6)])
+
+        assert source_extent.may_contain(0, 0, 0)
+        assert source_extent.may_contain(12, *[c * 256 + 128 for c in (5, 6)])
+        assert not source_extent.may_contain(12, 0, 0)
+
+    def test_bbox_without_grid(self):
+        source_extent = SourceExtent(datasource="roads", bbox=(-10, -10, 10, 10))
+
+        assert source_extent.may_contain(3, 3, 3)
+        assert not source_extent.may_contain(3, 0, 0)
+
+    def test_expand_grows_bbox_and_grid(self):
+        source_extent = extent(inner_bbox(4, 5, 6), [(5, 6)])
+
+        assert source_extent.expand([inner_bbox(4, 9, 9)])
+        assert not source_extent.expand([inner_bbox(4, 9, 9)])
+        assert source_extent.may_contain(4, 9, 9)
+        # Cells between the two regions stay empty.
+        assert not source_extent.may_contain(4, 7, 7)
+
+    def test_include_marks_the_given_cells_only(self):
+        source_extent = extent(inner_bbox(4, 5, 6), [(5, 6)])
+        (x0, y0, _, _), (x1, y1, _, _) = inner_bbox(4, 5, 6), inner_bbox(4, 9, 9)
+        bbox = (min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+
+        assert source_extent.include(bbox, [(9, 9)])
+        assert not source_extent.include(bbox, [(9, 9)])
+        assert source_extent.may_contain(4, 9, 9)
+        assert not source_extent.may_contain(4, 7, 7)
+
+
+class FakeExtentRepository:
+    def __init__(self, rows=()):
+        self.rows = {row.datasource: row for row in rows}
+        self.updates = []
+        # Extent and cells of the rows changed by an update.
+        self.changed = (None, [])
+
+    async def get_updated_since(self, after):
+        return [r for r in self.rows.values() if after is None or r.updated_at > after]
+
+    async def get_datasources(self):
+        return set(self.rows)
+
+    async def get_by_datasource(self, datasource, for_update=False):
+        return self.rows.get(datasource)
+
+    async def compute_changed(self, table, key, geometry_column, zoom):
+        return self.changed
+
+    async def update_by_datasource(self, datasource, values):
+        self.updates.append((datasource, values))
+        for name, value in values.items():
+            setattr(self.rows[datasource], name, value)
+
+
+class FakeRegionRepository:
+    """Dirty-region log; regions of `running` transactions are not visible."""
+
+    def __init__(self, regions=(), running=()):
+        self.regions = list(regions)
+        self.running = set(running)
+
+    async def get_since(self, horizon, after_id, limit):
+        regions = sorted(self.regions, key=lambda r: r.id)
+        return [
+            r
+            for r in regions
+            if r.xid not in self.running and r.xid >= horizon and r.id > after_id
+        ][:limit]
+
+    async def get_horizon(self):
+        last = max((r.xid for r in self.regions), default=0)
+        return min(self.running, default=last + 1)
+
+
+def row(region_horizon=0, computed_at=COMPUTED_AT, cells=((5, 6),)) -> DatasourceExtent:
+    min_x, min_y, max_x, max_y = inner_bbox(4, 5, 6)
+    return DatasourceExtent(
+        datasource="roads",
+        min_x=min_x,
+        min_y=min_y,
+        max_x=max_x,
+        max_y=max_y,
+        feature_count=1,
+        occupancy_zoom=4,
+        occupancy=OccupancyGrid.from_cells(4, cells).to_bytes(),
+        region_horizon=region_horizon,
+        computed_at=computed_at,
+        updated_at=computed_at,
+    )
+
+
+class TestExtentIndex:
+    def test_unknown_source_may_contain_anything(self):
+        assert ExtentIndex().may_contain("roads", 10, 0, 0)
+
+    def test_put_keeps_latest_computation(self):
+        index = ExtentIndex()
+        index.put(extent(inner_bbox(4, 5, 6), [(5, 6)]))
+
+        # Same computation: union.
+        index.put(extent(inner_bbox(4, 9, 9), [(9, 9)]))
+        assert index.may_contain("roads", 4, 5, 6)
+        assert index.may_contain("roads", 4, 9, 9)
+
+        # Older computation: ignored. Newer one: replaces.
+        index.put(extent(None, computed_at=COMPUTED_AT - timedelta(days=1)))
+        assert index.may_contain("roads", 4, 9, 9)
+        index.put(extent(None, computed_at=COMPUTED_AT + timedelta(days=1)))
+        assert not index.may_contain("roads", 4, 9, 9)
+
+    def test_new_computation_replays_regions(self):
+        index = ExtentIndex()
+        index.horizon = 100
+        index._applied = {99: 100, 100: 100}
+
+        index.put(extent(None, region_horizon=40))
+
+        assert index.horizon == 40
+        assert index._applied == {}
+
+    @pytest.mark.asyncio
+    async def test_load_drops_deleted_datasources(self):
+        index = ExtentIndex()
+        repository = FakeExtentRepository([row()])
+        await index.load(repository)
+        assert index.get("roads") is not None
+
+        repository.rows.clear()
+        await index.load(repository)
+        assert index.get("roads") is None
+
+    @pytest.mark.asyncio
+    async def test_poll_grows_and_persists_extent(self):
+        index = ExtentIndex()
+        repository = FakeExtentRepository([row(region_horizon=4)])
+        regions = FakeRegionRepository(
+            [
+                region(3, inner_bbox(4, 0, 0)),
+                region(4, inner_bbox(4, 9, 9)),
+                region(5, inner_bbox(4, 5, 6)),
+                region(6, inner_bbox(4, 1, 1), datasource="rivers"),
+            ]
+        )
+        await index.load(repository)
+
+        await index.poll(repository, regions)
+
+        assert index.horizon == 7
+        assert index.may_contain("roads", 4, 9, 9)
+        # The regions below the horizon of the computation are not replayed.
+        assert not index.may_contain("roads", 4, 0, 0)
+        assert len(repository.updates) == 1
+        stored = SourceExtent.from_model(repository.rows["roads"])
+        assert stored.grid.may_contain(4, 9, 9)
+        assert stored.region_horizon == 4
+
+    @pytest.mark.asyncio
+    async def test_poll_without_growth_writes_nothing(self):
+        index = ExtentIndex()
+        repository = FakeExtentRepository([row()])
+        await index.load(repository)
+
+        await index.poll(
+            repository, FakeRegionRepository([region(1, inner_bbox(4, 5, 6))])
+        )
+
+        assert repository.updates == []
+
+    @pytest.mark.asyncio
+    async def test_late_commits_far_below_the_last_id_are_applied(self):
+        index = ExtentIndex()
+        repository = FakeExtentRepository([row()])
+        late = region(1, inner_bbox(4, 9, 9), xid=1)
+        others = [
+            region(i, inner_bbox(4, 5, 6), xid=2) for i in range(2, BATCH_SIZE + 100)
+        ]
+        regions = FakeRegionRepository([late, *others], running={1})
+        await index.load(repository)
+
+        await index.poll(repository, regions)
+        assert not index.may_contain("roads", 4, 9, 9)
+        assert index.horizon == 1
+
+        regions.running.clear()
+        await index.poll(repository, regions)
+
+        assert index.may_contain("roads", 4, 9, 9)
+        stored = SourceExtent.from_model(repository.rows["roads"])
+        assert stored.grid.may_contain(4, 9, 9)
+        assert index.horizon == 3
+
+
+class TestTileExtentService:
+    def service(self, repository):
+        return TileExtentService(
+            repository, FakeRegionRepository(), Settings(), ExtentIndex()
+        )
+
+    @pytest.mark.asyncio
+    async def test_extend_grows_the_stored_extent(self):
+        repository = FakeExtentRepository([row()])
+        repository.changed = (inner_bbox(4, 9, 9), [(9, 9)])
+
+        assert await self.service(repository).extend("roads", "ref")
+
+        ((source, values),) = repository.updates
+        assert source == "roads"
+        assert values["max_x"] == inner_bbox(4, 9, 9)[2]
+        stored = SourceExtent.from_model(repository.rows["roads"])
+        assert stored.may_contain(4, 9, 9)
+        assert not stored.may_contain(4, 7, 7)
+
+    @pytest.mark.asyncio
+    async def test_extend_inside_the_extent_writes_nothing(self):
+        repository = FakeExtentRepository([row()])
+        repository.changed = (inner_bbox(4, 5, 6), [(5, 6)])
+
+        assert not await self.service(repository).extend("roads", "ref")
+        assert not await self.service(FakeExtentRepository()).extend("roads", "ref")
+        assert repository.updates == []
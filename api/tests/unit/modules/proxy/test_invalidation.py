@@ -0,0 +1,167 @@
+import time
+
+import pytest
+from app.core.config import Settings
+from app.core.utils.tile_utils import MAX_ZOOM, tile_bounds
+from app.modules.proxy.cache import CachedTile, TileCache, TileKey
+from app.modules.proxy.invalidation import (
+    BATCH_SIZE,
+    HORIZON_META_KEY,
+    TileInvalidator,
+)
+from app.modules.proxy.models import TileDirtyRegion
+
+
+def key(z, x, y, version=0, source="roads") -> TileKey:
+    return TileKey(source=source, z=z, x=x, y=y, format="pbf", version=version)
+
+
+def tile() -> CachedTile:
+    return CachedTile(data=b"tile", expires_at=time.time() + 60)
+
+
+def region(id, bbox=None, datasource="roads", xid=None) -> TileDirtyRegion:
+    values = dict(zip(("min_x", "min_y", "max_x", "max_y"), bbox or (None,) * 4))
+    # One transaction per region by default.
+    return TileDirtyRegion(id=id, datasource=datasource, xid=xid or id, **values)
+
+
+def inner_bbox(z, x, y):
+    """A small bbox in the middle of a tile, away from the buffer."""
+    min_lon, min_lat, max_lon, max_lat = tile_bounds(z, x, y)
+    lon, lat = (min_lon + max_lon) / 2, (min_lat + max_lat) / 2
+    return lon, lat, lon, lat
+
+
+class FakeRepository:
+    """Dirty-region log; regions of `running` transactions are not visible."""
+
+    def __init__(self, regions=(), running=()):
+        self.regions = list(regions)
+        self.running = set(running)
+
+    async def get_since(self, horizon, after_id, limit):
+        regions = sorted(self.regions, key=lambda r: r.id)
+        return [
+            r
+            for r in regions
+            if r.xid not in self.running and r.xid >= horizon and r.id > after_id
+        ][:limit]
+
+    async def get_horizon(self):
+        last = max((r.xid for r in self.regions), default=0)
+        return min(self.running, default=last + 1)
+
+
+class TestTileInvalidator:
+    @pytest.fixture
+    def settings(self, tmp_path):
+        return Settings(
+            tile_cache_memory_bytes=100_000,
+            tile_cache_disk_path=str(tmp_path / "tiles.sqlite"),
+            tile_cache_version_refresh_seconds=0,
+            tile_invalidation_max_tiles_per_zoom=64,
+        )
+
+    @pytest.fixture
+    def cache(self, settings):
+        return TileCache.from_settings(settings)
+
+    @pytest.fixture
+    def invalidator(self, cache, settings):
+        invalidator = TileInvalidator()
+        invalidator.configure(cache, settings)
+        invalidator.horizon = 0
+        return invalidator
+
+    def test_affected_tiles_per_zoom(self, invalidator):
+        tiles, overflowing = invalidator.affected_tiles([inner_bbox(12, 2100, 1400)])
+
+        assert (12, 2100, 1400) in tiles
+        assert (11, 1050, 700) in tiles
+        assert (0, 0, 0) in tiles
+        assert (12, 2101, 1400) not in tiles
+        assert overflowing == []
+
+    def test_large_region_overflows_from_some_zoom(self, invalidator):
+        tiles, overflowing = invalidator.affected_tiles([(-10.0, 40.0, 10.0, 55.0)])
+
+        assert overflowing and overflowing[-1] == MAX_ZOOM
+        assert all(z < overflowing[0] for z, _, _ in tiles)
+
+    @pytest.mark.asyncio
+    async def test_poll_deletes_touched_tiles_only(self, invalidator, cache):
+        await cache.set(key(12, 2100, 1400), tile())
+        await cache.set(key(12, 2200, 1400), tile())
+        await cache.set(key(12, 2100, 1400, source="rivers"), tile())
+
+        await invalidator.poll(FakeRepository([region(1, inner_bbox(12, 2100, 1400))]))
+
+        assert (await cache.get(key(12, 2100, 1400)))[0] is None
+        assert (await cache.get(key(12, 2200, 1400)))[0] is not None
+        assert (await cache.get(key(12, 2100, 1400, source="rivers")))[0] is not None
+        assert await cache.version("roads", 12) == 0
+        assert await cache.get_meta(HORIZON_META_KEY) == 2
+
+    @pytest.mark.asyncio
+    async def test_truncate_bumps_source_version(self, invalidator, cache):
+        await invalidator.poll(FakeRepository([region(1)]))
+
+        assert await cache.version("roads") == 1
+        assert await cache.version("rivers") == 0
+
+    @pytest.mark.asyncio
+    async def test_large_region_bumps_zoom_versions(self, invalidator, cache):
+        await invalidator.poll(FakeRepository([region(1, (-10.0, 40.0, 10.0, 55.0))]))
+
+        assert await cache.version("roads", 2) == 0
+        assert await cache.version("roads", 14) == 1
+
+    @pytest.mark.asyncio
+    async def test_regions_are_applied_once(self, invalidator, cache):
+        # Region 1 commits after region 2 was read: its transaction is still
+        # running, so region 2 is read again but not applied again.
+        repository = FakeRepository(
+            [region(1), region(2, inner_bbox(12, 2100, 1400))], running={1}
+        )
+        await invalidator.poll(repository)
+        assert invalidator.horizon == 1
+        repository.running.clear()
+        await invalidator.poll(repository)
+
+        assert await cache.version("roads") == 1
+        assert cache.data_version("roads") == 2
+        assert invalidator.horizon == 3
+
+    @pytest.mark.asyncio
+    async def test_late_commits_far_below_the_last_id_are_applied(
+        self, invalidator, cache
+    ):
+        late = region(1, datasource="rivers", xid=1)
+        others = [
+            region(i, inner_bbox(12, 2100, 1400), xid=2)
+            for i in range(2, BATCH_SIZE + 100)
+        ]
+        repository = FakeRepository([late, *others], running={1})
+        await invalidator.poll(repository)
+        assert await cache.version("rivers") == 0
+        roads_version = cache.data_version("roads")
+
+        repository.running.clear()
+        await invalidator.poll(repository)
+
+        assert await cache.version("rivers") == 1
+        # The other regions are read again, not applied again.
+        assert cache.data_version("roads") == roads_version
+
+    @pytest.mark.asyncio
+    async def test_first_poll_resumes_from_disk_horizon(self, invalidator, cache):
+        await cache.set_meta_max(HORIZON_META_KEY, 2)
+        invalidator.horizon = None
+
+        await invalidator.poll(
+            FakeRepository([region(1), region(2, datasource="rivers")])
+        )
+
+        assert await cache.version("roads") == 0
+        assert await cache.version("rivers") == 1
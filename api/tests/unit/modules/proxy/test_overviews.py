@@ -0,0 +1,236 @@
+import math
+
+import httpx
+import pytest
+from app.core.config import Settings
+from app.core.exceptions import DomainException
+from app.modules.proxy.cache import TileCache
+from app.modules.proxy.engine import WORLD_SIZE, TileEngine
+from app.modules.proxy.models import DatasourceOverview, TileEngineSource
+from app.modules.proxy.overviews import (
+    TileOverviewService,
+    band_grid,
+    band_tolerance,
+    overview_table_name,
+    validate_bands,
+)
+from app.modules.proxy.repository import OverviewRepository
+from app.modules.proxy.schemas import DatasourceOverviewsUpdate
+from app.modules.proxy.service import TileProxyService
+from app.modules.users.models import UserRole
+from app.modules.users.schemas import UserDetail
+
+ADMIN = UserDetail(
+    id=1, username="admin", email="admin@test.com", roles=[UserRole.ADMIN], teams=[]
+)
+
+
+def overview(**overrides) -> DatasourceOverview:
+    values = {
+        "id": 1,
+        "datasource": "roads",
+        "min_zoom": 0,
+        "max_zoom": 5,
+        "table_name": "public.roads_ov_0_5",
+        "source_table": "public.roads",
+        "id_column": "id",
+        "columns": ["name", "class"],
+        "tolerance": 1000.0,
+    }
+    values.update(overrides)
+    return DatasourceOverview(**values)
+
+
+@pytest.fixture
+def engine(fake_engine):
+    tile_engine = TileEngine()
+    tile_engine.engine = fake_engine(b"mvt")
+    tile_engine._expires_at = math.inf
+    tile_engine.put(
+        TileEngineSource(
+            datasource="roads",
+            table_name="public.roads",
+            geometry_column="geom",
+            srid=4326,
+            columns=["name", "class"],
+            buffer=32,
+        )
+    )
+    tile_engine.set_overviews([overview()])
+    return tile_engine
+
+
+class TestBands:
+    def test_tolerance_and_grid_at_highest_zoom(self):
+        assert band_tolerance(0, 1.0) == pytest.approx(WORLD_SIZE / 256)
+        assert band_tolerance(5, 2.0) == pytest.approx(WORLD_SIZE / 256 / 32 * 2)
+        assert band_grid(5) == pytest.approx(WORLD_SIZE / 4096 / 32)
+
+    def test_table_names(self):
+        assert overview_table_name("public.roads", 6, 8) == "public.roads_ov_6_8"
+        long_name = overview_table_name("a" * 60, 0, 5)
+        assert long_name == "a" * 40 + "_ov_0_5"
+
+    def test_validate_bands(self):
+        assert validate_bands([(6, 8), (0, 5)]) == [(0, 5), (6, 8)]
+        for bands in ([], [(0, 5), (5, 8)], [(4, 2)], [(0, 31)]):
+            with pytest.raises(DomainException) as exc:
+                validate_bands(bands)
+            assert exc.value.key == "proxy.overview_invalid_bands"
+
+
+class TestRouting:
+    @pytest.mark.asyncio
+    async def test_band_zooms_use_the_overview(self, engine):
+        low = await engine.route("roads", 3)
+        high = await engine.route("roads", 12)
+
+        assert low.table_name == "public.roads_ov_0_5"
+        assert low.srid == 3857 and low.geometry_column == "geom"
+        assert low.columns == ["name", "class"] and low.id_column == "id"
+        assert low.buffer == 32
+        assert high.table_name == "public.roads"
+
+    @pytest.mark.asyncio
+    async def test_overview_of_a_martin_datasource(self, engine):
+        engine.set_overviews(
+            [
+                overview(
+                    datasource="rivers", aggregate_by=["class"], min_zoom=6, max_zoom=8
+                )
+            ]
+        )
+
+        assert (await engine.route("rivers", 7)).columns == ["class"]
+        assert (await engine.route("rivers", 7)).id_column is None
+        assert await engine.route("rivers", 5) is None
+        assert await engine.route("rivers", 12) is None
+
+    @pytest.mark.asyncio
+    async def test_proxy_renders_band_tiles_from_the_overview(self, engine):
+        engine.set_overviews([overview(datasource="rivers", table_name="rivers_ov")])
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            return httpx.Response(200, stream=httpx.ByteStream(b"martin"))
+
+        cache = TileCache.from_settings(
+            Settings(tile_cache_disk_path=None, tile_cache_memory_bytes=100_000)
+        )
+        client = httpx.AsyncClient(
+            base_url="http://martin:3000", transport=httpx.MockTransport(handler)
+        )
+        service = TileProxyService(client, Settings(), cache, engine=engine)
+
+        await service.get_tile("rivers", 2, 1, 1)
+        martin = await service.get_tile("rivers", 9, 1, 1)
+
+        query, params = engine.engine.queries[0]
+        assert "FROM rivers_ov" in query and "ST_Transform" not in query
+        assert params["layer"] == "rivers"
+        assert martin.body == b"martin"
+
+
+def catalog_session(fake_engine, columns=()):
+    """Session reading `columns` from the catalog, and 42 for other queries."""
+
+    def respond(sql, params):
+        return list(columns) if "pg_attribute" in sql else 42
+
+    return fake_engine(respond).connect()
+
+
+def statements(session):
+    return [sql for sql, _ in session.engine.queries]
+
+
+class TestOverviewRepository:
+    @pytest.mark.asyncio
+    async def test_build_replaces_the_table(self, fake_engine):
+        session = catalog_session(fake_engine)
+        repository = OverviewRepository(session, DatasourceOverview)
+
+        count = await repository.build(overview(), band_grid(5))
+
+        create = statements(session)[1]
+        assert count == 42
+        assert create.startswith("CREATE TABLE public.roads_ov_0_5_tmp AS")
+        assert "ST_SimplifyPreserveTopology(ST_Transform(geom, 3857), 1000.0)" in create
+        assert "name, class, id, ST_SnapToGrid" in create
+        assert "GROUP BY" not in create
+        assert statements(session)[4] == (
+            "ALTER TABLE public.roads_ov_0_5_tmp RENAME TO roads_ov_0_5"
+        )
+
+    @pytest.mark.asyncio
+    async def test_build_merges_aggregated_features(self, fake_engine):
+        session = catalog_session(fake_engine)
+        repository = OverviewRepository(session, DatasourceOverview)
+
+        await repository.build(overview(aggregate_by=["class"]), band_grid(5))
+
+        create = statements(session)[1]
+        assert "ST_Union(ST_Transform(geom, 3857))" in create
+        assert "GROUP BY class" in create
+        assert "id," not in create
+
+
+class FakeOverviewRepository:
+    def __init__(self, session, rows=()):
+        self.session = session
+        self.rows = {row.min_zoom: row for row in rows}
+        self.dropped = []
+
+    async def get_by_datasource(self, datasource):
+        return sorted(self.rows.values(), key=lambda row: row.min_zoom)
+
+    async def drop_table(self, table_name):
+        self.dropped.append(table_name)
+
+    async def delete_by_ids(self, overview_ids):
+        self.rows = {k: v for k, v in self.rows.items() if v.id not in overview_ids}
+
+    async def upsert(self, values):
+        self.rows[values["min_zoom"]] = DatasourceOverview(
+            id=values["min_zoom"] + 100, **values
+        )
+
+
+COLUMNS = [("id", "int4", None), ("name", "text", None), ("geom", "geometry", 4326)]
+
+
+class TestTileOverviewService:
+    @pytest.mark.asyncio
+    async def test_configure_replaces_bands(self, engine, fake_engine):
+        repository = FakeOverviewRepository(
+            catalog_session(fake_engine, COLUMNS),
+            [overview(id=7, min_zoom=0, max_zoom=4, table_name="roads_ov_0_4")],
+        )
+        service = TileOverviewService(repository, Settings(), engine=engine)
+
+        overviews = await service.configure_overviews(
+            ADMIN,
+            "roads",
+            DatasourceOverviewsUpdate(id_column="id", bands=[(6, 8), (0, 5)]),
+        )
+
+        assert repository.dropped == ["roads_ov_0_4"]
+        assert [(o.min_zoom, o.max_zoom) for o in overviews] == [(0, 5), (6, 8)]
+        assert overviews[1].table_name == "roads_ov_6_8"
+        assert overviews[1].columns == ["name"]
+        assert overviews[1].tolerance == pytest.approx(band_tolerance(8, 1.0))
+        assert overviews[1].built_at is None
+
+    @pytest.mark.asyncio
+    async def test_configure_rejects_unknown_columns(self, engine, fake_engine):
+        service = TileOverviewService(
+            FakeOverviewRepository(catalog_session(fake_engine, COLUMNS)),
+            Settings(),
+            engine=engine,
+        )
+
+        with pytest.raises(DomainException) as exc:
+            await service.configure_overviews(
+                ADMIN, "roads", DatasourceOverviewsUpdate(aggregate_by=["kind"])
+            )
+        assert exc.value.key == "proxy.engine_invalid_table"
+        assert exc.value.params["column"] == "kind"
@@ -0,0 +1,163 @@
+import gzip
+import os
+
+import pytest
+from app.core.config import Settings
+from app.core.exceptions import DomainException, EntityNotFoundException
+from app.core.utils.pmtiles import (
+    COMPRESSION_GZIP,
+    HEADER_SIZE,
+    Entry,
+    Header,
+    compress,
+    encode_directory,
+    zxy_to_tile_id,
+)
+from app.modules.proxy.pmtiles import (
+    PMTilesRegistry,
+    PMTilesService,
+    parse_range,
+)
+
+TILES = {(0, 0, 0): b"world", (1, 0, 0): b"nw", (1, 1, 1): b"se", (2, 3, 3): b"corner"}
+
+
+def write_archive(path, tiles, leaves=True):
+    """Archive of gzipped tiles, its entries split across two leaf directories."""
+    entries, data = [], b""
+    for tile_id, tile in sorted((zxy_to_tile_id(*zxy), t) for zxy, t in tiles.items()):
+        tile = gzip.compress(tile, mtime=0)
+        entries.append(Entry(tile_id, len(data), len(tile), 1))
+        data += tile
+
+    leaf_dirs = b""
+    if leaves:
+        root = []
+        for part in (entries[: len(entries) // 2], entries[len(entries) // 2 :]):
+            leaf = compress(encode_directory(part), COMPRESSION_GZIP)
+            root.append(Entry(part[0].tile_id, len(leaf_dirs), len(leaf), 0))
+            leaf_dirs += leaf
+        entries = root
+    root_dir = compress(encode_directory(entries), COMPRESSION_GZIP)
+
+    leaf_offset = HEADER_SIZE + len(root_dir)
+    header = Header(
+        root_dir_offset=HEADER_SIZE,
+        root_dir_length=len(root_dir),
+        metadata_offset=leaf_offset,
+        metadata_length=0,
+        leaf_dirs_offset=leaf_offset,
+        leaf_dirs_length=len(leaf_dirs),
+        tile_data_offset=leaf_offset + len(leaf_dirs),
+        tile_data_length=len(data),
+        addressed_tiles_count=len(tiles),
+        tile_entries_count=len(tiles),
+        tile_contents_count=len(tiles),
+        clustered=True,
+        internal_compression=COMPRESSION_GZIP,
+        tile_compression=COMPRESSION_GZIP,
+        tile_type=1,
+        min_zoom=0,
+        max_zoom=2,
+        min_lon_e7=-1800000000,
+        min_lat_e7=-850000000,
+        max_lon_e7=1800000000,
+        max_lat_e7=850000000,
+        center_zoom=0,
+        center_lon_e7=0,
+        center_lat_e7=0,
+    )
+    with open(path, "wb") as f:
+        f.write(header.to_bytes() + root_dir + leaf_dirs + data)
+
+
+@pytest.fixture
+def service(tmp_path):
+    write_archive(tmp_path / "parcels.pmtiles", TILES)
+    registry = PMTilesRegistry()
+    registry.configure(Settings(pmtiles_directory=str(tmp_path)))
+    return PMTilesService(Settings(), registry)
+
+
+class TestParseRange:
+    @pytest.mark.parametrize(
+        "header,expected",
+        [
+            ("bytes=0-126", (0, 126)),
+            ("bytes=100-", (100, 999)),
+            ("bytes=-10", (990, 999)),
+            ("bytes=900-5000", (900, 999)),
+            ("bytes=1000-", None),
+            ("bytes=-0", None),
+        ],
+    )
+    def test_single_range(self, header, expected):
+        assert parse_range(header, 1000) == expected
+
+    @pytest.mark.parametrize("header", ["bytes=0-1,5-6", "items=0-1", "bytes=-"])
+    def test_unsupported_range(self, header):
+        with pytest.raises(ValueError):
+            parse_range(header, 1000)
+
+
+class TestPMTilesService:
+    @pytest.mark.parametrize("zxy", list(TILES))
+    def test_tiles_through_leaf_directories(self, service, zxy):
+        response = service.get_tile("parcels", *zxy, accept_encoding="gzip")
+
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.media_type == "application/x-protobuf"
+        assert gzip.decompress(response.body) == TILES[zxy]
+
+    def test_missing_tile_is_empty(self, service):
+        assert service.get_tile("parcels", 2, 0, 0).status_code == 204
+        assert service.get_tile("parcels", 5, 0, 0).status_code == 204
+
+    def test_decompresses_for_clients_without_gzip(self, service):
+        response = service.get_tile("parcels", 0, 0, 0)
+
+        assert response.body == b"world"
+        assert "content-encoding" not in response.headers
+
+    def test_unknown_and_invalid_archives(self, service, tmp_path):
+        with pytest.raises(EntityNotFoundException):
+            service.get_tile("roads", 0, 0, 0)
+        (tmp_path / "broken.pmtiles").write_bytes(b"not an archive" * 20)
+        with pytest.raises(DomainException) as exc:
+            service.get_tile("broken", 0, 0, 0)
+        assert exc.value.key == "proxy.pmtiles_invalid"
+
+    def test_replaced_archive_is_reopened(self, service, tmp_path):
+        service.archives.check_seconds = 0
+        service.get_tile("parcels", 0, 0, 0)
+
+        path = tmp_path / "parcels.pmtiles"
+        write_archive(tmp_path / "next.pmtiles", {(0, 0, 0): b"new world"}, False)
+        os.replace(tmp_path / "next.pmtiles", path)
+
+        assert service.get_tile("parcels", 0, 0, 0).body == b"new world"
+
+    def test_archive_range(self, service, tmp_path):
+        raw = (tmp_path / "parcels.pmtiles").read_bytes()
+
+        response = service.get_archive("parcels", "bytes=0-126")
+
+        assert response.status_code == 206
+        assert response.body == raw[:HEADER_SIZE]
+        assert response.headers["content-range"] == f"bytes 0-126/{len(raw)}"
+        assert response.headers["accept-ranges"] == "bytes"
+
+        unsatisfiable = service.get_archive("parcels", f"bytes={len(raw)}-")
+        assert unsatisfiable.status_code == 416
+        assert unsatisfiable.headers["content-range"] == f"bytes */{len(raw)}"
+
+    @pytest.mark.asyncio
+    async def test_whole_archive(self, service, tmp_path):
+        raw = (tmp_path / "parcels.pmtiles").read_bytes()
+
+        response = service.get_archive("parcels")
+
+        assert response.status_code == 200
+        assert response.headers["content-length"] == str(len(raw))
+        assert b"".join([bytes(c) async for c in response.body_iterator]) == raw
@@ -0,0 +1,257 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+import httpx
+import pytest
+from app.core.config import Settings
+from app.core.enums.seed_job_status import SeedJobStatus
+from app.core.exceptions import DomainException, PermissionDeniedException
+from app.core.martin import martin_client
+from app.modules.proxy.cache import TileCache
+from app.modules.proxy import seeding
+from app.modules.proxy.models import TileSeedJob
+from app.modules.proxy.schemas import TileSeedJobCreate, TileSeedJobRead
+from app.modules.proxy.seeding import (
+    SeedProgress,
+    TileSeeder,
+    TileSeedService,
+    iter_seed_tiles,
+    seed_ranges,
+)
+from app.modules.users.models import UserRole
+from app.modules.users.schemas import UserDetail
+
+WORLD = (-180.0, -85.0, 180.0, 85.0)
+
+
+def make_job(**overrides) -> TileSeedJob:
+    values = {
+        "id": 1,
+        "datasources": ["roads"],
+        "min_x": WORLD[0],
+        "min_y": WORLD[1],
+        "max_x": WORLD[2],
+        "max_y": WORLD[3],
+        "min_zoom": 0,
+        "max_zoom": 2,
+        "total_tiles": 21,
+        "status": SeedJobStatus.RUNNING,
+    }
+    values.update(overrides)
+    return TileSeedJob(**values)
+
+
+class TestSeedOrder:
+    def test_walks_every_tile_once(self):
+        ranges = seed_ranges(["roads", "rivers"], WORLD, 0, 2)
+        tiles = list(iter_seed_tiles(ranges))
+
+        assert len(tiles) == 2 * (1 + 4 + 16)
+        assert [position for position, *_ in tiles] == list(range(len(tiles)))
+        assert tiles[0][1:] == ("roads", 0, 0, 0)
+        assert tiles[21][1:] == ("rivers", 0, 0, 0)
+
+    @pytest.mark.parametrize("start", [0, 1, 4, 5, 20, 21, 30, 42])
+    def test_resumes_at_position(self, start):
+        ranges = seed_ranges(["roads", "rivers"], WORLD, 0, 2)
+        assert (
+            list(iter_seed_tiles(ranges, start))
+            == list(iter_seed_tiles(ranges))[start:]
+        )
+
+    def test_cursor_waits_for_earlier_positions(self):
+        progress = SeedProgress(make_job(cursor=10))
+        progress.complete(11, "fetched")
+        assert progress.cursor == 10
+        progress.complete(10, "skipped")
+        assert progress.cursor == 12
+        assert (progress.fetched, progress.skipped) == (1, 1)
+
+
+class TestTileSeeder:
+    @pytest.fixture
+    def martin_requests(self):
+        requests = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            requests.append(request.url.path)
+            return httpx.Response(200, stream=httpx.ByteStream(b"tile"))
+
+        settings = Settings(martin_internal_url="http://martin:3000")
+        martin_client.init(settings, transport=httpx.MockTransport(handler))
+        yield requests
+        martin_client.client = None
+
+    @pytest.fixture
+    def seeder(self, tmp_path):
+        settings = Settings(
+            tile_cache_disk_path=str(tmp_path / "tiles.sqlite"),
+            tile_cache_version_refresh_seconds=0,
+            tile_seed_concurrency=3,
+        )
+        seeder = TileSeeder()
+        seeder.cache = TileCache.from_settings(settings)
+        seeder.settings = settings
+        seeder.saved = []
+
+        async def save(job, values):
+            seeder.saved.append(values)
+            return True
+
+        seeder._save = save
+        return seeder
+
+    @pytest.mark.asyncio
+    async def test_run_job_seeds_disk_tier(self, seeder, martin_requests):
+        await seeder.run_job(make_job())
+
+        assert len(martin_requests) == 21
+        assert len(seeder.cache.memory) == 0
+        final = seeder.saved[-1]
+        assert final["status"] == SeedJobStatus.COMPLETED
+        assert (final["cursor"], final["tiles_fetched"]) == (21, 21)
+
+    @pytest.mark.asyncio
+    async def test_run_job_skips_cached_and_resumes(self, seeder, martin_requests):
+        await seeder.run_job(make_job(max_zoom=1, total_tiles=5))
+        martin_requests.clear()
+
+        await seeder.run_job(make_job(cursor=3, tiles_fetched=3))
+
+        # Positions 3-4 are cached, the 16 tiles of zoom 2 are fetched.
+        assert len(martin_requests) == 16
+        final = seeder.saved[-1]
+        assert (final["tiles_fetched"], final["tiles_skipped"]) == (19, 2)
+
+    @pytest.mark.asyncio
+    async def test_run_job_stops_when_cancelled(
+        self, seeder, martin_requests, monkeypatch
+    ):
+        async def cancelled(job, values):
+            return False
+
+        seeder._save = cancelled
+        monkeypatch.setattr(seeding, "CHECKPOINT_SECONDS", 0)
+
+        await seeder.run_job(make_job(min_zoom=6, max_zoom=6, total_tiles=4096))
+
+        assert len(martin_requests) < 4096
+
+    @pytest.mark.asyncio
+    async def test_heartbeats_continue_while_yielding(
+        self, seeder, martin_requests, monkeypatch
+    ):
+        async def busy():
+            await asyncio.Event().wait()
+
+        async def save(job, values):
+            seeder.saved.append(values)
+            # Taken over by another worker after a few heartbeats.
+            return len(seeder.saved) < 3
+
+        seeder._yield_to_interactive = busy
+        seeder._save = save
+        monkeypatch.setattr(seeding, "CHECKPOINT_SECONDS", 0.01)
+
+        await asyncio.wait_for(seeder.run_job(make_job()), timeout=5)
+
+        assert len(seeder.saved) == 3
+        assert all("heartbeat_at" in values for values in seeder.saved)
+        assert martin_requests == []
+
+
+class TestTileSeedService:
+    @pytest.fixture
+    def mock_repo(self):
+        repo = AsyncMock()
+        repo.session = AsyncMock()
+        repo.create.side_effect = lambda data: make_job(
+            status=SeedJobStatus.PENDING,
+            **{
+                k: v
+                for k, v in data.items()
+                if k in ("datasources", "min_zoom", "max_zoom", "total_tiles")
+            },
+        )
+        return repo
+
+    @pytest.fixture
+    def map_service(self):
+        service = AsyncMock()
+        service.get_map_datasources.return_value = ["roads", "rivers"]
+        return service
+
+    @pytest.fixture
+    def service(self, mock_repo, map_service):
+        return TileSeedService(
+            mock_repo, map_service, Settings(tile_seed_max_tiles=100)
+        )
+
+    @pytest.fixture
+    def admin(self):
+        return UserDetail(
+            id=1,
+            username="admin",
+            email="admin@test.com",
+            roles=[UserRole.ADMIN],
+            teams=[],
+        )
+
+    @pytest.mark.asyncio
+    async def test_create_job_for_map(self, service, mock_repo, admin):
+        job = await service.create_job(
+            TileSeedJobCreate(map_id=1, bbox=WORLD, min_zoom=0, max_zoom=2), admin
+        )
+
+        data = mock_repo.create.call_args.args[0]
+        assert data["datasources"] == ["roads", "rivers"]
+        assert data["total_tiles"] == 42
+        assert job.progress == 0.0
+
+    @pytest.mark.asyncio
+    async def test_create_job_requires_admin(self, service):
+        user = UserDetail(
+            id=2,
+            username="user",
+            email="user@test.com",
+            roles=[UserRole.USER],
+            teams=[],
+        )
+        with pytest.raises(PermissionDeniedException):
+            await service.create_job(
+                TileSeedJobCreate(source="roads", bbox=WORLD), user
+            )
+
+    @pytest.mark.parametrize(
+        "data,key",
+        [
+            ({"bbox": WORLD}, "seed.target_required"),
+            ({"source": "roads", "map_id": 1, "bbox": WORLD}, "seed.target_required"),
+            ({"source": "roads", "bbox": (10, 0, 5, 1)}, "seed.invalid_bbox"),
+            (
+                {"source": "roads", "bbox": WORLD, "min_zoom": 5, "max_zoom": 2},
+                "seed.invalid_zoom_range",
+            ),
+            ({"source": "roads", "bbox": WORLD, "max_zoom": 8}, "seed.too_many_tiles"),
+        ],
+    )
+    @pytest.mark.asyncio
+    async def test_create_job_validation(self, service, admin, data, key):
+        with pytest.raises(DomainException) as exc:
+            await service.create_job(TileSeedJobCreate(**data), admin)
+        assert exc.value.key == key
+
+    @pytest.mark.asyncio
+    async def test_cancel_finished_job(self, service, mock_repo, admin):
+        mock_repo.get_or_raise.return_value = make_job(status=SeedJobStatus.COMPLETED)
+        with pytest.raises(DomainException) as exc:
+            await service.cancel_job(1, admin)
+        assert exc.value.key == "seed.not_cancellable"
+
+
+def test_eta_from_rate():
+    job = TileSeedJobRead.model_validate(
+        make_job(cursor=11, total_tiles=21, tiles_per_second=5.0)
+    )
+    assert job.eta_seconds == 2.0
+    assert job.progress == pytest.approx(11 / 21)
@@ -0,0 +1,247 @@
+import gzip
+import json
+
+import httpx
+import pytest
+from app.core.config import Settings
+from app.core.exceptions import DomainException, ExternalServiceException
+from app.core.singleflight import SingleFlight
+from app.core.utils.mvt import (
+    LAYER_NAME,
+    TILE_LAYERS,
+    iter_fields,
+    layer_name,
+    length_delimited,
+)
+from app.modules.proxy.cache import TileCache
+from app.modules.proxy.extent import ExtentIndex, SourceExtent
+from app.modules.proxy.pruning import StyleUsageCache
+from app.modules.proxy.service import TileProxyService
+
+
+class TestTileProxyService:
+    @pytest.fixture
+    def requests(self):
+        return []
+
+    @pytest.fixture
+    def service(self, requests):
+        def handler(request: httpx.Request) -> httpx.Response:
+            requests.append(request)
+            return httpx.Response(200, content=b"tile")
+
+        client = httpx.AsyncClient(
+            base_url="http://martin:3000", transport=httpx.MockTransport(handler)
+        )
+        return TileProxyService(client, Settings())
+
+    @pytest.mark.parametrize("source", ["../catalog", "", ".hidden", "a/b"])
+    def test_validate_tile_rejects_source(self, service, source):
+        with pytest.raises(DomainException) as exc:
+            service.validate_tile(source, 0, 0, 0)
+        assert exc.value.key == "proxy.invalid_source"
+
+    @pytest.mark.parametrize("z,x,y", [(-1, 0, 0), (31, 0, 0), (1, 2, 0), (1, 0, -1)])
+    def test_validate_tile_rejects_coordinates(self, service, z, x, y):
+        with pytest.raises(DomainException) as exc:
+            service.validate_tile("roads", z, x, y)
+        assert exc.value.key == "proxy.invalid_tile"
+
+    @pytest.mark.asyncio
+    async def test_get_tile_forwards_accept_encoding(self, service, requests):
+        response = await service.get_tile("roads", 1, 1, 0, accept_encoding="br")
+
+        assert response.status_code == 200
+        assert requests[0].url.path == "/roads/1/1/0"
+        assert requests[0].headers["accept-encoding"] == "br"
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("format", ["png", "json", "pbf.gz", ""])
+    async def test_get_tile_rejects_format(self, service, requests, format):
+        with pytest.raises(DomainException) as exc:
+            await service.get_tile("roads", 0, 0, 0, format=format)
+        assert exc.value.key == "proxy.invalid_format"
+        assert not requests
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("format", [None, "pbf", "mvt"])
+    async def test_get_tile_accepts_format(self, service, format):
+        response = await service.get_tile("roads", 0, 0, 0, format=format)
+
+        assert response.status_code == 200
+
+    @pytest.mark.asyncio
+    async def test_get_tile_connection_error(self, service):
+        def handler(request: httpx.Request) -> httpx.Response:
+            raise httpx.ConnectError("refused", request=request)
+
+        service.client = httpx.AsyncClient(
+            base_url="http://martin:3000", transport=httpx.MockTransport(handler)
+        )
+        with pytest.raises(ExternalServiceException) as exc:
+            await service.get_tile("roads", 0, 0, 0)
+        assert exc.value.key == "proxy.martin_unavailable"
+
+    @pytest.mark.asyncio
+    async def test_fill_racing_an_invalidation_is_not_cached(self):
+        cache = TileCache.from_settings(
+            Settings(tile_cache_disk_path=None, tile_cache_memory_bytes=10_000)
+        )
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            # The source is edited while Martin renders the tile.
+            await cache.invalidate_tiles("roads", {(0, 0, 0)})
+            return httpx.Response(200, stream=httpx.ByteStream(b"stale"))
+
+        client = httpx.AsyncClient(
+            base_url="http://martin:3000", transport=httpx.MockTransport(handler)
+        )
+        service = TileProxyService(client, Settings(), cache, SingleFlight())
+
+        response = await service.get_tile("roads", 0, 0, 0)
+
+        assert response.body == b"stale"
+        assert len(cache.memory) == 0
+
+    @pytest.mark.asyncio
+    async def test_tile_outside_extent_skips_martin(self, requests):
+        def handler(request: httpx.Request) -> httpx.Response:
+            requests.append(request)
+            return httpx.Response(200, content=b"tile")
+
+        extents = ExtentIndex()
+        extents.put(SourceExtent(datasource="roads", bbox=(2.0, 48.0, 3.0, 49.0)))
+        client = httpx.AsyncClient(
+            base_url="http://martin:3000", transport=httpx.MockTransport(handler)
+        )
+        service = TileProxyService(client, Settings(), extents=extents)
+
+        outside = await service.get_tile("roads", 10, 0, 0)
+        inside = await service.get_tile("roads", 0, 0, 0)
+        other_source = await service.get_tile("rivers", 10, 0, 0)
+
+        assert outside.status_code == 204
+        assert outside.headers["x-cache"] == "EXTENT"
+        assert inside.status_code == 200
+        assert other_source.status_code == 200
+        assert [r.url.path for r in requests] == ["/roads/0/0/0", "/rivers/10/0/0"]
+
+    @pytest.mark.asyncio
+    async def test_pruned_tile_is_cached_per_style_usage(self, requests):
+        full = length_delimited(
+            TILE_LAYERS, length_delimited(LAYER_NAME, b"roads")
+        ) + length_delimited(TILE_LAYERS, length_delimited(LAYER_NAME, b"rivers"))
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            requests.append(request)
+            return httpx.Response(200, stream=httpx.ByteStream(full))
+
+        cache = TileCache.from_settings(
+            Settings(tile_cache_disk_path=None, tile_cache_memory_bytes=100_000)
+        )
+        usages = StyleUsageCache(ttl=60)
+        style = {
+            "sources": {"osm": {"type": "vector", "url": "http://martin:3000/roads"}},
+            "layers": [{"id": "a", "source": "osm", "source-layer": "roads"}],
+        }
+        usages.put(7, json.dumps(style))
+        client = httpx.AsyncClient(
+            base_url="http://martin:3000", transport=httpx.MockTransport(handler)
+        )
+        service = TileProxyService(
+            client, Settings(), cache, SingleFlight(), style_usages=usages
+        )
+
+        pruned = await service.get_tile("roads", 0, 0, 0, map_id=7)
+        again = await service.get_tile("roads", 0, 0, 0, map_id=7)
+        unpruned = await service.get_tile("roads", 0, 0, 0)
+
+        assert pruned.body == length_delimited(
+            TILE_LAYERS, length_delimited(LAYER_NAME, b"roads")
+        )
+        assert again.headers["x-cache"] == "MEMORY"
+        assert unpruned.body == full
+        assert len(requests) == 1
+
+    @pytest.mark.asyncio
+    async def test_composite_tile_merges_sources(self, requests):
+        def handler(request: httpx.Request) -> httpx.Response:
+            requests.append(request)
+            source = request.url.path.split("/")[1]
+            if source == "empty":
+                return httpx.Response(204, stream=httpx.ByteStream(b""))
+            layer = length_delimited(
+                TILE_LAYERS, length_delimited(LAYER_NAME, source.encode())
+            )
+            return httpx.Response(
+                200,
+                headers={"content-encoding": "gzip"},
+                stream=httpx.ByteStream(gzip.compress(layer)),
+            )
+
+        extents = ExtentIndex()
+        extents.put(SourceExtent(datasource="outside", bbox=(2.0, 48.0, 3.0, 49.0)))
+        client = httpx.AsyncClient(
+            base_url="http://martin:3000", transport=httpx.MockTransport(handler)
+        )
+        service = TileProxyService(client, Settings(), extents=extents)
+
+        response = await service.get_composite_tile(
+            ["roads", "empty", "outside", "rivers"], 10, 0, 0, accept_encoding="gzip"
+        )
+
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.headers["x-cache"] == "MISS, MISS, EXTENT, MISS"
+        assert gzip.decompress(response.body) == length_delimited(
+            TILE_LAYERS, length_delimited(LAYER_NAME, b"roads")
+        ) + length_delimited(TILE_LAYERS, length_delimited(LAYER_NAME, b"rivers"))
+        assert sorted(r.url.path for r in requests) == [
+            "/empty/10/0/0",
+            "/rivers/10/0/0",
+            "/roads/10/0/0",
+        ]
+
+    @pytest.mark.asyncio
+    async def test_composite_tile_prefixes_colliding_layers(self, requests):
+        def handler(request: httpx.Request) -> httpx.Response:
+            requests.append(request)
+            source = request.url.path.split("/")[1]
+            layers = [b"water", source.encode()]
+            return httpx.Response(
+                200,
+                stream=httpx.ByteStream(
+                    b"".join(
+                        length_delimited(TILE_LAYERS, length_delimited(LAYER_NAME, n))
+                        for n in layers
+                    )
+                ),
+            )
+
+        client = httpx.AsyncClient(
+            base_url="http://martin:3000", transport=httpx.MockTransport(handler)
+        )
+        service = TileProxyService(client, Settings())
+
+        response = await service.get_composite_tile(["roads", "rivers"], 10, 0, 0)
+
+        names = [
+            layer_name(value) for _, _, value, _ in iter_fields(bytes(response.body))
+        ]
+        assert names == ["roads.water", "roads", "rivers.water", "rivers"]
+
+    @pytest.mark.asyncio
+    async def test_composite_tile_limits(self, service):
+        with pytest.raises(DomainException) as exc:
+            await service.get_composite_tile(["roads"], 0, 0, 0, format="png")
+        assert exc.value.key == "proxy.invalid_format"
+        with pytest.raises(DomainException) as exc:
+            await service.get_composite_tile([], 0, 0, 0)
+        assert exc.value.key == "proxy.composite_no_source"
+        with pytest.raises(DomainException) as exc:
+            await service.get_composite_tile(["roads", "roads"], 0, 0, 0)
+        assert exc.value.key == "proxy.composite_duplicate_source"
+        service.settings = Settings(tile_composite_max_sources=1)
+        with pytest.raises(DomainException) as exc:
+            await service.get_composite_tile(["roads", "rivers"], 0, 0, 0)
+        assert exc.value.key == "proxy.composite_too_many_sources"
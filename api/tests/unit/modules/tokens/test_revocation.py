@@ -0,0 +1,171 @@
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock
+
+import pytest
+from app.modules.tokens import revocation
+from app.modules.tokens.revocation import BATCH_SIZE, MIN_CAPACITY, RevocationIndex
+
+
+class FakeSessionManager:
+    def __init__(self, session):
+        self.session = session
+
+    async def get_session(self):
+        yield self.session
+
+
+class FakeRepository:
+    """
+    Serves an in-memory revocation log, like TokenRepository would: entries of
+    transactions still running are not visible.
+    """
+
+    def __init__(self):
+        self.log = []
+        self.running = set()
+        self.next_xid = 100
+        self.pruned = 0
+
+    def __call__(self, session, model):
+        return self
+
+    def begin(self):
+        self.next_xid += 1
+        self.running.add(self.next_xid)
+        return self.next_xid
+
+    def commit(self, xid):
+        self.running.discard(xid)
+
+    def append(self, jti, expires_at=None, xid=None):
+        """Log a revocation, committed at once unless written by `xid`."""
+        if xid is None:
+            xid = self.begin()
+            self.commit(xid)
+        self.log.append((len(self.log) + 1, jti, expires_at, xid))
+
+    async def get_horizon(self):
+        return min(self.running, default=self.next_xid + 1)
+
+    async def get_revocations(self, horizon, after_id, now, limit):
+        rows = [
+            (row_id, jti, expires_at)
+            for row_id, jti, expires_at, xid in self.log
+            if xid not in self.running
+            and (horizon is None or xid >= horizon)
+            and row_id > after_id
+            and (expires_at is None or expires_at > now)
+        ]
+        return rows[:limit]
+
+    async def prune_revocations(self, now):
+        self.pruned += 1
+
+
+@pytest.fixture
+def repository(monkeypatch):
+    repository = FakeRepository()
+    monkeypatch.setattr(revocation, "TokenRepository", repository)
+    monkeypatch.setattr(revocation, "sessionmanager", FakeSessionManager(AsyncMock()))
+    return repository
+
+
+class TestRevocationIndex:
+    def test_lookup(self):
+        index = RevocationIndex()
+        index.add("revoked")
+
+        assert index.is_revoked("revoked")
+        assert not index.is_revoked("valid")
+        assert index.stats.lookups == 2
+
+    def test_grows_past_capacity(self):
+        index = RevocationIndex()
+        jtis = [f"jti-{i}" for i in range(MIN_CAPACITY * 3)]
+        for jti in jtis:
+            index.add(jti)
+
+        assert all(index.is_revoked(jti) for jti in jtis)
+        assert index._bloom.capacity > MIN_CAPACITY * 3
+        assert not index.is_revoked("valid")
+
+    def test_false_positives_are_confirmed(self):
+        index = RevocationIndex(error_rate=0.5)
+        index.replace(f"jti-{i}" for i in range(MIN_CAPACITY))
+
+        assert not any(index.is_revoked(f"valid-{i}") for i in range(1000))
+        assert index.stats.false_positives == index.stats.bloom_positives
+
+    @pytest.mark.asyncio
+    async def test_refresh_reads_new_log_entries(self, repository):
+        index = RevocationIndex()
+        repository.append("a")
+        await index.refresh(rebuild_interval=3600)
+        assert index.is_revoked("a")
+        assert index.horizon == repository.next_xid + 1
+        assert repository.pruned == 1
+
+        repository.append("b")
+        await index.refresh(rebuild_interval=3600)
+        assert index.is_revoked("a") and index.is_revoked("b")
+        assert index.horizon == repository.next_xid + 1
+        assert repository.pruned == 1
+
+    @pytest.mark.asyncio
+    async def test_refresh_catches_late_commits(self, repository):
+        index = RevocationIndex()
+        # The first revocation commits after many later ones were read.
+        late = repository.begin()
+        repository.append("late", xid=late)
+        for i in range(BATCH_SIZE + 10):
+            repository.append(f"jti-{i}")
+
+        await index.refresh(rebuild_interval=3600)
+        assert not index.is_revoked("late")
+        assert index.horizon == late
+
+        repository.commit(late)
+        repository.append("next")
+        await index.refresh(rebuild_interval=3600)
+
+        assert index.is_revoked("late") and index.is_revoked("next")
+        assert index.horizon == repository.next_xid + 1
+
+    @pytest.mark.asyncio
+    async def test_rebuild_forgets_expired_tokens(self, repository):
+        index = RevocationIndex()
+        index.add("expired", expires_at=0)
+        repository.append("expired", datetime.utcnow() - timedelta(minutes=1))
+        repository.append("kept", datetime.utcnow() + timedelta(minutes=1))
+
+        await index.refresh(rebuild_interval=0)
+
+        assert not index.is_revoked("expired")
+        assert index.is_revoked("kept")
+        assert len(index) == 1
+
+    @pytest.mark.asyncio
+    async def test_start_loads_the_index(self, repository):
+        index = RevocationIndex()
+        repository.append("a")
+
+        await index.start(interval=3600, rebuild_interval=3600)
+        try:
+            assert index.loaded
+            assert index.is_revoked("a")
+        finally:
+            await index.stop()
+
+    @pytest.mark.asyncio
+    async def test_start_without_database_stays_unloaded(self, repository):
+        async def get_revocations(horizon, after_id, now, limit):
+            raise ConnectionError("database unreachable")
+
+        repository.get_revocations = get_revocations
+        index = RevocationIndex()
+
+        await index.start(interval=3600, rebuild_interval=3600)
+        try:
+            assert not index.loaded
+        finally:
+            await index.stop()
@@ -0,0 +1,152 @@
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, Mock
+
+import pytest
+from app.core.config import Settings
+from app.core.enums.token_type import TokenType
+from app.core.exceptions import (
+    DomainException,
+    EntityNotFoundException,
+    PermissionDeniedException,
+)
+from app.modules.tokens.revocation import RevocationIndex
+from app.modules.tokens.schemas import ResourceTokenCreate
+from app.modules.tokens.service import TokenService
+from app.modules.tokens.signing import verify_resource_token
+from app.modules.tokens.validation import resource_token_key
+from app.modules.users.models import UserRole
+from app.modules.users.schemas import UserDetail
+
+
+def db_token(data: dict) -> Mock:
+    values = {
+        "id": 1,
+        "is_active": True,
+        "created_at": datetime.utcnow(),
+        "created_by_id": 2,
+    }
+    values.update(data)
+    token = Mock(**{k: v for k, v in values.items() if k != "name"})
+    # `name` is a Mock constructor argument, set it as a plain attribute.
+    token.name = values.get("name")
+    return token
+
+
+class TestTokenService:
+    @pytest.fixture
+    def mock_repo(self):
+        repo = AsyncMock()
+        repo.session = AsyncMock()
+        repo.create.side_effect = lambda data: db_token(data)
+        return repo
+
+    @pytest.fixture
+    def map_service(self):
+        service = AsyncMock()
+        service.get_map.return_value = Mock(id=1, created_by_id=2)
+        service.can_edit_map.return_value = True
+        service.get_map_datasources.return_value = ["roads", "rivers"]
+        return service
+
+    @pytest.fixture
+    def settings(self):
+        return Settings(env="test", session_token_expire_minutes=60)
+
+    @pytest.fixture
+    def revocations(self):
+        return RevocationIndex()
+
+    @pytest.fixture
+    def service(self, mock_repo, map_service, revocations, settings):
+        return TokenService(mock_repo, map_service, revocations, settings)
+
+    @pytest.fixture
+    def user(self):
+        return UserDetail(
+            id=2,
+            username="user",
+            email="user@test.com",
+            roles=[UserRole.USER],
+            teams=[],
+        )
+
+    @pytest.fixture
+    def other_user(self):
+        return UserDetail(
+            id=3,
+            username="other",
+            email="other@test.com",
+            roles=[UserRole.USER],
+            teams=[],
+        )
+
+    @pytest.mark.asyncio
+    async def test_create_session_token(self, service, mock_repo, settings, user):
+        created = await service.create_token(ResourceTokenCreate(map_id=1), user)
+
+        claims = verify_resource_token(
+            created.token, resource_token_key(settings), datetime.utcnow().timestamp()
+        )
+        assert claims.token_type == TokenType.SESSION
+        assert claims.datasources == {"roads", "rivers"}
+        assert claims.expires_at is not None
+        assert created.datasources == ["roads", "rivers"]
+        mock_repo.session.commit.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_create_style_token_requires_edit_rights(
+        self, service, map_service, user
+    ):
+        map_service.can_edit_map.return_value = False
+        with pytest.raises(PermissionDeniedException):
+            await service.create_token(
+                ResourceTokenCreate(map_id=1, token_type=TokenType.STYLE), user
+            )
+
+    @pytest.mark.asyncio
+    async def test_create_style_token_without_expiry(self, service, settings, user):
+        created = await service.create_token(
+            ResourceTokenCreate(
+                map_id=1,
+                token_type=TokenType.STYLE,
+                allowed_origins=["https://a.test/"],
+            ),
+            user,
+        )
+
+        claims = verify_resource_token(created.token, resource_token_key(settings), 0)
+        assert created.token.startswith("style_")
+        assert claims.expires_at is None
+        assert claims.allowed_origins == ("https://a.test",)
+
+    @pytest.mark.asyncio
+    async def test_create_style_token_rejects_past_expiry(self, service, user):
+        with pytest.raises(DomainException):
+            await service.create_token(
+                ResourceTokenCreate(
+                    map_id=1,
+                    token_type=TokenType.STYLE,
+                    expires_at=datetime.utcnow() - timedelta(minutes=1),
+                ),
+                user,
+            )
+
+    @pytest.mark.asyncio
+    async def test_revoke_token(self, service, mock_repo, revocations, user):
+        mock_repo.get_or_raise.return_value = db_token({"jti": "abc"})
+
+        assert await service.revoke_token(1, user) is True
+        assert revocations.is_revoked("abc")
+        mock_repo.log_revocation.assert_called_once()
+        update_data = mock_repo.update.call_args.args[1]
+        assert update_data["is_active"] is False
+
+    @pytest.mark.asyncio
+    async def test_revoke_token_of_other_user(
+        self, service, mock_repo, revocations, other_user
+    ):
+        mock_repo.get_or_raise.return_value = db_token({"jti": "abc"})
+
+        with pytest.raises(EntityNotFoundException):
+            await service.revoke_token(1, other_user)
+        assert not revocations.is_revoked("abc")
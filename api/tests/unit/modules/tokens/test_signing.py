@@ -0,0 +1,134 @@
+import pytest
+from app.core.config import Settings
+from app.core.enums.token_type import TokenType
+from app.core.exceptions import (
+    AuthenticationException,
+    ExternalServiceException,
+    PermissionDeniedException,
+)
+from app.modules.tokens.revocation import RevocationIndex
+from app.modules.tokens.signing import (
+    ResourceTokenClaims,
+    derive_signing_key,
+    sign_resource_token,
+    verify_resource_token,
+)
+from app.modules.tokens.validation import ResourceTokenValidator, request_origin
+
+KEY = derive_signing_key("test-secret")
+
+
+def make_claims(**overrides) -> ResourceTokenClaims:
+    values = {
+        "jti": "abc",
+        "token_type": TokenType.SESSION,
+        "map_id": 1,
+        "datasources": frozenset({"roads", "rivers"}),
+        "allowed_origins": (),
+        "expires_at": None,
+    }
+    values.update(overrides)
+    return ResourceTokenClaims(**values)
+
+
+class TestResourceTokenSigning:
+    def test_roundtrip(self):
+        claims = make_claims(allowed_origins=("https://a.test",), expires_at=2000)
+        token = sign_resource_token(claims, KEY)
+
+        assert token.startswith("sess_")
+        assert verify_resource_token(token, KEY, now=1000) == claims
+
+    def test_style_prefix(self):
+        token = sign_resource_token(make_claims(token_type=TokenType.STYLE), KEY)
+        assert token.startswith("style_")
+        assert verify_resource_token(token, KEY, 0).token_type == TokenType.STYLE
+
+    @pytest.mark.parametrize(
+        "mutate",
+        [
+            lambda token: token[:-2] + ("AA" if not token.endswith("AA") else "BB"),
+            lambda token: token.replace("sess_", "style_", 1),
+            lambda token: token.split(".")[0],
+            lambda token: "garbage",
+        ],
+    )
+    def test_rejects_tampered_tokens(self, mutate):
+        token = sign_resource_token(make_claims(), KEY)
+        with pytest.raises(AuthenticationException) as exc:
+            verify_resource_token(mutate(token), KEY, 0)
+        assert exc.value.params["detail"] == "token.invalid"
+
+    def test_rejects_other_key(self):
+        token = sign_resource_token(make_claims(), derive_signing_key("other"))
+        with pytest.raises(AuthenticationException):
+            verify_resource_token(token, KEY, 0)
+
+    def test_rejects_expired_token(self):
+        token = sign_resource_token(make_claims(expires_at=1000), KEY)
+        with pytest.raises(AuthenticationException) as exc:
+            verify_resource_token(token, KEY, now=1000)
+        assert exc.value.params["detail"] == "token.expired"
+
+
+class TestResourceTokenValidator:
+    @pytest.fixture
+    def settings(self):
+        return Settings(env="test", resource_token_secret="test-secret")
+
+    @pytest.fixture
+    def revocations(self):
+        revocations = RevocationIndex()
+        revocations.replace([])
+        return revocations
+
+    @pytest.fixture
+    def validator(self, settings, revocations):
+        return ResourceTokenValidator(settings, revocations)
+
+    def test_authorize_in_scope(self, validator):
+        token = sign_resource_token(make_claims(), KEY)
+        assert validator.authorize(token, "roads").jti == "abc"
+
+    def test_authorize_rejects_revoked(self, validator, revocations):
+        token = sign_resource_token(make_claims(), KEY)
+        revocations.add("abc")
+        with pytest.raises(AuthenticationException) as exc:
+            validator.authorize(token, "roads")
+        assert exc.value.params["detail"] == "token.revoked"
+
+    def test_rejects_tokens_until_revocations_are_loaded(self, settings):
+        validator = ResourceTokenValidator(settings, RevocationIndex())
+        token = sign_resource_token(make_claims(), KEY)
+        with pytest.raises(ExternalServiceException) as exc:
+            validator.authorize(token, "roads")
+        assert exc.value.key == "token.revocations_unavailable"
+
+    def test_authorize_rejects_out_of_scope(self, validator):
+        token = sign_resource_token(make_claims(), KEY)
+        with pytest.raises(PermissionDeniedException) as exc:
+            validator.authorize(token, "buildings")
+        assert exc.value.params["detail"] == "token.datasource_not_in_scope"
+
+    def test_authorize_all_needs_every_datasource(self, validator):
+        token = sign_resource_token(make_claims(), KEY)
+        assert validator.authorize_all(token, ["roads", "rivers"]).jti == "abc"
+        with pytest.raises(PermissionDeniedException):
+            validator.authorize_all(token, ["roads", "buildings"])
+
+    def test_authorize_checks_origin(self, validator):
+        token = sign_resource_token(
+            make_claims(allowed_origins=("https://a.test",)), KEY
+        )
+        assert validator.authorize(token, "roads", "https://a.test")
+        with pytest.raises(PermissionDeniedException) as exc:
+            validator.authorize(token, "roads", "https://b.test")
+        assert exc.value.params["detail"] == "token.origin_not_allowed"
+        with pytest.raises(PermissionDeniedException):
+            validator.authorize(token, "roads", None)
+
+    def test_request_origin(self):
+        assert request_origin("https://a.test/", None) == "https://a.test"
+        assert request_origin(None, "https://a.test/maps/1?x=1") == "https://a.test"
+        assert request_origin(None, "not a url") is None
+        assert request_origin(None, None) is None